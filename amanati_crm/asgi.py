@@ -19,18 +19,27 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'amanati_crm.settings')
 django_asgi_app = get_asgi_application()
 
 # Import consumers and custom auth middleware AFTER Django initialization
+from amanati_crm.long_poll import LongPollASGIHandler
 from social_integrations import consumers
 from users import consumers as users_consumers
+from crm import consumers as crm_consumers
 from amanati_crm.websocket_auth import JWTAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
+    "http": URLRouter([
+        # Long polls park for up to 25s; keep them off the sync middleware
+        # chain (and its worker threads). See amanati_crm/long_poll.py.
+        re_path(r'^api/widget/public/messages/wait/$', LongPollASGIHandler()),
+        re_path(r'', django_asgi_app),
+    ]),
     "websocket": URLRouter([
         path('ws/messages/<str:tenant_schema>/', JWTAuthMiddlewareStack(consumers.MessagesConsumer.as_asgi())),
         path('ws/typing/<str:tenant_schema>/<str:conversation_id>/', JWTAuthMiddlewareStack(consumers.TypingConsumer.as_asgi())),
         path('ws/notifications/<str:tenant_schema>/', JWTAuthMiddlewareStack(users_consumers.NotificationConsumer.as_asgi())),
         path('ws/boards/<str:tenant_schema>/<str:board_id>/', JWTAuthMiddlewareStack(users_consumers.TicketBoardConsumer.as_asgi())),
         path('ws/team-chat/<str:tenant_schema>/', JWTAuthMiddlewareStack(users_consumers.TeamChatConsumer.as_asgi())),
+        path('ws/extension-presence/<str:tenant_schema>/', JWTAuthMiddlewareStack(crm_consumers.ExtensionPresenceConsumer.as_asgi())),
+        path('ws/calls/<str:tenant_schema>/', JWTAuthMiddlewareStack(crm_consumers.LiveCallsConsumer.as_asgi())),
         # Widget visitor WebSocket — anonymous (no JWT). Token + session_id
         # in the URL identify the tenant + session; the consumer resolves
         # the tenant schema internally via the widget token.
@@ -67,3 +67,34 @@ def sanitized_upload_to(base_path, date_based=True):
         logo = models.ImageField(upload_to=sanitized_upload_to('logos', date_based=False))
     """
     return SanitizedUploadTo(base_path, date_based)
+
+
+def private_storage(url_ttl):
+    """
+    Storage for files that must not be publicly readable (customer media,
+    call recordings).
+
+    On Spaces/S3 this is ``default_storage`` with a private ACL and
+    signed URLs that expire after ``url_ttl`` seconds; the bucket-wide
+    ``public-read`` default and the unsigned CDN domain are not used.
+    Other backends (local dev) return ``default_storage`` unchanged.
+
+    Args:
+        url_ttl: Lifetime of the URLs returned by ``storage.url()``, in seconds
+
+    Returns:
+        A storage instance
+    """
+    from django.core.files.storage import default_storage
+    try:
+        from storages.backends.s3boto3 import S3Boto3Storage
+    except ImportError:
+        return default_storage
+    if not isinstance(default_storage, S3Boto3Storage):
+        return default_storage
+    return S3Boto3Storage(
+        default_acl='private',
+        querystring_auth=True,
+        querystring_expire=url_ttl,
+        custom_domain=None,
+    )
@@ -0,0 +1,42 @@
+"""ASGI handler for long-poll views.
+
+``settings.MIDDLEWARE`` includes sync-only middleware: the project's own
+``__call__`` classes, the tenant and subscription middleware, and
+WhiteNoise. When a sync middleware wraps an async view, Django adapts the
+view with ``async_to_sync`` and runs the whole chain on a worker thread. A
+long-poll view would then hold that thread for its entire wait, which is
+exactly what it was made async to avoid.
+
+:class:`LongPollASGIHandler` serves the long-poll URLs through the normal
+Django request cycle (URL resolution, signals, exception handling), but with
+its own short chain of async-capable middleware. ``asgi.py`` routes those
+paths to it and everything else to the regular handler. A view routed here
+must not rely on anything the skipped middleware provides (tenant on the
+request, session, auth): the widget long-poll resolves its tenant from the
+widget token.
+"""
+from django.core.asgi import ASGIHandler
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+class LongPollASGIHandler(ASGIHandler):
+    """``ASGIHandler`` whose middleware chain is :attr:`middleware`, all async."""
+
+    middleware = (
+        'amanati_crm.middleware.WidgetPublicCorsMiddleware',
+    )
+
+    def load_middleware(self, is_async=False):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response_async)
+        for middleware_path in reversed(self.middleware):
+            middleware = import_string(middleware_path)
+            if not getattr(middleware, 'async_capable', False):
+                raise ImproperlyConfigured(f'{middleware_path} must be async capable to serve long polls.')
+            handler = convert_exception_to_response(middleware(handler))
+        self._middleware_chain = handler
@@ -4,6 +4,7 @@ Custom middleware for EchoDesk multi-tenant routing
 import logging
 import time
 import json
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.http import Http404
 from django.urls import reverse
@@ -158,41 +159,62 @@ class WidgetPublicCorsMiddleware:
     """
 
     WIDGET_PUBLIC_PREFIX = '/api/widget/public/'
-    ALLOW_HEADERS = 'accept, accept-encoding, authorization, content-type, origin, user-agent, x-requested-with, cache-control'
+    ALLOW_HEADERS = 'accept, accept-encoding, authorization, content-type, origin, user-agent, x-requested-with, cache-control, if-none-match'
     ALLOW_METHODS = 'GET, POST, OPTIONS'
     MAX_AGE = '86400'
 
+    # Sync and async capable (like Django's MiddlewareMixin), so the
+    # long-poll handler in ``amanati_crm.long_poll`` can run it without
+    # pinning a worker thread.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self._async = iscoroutinefunction(get_response)
+        if self._async:
+            markcoroutinefunction(self)
 
     def _is_widget_public(self, request) -> bool:
         return request.path.startswith(self.WIDGET_PUBLIC_PREFIX)
 
     def __call__(self, request):
+        if self._async:
+            return self.__acall__(request)
         if not self._is_widget_public(request):
             return self.get_response(request)
+        if request.method == 'OPTIONS':
+            return self._preflight(request)
+        return self._add_cors_headers(request, self.get_response(request))
 
-        origin = request.META.get('HTTP_ORIGIN', '')
+    async def __acall__(self, request):
+        if not self._is_widget_public(request):
+            return await self.get_response(request)
+        if request.method == 'OPTIONS':
+            return self._preflight(request)
+        return self._add_cors_headers(request, await self.get_response(request))
 
+    def _preflight(self, request):
         # Short-circuit preflight. We don't run the view — just return the
         # CORS headers so the browser lets the real request through.
-        if request.method == 'OPTIONS':
-            from django.http import HttpResponse
-            response = HttpResponse(status=204)
-            if origin:
-                response['Access-Control-Allow-Origin'] = origin
-                response['Vary'] = 'Origin'
-                response['Access-Control-Allow-Methods'] = self.ALLOW_METHODS
-                response['Access-Control-Allow-Headers'] = (
-                    request.META.get('HTTP_ACCESS_CONTROL_REQUEST_HEADERS')
-                    or self.ALLOW_HEADERS
-                )
-                response['Access-Control-Max-Age'] = self.MAX_AGE
-                # Widget API is anonymous by design — never send cookies.
-                response['Access-Control-Allow-Credentials'] = 'false'
-            return response
+        from django.http import HttpResponse
+        origin = request.META.get('HTTP_ORIGIN', '')
+        response = HttpResponse(status=204)
+        if origin:
+            response['Access-Control-Allow-Origin'] = origin
+            response['Vary'] = 'Origin'
+            response['Access-Control-Allow-Methods'] = self.ALLOW_METHODS
+            response['Access-Control-Allow-Headers'] = (
+                request.META.get('HTTP_ACCESS_CONTROL_REQUEST_HEADERS')
+                or self.ALLOW_HEADERS
+            )
+            response['Access-Control-Max-Age'] = self.MAX_AGE
+            # Widget API is anonymous by design — never send cookies.
+            response['Access-Control-Allow-Credentials'] = 'false'
+        return response
 
-        response = self.get_response(request)
+    def _add_cors_headers(self, request, response):
+        origin = request.META.get('HTTP_ORIGIN', '')
         if origin:
             response['Access-Control-Allow-Origin'] = origin
             # Merge with any existing Vary header django-cors-headers may set.
@@ -202,6 +224,8 @@ class WidgetPublicCorsMiddleware:
                     f'{existing_vary}, Origin' if existing_vary else 'Origin'
                 )
             response['Access-Control-Allow-Credentials'] = 'false'
+            # Lets the polling client read the validator it should echo back.
+            response['Access-Control-Expose-Headers'] = 'ETag'
         return response
 
 
@@ -0,0 +1,66 @@
+"""
+Shared helpers for the Redis-backed caches, queues and write-behind buffers.
+"""
+from typing import Dict, Iterable
+
+
+# Read-and-clear in one step, so a field written during processing is not lost.
+TAKE_HASH = """
+local values = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return values
+"""
+
+# Delete the given fields only if they still hold the values we read
+# (ARGV = field1, value1, field2, value2, ...): a newer write survives.
+DELETE_UNCHANGED = """
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        deleted = deleted + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return deleted
+"""
+
+
+def get_redis():
+    """The shared ``default`` django-redis connection."""
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _pairs(raw: Iterable) -> Dict[str, str]:
+    items = iter(decode(item) for item in raw or [])
+    return dict(zip(items, items))
+
+
+def read_hash(redis, key: str) -> Dict[str, str]:
+    return {decode(field): decode(value) for field, value in redis.hgetall(key).items()}
+
+
+def take_hash(redis, key: str) -> Dict[str, str]:
+    """HGETALL + DEL atomically; returns the decoded fields."""
+    return _pairs(redis.eval(TAKE_HASH, 1, key))
+
+
+def restore_hash(redis, key: str, values: Dict[str, str]) -> None:
+    """Put back fields taken with :func:`take_hash` (newer writes win)."""
+    if not values:
+        return
+    pipe = redis.pipeline()
+    for field, value in values.items():
+        pipe.hsetnx(key, field, value)
+    pipe.execute()
+
+
+def delete_unchanged(redis, key: str, values: Dict[str, str]) -> int:
+    """HDEL the fields of ``values`` that still hold the same value."""
+    if not values:
+        return 0
+    args = [item for pair in values.items() for item in pair]
+    return redis.eval(DELETE_UNCHANGED, 1, key, *args)
@@ -211,6 +211,10 @@ DATABASES = {
 # short-circuits when no active PbxServer exists for the current tenant.
 ASTERISK_SYNC_ENABLED = True
 
+# Signals mark changed extensions/trunks/queues dirty; a Celery drain applies
+# them this many seconds after the first mark (see crm.asterisk_sync_queue).
+ASTERISK_SYNC_DEBOUNCE_SECONDS = config('ASTERISK_SYNC_DEBOUNCE_SECONDS', default=2, cast=float)
+
 # Router order matters: the asterisk router short-circuits for its own app
 # label, then the tenant-schemas router handles everything else.
 DATABASE_ROUTERS = (
@@ -273,6 +277,19 @@ AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.{AWS_S3_REGION_NAME}.digitalo
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_LOCATION}/'
 
+# Social media proxy: once a WhatsApp/Instagram attachment is cached in
+# Spaces (private ACL), redirect viewers to a signed URL valid for
+# SOCIAL_MEDIA_URL_TTL seconds instead of streaming it through Django.
+# Disable to stream from storage (Range-capable) instead.
+SOCIAL_MEDIA_CACHE_REDIRECT = config('SOCIAL_MEDIA_CACHE_REDIRECT', default=True, cast=bool)
+SOCIAL_MEDIA_URL_TTL = config('SOCIAL_MEDIA_URL_TTL', default=900, cast=int)
+
+# Call recordings are fetched from the PBX once, transcoded for playback
+# (crm.recording_pipeline) and served from storage via short-lived signed URLs.
+CALL_RECORDING_FORMAT = config('CALL_RECORDING_FORMAT', default='mp3')  # mp3 | opus
+CALL_RECORDING_FFMPEG = config('CALL_RECORDING_FFMPEG', default='ffmpeg')
+CALL_RECORDING_URL_TTL = config('CALL_RECORDING_URL_TTL', default=900, cast=int)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -517,6 +534,16 @@ SOCIAL_INTEGRATIONS = {
     'FACEBOOK_APP_ID': FACEBOOK_APP_ID,
     'FACEBOOK_APP_SECRET': FACEBOOK_APP_SECRET,
     'FACEBOOK_API_VERSION': FACEBOOK_APP_VERSION,
+    # Shared Graph client (social_integrations.graph_client). The base URL is
+    # overridable so tests / staging can point at a local stub server.
+    'GRAPH_API_BASE_URL': config('FACEBOOK_GRAPH_BASE_URL', default='https://graph.facebook.com'),
+    'GRAPH_RATE_LIMIT_PER_SECOND': config('FACEBOOK_GRAPH_RATE_LIMIT', default=20, cast=float),
+    'GRAPH_RATE_LIMIT_BURST': config('FACEBOOK_GRAPH_RATE_BURST', default=40, cast=float),
+    'GRAPH_RATE_LIMIT_MAX_WAIT': config('FACEBOOK_GRAPH_RATE_MAX_WAIT', default=5, cast=float),
+    # Window over which WhatsApp delivery/read receipts are buffered and collapsed
+    'WHATSAPP_STATUS_FLUSH_SECONDS': config('WHATSAPP_STATUS_FLUSH_SECONDS', default=2, cast=float),
+    # Delay before buffered widget visitor messages are written to Postgres
+    'WIDGET_WRITE_BEHIND_SECONDS': config('WIDGET_WRITE_BEHIND_SECONDS', default=1, cast=float),
     'FACEBOOK_VERIFY_TOKEN': config('FACEBOOK_WEBHOOK_VERIFY_TOKEN', default='echodesk_webhook_token_2024'),
     'FACEBOOK_SCOPES': [
         'business_management',  # Essential for accessing Pages and Business assets
@@ -632,6 +659,46 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'social_integrations.tasks.publish_approved_posts',
         'schedule': 300.0,  # every 5 minutes
     },
+    # Repair rating rollups for changes that bypass model signals
+    'reconcile-rating-rollups': {
+        'task': 'social_integrations.tasks.reconcile_rating_rollups',
+        'schedule': crontab(hour=3, minute=30),  # nightly
+    },
+    # Repair call statistics rollups (crm.call_rollups)
+    'reconcile-call-rollups': {
+        'task': 'crm.reconcile_call_rollups',
+        'schedule': crontab(hour=3, minute=45),  # nightly
+    },
+    # Lazily write board/team-chat presence (last seen, online) to Postgres
+    'persist-presence': {
+        'task': 'users.tasks.persist_presence',
+        'schedule': 30.0,  # every 30 seconds
+    },
+    # Extension presence for watched tenants without a live AMI feed
+    'poll-extension-presence': {
+        'task': 'crm.poll_extension_presence',
+        'schedule': 10.0,  # every 10 seconds
+    },
+    # Pick up Asterisk sync marks whose drain task was lost
+    'drain-pending-asterisk-sync': {
+        'task': 'crm.drain_pending_asterisk_sync',
+        'schedule': 60.0,  # every minute
+    },
+    # Pick up widget write-behind buffers whose flush task was lost
+    'flush-pending-widget-writes': {
+        'task': 'social_integrations.tasks.flush_pending_widget_writes',
+        'schedule': 60.0,  # every minute
+    },
+    # Pick up WhatsApp status buffers whose flush task was lost
+    'flush-pending-whatsapp-statuses': {
+        'task': 'social_integrations.tasks.flush_pending_whatsapp_statuses',
+        'schedule': 60.0,  # every minute
+    },
+    # Keep the local WhatsApp template table warm (one job per WABA)
+    'sync-all-whatsapp-templates': {
+        'task': 'social_integrations.tasks.sync_all_whatsapp_templates',
+        'schedule': crontab(minute=15),  # every hour
+    },
     # Booking management tasks
     'create-recurring-bookings': {
         'task': 'booking_management.tasks.create_recurring_bookings',
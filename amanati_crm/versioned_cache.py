@@ -0,0 +1,152 @@
+"""Per-tenant values cached in process memory and Redis under a version token.
+
+Used for data that is read on hot paths and rarely written (the social
+settings bundle, the compiled PBX routing table). A lookup goes through two
+layers:
+
+* a per-process dict that re-checks the tenant's version at most every
+  ``local_ttl`` seconds. In between, a lookup costs no network hop;
+* the shared Django cache (Redis), keyed by ``(schema, version)``.
+
+Writers call :meth:`VersionedCache.invalidate`. Once the transaction
+commits, it replaces the tenant's version with a fresh token, so every
+process moves to a new shared key and nothing has to be deleted.
+
+Until the commit, the writing connection reads straight from the database
+and caches nothing. Its uncommitted rows are never published under any
+version, so a rollback leaves the caches exactly as they were.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_NOT_FOUND = '__not_found__'
+_DIRTY_ATTR = '_versioned_cache_dirty'
+
+
+class VersionedCache:
+    """``get(schema)`` → ``loader(schema)``, cached; ``None`` results are cached too.
+
+    ``to_shared``/``from_shared`` convert values for the shared cache when
+    they don't pickle cleanly as they are.
+    """
+
+    def __init__(self, name: str, loader: Callable[[str], Any], *,
+                 local_ttl: float = 5, shared_ttl: int = 60 * 60, local_max_entries: int = 1024,
+                 to_shared: Optional[Callable] = None, from_shared: Optional[Callable] = None):
+        self.name = name
+        self.loader = loader
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self.local_max_entries = local_max_entries
+        self.to_shared = to_shared or (lambda value: value)
+        self.from_shared = from_shared or (lambda value: value)
+        self.version_key = name + '_ver:{schema}'
+        self.value_key = name + ':{schema}:{version}'
+        self._local: dict = {}
+        self._local_lock = threading.Lock()
+
+    # -- uncommitted writes ---------------------------------------------------
+
+    def _dirty_marks(self) -> dict:
+        marks = getattr(connection, _DIRTY_ATTR, None)
+        if marks is None:
+            marks = {}
+            setattr(connection, _DIRTY_ATTR, marks)
+        return marks
+
+    def _is_dirty(self, schema: str) -> bool:
+        """Whether this connection's open transaction has invalidated ``schema``."""
+        marks = getattr(connection, _DIRTY_ATTR, None)
+        if not marks:
+            return False
+        block = marks.get((self.name, schema))
+        if block is None:
+            return False
+        if connection.in_atomic_block and connection.atomic_blocks and connection.atomic_blocks[0] is block:
+            return True
+        # The transaction that wrote has ended (its rollback has no hook).
+        marks.pop((self.name, schema), None)
+        return False
+
+    # -- reads ----------------------------------------------------------------
+
+    def _current_version(self, schema: str) -> Optional[str]:
+        key = self.version_key.format(schema=schema)
+        try:
+            version = cache.get(key)
+            if version is None:
+                cache.add(key, uuid.uuid4().hex, None)
+                version = cache.get(key)
+            return version
+        except Exception as exc:  # noqa: BLE001 — Redis down: fall back to the DB.
+            logger.warning('%s version read failed: %s', self.name, exc)
+            return None
+
+    def get(self, schema: str):
+        if self._is_dirty(schema):
+            return self.loader(schema)
+
+        entry = self._local.get(schema)
+        if entry is not None and entry[0] >= time.monotonic():
+            value = entry[2]
+        else:
+            version = self._current_version(schema)
+            if entry is not None and version is not None and entry[1] == version:
+                value = entry[2]
+            else:
+                value = None
+                if version is not None:
+                    try:
+                        cached = cache.get(self.value_key.format(schema=schema, version=version))
+                    except Exception as exc:  # noqa: BLE001
+                        logger.warning('%s cache read failed: %s', self.name, exc)
+                        cached = None
+                    if cached is not None:
+                        value = cached if cached == _NOT_FOUND else self.from_shared(cached)
+                if value is None:
+                    loaded = self.loader(schema)
+                    value = loaded if loaded is not None else _NOT_FOUND
+                    if version is not None:
+                        try:
+                            cache.set(
+                                self.value_key.format(schema=schema, version=version),
+                                self.to_shared(loaded) if loaded is not None else _NOT_FOUND,
+                                self.shared_ttl,
+                            )
+                        except Exception as exc:  # noqa: BLE001
+                            logger.warning('%s cache write failed: %s', self.name, exc)
+            with self._local_lock:
+                if len(self._local) >= self.local_max_entries:
+                    self._local.clear()
+                self._local[schema] = (time.monotonic() + self.local_ttl, version, value)
+        return None if value == _NOT_FOUND else value
+
+    # -- writes ---------------------------------------------------------------
+
+    def invalidate_now(self, schema: str) -> None:
+        """Move ``schema`` to a new version immediately (committed changes only)."""
+        with self._local_lock:
+            self._local.pop(schema, None)
+        marks = getattr(connection, _DIRTY_ATTR, None)
+        if marks:
+            marks.pop((self.name, schema), None)
+        try:
+            cache.set(self.version_key.format(schema=schema), uuid.uuid4().hex, None)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('%s cache invalidation failed: %s', self.name, exc)
+
+    def invalidate(self, schema: str) -> None:
+        """Bypass the cache for the rest of this transaction; new version after commit."""
+        if connection.in_atomic_block and connection.atomic_blocks:
+            self._dirty_marks()[(self.name, schema)] = connection.atomic_blocks[0]
+        transaction.on_commit(lambda: self.invalidate_now(schema))
@@ -0,0 +1,362 @@
+"""Persistent Asterisk Manager Interface (AMI) clients.
+
+The call-control views used to open a TCP socket, read the banner, log in,
+run a single action and log off on every request. A three-way merge with
+two channels meant three logins, and on a BYO PBX each login crosses the
+WAN. :class:`AmiClient` keeps one logged-in session per PBX for the life of
+the process instead:
+
+* a reader thread owns the socket. It routes every ``Response`` (and the
+  list events that belong to it) to the caller waiting on that
+  ``ActionID``, so any number of threads can share one session;
+* unsolicited events go to ``on_event`` (see :mod:`crm.live_calls`). Pooled
+  web-side clients log in with ``Events: off`` and never see them;
+* when the connection drops, pending actions fail with
+  :class:`AmiUnavailable` and the reader reconnects with exponential
+  backoff. Idle sessions are kept alive with ``Ping``.
+
+:func:`client_for` hands out the per-process client for a
+:class:`crm.models.PbxServer`.
+"""
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5038
+CONNECT_TIMEOUT = 5
+ACTION_TIMEOUT = 5
+PING_INTERVAL = 20
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+
+class AmiError(RuntimeError):
+    """Asterisk answered the action with ``Response: Error``."""
+
+
+class AmiUnavailable(ConnectionError):
+    """No logged-in session (connecting, reconnecting or login refused)."""
+
+
+def parse_message(block: str) -> Dict[str, str]:
+    """``Key: Value`` lines → dict with lower-cased keys (``ActionID`` → ``actionid``)."""
+    message = {}
+    for line in block.splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            message[key.strip().lower()] = value.strip()
+    return message
+
+
+def format_action(action: str, action_id: str, fields) -> bytes:
+    lines = [f'Action: {action}', f'ActionID: {action_id}']
+    lines += [f'{key}: {value}' for key, value in fields]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+class _Pending:
+    __slots__ = ('complete_event', 'response', 'events', 'error', 'done')
+
+    def __init__(self, complete_event: Optional[str]):
+        self.complete_event = complete_event
+        self.response: Optional[Dict[str, str]] = None
+        self.events: List[Dict[str, str]] = []
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class AmiClient:
+    """One logged-in AMI session shared by every thread of the process."""
+
+    def __init__(self, host: str, port: int, username: str, secret: str, *, events: bool = False,
+                 on_event: Optional[Callable[[Dict[str, str]], None]] = None,
+                 on_connect: Optional[Callable[['AmiClient'], None]] = None,
+                 on_disconnect: Optional[Callable[['AmiClient'], None]] = None,
+                 name: str = ''):
+        self.host = host
+        self.port = port or DEFAULT_PORT
+        self.username = username
+        self.secret = secret
+        self.events = events
+        self.on_event = on_event
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.name = name or f'{host}:{self.port}'
+
+        self._sock: Optional[socket.socket] = None
+        self._write_lock = threading.Lock()
+        self._pending: Dict[str, _Pending] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._id_prefix = f'ed{os.getpid()}-{id(self) & 0xffff:x}'
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> 'AmiClient':
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._closed.clear()
+                self._thread = threading.Thread(target=self._run, name=f'ami-{self.name}', daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._closed.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                self._send('Logoff', [], self._next_id())
+            except OSError:
+                pass
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def wait_connected(self, timeout: float) -> bool:
+        self.start()
+        return self._connected.wait(timeout)
+
+    def send_action(self, action: str, fields=None, timeout: float = ACTION_TIMEOUT) -> Dict[str, str]:
+        """Run one action and return its response. Raises :class:`AmiError` on ``Response: Error``."""
+        pending = self._submit(action, fields, None, timeout)
+        return pending.response
+
+    def collect(self, action: str, complete_event: str, fields=None,
+                timeout: float = ACTION_TIMEOUT) -> List[Dict[str, str]]:
+        """Run a list action (e.g. ``CoreShowChannels``) and return its events."""
+        pending = self._submit(action, fields, complete_event, timeout)
+        return pending.events
+
+    # ------------------------------------------------------------------
+    # Request side
+    # ------------------------------------------------------------------
+
+    def _next_id(self) -> str:
+        return f'{self._id_prefix}-{next(self._ids)}'
+
+    def _send(self, action: str, fields, action_id: str) -> None:
+        sock = self._sock
+        if sock is None:
+            raise AmiUnavailable(f'AMI {self.name} is not connected')
+        with self._write_lock:
+            sock.sendall(format_action(action, action_id, fields))
+
+    def _submit(self, action: str, fields, complete_event: Optional[str], timeout: float) -> _Pending:
+        if isinstance(fields, dict):
+            fields = list(fields.items())
+        deadline = time.monotonic() + timeout
+        if not self.wait_connected(timeout):
+            raise AmiUnavailable(f'AMI {self.name} is not connected')
+
+        action_id = self._next_id()
+        pending = _Pending(complete_event)
+        with self._pending_lock:
+            self._pending[action_id] = pending
+        try:
+            try:
+                self._send(action, fields or [], action_id)
+            except OSError as exc:
+                raise AmiUnavailable(f'AMI {self.name} send failed: {exc}') from exc
+            if not pending.done.wait(max(deadline - time.monotonic(), 0.1)):
+                raise AmiUnavailable(f'AMI {self.name} timed out waiting for {action}')
+        finally:
+            with self._pending_lock:
+                self._pending.pop(action_id, None)
+        if pending.error is not None:
+            raise pending.error
+        if (pending.response or {}).get('response', '').lower() == 'error':
+            raise AmiError(f"AMI {action} failed: {pending.response.get('message', '')}")
+        return pending
+
+    # ------------------------------------------------------------------
+    # Reader thread
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                self._session()
+            except Exception as exc:  # noqa: BLE001
+                if not self._closed.is_set():
+                    logger.warning('AMI %s connection lost: %s', self.name, exc)
+            finally:
+                if self._teardown():
+                    attempt = 0
+            if self._closed.is_set():
+                break
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.8, 1.2)
+            attempt += 1
+            self._closed.wait(delay)
+
+    def _session(self) -> None:
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        sock.settimeout(PING_INTERVAL)
+        self._sock = sock
+        reader = self._messages(sock)
+        next(reader)  # banner ("Asterisk Call Manager/x.y")
+
+        login_id = self._next_id()
+        self._send('Login', [
+            ('Username', self.username),
+            ('Secret', self.secret),
+            ('Events', 'on' if self.events else 'off'),
+        ], login_id)
+        for message in reader:
+            if message.get('actionid') == login_id:
+                if message.get('response', '').lower() != 'success':
+                    raise AmiUnavailable(f"AMI {self.name} login failed: {message.get('message', '')}")
+                break
+
+        self._connected.set()
+        logger.info('AMI %s connected', self.name)
+        if self.on_connect is not None:
+            threading.Thread(target=self._notify, args=(self.on_connect,), daemon=True).start()
+        for message in reader:
+            self._dispatch(message)
+
+    def _messages(self, sock: socket.socket):
+        """Yield parsed messages; the banner line comes out first on its own."""
+        buffer = b''
+        banner = True
+        idle_since = time.monotonic()
+        while True:
+            if banner and b'\r\n' in buffer:
+                line, buffer = buffer.split(b'\r\n', 1)
+                banner = False
+                yield {'banner': line.decode('utf-8', errors='replace')}
+                continue
+            if not banner and b'\r\n\r\n' in buffer:
+                block, buffer = buffer.split(b'\r\n\r\n', 1)
+                yield parse_message(block.decode('utf-8', errors='replace'))
+                continue
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                if time.monotonic() - idle_since > 2 * PING_INTERVAL:
+                    raise AmiUnavailable(f'AMI {self.name} stopped answering')
+                if self._connected.is_set():
+                    self._send('Ping', [], self._next_id())
+                continue
+            if not chunk:
+                raise AmiUnavailable(f'AMI {self.name} closed the connection')
+            idle_since = time.monotonic()
+            buffer += chunk
+
+    def _dispatch(self, message: Dict[str, str]) -> None:
+        action_id = message.get('actionid')
+        pending = None
+        if action_id:
+            with self._pending_lock:
+                pending = self._pending.get(action_id)
+        if pending is None:
+            if 'event' in message and self.on_event is not None:
+                try:
+                    self.on_event(message)
+                except Exception:  # noqa: BLE001
+                    logger.exception('AMI %s event handler failed for %s', self.name, message.get('event'))
+            return
+
+        if 'response' in message and pending.response is None:
+            pending.response = message
+            # Error responses never get a list, and plain actions end here.
+            if pending.complete_event is None or message['response'].lower() == 'error':
+                pending.done.set()
+        elif message.get('event') == pending.complete_event:
+            pending.done.set()
+        elif 'event' in message:
+            pending.events.append(message)
+
+    def _teardown(self) -> bool:
+        """Drop the socket and fail pending actions. True if a session had been up."""
+        was_connected = self._connected.is_set()
+        self._connected.clear()
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        with self._pending_lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for entry in pending:
+            entry.error = AmiUnavailable(f'AMI {self.name} connection lost')
+            entry.done.set()
+        if was_connected and self.on_disconnect is not None:
+            self._notify(self.on_disconnect)
+        return was_connected
+
+    def _notify(self, callback) -> None:
+        try:
+            callback(self)
+        except Exception:  # noqa: BLE001
+            logger.exception('AMI %s callback %s failed', self.name, getattr(callback, '__name__', callback))
+
+
+# ---------------------------------------------------------------------------
+# Per-process pool
+# ---------------------------------------------------------------------------
+
+_clients: Dict[Tuple[str, int], Tuple[tuple, AmiClient]] = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def credentials_of(pbx) -> tuple:
+    return (pbx.ami_host or pbx.fqdn, pbx.ami_port or DEFAULT_PORT, pbx.ami_username, pbx.ami_password)
+
+
+def client_for(pbx, schema_name: Optional[str] = None) -> AmiClient:
+    """The shared (``Events: off``) client for ``pbx`` in this process.
+
+    A client whose PBX credentials changed is closed and replaced. After a
+    fork (gunicorn ``--preload``) the inherited clients are dropped, since
+    their reader threads did not survive.
+    """
+    global _clients_pid
+    if schema_name is None:
+        from django.db import connection
+        schema_name = connection.schema_name
+    key = (schema_name, pbx.pk)
+    credentials = credentials_of(pbx)
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        entry = _clients.get(key)
+        if entry is not None and entry[0] == credentials:
+            return entry[1].start()
+        if entry is not None:
+            entry[1].close()
+        host, port, username, secret = credentials
+        client = AmiClient(host, port, username, secret, name=f'{schema_name}@{host}:{port}')
+        _clients[key] = (credentials, client)
+    return client.start()
+
+
+def close_all() -> None:
+    with _clients_lock:
+        entries = list(_clients.values())
+        _clients.clear()
+    for _, client in entries:
+        client.close()
@@ -0,0 +1,165 @@
+"""Set-based diff/apply for the Asterisk realtime tables.
+
+:class:`crm.asterisk_sync.AsteriskStateSync` used to write realtime rows one
+at a time with ``update_or_create``. That is a ``SELECT`` plus an
+``UPDATE``/``INSERT`` per row, and for a BYO PBX every one of those crosses
+the WAN. This module does the same work in three steps:
+
+1. **read**: one query per table loads the rows the sync owns (see
+   :func:`read_current`);
+2. **plan**: the rows are compared in memory against the desired state the
+   sync computed from the product models (see :func:`plan_table`);
+3. **apply**: every table's deletes, inserts and updates run as bulk
+   statements inside one transaction on the PBX alias (see :func:`apply`).
+
+Desired state is a dict ``{model: {key: fields | None}}``. ``None`` means
+"this row must not exist", e.g. the identify row of a WebRTC endpoint. Rows
+that are read through the table's *scope* but are not desired at all get
+deleted too. This is how a full resync removes leftovers from extensions,
+trunks and queues that were deleted while the PBX was unreachable.
+
+The result is a :class:`SyncReport` listing what was created, updated and
+deleted per table.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Q
+
+# Rows whose identity is not their primary key (the key is ``(queue_name,
+# interface)``; ``uniqueid`` is a surrogate).
+COMPOSITE_KEYS = {
+    "AsteriskQueueMember": ("queue_name", "interface"),
+}
+
+
+def key_fields(model) -> Tuple[str, ...]:
+    return COMPOSITE_KEYS.get(model.__name__, (model._meta.pk.name,))
+
+
+def _key_of(row: dict, fields: Tuple[str, ...]):
+    return row[fields[0]] if len(fields) == 1 else tuple(row[f] for f in fields)
+
+
+def _label(key) -> str:
+    return "/".join(key) if isinstance(key, tuple) else str(key)
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class TableChanges:
+    created: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.created or self.updated or self.deleted)
+
+    def counts(self) -> Dict[str, int]:
+        return {"created": len(self.created), "updated": len(self.updated), "deleted": len(self.deleted)}
+
+
+@dataclass
+class SyncReport:
+    """What a sync changed, per realtime table (``db_table`` name)."""
+
+    tables: Dict[str, TableChanges] = field(default_factory=dict)
+
+    @property
+    def changed(self) -> bool:
+        return any(self.tables.values())
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        """``{table: {"created": n, "updated": n, "deleted": n}}`` for tables that changed."""
+        return {table: changes.counts() for table, changes in self.tables.items() if changes}
+
+    def __str__(self) -> str:
+        if not self.changed:
+            return "no changes"
+        return ", ".join(
+            f"{table} +{c['created']} ~{c['updated']} -{c['deleted']}"
+            for table, c in self.as_dict().items()
+        )
+
+
+# ---------------------------------------------------------------------------
+# Read / plan / apply
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class TablePlan:
+    model: type
+    creates: List[dict] = field(default_factory=list)
+    updates: List[Tuple[dict, List[str]]] = field(default_factory=list)
+    deletes: List[object] = field(default_factory=list)
+    changes: TableChanges = field(default_factory=TableChanges)
+
+
+def read_current(model, alias: str, desired_keys: Iterable, scope: Optional[Q] = None) -> List[dict]:
+    """Existing rows that are either desired/undesired by key or inside ``scope``. One query."""
+    fields = key_fields(model)
+    condition = Q(pk__in=[])
+    if len(fields) == 1:
+        condition = Q(**{f"{fields[0]}__in": list(desired_keys)})
+    if scope is not None:
+        condition |= scope
+    return list(model.objects.using(alias).filter(condition).values())
+
+
+def plan_table(model, current_rows: Iterable[dict], desired: Dict[object, Optional[dict]]) -> TablePlan:
+    """Compare stored rows against the desired state for one table."""
+    fields = key_fields(model)
+    pk_name = model._meta.pk.name
+    plan = TablePlan(model=model)
+    current = {_key_of(row, fields): row for row in current_rows}
+
+    for key, row in current.items():
+        if desired.get(key) is None:
+            plan.deletes.append(row[pk_name])
+            plan.changes.deleted.append(_label(key))
+
+    for key, wanted in desired.items():
+        if wanted is None:
+            continue
+        key_values = dict(zip(fields, key if len(fields) > 1 else (key,)))
+        existing = current.get(key)
+        if existing is None:
+            plan.creates.append({**key_values, **wanted})
+            plan.changes.created.append(_label(key))
+            continue
+        changed = [name for name, value in wanted.items() if existing.get(name) != value]
+        if changed:
+            plan.updates.append(({**existing, **wanted}, changed))
+            plan.changes.updated.append(_label(key))
+    return plan
+
+
+def apply(alias: str, desired: Dict[type, Dict[object, Optional[dict]]],
+          scopes: Optional[Dict[type, Q]] = None) -> SyncReport:
+    """Read, diff and write every table in ``desired`` in one transaction."""
+    scopes = scopes or {}
+    report = SyncReport()
+    with transaction.atomic(using=alias):
+        plans = [
+            plan_table(model, read_current(model, alias, rows.keys(), scopes.get(model)), rows)
+            for model, rows in desired.items()
+        ]
+        for plan in plans:
+            manager = plan.model.objects.using(alias)
+            if plan.deletes:
+                manager.filter(pk__in=plan.deletes).delete()
+            if plan.creates:
+                manager.bulk_create([plan.model(**row) for row in plan.creates])
+            if plan.updates:
+                changed_fields = sorted({name for _, changed in plan.updates for name in changed})
+                manager.bulk_update([plan.model(**row) for row, _ in plan.updates], changed_fields)
+            report.tables[plan.model._meta.db_table] = plan.changes
+    return report
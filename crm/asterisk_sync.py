@@ -22,15 +22,22 @@ Design rules
    ``extensions_custom.conf`` + the existing AGI that calls
    ``/api/pbx/call-routing/``. So ``sync_inbound_route`` is intentionally a
    no-op at the DB level; the route lookup happens at call time.
+5. **Diff, don't upsert.** Sync methods compute the rows they want and hand
+   them to :mod:`crm.asterisk_diff`. That reads the existing rows once per
+   table, writes only the delta as bulk statements in one transaction, and
+   reports what changed. ``full_resync`` does this for the whole tenant in a
+   single pass.
 """
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 
+from crm import asterisk_diff
 from crm.asterisk_db import get_active_pbx_for_current_tenant, register_pbx_alias
 
 if TYPE_CHECKING:
@@ -239,13 +246,16 @@ class AsteriskStateSync:
     # Endpoint (UserPhoneAssignment) sync
     # ------------------------------------------------------------------
 
-    def sync_endpoint(self, assignment: "UserPhoneAssignment") -> None:
+    def sync_endpoint(self, assignment: "UserPhoneAssignment") -> Optional[asterisk_diff.SyncReport]:
         """Upsert the 4 pjsip rows (endpoint, auth, aor, identify) for a user extension."""
         if not self._enabled():
-            return
-        self._run("sync_endpoint", self._sync_endpoint_impl, assignment)
+            return None
+        return self._run("sync_endpoint", self._sync_endpoint_impl, assignment)
+
+    def _sync_endpoint_impl(self, assignment: "UserPhoneAssignment") -> asterisk_diff.SyncReport:
+        return self._apply(self._endpoint_rows(assignment))
 
-    def _sync_endpoint_impl(self, assignment: "UserPhoneAssignment") -> None:
+    def _endpoint_rows(self, assignment: "UserPhoneAssignment") -> Dict[type, Dict[str, Optional[dict]]]:
         from asterisk_state.models import PsAor, PsAuth, PsEndpoint, PsIdentify
 
         endpoint_id = self.prefix(self.tenant_schema, str(assignment.extension))
@@ -276,29 +286,26 @@ class AsteriskStateSync:
             "password": assignment.extension_password,
             "realm": getattr(settings, "PBX_REALM", "asterisk"),
         }
-
-        with transaction.atomic(using=self.alias):
-            PsAuth.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=auth_fields
-            )
-            PsAor.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=aor_fields
-            )
-            PsEndpoint.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=endpoint_fields
-            )
+        return {
+            PsAuth: {endpoint_id: auth_fields},
+            PsAor: {endpoint_id: aor_fields},
+            PsEndpoint: {endpoint_id: endpoint_fields},
             # Identify by username — pjsip already uses identify_by=username
             # on the endpoint so this row is only needed when we later layer
             # IP-based identify. For WebRTC endpoints we ensure no stale row.
-            PsIdentify.objects.using(self.alias).filter(id=endpoint_id).delete()
+            PsIdentify: {endpoint_id: None},
+        }
+
+    def tombstone_endpoint(self, assignment_id: int, extension: str) -> bool:
+        """Delete all 4 pjsip rows for an extension (on extension deletion).
 
-    def tombstone_endpoint(self, assignment_id: int, extension: str) -> None:
-        """Delete all 4 pjsip rows for an extension (on extension deletion)."""
+        Returns False when the delete failed.
+        """
         if not self._enabled():
-            return
-        self._run("tombstone_endpoint", self._tombstone_endpoint_impl, extension)
+            return False
+        return bool(self._run("tombstone_endpoint", self._tombstone_endpoint_impl, extension))
 
-    def _tombstone_endpoint_impl(self, extension: str) -> None:
+    def _tombstone_endpoint_impl(self, extension: str) -> bool:
         from asterisk_state.models import PsAor, PsAuth, PsEndpoint, PsIdentify
 
         endpoint_id = self.prefix(self.tenant_schema, str(extension))
@@ -307,18 +314,22 @@ class AsteriskStateSync:
             PsIdentify.objects.using(self.alias).filter(id=endpoint_id).delete()
             PsAor.objects.using(self.alias).filter(id=endpoint_id).delete()
             PsAuth.objects.using(self.alias).filter(id=endpoint_id).delete()
+        return True
 
     # ------------------------------------------------------------------
     # Trunk sync
     # ------------------------------------------------------------------
 
-    def sync_trunk(self, trunk: "Trunk") -> None:
+    def sync_trunk(self, trunk: "Trunk") -> Optional[asterisk_diff.SyncReport]:
         """Upsert the pjsip rows (and optional registration) for a provider trunk."""
         if not self._enabled():
-            return
-        self._run("sync_trunk", self._sync_trunk_impl, trunk)
+            return None
+        return self._run("sync_trunk", self._sync_trunk_impl, trunk)
 
-    def _sync_trunk_impl(self, trunk: "Trunk") -> None:
+    def _sync_trunk_impl(self, trunk: "Trunk") -> asterisk_diff.SyncReport:
+        return self._apply(self._trunk_rows(trunk))
+
+    def _trunk_rows(self, trunk: "Trunk") -> Dict[type, Dict[str, Optional[dict]]]:
         from asterisk_state.models import (
             PsAor,
             PsAuth,
@@ -360,62 +371,51 @@ class AsteriskStateSync:
             "match": trunk.sip_server,
         }
 
-        with transaction.atomic(using=self.alias):
-            PsAuth.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=auth_fields
-            )
-            PsAor.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=aor_fields
-            )
-            PsEndpoint.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=endpoint_fields
-            )
-            PsIdentify.objects.using(self.alias).update_or_create(
-                id=endpoint_id, defaults=identify_fields
-            )
-
-            if trunk.register:
-                reg_fields = {
-                    "server_uri": f"sip:{trunk.sip_server}:{trunk.sip_port}",
-                    "client_uri": (
-                        f"sip:{trunk.username}@{trunk.realm or trunk.sip_server}"
-                    ),
-                    "contact_user": trunk.username,
-                    "expiration": 3600,
-                    "retry_interval": 60,
-                    "forbidden_retry_interval": 600,
-                    "fatal_retry_interval": 600,
-                    "outbound_auth": endpoint_id,
-                    "transport": "transport-udp",
-                    "max_retries": 10000,
-                    "auth_rejection_permanent": "no",
-                    "support_path": "no",
-                }
-                PsRegistration.objects.using(self.alias).update_or_create(
-                    id=endpoint_id, defaults=reg_fields
-                )
-            else:
-                PsRegistration.objects.using(self.alias).filter(id=endpoint_id).delete()
+        reg_fields = None
+        if trunk.register:
+            reg_fields = {
+                "server_uri": f"sip:{trunk.sip_server}:{trunk.sip_port}",
+                "client_uri": (
+                    f"sip:{trunk.username}@{trunk.realm or trunk.sip_server}"
+                ),
+                "contact_user": trunk.username,
+                "expiration": 3600,
+                "retry_interval": 60,
+                "forbidden_retry_interval": 600,
+                "fatal_retry_interval": 600,
+                "outbound_auth": endpoint_id,
+                "transport": "transport-udp",
+                "max_retries": 10000,
+                "auth_rejection_permanent": "no",
+                "support_path": "no",
+            }
+        return {
+            PsAuth: {endpoint_id: auth_fields},
+            PsAor: {endpoint_id: aor_fields},
+            PsEndpoint: {endpoint_id: endpoint_fields},
+            PsIdentify: {endpoint_id: identify_fields},
+            PsRegistration: {endpoint_id: reg_fields},
+        }
 
-    def tombstone_trunk(self, trunk_id: int, slug: Optional[str] = None) -> None:
+    def tombstone_trunk(self, trunk_id: int, slug: Optional[str] = None) -> bool:
         """Delete all pjsip + registration rows for a deleted trunk.
 
         ``slug`` is required because after a ``post_delete`` signal the Trunk
         instance is gone — the caller must pass the slug they computed while
-        the row still existed.
+        the row still existed. Returns False when the delete failed.
         """
         if not self._enabled():
-            return
+            return False
         if not slug:
             logger.warning(
                 "tombstone_trunk called without slug for trunk_id=%s (tenant=%s)",
                 trunk_id,
                 self.tenant_schema,
             )
-            return
-        self._run("tombstone_trunk", self._tombstone_trunk_impl, slug)
+            return False
+        return bool(self._run("tombstone_trunk", self._tombstone_trunk_impl, slug))
 
-    def _tombstone_trunk_impl(self, slug: str) -> None:
+    def _tombstone_trunk_impl(self, slug: str) -> bool:
         from asterisk_state.models import (
             PsAor,
             PsAuth,
@@ -431,20 +431,28 @@ class AsteriskStateSync:
             PsIdentify.objects.using(self.alias).filter(id=endpoint_id).delete()
             PsAor.objects.using(self.alias).filter(id=endpoint_id).delete()
             PsAuth.objects.using(self.alias).filter(id=endpoint_id).delete()
+        return True
 
     # ------------------------------------------------------------------
     # Queue sync
     # ------------------------------------------------------------------
 
-    def sync_queue(self, queue: "Queue") -> None:
+    def sync_queue(self, queue: "Queue") -> Optional[asterisk_diff.SyncReport]:
         """Upsert the ``queues`` row and then resync membership."""
         if not self._enabled():
-            return
-        self._run("sync_queue", self._sync_queue_impl, queue)
+            return None
+        report = self._run("sync_queue", self._sync_queue_impl, queue)
         # Member sync is idempotent so re-running after a queue update is safe.
-        self._run("sync_queue_members", self._sync_queue_members_impl, queue)
+        members = self._run("sync_queue_members", self._sync_queue_members_impl, queue)
+        if report is None or members is None:
+            return None
+        report.tables.update(members.tables)
+        return report
 
-    def _sync_queue_impl(self, queue: "Queue") -> None:
+    def _sync_queue_impl(self, queue: "Queue") -> asterisk_diff.SyncReport:
+        return self._apply(self._queue_rows(queue))
+
+    def _queue_rows(self, queue: "Queue") -> Dict[type, Dict[str, Optional[dict]]]:
         from asterisk_state.models import AsteriskQueue
 
         queue_name = self.prefix(self.tenant_schema, queue.slug)
@@ -467,11 +475,9 @@ class AsteriskStateSync:
             "reportholdtime": "no",
             "context": self._tenant_context,
         }
-        AsteriskQueue.objects.using(self.alias).update_or_create(
-            name=queue_name, defaults=fields
-        )
+        return {AsteriskQueue: {queue_name: fields}}
 
-    def sync_queue_members(self, queue: "Queue") -> None:
+    def sync_queue_members(self, queue: "Queue") -> Optional[asterisk_diff.SyncReport]:
         """Recompute the queue's membership from the Django group → assignments intersection.
 
         Also mirrors rows into the local ``crm.QueueMember`` table so the UI
@@ -479,84 +485,90 @@ class AsteriskStateSync:
         Asterisk.
         """
         if not self._enabled():
-            return
-        self._run("sync_queue_members", self._sync_queue_members_impl, queue)
+            return None
+        return self._run("sync_queue_members", self._sync_queue_members_impl, queue)
 
-    def _sync_queue_members_impl(self, queue: "Queue") -> None:
+    def _sync_queue_members_impl(self, queue: "Queue") -> asterisk_diff.SyncReport:
         from asterisk_state.models import AsteriskQueueMember
-        from crm.models import QueueMember, UserPhoneAssignment
 
+        active_assignments = self._queue_assignments(queue)
         queue_name = self.prefix(self.tenant_schema, queue.slug)
+        # Scoped to this queue, so members that are no longer desired are deleted.
+        report = self._apply(
+            self._queue_member_rows(queue, active_assignments),
+            {AsteriskQueueMember: Q(queue_name=queue_name)},
+        )
+        self._mirror_queue_members(queue, active_assignments)
+        return report
 
-        # Source of truth: group members who have an active primary assignment.
-        group_user_ids = set(queue.group.members.values_list("id", flat=True))
-        active_assignments = list(
+    @staticmethod
+    def _queue_assignments(queue: "Queue") -> List["UserPhoneAssignment"]:
+        """Source of truth: group members who have an active assignment."""
+        from crm.models import UserPhoneAssignment
+
+        return list(
             UserPhoneAssignment.objects.filter(
-                user_id__in=group_user_ids, is_active=True
-            ).select_related("user")
+                user__tenant_groups=queue.group_id, is_active=True
+            ).select_related("user").distinct()
         )
 
-        # --- Asterisk realtime side ---
-        desired_interfaces: Dict[str, "UserPhoneAssignment"] = {}
-        for assignment in active_assignments:
+    def _queue_member_rows(self, queue: "Queue", assignments) -> Dict[type, Dict[tuple, Optional[dict]]]:
+        from asterisk_state.models import AsteriskQueueMember
+
+        queue_name = self.prefix(self.tenant_schema, queue.slug)
+        members = {}
+        for assignment in assignments:
             endpoint_id = self.prefix(self.tenant_schema, str(assignment.extension))
-            desired_interfaces[f"PJSIP/{endpoint_id}"] = assignment
-
-        # Upsert each desired interface.
-        for interface, assignment in desired_interfaces.items():
-            AsteriskQueueMember.objects.using(self.alias).update_or_create(
-                queue_name=queue_name,
-                interface=interface,
-                defaults={
-                    "membername": assignment.display_name or assignment.user.email,
-                    "state_interface": interface,
-                    "penalty": 0,
-                    "paused": 0,
-                    "wrapuptime": queue.wrapup_time,
-                },
-            )
-        # Drop rows that are no longer in the desired set.
-        AsteriskQueueMember.objects.using(self.alias).filter(
-            queue_name=queue_name
-        ).exclude(interface__in=list(desired_interfaces.keys())).delete()
-
-        # --- Local product-side mirror (crm.QueueMember) ---
-        desired_assignment_ids = {a.id for a in active_assignments}
-        existing = {
-            qm.user_phone_assignment_id: qm
-            for qm in QueueMember.objects.filter(queue=queue)
-        }
-        for assignment in active_assignments:
-            if assignment.id in existing:
-                qm = existing[assignment.id]
-                if not qm.is_active:
-                    qm.is_active = True
-                    qm.save(update_fields=["is_active", "synced_at"])
-            else:
-                QueueMember.objects.create(
+            interface = f"PJSIP/{endpoint_id}"
+            members[(queue_name, interface)] = {
+                "membername": assignment.display_name or assignment.user.email,
+                "state_interface": interface,
+                "penalty": 0,
+                "paused": 0,
+                "wrapuptime": queue.wrapup_time,
+            }
+        return {AsteriskQueueMember: members}
+
+    @staticmethod
+    def _mirror_queue_members(queue: "Queue", assignments) -> None:
+        """Local product-side mirror (crm.QueueMember), written with bulk statements."""
+        from django.utils import timezone
+
+        from crm.models import QueueMember
+
+        desired_ids = {a.id for a in assignments}
+        existing = dict(
+            QueueMember.objects.filter(queue=queue).values_list("user_phone_assignment_id", "is_active")
+        )
+        missing = desired_ids - existing.keys()
+        if missing:
+            QueueMember.objects.bulk_create([
+                QueueMember(
                     queue=queue,
-                    user_phone_assignment=assignment,
+                    user_phone_assignment_id=assignment_id,
                     penalty=0,
                     paused=False,
                     is_active=True,
                 )
+                for assignment_id in sorted(missing)
+            ])
+        reactivate = [aid for aid, is_active in existing.items() if aid in desired_ids and not is_active]
+        if reactivate:
+            QueueMember.objects.filter(
+                queue=queue, user_phone_assignment_id__in=reactivate
+            ).update(is_active=True, synced_at=timezone.now())
         # Remove mirror rows that no longer belong.
-        stale_ids = [
-            qm_id
-            for assignment_id, qm in existing.items()
-            for qm_id in [qm.id]
-            if assignment_id not in desired_assignment_ids
-        ]
-        if stale_ids:
-            QueueMember.objects.filter(id__in=stale_ids).delete()
+        stale = existing.keys() - desired_ids
+        if stale:
+            QueueMember.objects.filter(queue=queue, user_phone_assignment_id__in=stale).delete()
 
-    def tombstone_queue(self, queue_id: int, slug: str) -> None:
-        """Delete the queue row + all its members."""
+    def tombstone_queue(self, queue_id: int, slug: str) -> bool:
+        """Delete the queue row + all its members. Returns False when the delete failed."""
         if not self._enabled():
-            return
-        self._run("tombstone_queue", self._tombstone_queue_impl, slug)
+            return False
+        return bool(self._run("tombstone_queue", self._tombstone_queue_impl, slug))
 
-    def _tombstone_queue_impl(self, slug: str) -> None:
+    def _tombstone_queue_impl(self, slug: str) -> bool:
         from asterisk_state.models import AsteriskQueue, AsteriskQueueMember
 
         queue_name = self.prefix(self.tenant_schema, slug)
@@ -565,6 +577,7 @@ class AsteriskStateSync:
                 queue_name=queue_name
             ).delete()
             AsteriskQueue.objects.using(self.alias).filter(name=queue_name).delete()
+        return True
 
     # ------------------------------------------------------------------
     # Inbound routes (intentionally no-op at the DB level)
@@ -603,16 +616,22 @@ class AsteriskStateSync:
     # Full tenant resync (Celery-driven)
     # ------------------------------------------------------------------
 
-    def full_resync(self) -> Dict[str, int]:
-        """Run every sync_* method for the current tenant.
+    def full_resync(self) -> Dict[str, Any]:
+        """Diff the tenant's whole realtime state against the product models.
+
+        Desired rows for every active trunk, extension and queue (plus queue
+        members) are built in memory. :func:`crm.asterisk_diff.apply` then
+        reads the existing rows once per table and writes the delta in one
+        transaction. When IDs carry the tenant prefix, every ``{schema}_*``
+        row that is no longer desired is deleted as well. A BYO PBX may hold
+        rows we didn't create, so there only stale members of the tenant's
+        own queues are removed.
 
-        Returns a summary dict usable by the Celery task / management command
-        for logging (e.g. ``{"trunks": 2, "extensions": 18, "queues": 3}``).
-        Failures on individual rows are swallowed via ``_run``; the count we
-        return is the number of rows we *attempted* to sync, not the number
-        that succeeded.
+        Returns the number of trunks/extensions/queues/routes considered,
+        plus ``changes`` (per-table created/updated/deleted counts, or
+        ``None`` if the write failed and was rolled back).
         """
-        summary = {"trunks": 0, "extensions": 0, "queues": 0, "inbound_routes": 0}
+        summary: Dict[str, Any] = {"trunks": 0, "extensions": 0, "queues": 0, "inbound_routes": 0}
         if not self._enabled():
             logger.info(
                 "full_resync no-op (ASTERISK_SYNC_ENABLED=False) for tenant=%s",
@@ -620,26 +639,84 @@ class AsteriskStateSync:
             )
             return summary
 
+        from asterisk_state.models import (
+            AsteriskQueue, AsteriskQueueMember, PsAor, PsAuth, PsEndpoint, PsIdentify, PsRegistration,
+        )
         from crm.models import InboundRoute, Queue, Trunk, UserPhoneAssignment
 
+        # Every managed table takes part even with nothing desired, so a tenant
+        # without trunks or queues still has its leftover rows pruned.
+        desired: Dict[type, Dict[Any, Optional[dict]]] = {
+            model: {}
+            for model in (PsAuth, PsAor, PsEndpoint, PsIdentify, PsRegistration, AsteriskQueue, AsteriskQueueMember)
+        }
+
+        def add(rows):
+            for model, model_rows in rows.items():
+                desired.setdefault(model, {}).update(model_rows)
+
         for trunk in Trunk.objects.filter(is_active=True):
-            self.sync_trunk(trunk)
+            add(self._trunk_rows(trunk))
             summary["trunks"] += 1
-        for assignment in UserPhoneAssignment.objects.filter(is_active=True):
-            self.sync_endpoint(assignment)
+        for assignment in UserPhoneAssignment.objects.filter(is_active=True).select_related("user"):
+            add(self._endpoint_rows(assignment))
             summary["extensions"] += 1
+        queue_names = []
+        queue_assignments = []
         for queue in Queue.objects.filter(is_active=True):
-            self.sync_queue(queue)
+            assignments = self._queue_assignments(queue)
+            add(self._queue_rows(queue))
+            add(self._queue_member_rows(queue, assignments))
+            queue_names.append(self.prefix(self.tenant_schema, queue.slug))
+            queue_assignments.append((queue, assignments))
             summary["queues"] += 1
-        for route in InboundRoute.objects.filter(is_active=True):
-            self.sync_inbound_route(route)
-            summary["inbound_routes"] += 1
+        # Routes are dialplan-side (see ``sync_inbound_route``); counted only.
+        summary["inbound_routes"] = InboundRoute.objects.filter(is_active=True).count()
+
+        scopes = self._prune_scopes(desired.keys())
+        scopes[AsteriskQueueMember] = scopes.get(AsteriskQueueMember, Q()) | Q(queue_name__in=queue_names)
+        report = self._run("full_resync", asterisk_diff.apply, self.alias, dict(desired), scopes)
+        summary["changes"] = report.as_dict() if report is not None else None
+        if report is not None:
+            for queue, assignments in queue_assignments:
+                self._run("mirror_queue_members", self._mirror_queue_members, queue, assignments)
 
         logger.info(
-            "full_resync complete for tenant=%s summary=%s", self.tenant_schema, summary
+            "full_resync complete for tenant=%s summary=%s changes=%s",
+            self.tenant_schema, summary, report if report is not None else "failed",
         )
         return summary
 
+    def _prune_scopes(self, models) -> Dict[type, Q]:
+        """Per-table filters for "every row this tenant owns" (prefixed IDs only).
+
+        A schema whose name starts with ours plus ``_`` (``acme`` vs
+        ``acme_eu``) shares the ID prefix, so its rows are excluded.
+        """
+        if self.pbx is not None and not self.pbx.use_tenant_prefix:
+            return {}
+        from tenants.models import Tenant
+
+        own = f"{self.tenant_schema}_"
+        others = [
+            f"{schema}_"
+            for schema in Tenant.objects.filter(schema_name__startswith=own).values_list("schema_name", flat=True)
+        ]
+        scopes = {}
+        for model in models:
+            field_name = "queue_name" if model.__name__ == "AsteriskQueueMember" else model._meta.pk.name
+            scope = Q(**{f"{field_name}__startswith": own})
+            for other in others:
+                scope &= ~Q(**{f"{field_name}__startswith": other})
+            scopes[model] = scope
+        return scopes
+
+    def _apply(self, desired, scopes=None) -> asterisk_diff.SyncReport:
+        report = asterisk_diff.apply(self.alias, desired, scopes)
+        if report.changed:
+            logger.debug("AsteriskStateSync tenant=%s: %s", self.tenant_schema, report)
+        return report
+
 
 # ---------------------------------------------------------------------------
 # Internal helpers
@@ -0,0 +1,279 @@
+"""Coalescing, debounced queue for Django → Asterisk realtime syncs.
+
+The model signals in ``crm/signals.py`` used to call
+:class:`crm.asterisk_sync.AsteriskStateSync` inline. Saving a group with 40
+members meant 40 ``m2m_changed`` rounds, and each one resynced every queue
+backed by the group against a PBX database that may be across a WAN. The
+admin's request waited for all of it, and the same queue was written dozens
+of times.
+
+Signals now only record *what* is dirty:
+
+* after the transaction commits, :func:`mark` sets a field in the tenant's
+  ``pbx_sync_dirty:<schema>`` Redis hash (``endpoint:12``, ``queue:3``,
+  ``group:7``, ...). Marking the same object twice just overwrites the
+  field, which is where the deduplication happens;
+* the first mark in a quiet period schedules :func:`drain` (Celery) after
+  ``ASTERISK_SYNC_DEBOUNCE_SECONDS``. Marks made during that window ride
+  along;
+* the drain takes the whole hash atomically and resolves it to a minimal
+  set of operations. Each trunk, endpoint and queue is synced at most once.
+  User and group marks are expanded to the queues they feed, and queue
+  member syncs are skipped for queues that get a full sync anyway.
+  Operations whose sync fails are marked again and retried after
+  ``RETRY_SECONDS``, up to ``MAX_ATTEMPTS`` times. If the drain itself
+  raises, every taken mark is put back and retried the same way.
+
+:func:`status` (exposed at ``GET /api/pbx-servers/sync-status/``) reports
+the pending marks and the outcome of the last drain. If Redis is down,
+:func:`mark` runs the sync inline, as before.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+from django.conf import settings
+from django.db import transaction
+
+from amanati_crm.redis_utils import decode, get_redis, restore_hash, take_hash
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = 'pbx_sync_dirty:{schema}'
+DRAIN_FLAG_KEY = 'pbx_sync_drain:{schema}'
+LOCK_KEY = 'pbx_sync_lock:{schema}'
+STATUS_KEY = 'pbx_sync_status:{schema}'
+LOCK_TTL = 300
+STATUS_TTL = 7 * 24 * 60 * 60
+RETRY_SECONDS = 30
+MAX_ATTEMPTS = 5
+
+# Mark kinds. ``endpoint``/``trunk``/``queue``/``route`` carry what a
+# tombstone needs once the row is gone (extension / slug).
+KINDS = ('trunk', 'endpoint', 'queue', 'queue_members', 'user', 'group', 'all_queues', 'route')
+
+
+def _debounce_window() -> float:
+    return float(getattr(settings, 'ASTERISK_SYNC_DEBOUNCE_SECONDS', 2))
+
+
+def _schedule_drain(redis, tenant_schema: str, countdown: float) -> None:
+    if redis.set(DRAIN_FLAG_KEY.format(schema=tenant_schema), '1', nx=True, ex=max(int(countdown * 10), 30)):
+        from crm.tasks import drain_asterisk_sync
+        drain_asterisk_sync.apply_async((tenant_schema,), countdown=countdown)
+
+
+# ---------------------------------------------------------------------------
+# Marking (called from signals)
+# ---------------------------------------------------------------------------
+
+def _field(kind: str, object_id=None) -> str:
+    return kind if object_id is None else f'{kind}:{object_id}'
+
+
+def _write_marks(tenant_schema: str, marks: Dict[str, dict], countdown: float) -> None:
+    try:
+        redis = get_redis()
+        redis.hset(
+            DIRTY_KEY.format(schema=tenant_schema),
+            mapping={field: json.dumps(payload) for field, payload in marks.items()},
+        )
+        _schedule_drain(redis, tenant_schema, countdown)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Asterisk sync queue unavailable, syncing %s inline: %s', sorted(marks), exc)
+        from tenant_schemas.utils import schema_context
+
+        with schema_context(tenant_schema):
+            _process(tenant_schema, marks)
+
+
+def mark(tenant_schema: str, kind: str, object_id=None, **payload) -> None:
+    """Flag ``(tenant, object)`` for a sync once the current transaction commits."""
+    if not tenant_schema or tenant_schema == 'public':
+        return
+    marks = {_field(kind, object_id): payload}
+    transaction.on_commit(lambda: _write_marks(tenant_schema, marks, _debounce_window()))
+
+
+# ---------------------------------------------------------------------------
+# Draining
+# ---------------------------------------------------------------------------
+
+def _split(field: str):
+    kind, _, object_id = field.partition(':')
+    return kind, (int(object_id) if object_id else None)
+
+
+def _process(tenant_schema: str, marks: Dict[str, dict]) -> dict:
+    """Run the deduplicated syncs for ``marks``. Runs inside ``schema_context``.
+
+    Returns ``{"operations": n, "changes": {...}, "failed": {field: payload}}``.
+    """
+    from crm.asterisk_sync import AsteriskStateSync, _slugify_trunk
+    from crm.models import InboundRoute, Queue, Trunk, UserPhoneAssignment
+
+    result = {'operations': 0, 'changes': {}, 'failed': {}}
+    sync = AsteriskStateSync(tenant_schema)
+    if not sync._enabled():
+        return result
+
+    by_kind: Dict[str, Dict[Optional[int], dict]] = {kind: {} for kind in KINDS}
+    for field, payload in marks.items():
+        kind, object_id = _split(field)
+        if kind in by_kind:
+            by_kind[kind][object_id] = payload
+
+    def run(field: str, payload: dict, report) -> None:
+        # Syncs return a SyncReport (None on failure), tombstones a bool.
+        result['operations'] += 1
+        if report is None or report is False:
+            result['failed'][field] = payload
+            return
+        if report is True:
+            return
+        for table, counts in report.as_dict().items():
+            totals = result['changes'].setdefault(table, {'created': 0, 'updated': 0, 'deleted': 0})
+            for name, count in counts.items():
+                totals[name] += count
+
+    trunks = Trunk.objects.in_bulk(list(by_kind['trunk']))
+    for trunk_id, payload in by_kind['trunk'].items():
+        trunk = trunks.get(trunk_id)
+        if trunk is not None and trunk.is_active:
+            run(_field('trunk', trunk_id), payload, sync.sync_trunk(trunk))
+        else:
+            slug = (trunk and _slugify_trunk(trunk)) or payload.get('slug')
+            if slug:
+                run(_field('trunk', trunk_id), payload, sync.tombstone_trunk(trunk_id, slug=slug))
+
+    assignments = UserPhoneAssignment.objects.select_related('user').in_bulk(list(by_kind['endpoint']))
+    for assignment_id, payload in by_kind['endpoint'].items():
+        assignment = assignments.get(assignment_id)
+        if assignment is not None and assignment.is_active:
+            run(_field('endpoint', assignment_id), payload, sync.sync_endpoint(assignment))
+        else:
+            extension = (assignment and assignment.extension) or payload.get('extension')
+            if extension:
+                run(_field('endpoint', assignment_id), payload, sync.tombstone_endpoint(assignment_id, extension))
+
+    queues = Queue.objects.in_bulk(list(by_kind['queue']))
+    fully_synced: Set[int] = set()
+    for queue_id, payload in by_kind['queue'].items():
+        queue = queues.get(queue_id)
+        if queue is not None and queue.is_active:
+            run(_field('queue', queue_id), payload, sync.sync_queue(queue))
+            fully_synced.add(queue_id)
+        else:
+            slug = (queue and queue.slug) or payload.get('slug')
+            if slug:
+                run(_field('queue', queue_id), payload, sync.tombstone_queue(queue_id, slug))
+
+    # Membership: expand user/group marks to the queues they feed.
+    active_queues = Queue.objects.filter(is_active=True)
+    if by_kind['all_queues']:
+        member_ids = set(active_queues.values_list('id', flat=True))
+    else:
+        member_ids = set(by_kind['queue_members'])
+        if by_kind['group']:
+            member_ids |= set(active_queues.filter(group_id__in=list(by_kind['group'])).values_list('id', flat=True))
+        if by_kind['user']:
+            member_ids |= set(
+                active_queues.filter(group__members__id__in=list(by_kind['user'])).values_list('id', flat=True)
+            )
+    for queue in active_queues.filter(id__in=member_ids - fully_synced):
+        run(_field('queue_members', queue.id), {}, sync.sync_queue_members(queue))
+
+    routes = InboundRoute.objects.in_bulk(list(by_kind['route']))
+    for route_id in by_kind['route']:
+        route = routes.get(route_id)
+        if route is not None:
+            sync.sync_inbound_route(route)
+        else:
+            sync.tombstone_inbound_route(route_id)
+    return result
+
+
+def drain(tenant_schema: str) -> dict:
+    """Apply every pending mark for the tenant. Runs inside ``schema_context``."""
+    redis = get_redis()
+    lock_key = LOCK_KEY.format(schema=tenant_schema)
+    if not redis.set(lock_key, '1', nx=True, ex=LOCK_TTL):
+        # Another worker is draining; look again once it is likely done.
+        from crm.tasks import drain_asterisk_sync
+        drain_asterisk_sync.apply_async((tenant_schema,), countdown=_debounce_window())
+        return {}
+    try:
+        # Clear the flag first: anything marked from here on schedules its own drain.
+        redis.delete(DRAIN_FLAG_KEY.format(schema=tenant_schema))
+        dirty_key = DIRTY_KEY.format(schema=tenant_schema)
+        taken = take_hash(redis, dirty_key)
+        if not taken:
+            return {}
+        marks = {field: json.loads(value) for field, value in taken.items()}
+        started = time.time()
+        try:
+            result = _process(tenant_schema, marks)
+        except Exception:
+            # Put the marks back (newer ones win) so the work isn't lost.
+            restore_hash(redis, dirty_key, taken)
+            _schedule_drain(redis, tenant_schema, RETRY_SECONDS)
+            raise
+
+        retry = {}
+        dropped = []
+        for field, payload in result['failed'].items():
+            attempts = int(payload.get('attempts', 0)) + 1
+            if attempts < MAX_ATTEMPTS:
+                retry[field] = {**payload, 'attempts': attempts}
+            else:
+                dropped.append(field)
+        if retry:
+            redis.hset(
+                dirty_key,
+                mapping={field: json.dumps(payload) for field, payload in retry.items()},
+            )
+            _schedule_drain(redis, tenant_schema, RETRY_SECONDS)
+        if dropped:
+            logger.error('Asterisk sync gave up on %s for tenant=%s', dropped, tenant_schema)
+
+        summary = {
+            'started_at': started,
+            'finished_at': time.time(),
+            'marks': len(marks),
+            'operations': result['operations'],
+            'changes': result['changes'],
+            'failed': sorted(result['failed']),
+            'retrying': sorted(retry),
+            'dropped': dropped,
+        }
+        redis.set(STATUS_KEY.format(schema=tenant_schema), json.dumps(summary), ex=STATUS_TTL)
+        return summary
+    finally:
+        redis.delete(lock_key)
+
+
+def status(tenant_schema: str) -> dict:
+    """Pending marks, whether a drain is scheduled, and the last drain's summary."""
+    redis = get_redis()
+    pending = sorted(decode(field) for field in redis.hkeys(DIRTY_KEY.format(schema=tenant_schema)))
+    last = redis.get(STATUS_KEY.format(schema=tenant_schema))
+    return {
+        'pending': pending,
+        'pending_count': len(pending),
+        'drain_scheduled': bool(redis.exists(DRAIN_FLAG_KEY.format(schema=tenant_schema))),
+        'draining': bool(redis.exists(LOCK_KEY.format(schema=tenant_schema))),
+        'last_drain': json.loads(last) if last else None,
+    }
+
+
+def pending_schemas() -> List[str]:
+    """Tenants with marks waiting (safety net for lost drain tasks)."""
+    redis = get_redis()
+    prefix = DIRTY_KEY.format(schema='')
+    return sorted(
+        decode(key)[len(prefix):]
+        for key in redis.scan_iter(match=prefix + '*', count=500)
+    )
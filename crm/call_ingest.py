@@ -0,0 +1,315 @@
+"""Batched ingestion of PBX call and recording events.
+
+``sip_webhook`` used to handle one event per request: ``CallLog.objects.get``,
+a full ``save()`` (with its signal round trips) and a ``CallEvent`` insert.
+A busy queue sends several events per call leg, so the PBX spent most of its
+time waiting on HTTP round trips. :func:`ingest_sip_events` takes a whole
+batch instead:
+
+* one ``SELECT`` loads every CallLog the batch mentions (``sip_call_id``,
+  indexed);
+* each call's events are folded in memory, in order, into its final status
+  and timestamps. This applies the same transitions the single-event webhook
+  did;
+* the results are written with one ``bulk_create`` for calls that start in
+  this batch, one ``bulk_update`` for the others, and one ``bulk_create``
+  for all the CallEvents;
+* ``save()`` and its signals are bypassed, so the hourly rollups they would
+  have refreshed are recomputed here, once per touched bucket (see
+  :func:`crm.call_rollups.refresh_many`);
+* one ``calls_updated`` message per batch goes to the tenant's
+  ``live_calls_<schema>`` WebSocket group (see
+  :class:`crm.consumers.LiveCallsConsumer`). It carries one entry per call,
+  however many events the call had.
+
+:func:`ingest_recordings` does the same for recording updates. Completed
+recordings are queued for :mod:`crm.recording_pipeline`. The
+single-event ``sip_webhook``/``recording_webhook`` now go through these
+functions with a batch of one.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import call_rollups, phone_index, recording_pipeline
+from .models import CallEvent, CallLog, CallRecording, SipConfiguration
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 500
+
+# SIP events → CallLog.status (unknown events count as ringing, as before).
+EVENT_STATUS = {
+    'call_initiated': 'initiated',
+    'call_ringing': 'ringing',
+    'call_answered': 'answered',
+    'call_ended': 'ended',
+    'call_failed': 'failed',
+    'call_busy': 'busy',
+    'call_no_answer': 'no_answer',
+}
+TERMINAL_STATUSES = ('ended', 'failed', 'busy', 'no_answer')
+CREATING_EVENTS = ('call_initiated', 'call_ringing')
+LIVE_FIELDS = ('status', 'answered_at', 'ended_at', 'duration', 'updated_at')
+
+
+def group_name(schema_name: str) -> str:
+    return f'live_calls_{schema_name}'
+
+
+def _event_time(event: dict):
+    value = event.get('timestamp')
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed or timezone.now()
+
+
+def _apply(call: CallLog, event: dict) -> dict:
+    """Move ``call`` through one SIP event; returns the CallEvent metadata."""
+    old_status = call.status
+    call.status = EVENT_STATUS.get(event['event_type'], 'ringing')
+    at = _event_time(event)
+    if call.status == 'answered' and not call.answered_at:
+        call.answered_at = at
+    elif call.status in TERMINAL_STATUSES and not call.ended_at:
+        call.ended_at = at
+        call.duration = call.ended_at - call.answered_at if call.answered_at else timedelta(seconds=0)
+    return {'sip_event': True, 'old_status': old_status, 'new_status': call.status}
+
+
+def _live_entry(call: CallLog) -> dict:
+    return {
+        'call_id': str(call.call_id),
+        'sip_call_id': call.sip_call_id,
+        'status': call.status,
+        'direction': call.direction,
+        'caller_number': call.caller_number,
+        'recipient_number': call.recipient_number,
+        'handled_by': call.handled_by_id,
+        'answered_at': call.answered_at.isoformat() if call.answered_at else None,
+        'ended_at': call.ended_at.isoformat() if call.ended_at else None,
+        'duration_seconds': int(call.duration.total_seconds()) if call.duration is not None else None,
+    }
+
+
+def broadcast(schema_name: str, calls: List[CallLog]) -> None:
+    if not calls or not schema_name or schema_name == 'public':
+        return
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(group_name(schema_name), {
+            'type': 'calls_updated',
+            'calls': [_live_entry(call) for call in calls],
+        })
+    except Exception as exc:  # noqa: BLE001 — broadcast is best-effort.
+        logger.warning('Live call broadcast failed for tenant=%s: %s', schema_name, exc)
+
+
+# ---------------------------------------------------------------------------
+# SIP events
+# ---------------------------------------------------------------------------
+
+def ingest_sip_events(events: List[dict]) -> List[dict]:
+    """Apply a batch of SIP events. Returns one result per ``sip_call_id`` (or invalid event).
+
+    Results are ``{"sip_call_id", "call_id", "status"}``,
+    ``{"sip_call_id", "error": "not_found"}`` for a call whose first event
+    can't open it, or ``{"index", "error"}`` for a malformed event.
+    """
+    results: List[dict] = []
+    by_call: Dict[str, List[dict]] = OrderedDict()
+    for index, event in enumerate(events):
+        if not isinstance(event, dict) or not event.get('event_type') or not event.get('sip_call_id'):
+            results.append({'index': index, 'error': 'event_type and sip_call_id are required'})
+            continue
+        by_call.setdefault(str(event['sip_call_id']), []).append(event)
+    if not by_call:
+        return results
+
+    existing = {}
+    for call in CallLog.objects.filter(sip_call_id__in=list(by_call)).order_by('-started_at'):
+        existing.setdefault(call.sip_call_id, call)  # newest wins if the PBX reused an id
+
+    sip_config = None
+    created, updated, missing = [], [], []
+    previous_states = {}  # id(call) → rollup state before this batch
+    pending_events = []  # (call, event_type, metadata)
+    for sip_call_id, call_events in by_call.items():
+        call = existing.get(sip_call_id)
+        if call is not None:
+            previous_states[id(call)] = call_rollups.state_of(call)
+            for event in call_events:
+                metadata = _apply(call, event)
+                pending_events.append((call, event['event_type'], {**metadata, **(event.get('metadata') or {})}))
+            updated.append(call)
+            continue
+
+        first = call_events[0]
+        if first['event_type'] not in CREATING_EVENTS:
+            missing.append(sip_call_id)
+            continue
+        if sip_config is None:
+            sip_config = SipConfiguration.objects.filter(is_default=True, is_active=True).first() or False
+        caller_number = first.get('caller_number', '')
+        recipient_number = first.get('recipient_number', '')
+        direction = 'inbound' if caller_number != recipient_number else 'outbound'
+        call = CallLog(
+            caller_number=caller_number,
+            recipient_number=recipient_number,
+            direction=direction,
+            status=EVENT_STATUS.get(first['event_type'], 'ringing'),
+            sip_call_id=sip_call_id,
+            sip_configuration=sip_config or None,
+            client=phone_index.find_crm_client(caller_number if direction == 'inbound' else recipient_number),
+        )
+        pending_events.append((call, first['event_type'], {
+            'sip_event': True, 'caller': caller_number, 'recipient': recipient_number,
+            **(first.get('metadata') or {}),
+        }))
+        for event in call_events[1:]:
+            metadata = _apply(call, event)
+            pending_events.append((call, event['event_type'], {**metadata, **(event.get('metadata') or {})}))
+        created.append(call)
+
+    now = timezone.now()
+    with transaction.atomic():
+        if created:
+            CallLog.objects.bulk_create(created)
+        if updated:
+            for call in updated:
+                call.updated_at = now
+            CallLog.objects.bulk_update(updated, list(LIVE_FIELDS))
+        CallEvent.objects.bulk_create([
+            CallEvent(call_log=call, event_type=event_type.replace('call_', ''), metadata=metadata)
+            for call, event_type, metadata in pending_events
+        ])
+
+    calls = updated + created
+    call_rollups.refresh_many(
+        (previous_states.get(id(call)), call_rollups.state_of(call)) for call in calls
+    )
+    broadcast(getattr(connection, 'schema_name', None), calls)
+
+    results += [
+        {'sip_call_id': call.sip_call_id, 'call_id': str(call.call_id), 'status': call.status}
+        for call in calls
+    ]
+    results += [{'sip_call_id': sip_call_id, 'error': 'not_found'} for sip_call_id in missing]
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Recording updates
+# ---------------------------------------------------------------------------
+
+RECORDING_FIELDS = ('status', 'file_url', 'file_size', 'duration', 'started_at', 'completed_at', 'updated_at')
+
+
+def _uuid_or_none(value) -> Optional[str]:
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def ingest_recordings(updates: List[dict]) -> List[dict]:
+    """Apply a batch of recording updates (``call_id``, ``status``, ``file_url``, ...).
+
+    Returns one result per update, in order: ``{"call_id", "recording_id",
+    "status"}``, ``{"call_id", "error": "not_found"}`` or ``{"index", "error"}``.
+    """
+    valid = [
+        (index, update) for index, update in enumerate(updates)
+        if isinstance(update, dict) and update.get('call_id') and update.get('status')
+    ]
+    call_ids = {_uuid_or_none(update['call_id']) for _, update in valid} - {None}
+    calls = {
+        str(call.call_id): call for call in CallLog.objects.filter(call_id__in=call_ids)
+    } if call_ids else {}
+    recordings = {
+        recording.call_log_id: recording
+        for recording in CallRecording.objects.filter(call_log__in=list(calls.values()))
+    }
+
+    now = timezone.now()
+    new_recordings, touched_recordings, touched_calls, events = {}, {}, {}, []
+    completed = []  # calls whose recording is ready to fetch
+    outcomes: Dict[int, dict] = {}
+    for index, update in valid:
+        call = calls.get(_uuid_or_none(update['call_id']))
+        if call is None:
+            outcomes[index] = {'call_id': str(update['call_id']), 'error': 'not_found'}
+            continue
+        recording = recordings.get(call.id)
+        if recording is None:
+            recording = CallRecording(call_log=call, status='pending', format=update.get('format', 'wav'))
+            recordings[call.id] = new_recordings[call.id] = recording
+
+        recording_status = update['status']
+        file_url = update.get('file_url', '')
+        recording.status = recording_status
+        if file_url:
+            recording.file_url = file_url
+        if update.get('file_size'):
+            recording.file_size = update['file_size']
+        if update.get('duration'):
+            recording.duration = timedelta(seconds=update['duration'])
+        if recording_status == 'started':
+            recording.started_at = now
+        elif recording_status == 'completed':
+            recording.completed_at = now
+        recording.updated_at = now
+        if call.id not in new_recordings:
+            touched_recordings[call.id] = recording
+
+        # Mirror the URL onto the legacy CallLog.recording_url field so list
+        # endpoints / older clients still see the recording.
+        if file_url and call.recording_url != file_url:
+            call.recording_url = file_url
+            touched_calls[call.id] = call
+        events.append(CallEvent(
+            call_log=call,
+            event_type=f'recording_{recording_status}',
+            metadata={
+                'recording_webhook': True,
+                'recording_id': str(recording.recording_id),
+                'file_url': file_url,
+                'file_size': update.get('file_size'),
+                'duration_seconds': update.get('duration'),
+            },
+        ))
+        outcomes[index] = {
+            'call_id': str(call.call_id), 'recording_id': str(recording.recording_id), 'status': recording_status,
+        }
+        if recording_status == 'completed' and (recording.file_url or call.recording_url):
+            completed.append(call.id)
+
+    with transaction.atomic():
+        if new_recordings:
+            CallRecording.objects.bulk_create(list(new_recordings.values()))
+        if touched_recordings:
+            CallRecording.objects.bulk_update(list(touched_recordings.values()), list(RECORDING_FIELDS))
+        if touched_calls:
+            CallLog.objects.bulk_update(list(touched_calls.values()), ['recording_url'])
+        if events:
+            CallEvent.objects.bulk_create(events)
+    recording_pipeline.enqueue(completed)
+
+    return [
+        outcomes.get(index, {'index': index, 'error': 'call_id and status are required'})
+        for index in range(len(updates))
+    ]
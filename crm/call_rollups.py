@@ -0,0 +1,387 @@
+"""Hourly call rollups behind the call statistics endpoints.
+
+``CallHourlyRollup`` holds one row per ``(hour, handled_by, inbound DID,
+direction, status)``. Each row stores the call count and the talk and wait
+totals for that bucket. ``crm/views_stats.py`` sums these rows instead of
+aggregating CallLog, so a month of history costs a few hundred rollup rows
+rather than every call in it.
+
+Rows are kept current in two ways:
+
+* a CallLog save that leaves the call in a terminal status and moves it
+  between buckets or changes its talk/wait timings recomputes the bucket it
+  left and the one it entered from the raw rows. The query is scoped to one
+  hour, so it stays cheap and is idempotent. Saves while the call is still
+  in progress (initiated, ringing, answered, on hold), where most PBX events
+  land, cost neither the pre-save read nor the aggregates; neither do saves
+  whose ``update_fields`` skip the tracked columns. An in-progress call is
+  therefore missing from a past hour's rollups until it ends (that refresh
+  also clears any bucket a reconcile had put it in) or the nightly
+  reconcile runs. The current hour is always read from CallLog, so live
+  numbers are unaffected;
+* :func:`rebuild` recomputes a whole time range with one grouped query. The
+  nightly reconcile task runs it over the last few days. The
+  ``rebuild_call_rollups`` command runs it over the full history; the
+  migration that created the table ran it once.
+
+:func:`summarize` reads whole hours from the rollups and the partial hours at
+either end of the range (``range=week`` starts at ``now - 7 days``) from
+CallLog. Those edge reads are at most two hours of calls, so results match
+the old raw-row aggregation exactly.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import CallHourlyRollup, CallLog
+
+logger = logging.getLogger(__name__)
+
+ANSWERED_STATUSES = ('answered', 'ended', 'transferred')
+MISSED_STATUSES = ('missed', 'no_answer')
+
+TERMINAL_STATUSES = ('ended', 'missed', 'busy', 'no_answer', 'failed', 'cancelled', 'transferred')
+
+COUNT_FIELDS = ('call_count', 'talk_count', 'talk_duration', 'wait_count', 'wait_duration')
+TRACKED_FIELDS = (
+    'started_at', 'handled_by_id', 'recipient_number', 'direction', 'status', 'duration', 'answered_at',
+)
+_TRACKED_NAMES = frozenset(field[:-3] if field.endswith('_id') else field for field in TRACKED_FIELDS)
+_STATUS = TRACKED_FIELDS.index('status')
+
+ONE_HOUR = timedelta(hours=1)
+
+Bucket = Tuple[datetime, Optional[int], str, str, str]
+
+
+def hour_of(dt: datetime) -> datetime:
+    """Start of the local-time hour ``dt`` falls in."""
+    return timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+
+
+def _next_hour(hour: datetime) -> datetime:
+    # UTC arithmetic, so an hour is an hour across DST changes.
+    return timezone.localtime(hour.astimezone(dt_timezone.utc) + ONE_HOUR)
+
+
+def _did_of(direction: str, recipient_number: str) -> str:
+    return recipient_number if direction == 'inbound' else ''
+
+
+def _zero(field: str):
+    return timedelta(0) if field.endswith('_duration') else 0
+
+
+# ---------------------------------------------------------------------------
+# Incremental maintenance
+# ---------------------------------------------------------------------------
+
+def _raw_aggregates() -> dict:
+    answered = Q(answered_at__isnull=False)
+    return {
+        'call_count': Count('id'),
+        'talk_count': Count('id', filter=Q(duration__isnull=False)),
+        'talk_duration': Sum('duration'),
+        'wait_count': Count('id', filter=answered),
+        'wait_duration': Sum(F('answered_at') - F('started_at'), filter=answered),
+    }
+
+
+def _state(values: dict) -> Tuple[Optional[Bucket], tuple]:
+    bucket = None
+    if values['started_at'] is not None:
+        bucket = (
+            hour_of(values['started_at']),
+            values['handled_by_id'],
+            _did_of(values['direction'], values['recipient_number']),
+            values['direction'],
+            values['status'],
+        )
+    return bucket, tuple(values[field] for field in TRACKED_FIELDS)
+
+
+def state_of(call: CallLog) -> Tuple[Optional[Bucket], tuple]:
+    """``(bucket, tracked values)`` of an in-memory CallLog."""
+    return _state({field: getattr(call, field) for field in TRACKED_FIELDS})
+
+
+def is_tracked_save(call: CallLog, update_fields=None) -> bool:
+    """Whether saving ``call`` should refresh its rollups (decided before the save)."""
+    if update_fields is not None:
+        names = {field[:-3] if field.endswith('_id') else field for field in update_fields}
+        if not names & _TRACKED_NAMES:
+            return False
+    return call.status in TERMINAL_STATUSES
+
+
+def _needs_refresh(previous, current) -> bool:
+    if previous is not None and previous[1] == current[1]:
+        return False
+    return current[1][_STATUS] in TERMINAL_STATUSES
+
+
+def stored_state(pk) -> Optional[Tuple[Optional[Bucket], tuple]]:
+    """State of the row as currently stored (call before saving changes)."""
+    if pk is None:
+        return None
+    values = CallLog.objects.filter(pk=pk).values(*TRACKED_FIELDS).first()
+    return _state(values) if values is not None else None
+
+
+def refresh_bucket(hour: datetime, user_id: Optional[int], did: str, direction: str, status: str) -> None:
+    calls = CallLog.objects.filter(
+        started_at__gte=hour, started_at__lt=_next_hour(hour),
+        handled_by_id=user_id, direction=direction, status=status,
+    )
+    if direction == 'inbound':
+        calls = calls.filter(recipient_number=did)
+    agg = calls.aggregate(**_raw_aggregates())
+    lookup = {
+        'hour': hour, 'handled_by_id': user_id, 'recipient_number': did,
+        'direction': direction, 'status': status,
+    }
+    if not agg['call_count']:
+        CallHourlyRollup.objects.filter(**lookup).delete()
+        return
+    values = {field: agg[field] or _zero(field) for field in COUNT_FIELDS}
+    try:
+        with transaction.atomic():
+            CallHourlyRollup.objects.update_or_create(**lookup, defaults=values)
+    except IntegrityError:
+        # A concurrent refresh inserted the bucket first.
+        CallHourlyRollup.objects.filter(**lookup).update(**values)
+
+
+def refresh_buckets(buckets) -> None:
+    """Recompute ``buckets``; never raises (the nightly reconcile repairs failures)."""
+    try:
+        with transaction.atomic():
+            for item in buckets:
+                refresh_bucket(*item)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Call rollup refresh failed for {len(buckets)} buckets: {e}")
+
+
+def refresh_for(call: CallLog, previous=None, deleted: bool = False) -> None:
+    """Recompute the buckets a CallLog save/delete may have changed.
+
+    ``previous`` is :func:`stored_state` from before the save. Saves that
+    leave every tracked field alone (notes, recordings, ...) or leave the
+    call in progress are skipped.
+    """
+    current = state_of(call)
+    if not deleted and not _needs_refresh(previous, current):
+        return
+    refresh_buckets({current[0], previous[0] if previous else None} - {None})
+
+
+def refresh_many(changes) -> None:
+    """:func:`refresh_for` for bulk writes that bypass ``save()`` and its signals.
+
+    ``changes`` is an iterable of ``(previous, current)`` states as returned
+    by :func:`state_of` (``previous`` is ``None`` for new calls). Calls that
+    are still in progress are skipped, as in :func:`refresh_for`; a bucket
+    touched by several calls is recomputed once.
+    """
+    buckets = set()
+    for previous, current in changes:
+        if not _needs_refresh(previous, current):
+            continue
+        buckets |= {current[0], previous[0] if previous else None}
+    buckets.discard(None)
+    refresh_buckets(buckets)
+
+
+def detach_user(user_id) -> set:
+    """Delete a user's rollups ahead of deleting the user.
+
+    ``handled_by`` is ``SET_NULL`` on both CallLog and the rollups, and the
+    user's rows can't simply be nulled: they would collide with the
+    unassigned buckets. Returns those buckets, for :func:`refresh_buckets`
+    once the user's calls have been moved to them.
+    """
+    rows = CallHourlyRollup.objects.filter(handled_by_id=user_id)
+    buckets = {
+        (hour, None, did, direction, status)
+        for hour, did, direction, status in rows.values_list('hour', 'recipient_number', 'direction', 'status')
+    }
+    rows.delete()
+    return buckets
+
+
+# ---------------------------------------------------------------------------
+# Rebuild
+# ---------------------------------------------------------------------------
+
+def rebuild(start: datetime, end: datetime) -> int:
+    """Replace the rollups for the hours in ``[start, end)`` from raw calls.
+
+    ``start`` and ``end`` should fall on hour boundaries (see :func:`hour_of`).
+    """
+    grouped = (
+        CallLog.objects
+        .filter(started_at__gte=start, started_at__lt=end)
+        .annotate(
+            hour=TruncHour('started_at'),
+            did=Case(
+                When(direction='inbound', then=F('recipient_number')),
+                default=Value(''),
+                output_field=CharField(),
+            ),
+        )
+        .order_by()
+        .values('hour', 'handled_by_id', 'did', 'direction', 'status')
+        .annotate(**_raw_aggregates())
+    )
+    rows = [
+        CallHourlyRollup(
+            hour=row['hour'], handled_by_id=row['handled_by_id'], recipient_number=row['did'],
+            direction=row['direction'], status=row['status'],
+            **{field: row[field] or _zero(field) for field in COUNT_FIELDS},
+        )
+        for row in grouped
+    ]
+    with transaction.atomic():
+        CallHourlyRollup.objects.filter(hour__gte=start, hour__lt=end).delete()
+        CallHourlyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def reconcile(days: int = 7) -> int:
+    """Nightly repair window: rebuild the last ``days`` days up to the current hour."""
+    now = timezone.now()
+    start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    return rebuild(start, _next_hour(hour_of(now)))
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+# Metrics returned by :func:`summarize`. Both sources share the ``direction``,
+# ``status``, ``handled_by`` and ``recipient_number`` field names, so the
+# filters are the same; only the aggregated expression differs.
+_ANSWERED = Q(status__in=ANSWERED_STATUSES)
+_MISSED = Q(status__in=MISSED_STATUSES)
+_INBOUND = Q(direction='inbound')
+_METRIC_FILTERS = {
+    'total_calls': None,
+    'answered_calls': _ANSWERED,
+    'missed_calls': _MISSED,
+    'answered_inbound': _ANSWERED & _INBOUND,
+    'missed_inbound': _MISSED & _INBOUND,
+    'inbound_calls': _INBOUND,
+    'outbound_calls': Q(direction='outbound'),
+}
+DURATION_METRICS = ('talk_duration', 'wait_duration')
+METRIC_NAMES = tuple(_METRIC_FILTERS) + ('talk_count', 'talk_duration', 'wait_count', 'wait_duration')
+
+_GROUPINGS = {
+    'user': lambda time_field: F('handled_by'),
+    'day': TruncDate,
+    'hour': ExtractHour,
+    'weekday': ExtractIsoWeekDay,
+}
+
+
+def _rollup_metrics() -> dict:
+    metrics = {name: Sum('call_count', filter=q) for name, q in _METRIC_FILTERS.items()}
+    metrics.update(
+        # Talk time only counts answered calls (as it always has).
+        talk_count=Sum('talk_count', filter=_ANSWERED),
+        talk_duration=Sum('talk_duration', filter=_ANSWERED),
+        wait_count=Sum('wait_count'),
+        wait_duration=Sum('wait_duration'),
+    )
+    return metrics
+
+
+def _call_metrics() -> dict:
+    talk = _ANSWERED & Q(duration__isnull=False)
+    answered = Q(answered_at__isnull=False)
+    metrics = {name: Count('id', filter=q) for name, q in _METRIC_FILTERS.items()}
+    metrics.update(
+        talk_count=Count('id', filter=talk),
+        talk_duration=Sum('duration', filter=talk),
+        wait_count=Count('id', filter=answered),
+        wait_duration=Sum(F('answered_at') - F('started_at'), filter=answered),
+    )
+    return metrics
+
+
+def _windows(start: datetime, end: datetime):
+    """Split ``[start, end)`` into whole hours (rollups) and partial edges (raw calls)."""
+    first_full = hour_of(start)
+    if first_full < start:
+        first_full = _next_hour(first_full)
+    last_full = hour_of(end)
+    if first_full >= last_full:
+        return None, [(start, end)]
+    edges = [(lo, hi) for lo, hi in ((start, first_full), (last_full, end)) if lo < hi]
+    return (first_full, last_full), edges
+
+
+def _grouped(queryset, metrics: dict, time_field: str, group_by: Optional[str]) -> dict:
+    queryset = queryset.order_by()
+    if group_by is None:
+        return {None: queryset.aggregate(**metrics)}
+    rows = queryset.annotate(key=_GROUPINGS[group_by](time_field)).values('key').annotate(**metrics)
+    return {row.pop('key'): row for row in rows}
+
+
+def empty_metrics() -> dict:
+    """A :func:`summarize` value with nothing counted."""
+    return {name: _zero(name) for name in METRIC_NAMES}
+
+
+def _as_duration(value):
+    if value is None or isinstance(value, timedelta):
+        return value
+    # Some backends return microseconds as an int.
+    return timedelta(microseconds=int(value))
+
+
+def summarize(start: datetime, end: datetime, filters: Optional[Q] = None,
+              group_by: Optional[str] = None) -> Dict[object, dict]:
+    """Call metrics for ``[start, end)``, optionally grouped.
+
+    ``group_by`` is ``None`` (a single ``None`` key), ``'user'`` (handled_by
+    id), ``'day'`` (local date), ``'hour'`` (local hour 0-23) or ``'weekday'``
+    (ISO 1-7). Every value is a dict with the ``_METRIC_FILTERS`` counts plus
+    ``talk_count``/``talk_duration`` (answered calls with a duration) and
+    ``wait_count``/``wait_duration`` (calls with an ``answered_at``). Counts
+    are ints and durations timedeltas, zero when there was nothing to sum.
+    Grouped results only contain keys that had calls.
+    """
+    filters = filters or Q()
+    full, edges = _windows(start, end)
+    parts = []
+    if full is not None:
+        rollups = CallHourlyRollup.objects.filter(filters, hour__gte=full[0], hour__lt=full[1])
+        parts.append(_grouped(rollups, _rollup_metrics(), 'hour', group_by))
+    for lo, hi in edges:
+        calls = CallLog.objects.filter(filters, started_at__gte=lo, started_at__lt=hi)
+        parts.append(_grouped(calls, _call_metrics(), 'started_at', group_by))
+
+    merged: Dict[object, dict] = {}
+    for part in parts:
+        for key, row in part.items():
+            if group_by is not None and not row.get('total_calls'):
+                continue
+            into = merged.get(key)
+            if into is None:
+                into = merged[key] = empty_metrics()
+            for name in METRIC_NAMES:
+                value = _as_duration(row.get(name)) if name in DURATION_METRICS else row.get(name)
+                if value:
+                    into[name] += value
+    if group_by is None:
+        merged.setdefault(None, empty_metrics())
+    return merged
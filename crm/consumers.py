@@ -0,0 +1,127 @@
+"""
+WebSocket consumers for the softphone UI.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+
+from . import call_ingest, extension_presence
+
+logger = logging.getLogger(__name__)
+
+
+class ExtensionPresenceConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes extension presence changes (see crm.extension_presence).
+    Sends the full snapshot on connect, then only the entries that changed.
+    """
+
+    async def connect(self):
+        self.tenant_schema = self.scope['url_route']['kwargs']['tenant_schema']
+        self.user = self.scope.get('user', AnonymousUser())
+
+        if self.user.is_anonymous:
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Authentication required',
+                'code': 'UNAUTHENTICATED'
+            }))
+            await self.close(code=4001)
+            return
+
+        self.presence_group_name = extension_presence.group_name(self.tenant_schema)
+        await self.channel_layer.group_add(self.presence_group_name, self.channel_name)
+        await self.accept()
+
+        try:
+            await sync_to_async(extension_presence.watch)(self.tenant_schema)
+            extensions = await sync_to_async(extension_presence.snapshot)(self.tenant_schema)
+        except Exception as exc:  # noqa: BLE001 — Redis down: updates resume once it is back.
+            logger.warning('Presence snapshot failed for tenant=%s: %s', self.tenant_schema, exc)
+            extensions = []
+        await self.send(text_data=json.dumps({
+            'type': 'presence_snapshot',
+            'extensions': extensions,
+        }))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'presence_group_name'):
+            try:
+                await self.channel_layer.group_discard(self.presence_group_name, self.channel_name)
+            except Exception as exc:  # noqa: BLE001
+                logger.debug('Presence group_discard failed during disconnect: %s', exc)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        if data.get('type') == 'ping':
+            # Pings double as "still watching", which keeps the status API poller running.
+            try:
+                await sync_to_async(extension_presence.watch)(self.tenant_schema)
+            except Exception:  # noqa: BLE001
+                pass
+            await self.send(text_data=json.dumps({
+                'type': 'pong',
+                'timestamp': data.get('timestamp')
+            }))
+
+    async def extension_presence(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'presence_update',
+            'extensions': event['extensions'],
+        }))
+
+
+class LiveCallsConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes call state changes from the PBX webhooks (see crm.call_ingest).
+    One ``calls_update`` message per ingested batch, one entry per call.
+    """
+
+    async def connect(self):
+        self.tenant_schema = self.scope['url_route']['kwargs']['tenant_schema']
+        self.user = self.scope.get('user', AnonymousUser())
+
+        if self.user.is_anonymous:
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Authentication required',
+                'code': 'UNAUTHENTICATED'
+            }))
+            await self.close(code=4001)
+            return
+
+        self.calls_group_name = call_ingest.group_name(self.tenant_schema)
+        await self.channel_layer.group_add(self.calls_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'calls_group_name'):
+            try:
+                await self.channel_layer.group_discard(self.calls_group_name, self.channel_name)
+            except Exception as exc:  # noqa: BLE001
+                logger.debug('Live calls group_discard failed during disconnect: %s', exc)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        if data.get('type') == 'ping':
+            await self.send(text_data=json.dumps({
+                'type': 'pong',
+                'timestamp': data.get('timestamp')
+            }))
+
+    async def calls_updated(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'calls_update',
+            'calls': event['calls'],
+        }))
@@ -0,0 +1,245 @@
+"""Per-tenant extension presence, cached in Redis and pushed over WebSocket.
+
+``extension_status`` used to proxy every request to the PBX status API
+(``http://<pbx>:8081/api/extensions/status``). Each open softphone tab polls
+it, so N tabs meant N HTTP calls to the PBX. Presence now lives in the
+``pbx_presence:<schema>`` hash (extension → JSON entry with at least
+``extension`` and ``status``) and is fed from two places:
+
+* **AMI events**. ``run_ami_listener`` (see :mod:`crm.live_calls`) seeds the
+  hash from ``DeviceStateList`` and applies ``DeviceStateChange`` and
+  ``ContactStatus`` as they arrive. It sets ``pbx_presence_live:<schema>``
+  while connected;
+* **the status API**, polled by :func:`refresh_from_status_api` at most once
+  per ``POLL_SECONDS`` per tenant. It only runs for tenants without a live
+  AMI feed that someone is watching (a recent REST read or an open
+  WebSocket).
+
+Whenever an entry changes, the changed entries are sent to the
+``extension_presence_<schema>`` channel group (see
+:class:`crm.consumers.ExtensionPresenceConsumer`). Browsers get updates
+without polling at all.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+from amanati_crm.redis_utils import decode, get_redis
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_KEY = 'pbx_presence:{schema}'
+LIVE_KEY = 'pbx_presence_live:{schema}'
+FRESH_KEY = 'pbx_presence_fresh:{schema}'
+POLL_LOCK_KEY = 'pbx_presence_poll:{schema}'
+WATCHED_KEY = 'pbx_presence_watched:{schema}'
+POLL_SECONDS = 5
+WATCH_SECONDS = 120
+STATUS_API_TIMEOUT = 3
+
+# KEYS[1] presence hash; ARGV: JSON {extension: entry}, "1" to replace, now.
+# Merges server-side so concurrent writers (the AMI listener, a status API
+# poll) can't lose each other's fields. Returns {changed entries (JSON),
+# removed extensions}.
+_MERGE = """
+local entries = cjson.decode(ARGV[1])
+local changed = {}
+for extension, entry in pairs(entries) do
+    local raw = redis.call('HGET', KEYS[1], extension)
+    local current = raw and cjson.decode(raw) or {}
+    local merged = {}
+    for k, v in pairs(current) do merged[k] = v end
+    for k, v in pairs(entry) do merged[k] = v end
+    merged['extension'] = extension
+    local differs = false
+    for k, v in pairs(merged) do
+        if k ~= 'updated_at' and (current[k] == nil or cjson.encode(current[k]) ~= cjson.encode(v)) then
+            differs = true
+            break
+        end
+    end
+    if differs then
+        merged['updated_at'] = tonumber(ARGV[3])
+        local encoded = cjson.encode(merged)
+        redis.call('HSET', KEYS[1], extension, encoded)
+        table.insert(changed, encoded)
+    end
+end
+local removed = {}
+if ARGV[2] == '1' then
+    for _, extension in ipairs(redis.call('HKEYS', KEYS[1])) do
+        if entries[extension] == nil then
+            redis.call('HDEL', KEYS[1], extension)
+            table.insert(removed, extension)
+        end
+    end
+end
+return {changed, removed}
+"""
+
+# Asterisk device states → the status the softphone UI understands.
+DEVICE_STATUS = {
+    'NOT_INUSE': 'online',
+    'INUSE': 'busy',
+    'BUSY': 'busy',
+    'ONHOLD': 'busy',
+    'RINGING': 'ringing',
+    'RINGINUSE': 'busy',
+    'UNAVAILABLE': 'offline',
+    'INVALID': 'offline',
+    'UNKNOWN': 'offline',
+}
+
+
+def group_name(schema_name: str) -> str:
+    return f'extension_presence_{schema_name}'
+
+
+def extension_of(resource: str, prefix: str = '') -> Optional[str]:
+    """``PJSIP/acme_100`` / ``acme_100`` → ``"100"``; ``None`` for trunks and foreign tenants."""
+    name = resource.partition('/')[2] if '/' in resource else resource
+    if prefix:
+        if not name.startswith(prefix):
+            return None
+        name = name[len(prefix):]
+    return name if name.isdigit() else None
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def snapshot(schema_name: str) -> List[dict]:
+    entries = get_redis().hvals(PRESENCE_KEY.format(schema=schema_name))
+    return sorted((json.loads(value) for value in entries), key=lambda entry: entry.get('extension', ''))
+
+
+def is_fresh(schema_name: str) -> bool:
+    redis = get_redis()
+    return bool(redis.exists(LIVE_KEY.format(schema=schema_name)) or redis.exists(FRESH_KEY.format(schema=schema_name)))
+
+
+def watch(schema_name: str) -> None:
+    """Note that someone is looking at this tenant's presence (keeps polling alive)."""
+    get_redis().set(WATCHED_KEY.format(schema=schema_name), '1', ex=WATCH_SECONDS)
+
+
+def watched_schemas() -> List[str]:
+    prefix = WATCHED_KEY.format(schema='')
+    return sorted(decode(key)[len(prefix):] for key in get_redis().scan_iter(match=prefix + '*', count=500))
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+def _broadcast(schema_name: str, changed: List[dict]) -> None:
+    if not changed:
+        return
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(group_name(schema_name), {
+            'type': 'extension_presence',
+            'extensions': changed,
+        })
+    except Exception as exc:  # noqa: BLE001 — broadcast is best-effort.
+        logger.warning('Presence broadcast failed for tenant=%s: %s', schema_name, exc)
+
+
+def update(schema_name: str, entries: Dict[str, dict], replace: bool = False) -> List[dict]:
+    """Store ``{extension: entry}`` and broadcast what changed.
+
+    Entries are merged into the stored ones, atomically (see ``_MERGE``).
+    ``replace=True`` treats ``entries`` as the complete list: extensions
+    missing from it are removed. Returns the changed entries (removed ones
+    come back with ``status: "offline"``).
+    """
+    changed_raw, removed_raw = get_redis().eval(
+        _MERGE, 1, PRESENCE_KEY.format(schema=schema_name),
+        json.dumps(entries), '1' if replace else '0', time.time(),
+    )
+    changed = sorted((json.loads(raw) for raw in changed_raw), key=lambda entry: entry['extension'])
+    removed = sorted(decode(extension) for extension in removed_raw)
+    changed += [{'extension': extension, 'status': 'offline', 'removed': True} for extension in removed]
+    _broadcast(schema_name, changed)
+    return changed
+
+
+def set_live(schema_name: str, ttl: int) -> None:
+    get_redis().set(LIVE_KEY.format(schema=schema_name), '1', ex=ttl)
+
+
+def clear_live(schema_name: str) -> None:
+    get_redis().delete(LIVE_KEY.format(schema=schema_name))
+
+
+def device_entry(state: str) -> dict:
+    state = (state or 'UNKNOWN').upper()
+    return {'status': DEVICE_STATUS.get(state, 'offline'), 'device_state': state}
+
+
+# ---------------------------------------------------------------------------
+# Status API fallback
+# ---------------------------------------------------------------------------
+
+def status_api_host() -> Optional[str]:
+    """The current tenant's PBX host; the default SipConfiguration before BYO enrolment."""
+    from crm.asterisk_db import get_active_pbx_for_current_tenant
+    from crm.models import SipConfiguration
+
+    pbx = get_active_pbx_for_current_tenant()
+    if pbx is not None:
+        return pbx.ami_host or pbx.fqdn
+    sip_config = SipConfiguration.objects.filter(is_default=True, is_active=True).first()
+    return sip_config.sip_server if sip_config else None
+
+
+def refresh_if_stale(schema_name: str) -> bool:
+    """Poll the status API when neither AMI nor a recent poll covers the tenant.
+
+    Runs inside the tenant's ``schema_context``. Returns True when it fetched.
+    """
+    if is_fresh(schema_name):
+        return False
+    pbx_host = status_api_host()
+    return bool(pbx_host) and refresh_from_status_api(schema_name, pbx_host)
+
+
+def refresh_from_status_api(schema_name: str, pbx_host: str) -> bool:
+    """Poll the PBX status API unless someone did within ``POLL_SECONDS``.
+
+    Returns True when this call fetched. Concurrent callers (tabs, workers)
+    skip the fetch and read whatever the winner stored.
+    """
+    import requests
+
+    redis = get_redis()
+    if not redis.set(POLL_LOCK_KEY.format(schema=schema_name), '1', nx=True, ex=POLL_SECONDS):
+        return False
+    try:
+        resp = requests.get(f'http://{pbx_host}:8081/api/extensions/status', timeout=STATUS_API_TIMEOUT)
+        resp.raise_for_status()
+        payload = resp.json()
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Extension status API failed for tenant=%s host=%s: %s', schema_name, pbx_host, exc)
+        return False
+    # An error body or a changed API must not read as "every extension is gone".
+    if not isinstance(payload, dict) or not isinstance(payload.get('extensions'), list):
+        logger.warning('Extension status API returned no extension list for tenant=%s host=%s', schema_name, pbx_host)
+        return False
+    items = payload['extensions']
+    entries = {
+        str(item['extension']): {k: v for k, v in item.items() if k != 'extension'}
+        for item in items if isinstance(item, dict) and item.get('extension') is not None
+    }
+    update(schema_name, entries, replace=True)
+    redis.set(FRESH_KEY.format(schema=schema_name), '1', ex=POLL_SECONDS * 2)
+    return True
@@ -0,0 +1,300 @@
+"""Long-running FastAGI server for inbound call routing.
+
+``pbx/echodesk-routing.py`` runs as a classic AGI. Asterisk forks a fresh
+Python interpreter for every inbound call, and the script imports
+``requests`` and makes an HTTP round trip to ``/api/pbx/call-routing/``
+before the caller hears anything. This module serves the same channel
+variables over FastAGI. Asterisk opens a TCP connection
+(``AGI(agi://host:4573/echodesk-routing,<pbx_token>)``), and routing is
+resolved in-process by :func:`crm.views._resolve_routing_for_tenant`. The
+call never sees interpreter start-up or an HTTP hop.
+
+* Each connection is one asyncio task, so many channels can be served at
+  once. The ORM work runs on a bounded thread pool. Concurrent calls for the
+  same DID share one lookup.
+* Answers are kept in a small per-process cache for ``cache_seconds``.
+  Routing tables are invalidated on save anyway (see
+  :mod:`crm.routing_table`), so this only absorbs bursts.
+* :class:`Metrics` records per-call latency and outcome counters. The
+  ``run_fastagi`` command logs them periodically and can serve them as
+  Prometheus text on a side port.
+
+If the server is unreachable, Asterisk sets ``AGISTATUS=FAILURE`` and the
+dialplan falls back to the old script (see ``pbx/extensions-incoming.conf``).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 4573
+READ_TIMEOUT = 5
+
+SOUND_KEYS = ('greeting', 'after_hours', 'queue_hold', 'voicemail_prompt', 'thank_you', 'transfer_hold')
+
+# Same variables the classic script sets when the API is unreachable.
+FALLBACK_VARIABLES = [
+    ('IS_WORKING', 'true'),
+    ('ROUTE_ACTION', 'queue'),
+    ('SOUND_GREETING', ''),
+    ('SOUND_AFTER_HOURS', ''),
+    ('SOUND_QUEUE_HOLD', ''),
+    ('SOUND_VOICEMAIL_PROMPT', ''),
+    ('VM_ENABLED', 'false'),
+    ('FORWARD_NUMBER', ''),
+    ('QUEUE_NAME', 'support'),
+    ('QUEUE_SLUG', 'support'),
+    ('TENANT_SCHEMA', ''),
+    ('DEST_EXTENSIONS', ''),
+    ('IVR_CONTEXT', ''),
+]
+
+
+def routing_variables(data: Optional[dict]) -> List[Tuple[str, str]]:
+    """Channel variables for a ``call_routing`` response (``None`` = fallback)."""
+    if data is None:
+        return list(FALLBACK_VARIABLES)
+    sounds = data.get('sounds') or {}
+    route_info = data.get('inbound_route') or {}
+    variables = [
+        ('IS_WORKING', 'true' if data.get('is_working_hours', True) else 'false'),
+        ('ROUTE_ACTION', data.get('action', 'queue')),
+        ('VM_ENABLED', 'true' if data.get('voicemail_enabled') else 'false'),
+        ('AFTER_HOURS_ACTION', data.get('after_hours_action', 'announcement')),
+        ('FORWARD_NUMBER', data.get('forward_number') or ''),
+    ]
+    variables += [(f'SOUND_{key.upper()}', sounds.get(key) or '') for key in SOUND_KEYS]
+    variables += [
+        ('QUEUE_NAME', data.get('queue_name') or ''),
+        ('QUEUE_SLUG', data.get('queue_slug') or ''),
+        ('TENANT_SCHEMA', data.get('tenant_schema') or ''),
+        ('DEST_EXTENSIONS', ','.join(data.get('extensions') or [])),
+        ('IVR_CONTEXT', route_info.get('ivr_custom_context') or ''),
+    ]
+    return variables
+
+
+def _quote(value: str) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ') + '"'
+
+
+def pbx_token_from_env(env: Dict[str, str]) -> str:
+    """Token from the first AGI argument, or ``?pbx_token=`` in the script URL."""
+    token = env.get('agi_arg_1', '')
+    if not token:
+        query = urlsplit(env.get('agi_network_script', '')).query
+        token = (parse_qs(query).get('pbx_token') or [''])[0]
+    return token.strip()
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+class Metrics:
+    """Call counters and a rolling window of routing latencies (milliseconds)."""
+
+    WINDOW = 2048
+
+    def __init__(self):
+        self.counters = {'calls': 0, 'cache_hits': 0, 'fallbacks': 0, 'errors': 0, 'hangups': 0}
+        self.active = 0
+        self.resolve_ms = deque(maxlen=self.WINDOW)
+        self.session_ms = deque(maxlen=self.WINDOW)
+
+    def incr(self, name: str) -> None:
+        self.counters[name] += 1
+
+    @staticmethod
+    def _percentile(samples, q: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        data = dict(self.counters, active=self.active)
+        for name in ('resolve_ms', 'session_ms'):
+            samples = getattr(self, name)
+            for q in (0.5, 0.95, 0.99):
+                data[f'{name}_p{int(q * 100)}'] = round(self._percentile(samples, q), 2)
+        return data
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, value in self.counters.items():
+            lines.append(f'echodesk_fastagi_{name}_total {value}')
+        lines.append(f'echodesk_fastagi_active_channels {self.active}')
+        for name in ('resolve_ms', 'session_ms'):
+            samples = getattr(self, name)
+            metric = f'echodesk_fastagi_{name[:-3]}_milliseconds'
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'{metric}{{quantile="{q}"}} {self._percentile(samples, q):.2f}')
+            lines.append(f'{metric}_count {len(samples)}')
+        return '\n'.join(lines) + '\n'
+
+
+# ---------------------------------------------------------------------------
+# Routing
+# ---------------------------------------------------------------------------
+
+def resolve_routing(did: str, pbx_token: str, legacy_scan: bool = False) -> Optional[dict]:
+    """Same resolution as ``call_routing``, minus HTTP. Runs on a worker thread."""
+    from django.db import close_old_connections
+    from crm.views import _resolve_routing_for_tenant, _resolve_tenant_by_pbx_token
+
+    close_old_connections()
+    try:
+        if pbx_token:
+            tenant_schema = _resolve_tenant_by_pbx_token(pbx_token)
+            if tenant_schema is None:
+                logger.warning('FastAGI: unknown pbx token (did=%s)', did)
+                return None
+            try:
+                resolved = _resolve_routing_for_tenant(tenant_schema, did)
+            except Exception:  # noqa: BLE001
+                logger.exception('FastAGI: resolution failed for tenant=%s did=%s', tenant_schema, did)
+                resolved = None
+            if resolved is not None or not legacy_scan:
+                return resolved
+        elif not legacy_scan:
+            logger.warning('FastAGI: call without pbx token (did=%s); using fallback', did)
+            return None
+
+        from tenants.models import Tenant
+
+        for tenant in Tenant.objects.exclude(schema_name='public'):
+            try:
+                resolved = _resolve_routing_for_tenant(tenant.schema_name, did)
+            except Exception:  # noqa: BLE001
+                continue
+            if resolved is not None:
+                return resolved
+        return None
+    finally:
+        close_old_connections()
+
+
+class RoutingServer:
+    """asyncio FastAGI server answering the ``echodesk-routing`` script."""
+
+    def __init__(self, cache_seconds: float = 5, workers: int = 16, legacy_scan: bool = False,
+                 metrics: Optional[Metrics] = None, resolver=resolve_routing):
+        self.cache_seconds = cache_seconds
+        self.legacy_scan = legacy_scan
+        self.metrics = metrics or Metrics()
+        self.resolver = resolver
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fastagi')
+        self._cache: Dict[Tuple[str, str], Tuple[float, Optional[dict]]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def lookup(self, did: str, pbx_token: str) -> Optional[dict]:
+        key = (pbx_token, did)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            self.metrics.incr('cache_hits')
+            return cached[1]
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self.resolver, did, pbx_token, self.legacy_scan)
+        self._inflight[key] = future
+        try:
+            data = await future
+        finally:
+            self._inflight.pop(key, None)
+        if len(self._cache) > 10000:
+            self._cache.clear()
+        self._cache[key] = (time.monotonic() + self.cache_seconds, data)
+        return data
+
+    async def _read_env(self, reader) -> Dict[str, str]:
+        env = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if not line:
+                break
+            line = line.decode(errors='replace').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            env[key.strip()] = value.strip()
+        return env
+
+    async def _command(self, reader, writer, command: str) -> bool:
+        """Send one AGI command; ``False`` once the channel is gone."""
+        writer.write(command.encode() + b'\n')
+        await writer.drain()
+        while True:
+            reply = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if not reply:
+                return False
+            # Asterisk interleaves a bare HANGUP line when the caller drops.
+            if reply.strip() == b'HANGUP':
+                self.metrics.incr('hangups')
+                continue
+            return reply.startswith(b'200')
+
+    async def handle(self, reader, writer) -> None:
+        started = time.perf_counter()
+        self.metrics.active += 1
+        self.metrics.incr('calls')
+        try:
+            env = await self._read_env(reader)
+            did = env.get('agi_extension') or env.get('agi_dnid') or ''
+            try:
+                resolve_started = time.perf_counter()
+                data = await self.lookup(did, pbx_token_from_env(env))
+                self.metrics.resolve_ms.append((time.perf_counter() - resolve_started) * 1000)
+            except Exception:  # noqa: BLE001
+                logger.exception('FastAGI: routing lookup failed for did=%s', did)
+                self.metrics.incr('errors')
+                data = None
+            if data is None:
+                self.metrics.incr('fallbacks')
+            for name, value in routing_variables(data):
+                if not await self._command(reader, writer, f'SET VARIABLE {name} {_quote(value)}'):
+                    break
+            logger.info(
+                'FastAGI: did=%s caller=%s tenant=%s action=%s in %.1fms',
+                did, env.get('agi_callerid', 'unknown'), (data or {}).get('tenant_schema') or '-',
+                (data or {}).get('action', 'queue'), (time.perf_counter() - started) * 1000,
+            )
+        except (asyncio.TimeoutError, ConnectionError) as exc:
+            self.metrics.incr('errors')
+            logger.warning('FastAGI: channel dropped: %r', exc)
+        finally:
+            self.metrics.active -= 1
+            self.metrics.session_ms.append((time.perf_counter() - started) * 1000)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:  # noqa: BLE001
+                pass
+
+    async def handle_metrics(self, reader, writer) -> None:
+        """Minimal HTTP responder: any request gets the Prometheus text body."""
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), READ_TIMEOUT)
+        except Exception:  # noqa: BLE001
+            pass
+        body = self.metrics.prometheus().encode()
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+            + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
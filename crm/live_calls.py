@@ -0,0 +1,335 @@
+"""Live channel and queue state, fed by AMI events and kept in Redis.
+
+``merge_conference`` used to run ``CoreShowChannels`` over a fresh AMI login
+to find the legs it should redirect. The ``run_ami_listener`` command now
+keeps one event-enabled :class:`crm.ami.AmiClient` per tenant PBX and mirrors
+what Asterisk reports into Redis:
+
+* ``pbx_live_channels:<schema>`` (hash): channel name → JSON with the same
+  lower-cased keys ``CoreShowChannel`` returns (``channel``,
+  ``calleridnum``, ``connectedlinenum``, ``bridgeid``, ...). Kept current by
+  ``Newchannel``/``Newstate``/``NewCallerid``/``NewConnectedLine``/
+  ``Rename``/``BridgeEnter``/``BridgeLeave``/``Hangup``;
+* ``pbx_live_queue_callers:<schema>`` (hash): queue → callers waiting;
+* ``pbx_live_queue_members:<schema>`` (hash): ``queue|interface`` → JSON
+  member status;
+* ``pbx_live_heartbeat:<schema>``: set while the listener is connected and
+  has seeded the hashes from ``CoreShowChannels``/``QueueStatus``.
+
+Readers (:func:`channels`, :func:`queues`) return ``None`` when the heartbeat
+is missing. The caller then asks AMI directly, so a stopped listener only
+costs speed, never correctness.
+
+The same session feeds extension presence (``DeviceStateChange`` and
+``ContactStatus``, see :mod:`crm.extension_presence`).
+
+On a shared PBX (``use_tenant_prefix``) only channels of the tenant's own
+endpoints and trunks (``PJSIP/<schema>_...``) are mirrored.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from amanati_crm.redis_utils import decode, get_redis
+
+from crm import extension_presence
+from crm.ami import AmiClient, AmiError, AmiUnavailable, credentials_of
+
+logger = logging.getLogger(__name__)
+
+CHANNELS_KEY = 'pbx_live_channels:{schema}'
+QUEUE_CALLERS_KEY = 'pbx_live_queue_callers:{schema}'
+QUEUE_MEMBERS_KEY = 'pbx_live_queue_members:{schema}'
+HEARTBEAT_KEY = 'pbx_live_heartbeat:{schema}'
+HEARTBEAT_TTL = 90
+SEED_TIMEOUT = 15
+
+CHANNEL_FIELDS = (
+    'channel', 'uniqueid', 'linkedid', 'channelstate', 'channelstatedesc',
+    'calleridnum', 'calleridname', 'connectedlinenum', 'connectedlinename',
+    'context', 'exten', 'application', 'bridgeid',
+)
+MEMBER_FIELDS = ('membername', 'status', 'paused', 'incall', 'penalty', 'callstaken', 'lastcall')
+MEMBER_EVENTS = {'QueueMemberStatus', 'QueueMemberAdded', 'QueueMemberPause', 'QueueMemberPenalty'}
+CHANNEL_EVENTS = {'Newchannel', 'Newstate', 'NewCallerid', 'NewConnectedLine'}
+
+
+def _channel_fields(message: Dict[str, str]) -> Dict[str, str]:
+    return {name: message[name] for name in CHANNEL_FIELDS if name in message}
+
+
+def _member_field(queue: str, interface: str) -> str:
+    return f'{queue}|{interface}'
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+
+def is_live(schema_name: str) -> bool:
+    try:
+        return bool(get_redis().exists(HEARTBEAT_KEY.format(schema=schema_name)))
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Live call state unavailable for %s: %s', schema_name, exc)
+        return False
+
+
+def channels(schema_name: str) -> Optional[List[dict]]:
+    """Active channels (``CoreShowChannel``-shaped dicts), or ``None`` when not live."""
+    if not is_live(schema_name):
+        return None
+    raw = get_redis().hvals(CHANNELS_KEY.format(schema=schema_name))
+    return [json.loads(value) for value in raw]
+
+
+def queues(schema_name: str) -> Optional[Dict[str, dict]]:
+    """``{queue: {"callers": n, "members": {interface: {...}}}}``, or ``None`` when not live."""
+    if not is_live(schema_name):
+        return None
+    redis = get_redis()
+    state: Dict[str, dict] = {}
+    for queue, count in redis.hgetall(QUEUE_CALLERS_KEY.format(schema=schema_name)).items():
+        queue = decode(queue)
+        state.setdefault(queue, {'callers': 0, 'members': {}})['callers'] = int(count)
+    for field, value in redis.hgetall(QUEUE_MEMBERS_KEY.format(schema=schema_name)).items():
+        field = decode(field)
+        queue, _, interface = field.partition('|')
+        state.setdefault(queue, {'callers': 0, 'members': {}})['members'][interface] = json.loads(value)
+    return state
+
+
+# ---------------------------------------------------------------------------
+# Writer (one per tenant PBX, inside run_ami_listener)
+# ---------------------------------------------------------------------------
+
+class LiveStateListener:
+    """Mirror one tenant PBX's channel/queue events into Redis."""
+
+    def __init__(self, schema_name: str, pbx):
+        self.schema_name = schema_name
+        self.credentials = credentials_of(pbx)
+        self.prefix = f'{schema_name}_' if pbx.use_tenant_prefix else ''
+        self._seeded = threading.Event()
+        self._presence_live = threading.Event()
+        # Events that arrive while a seed runs; see seed().
+        self._buffer_lock = threading.Lock()
+        self._buffered: Optional[List[Dict[str, str]]] = None
+        host, port, username, secret = self.credentials
+        self.client = AmiClient(
+            host, port, username, secret, events=True,
+            on_event=self.handle, on_connect=self.seed, on_disconnect=self._lost,
+            name=f'{schema_name}@{host}:{port} (events)',
+        )
+        self.channels_key = CHANNELS_KEY.format(schema=schema_name)
+        self.callers_key = QUEUE_CALLERS_KEY.format(schema=schema_name)
+        self.members_key = QUEUE_MEMBERS_KEY.format(schema=schema_name)
+        self.heartbeat_key = HEARTBEAT_KEY.format(schema=schema_name)
+
+    def start(self) -> None:
+        self.client.start()
+
+    def stop(self) -> None:
+        self.client.close()
+        self._lost(self.client)
+
+    def heartbeat(self) -> None:
+        if self.client.connected and self._seeded.is_set():
+            get_redis().set(self.heartbeat_key, '1', ex=HEARTBEAT_TTL)
+        if self.client.connected and self._presence_live.is_set():
+            extension_presence.set_live(self.schema_name, HEARTBEAT_TTL)
+
+    def owns(self, channel: str) -> bool:
+        if not self.prefix:
+            return True
+        return channel.partition('/')[2].startswith(self.prefix)
+
+    def owns_queue(self, queue: str) -> bool:
+        return not self.prefix or queue.startswith(self.prefix)
+
+    # -- snapshot ------------------------------------------------------
+
+    def seed(self, client: AmiClient) -> None:
+        """Replace the Redis state with a fresh snapshot after (re)connecting.
+
+        Runs on its own thread while the reader keeps delivering events. Those
+        events are held back until the snapshot is written and then replayed
+        in order, so the snapshot can't overwrite a newer change (a hangup
+        between ``CoreShowChannels`` and the write would otherwise leave a
+        ghost channel). Replaying events the snapshot already reflects is
+        harmless: applied in order they converge on the same state.
+        """
+        self._seeded.clear()
+        with self._buffer_lock:
+            self._buffered = []
+        try:
+            self._write_snapshot(client)
+        finally:
+            with self._buffer_lock:
+                buffered, self._buffered = self._buffered or [], None
+                for event in buffered:
+                    try:
+                        self._apply(event)
+                    except Exception:  # noqa: BLE001
+                        logger.exception('Replaying %s failed for %s', event.get('event'), self.schema_name)
+
+    def _write_snapshot(self, client: AmiClient) -> None:
+        try:
+            channel_events = client.collect('CoreShowChannels', 'CoreShowChannelsComplete', timeout=SEED_TIMEOUT)
+            queue_events = client.collect('QueueStatus', 'QueueStatusComplete', timeout=SEED_TIMEOUT)
+        except (AmiError, AmiUnavailable) as exc:
+            logger.warning('Live state seed failed for %s: %s', self.schema_name, exc)
+            return
+
+        live_channels = {
+            event['channel']: json.dumps(_channel_fields(event))
+            for event in channel_events if event.get('channel') and self.owns(event['channel'])
+        }
+        callers: Dict[str, int] = {}
+        members: Dict[str, str] = {}
+        for event in queue_events:
+            queue = event.get('queue', '')
+            if not self.owns_queue(queue):
+                continue
+            if event.get('event') == 'QueueParams':
+                callers[queue] = int(event.get('calls') or 0)
+            elif event.get('event') == 'QueueMember':
+                interface = event.get('stateinterface') or event.get('location', '')
+                members[_member_field(queue, interface)] = json.dumps(
+                    {name: event[name] for name in MEMBER_FIELDS if name in event}
+                )
+
+        pipe = get_redis().pipeline()
+        pipe.delete(self.channels_key, self.callers_key, self.members_key)
+        if live_channels:
+            pipe.hset(self.channels_key, mapping=live_channels)
+        if callers:
+            pipe.hset(self.callers_key, mapping=callers)
+        if members:
+            pipe.hset(self.members_key, mapping=members)
+        pipe.set(self.heartbeat_key, '1', ex=HEARTBEAT_TTL)
+        pipe.execute()
+        self._seeded.set()
+        logger.info(
+            'Live state seeded for %s: %s channels, %s queues', self.schema_name, len(live_channels), len(callers),
+        )
+        self._seed_presence(client)
+
+    def _seed_presence(self, client: AmiClient) -> None:
+        self._presence_live.clear()
+        try:
+            devices = client.collect('DeviceStateList', 'DeviceStateListComplete', timeout=SEED_TIMEOUT)
+        except (AmiError, AmiUnavailable) as exc:
+            # Older Asterisk without DeviceStateList: the status API poller keeps covering presence.
+            logger.warning('Presence seed failed for %s: %s', self.schema_name, exc)
+            return
+        entries = {}
+        for event in devices:
+            extension = extension_presence.extension_of(event.get('device', ''), self.prefix)
+            if extension:
+                entries[extension] = extension_presence.device_entry(event.get('state'))
+        extension_presence.update(self.schema_name, entries, replace=True)
+        extension_presence.set_live(self.schema_name, HEARTBEAT_TTL)
+        self._presence_live.set()
+
+    def _lost(self, client: AmiClient) -> None:
+        self._seeded.clear()
+        self._presence_live.clear()
+        try:
+            get_redis().delete(self.heartbeat_key)
+            extension_presence.clear_live(self.schema_name)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('Could not clear live heartbeat for %s: %s', self.schema_name, exc)
+
+    # -- events --------------------------------------------------------
+
+    def handle(self, event: Dict[str, str]) -> None:
+        with self._buffer_lock:
+            if self._buffered is not None:
+                self._buffered.append(event)
+                return
+            self._apply(event)
+
+    def _apply(self, event: Dict[str, str]) -> None:
+        name = event.get('event')
+        if name in CHANNEL_EVENTS or name in {'Hangup', 'Rename', 'BridgeEnter', 'BridgeLeave'}:
+            self._channel_event(name, event)
+        elif name in {'QueueCallerJoin', 'QueueCallerLeave'}:
+            if self.owns_queue(event.get('queue', '')):
+                get_redis().hset(self.callers_key, event['queue'], int(event.get('count') or 0))
+        elif name in MEMBER_EVENTS or name == 'QueueMemberRemoved':
+            self._member_event(name, event)
+        elif name == 'DeviceStateChange':
+            extension = extension_presence.extension_of(event.get('device', ''), self.prefix)
+            if extension:
+                extension_presence.update(self.schema_name, {extension: extension_presence.device_entry(event.get('state'))})
+        elif name == 'ContactStatus':
+            extension = extension_presence.extension_of(event.get('aor', ''), self.prefix)
+            status = event.get('contactstatus', '')
+            if extension and status in {'Created', 'Reachable', 'Removed', 'Unreachable'}:
+                extension_presence.update(self.schema_name, {extension: {'registered': status in {'Created', 'Reachable'}}})
+
+    def _channel_event(self, name: str, event: Dict[str, str]) -> None:
+        channel = event.get('channel')
+        if not channel or not self.owns(channel):
+            return
+        redis = get_redis()
+        if name == 'Hangup':
+            redis.hdel(self.channels_key, channel)
+            return
+        if name == 'Rename':
+            new_name = event.get('newname') or channel
+            # A replayed rename may find the snapshot already under the new name.
+            current = redis.hget(self.channels_key, channel) or redis.hget(self.channels_key, new_name)
+            redis.hdel(self.channels_key, channel)
+            state = json.loads(current) if current else {}
+            channel = new_name
+            state['channel'] = channel
+            redis.hset(self.channels_key, channel, json.dumps(state))
+            return
+
+        current = redis.hget(self.channels_key, channel)
+        state = json.loads(current) if current else {}
+        state.update(_channel_fields(event))
+        if name == 'BridgeEnter':
+            state['bridgeid'] = event.get('bridgeuniqueid', '')
+        elif name == 'BridgeLeave':
+            state['bridgeid'] = ''
+        redis.hset(self.channels_key, channel, json.dumps(state))
+
+    def _member_event(self, name: str, event: Dict[str, str]) -> None:
+        queue = event.get('queue', '')
+        interface = event.get('stateinterface') or event.get('interface', '')
+        if not queue or not interface or not self.owns_queue(queue):
+            return
+        field = _member_field(queue, interface)
+        redis = get_redis()
+        if name == 'QueueMemberRemoved':
+            redis.hdel(self.members_key, field)
+            return
+        current = redis.hget(self.members_key, field)
+        state = json.loads(current) if current else {}
+        state.update({key: event[key] for key in MEMBER_FIELDS if key in event})
+        redis.hset(self.members_key, field, json.dumps(state))
+
+
+def active_pbx_servers() -> Dict[str, object]:
+    """``{schema: PbxServer}`` for every tenant with an active PBX and AMI credentials."""
+    from tenant_schemas.utils import schema_context
+    from tenants.models import Tenant
+
+    from crm.asterisk_db import get_active_pbx_for_current_tenant
+
+    servers = {}
+    for schema_name in Tenant.objects.exclude(schema_name='public').values_list('schema_name', flat=True):
+        try:
+            with schema_context(schema_name):
+                pbx = get_active_pbx_for_current_tenant()
+        except Exception:  # noqa: BLE001
+            logger.exception('PbxServer lookup failed for tenant=%s', schema_name)
+            continue
+        if pbx is not None and pbx.ami_username and pbx.ami_password and (pbx.ami_host or pbx.fqdn):
+            servers[schema_name] = pbx
+    return servers
@@ -0,0 +1,82 @@
+"""Management command: fill the normalised phone columns on existing clients.
+
+Usage::
+
+    # Single tenant
+    python manage.py backfill_phone_index acme
+
+    # Every tenant (skips public)
+    python manage.py backfill_phone_index --all --batch-size 2000
+
+``phone_e164`` / ``phone_reversed`` are kept up to date by ``save()`` (see
+:mod:`crm.phone_index`), and the migrations that added them filled the rows
+that existed then. Rows written around ``save()`` since (``QuerySet.update``,
+raw SQL, imports) are fixed by this command. It walks ``crm.Client`` and
+``social_integrations.Client`` in primary-key order, one batch per
+transaction. It only writes rows whose derived values changed, so it is safe
+to re-run or to stop halfway.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import phone_index
+
+
+class Command(BaseCommand):
+    help = "Backfill phone_e164 / phone_reversed on CRM and social clients."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "schema_name",
+            nargs="?",
+            help="Tenant schema name to backfill (omit when using --all).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            dest="all_tenants",
+            help="Iterate every tenant (skipping the public schema).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows read and updated per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        schema_name = options.get("schema_name")
+        all_tenants = options.get("all_tenants", False)
+
+        if not schema_name and not all_tenants:
+            raise CommandError(
+                "Pass a schema_name or --all. Run `--help` for usage."
+            )
+        if schema_name and all_tenants:
+            raise CommandError("Pass either a schema_name or --all, not both.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        if schema_name:
+            schemas = [schema_name]
+        else:
+            from tenants.models import Tenant
+
+            schemas = Tenant.objects.exclude(schema_name="public").values_list(
+                "schema_name", flat=True
+            )
+        for schema in schemas:
+            self._backfill_tenant(schema, options["batch_size"])
+
+    def _backfill_tenant(self, schema_name: str, batch_size: int) -> None:
+        from tenant_schemas.utils import schema_context
+        from crm.models import Client
+        from social_integrations.models import Client as SocialClient
+
+        self.stdout.write(f"Backfilling phone index for tenant={schema_name}...")
+        with schema_context(schema_name):
+            for model in (Client, SocialClient):
+                updated = phone_index.backfill(model, batch_size)
+                self.stdout.write(f"  {model._meta.label}: {updated} updated")
+        self.stdout.write(self.style.SUCCESS("  done"))
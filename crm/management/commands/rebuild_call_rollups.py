@@ -0,0 +1,99 @@
+"""Management command: backfill or reconcile the hourly call rollups.
+
+Usage::
+
+    # Full history for one tenant
+    python manage.py rebuild_call_rollups acme
+
+    # Every tenant (skips public), only the last 3 days
+    python manage.py rebuild_call_rollups --all --days 3
+
+The call statistics endpoints read ``CallHourlyRollup`` (see
+:mod:`crm.call_rollups`). The migration that created it filled it from the
+existing calls, CallLog saves keep it current and a nightly task reconciles
+the last week; use this to repair older history (e.g. after a bulk import or
+a changed ``TIME_ZONE``). Without ``--days`` the command rebuilds everything
+from the tenant's first call, ``--chunk-days`` at a time, one transaction
+per chunk. Re-running it is safe.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm import call_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild CallHourlyRollup rows from CallLog."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "schema_name",
+            nargs="?",
+            help="Tenant schema name to rebuild (omit when using --all).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            dest="all_tenants",
+            help="Iterate every tenant (skipping the public schema).",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=0,
+            help="Only rebuild the last N days (0 = full history).",
+        )
+        parser.add_argument(
+            "--chunk-days",
+            type=int,
+            default=7,
+            help="Days of calls aggregated per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        schema_name = options.get("schema_name")
+        all_tenants = options.get("all_tenants", False)
+
+        if not schema_name and not all_tenants:
+            raise CommandError(
+                "Pass a schema_name or --all. Run `--help` for usage."
+            )
+        if schema_name and all_tenants:
+            raise CommandError("Pass either a schema_name or --all, not both.")
+        if options["days"] < 0 or options["chunk_days"] < 1:
+            raise CommandError("--days must be >= 0 and --chunk-days >= 1.")
+
+        if schema_name:
+            schemas = [schema_name]
+        else:
+            from tenants.models import Tenant
+
+            schemas = Tenant.objects.exclude(schema_name="public").values_list(
+                "schema_name", flat=True
+            )
+        for schema in schemas:
+            self._rebuild_tenant(schema, options["days"], options["chunk_days"])
+
+    def _rebuild_tenant(self, schema_name: str, days: int, chunk_days: int) -> None:
+        from tenant_schemas.utils import schema_context
+        from crm.models import CallLog
+
+        self.stdout.write(f"Rebuilding call rollups for tenant={schema_name}...")
+        with schema_context(schema_name):
+            if days:
+                rows = call_rollups.reconcile(days)
+            else:
+                first = CallLog.objects.order_by("started_at").values_list("started_at", flat=True).first()
+                rows = 0
+                if first is not None:
+                    start = call_rollups.hour_of(first)
+                    end = call_rollups.hour_of(timezone.now()) + timedelta(hours=1)
+                    while start < end:
+                        chunk_end = min(start + timedelta(days=chunk_days), end)
+                        rows += call_rollups.rebuild(start, chunk_end)
+                        start = chunk_end
+        self.stdout.write(self.style.SUCCESS(f"  done: {rows} rollup rows"))
@@ -0,0 +1,80 @@
+"""Management command: mirror live AMI channel/queue state into Redis.
+
+Usage::
+
+    python manage.py run_ami_listener --refresh 60
+
+Keeps one event-enabled AMI session per tenant with an active
+:class:`crm.models.PbxServer` and feeds :mod:`crm.live_calls`. The tenant
+list is re-read every ``--refresh`` seconds. New PBXes are picked up,
+revoked ones dropped, and a listener whose AMI credentials changed is
+restarted. Run a single instance next to the FastAGI server; call-control
+views fall back to direct AMI queries while it is down.
+"""
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from crm.ami import credentials_of
+from crm.live_calls import HEARTBEAT_TTL, LiveStateListener, active_pbx_servers
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run the AMI event listener that keeps live call state in Redis."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--refresh",
+            type=int,
+            default=60,
+            help="Seconds between re-reading the tenant PBX list.",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        listeners = {}
+        tick = max(HEARTBEAT_TTL // 3, 1)
+        elapsed = options["refresh"]
+        try:
+            while not stop.is_set():
+                if elapsed >= options["refresh"]:
+                    self._reconcile(listeners)
+                    elapsed = 0
+                for listener in listeners.values():
+                    try:
+                        listener.heartbeat()
+                    except Exception as exc:  # noqa: BLE001
+                        logger.warning("Heartbeat failed for %s: %s", listener.schema_name, exc)
+                stop.wait(tick)
+                elapsed += tick
+        finally:
+            for listener in listeners.values():
+                listener.stop()
+
+    def _reconcile(self, listeners) -> None:
+        try:
+            servers = active_pbx_servers()
+        except Exception:  # noqa: BLE001
+            logger.exception("Could not list tenant PBX servers")
+            return
+
+        for schema_name in list(listeners):
+            pbx = servers.get(schema_name)
+            if pbx is None or credentials_of(pbx) != listeners[schema_name].credentials:
+                listeners.pop(schema_name).stop()
+                self.stdout.write(f"Stopped AMI listener for tenant={schema_name}")
+        for schema_name, pbx in servers.items():
+            if schema_name not in listeners:
+                listener = LiveStateListener(schema_name, pbx)
+                listener.start()
+                listeners[schema_name] = listener
+                self.stdout.write(self.style.SUCCESS(f"Started AMI listener for tenant={schema_name}"))
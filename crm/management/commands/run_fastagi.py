@@ -0,0 +1,133 @@
+"""Management command: serve inbound call routing over FastAGI.
+
+Usage::
+
+    python manage.py run_fastagi --port 4573 --metrics-port 9573
+
+Asterisk dialplan::
+
+    same => n,AGI(agi://<host>:4573/echodesk-routing,${ECHODESK_PBX_TOKEN})
+
+Replaces the per-call ``pbx/echodesk-routing.py`` spawn + HTTP request with
+one long-running process (see :mod:`crm.fastagi`). Run it under systemd or
+the process manager next to the web workers. It needs the same settings and
+database access.
+
+FastAGI has no authentication of its own, so the server listens on
+127.0.0.1 unless ``--host`` says otherwise. ``--legacy-scan`` answers calls
+that carry no PBX token, so it is refused on anything but a loopback
+address.
+"""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.fastagi import DEFAULT_PORT, RoutingServer
+
+logger = logging.getLogger(__name__)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Command(BaseCommand):
+    help = "Run the asyncio FastAGI server Asterisk uses for inbound call routing."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="Address to listen on. Only expose it beyond loopback when every PBX sends its token.",
+        )
+        parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=0,
+            help="Serve Prometheus text metrics on this port (0 disables).",
+        )
+        parser.add_argument(
+            "--cache-seconds",
+            type=float,
+            default=5,
+            help="How long a resolved DID is reused in this process.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=16,
+            help="Threads available for ORM lookups.",
+        )
+        parser.add_argument(
+            "--legacy-scan",
+            action="store_true",
+            help=(
+                "Scan every tenant for calls without a PBX token (slow; matches the HTTP fallback). "
+                "Loopback --host only."
+            ),
+        )
+        parser.add_argument(
+            "--stats-interval",
+            type=int,
+            default=60,
+            help="Seconds between latency summaries in the log (0 disables).",
+        )
+
+    def handle(self, *args, **options):
+        if options["legacy_scan"] and not _is_loopback(options["host"]):
+            raise CommandError(
+                "--legacy-scan answers calls without a PBX token; "
+                f"refusing to serve it on {options['host']}. Bind to a loopback address."
+            )
+        server = RoutingServer(
+            cache_seconds=options["cache_seconds"],
+            workers=options["workers"],
+            legacy_scan=options["legacy_scan"],
+        )
+        try:
+            asyncio.run(self._serve(server, options))
+        finally:
+            server.shutdown()
+
+    async def _serve(self, server: RoutingServer, options):
+        agi = await asyncio.start_server(server.handle, options["host"], options["port"])
+        servers = [agi]
+        if options["metrics_port"]:
+            servers.append(
+                await asyncio.start_server(server.handle_metrics, options["host"], options["metrics_port"])
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"FastAGI routing on {options['host']}:{options['port']}"
+            + (f", metrics on :{options['metrics_port']}" if options["metrics_port"] else "")
+        ))
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # pragma: no cover — non-Unix
+                pass
+
+        async def report():
+            while options["stats_interval"]:
+                await asyncio.sleep(options["stats_interval"])
+                logger.info("FastAGI stats: %s", server.metrics.snapshot())
+
+        reporter = asyncio.create_task(report())
+        await stop.wait()
+        reporter.cancel()
+        for srv in servers:
+            srv.close()
+            await srv.wait_closed()
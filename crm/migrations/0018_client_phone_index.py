@@ -0,0 +1,61 @@
+# Generated by Django 4.2.24 on 2026-10-18 15:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_phone_index(apps, schema_editor):
+    """Fill the new columns on existing clients (mirrors crm.phone_index.fill)."""
+    Client = apps.get_model('crm', 'Client')
+    country_code = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '995')
+
+    def e164(raw, digits):
+        if raw.startswith('+'):
+            pass
+        elif digits.startswith('00'):
+            digits = digits[2:]
+        elif len(digits) == 9:
+            digits = country_code + digits
+        elif len(digits) == 10 and digits.startswith('0'):
+            digits = country_code + digits[1:]
+        return '+' + digits if 8 <= len(digits) <= 15 else ''
+
+    last_pk = 0
+    while True:
+        batch = list(
+            Client.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('phone', 'phone_e164', 'phone_reversed')[:1000]
+        )
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        changed = []
+        for client in batch:
+            raw = (client.phone or '').strip()
+            digits = ''.join(ch for ch in raw if ch.isdigit())
+            values = (e164(raw, digits) if digits else '', digits[::-1][:20])
+            if values != (client.phone_e164, client.phone_reversed):
+                client.phone_e164, client.phone_reversed = values
+                changed.append(client)
+        Client.objects.bulk_update(changed, ['phone_e164', 'phone_reversed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0017_pbxserver'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='phone_reversed',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_phone_index, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.24 on 2026-10-18 16:20
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncHour
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    """One grouped pass over the existing calls (mirrors call_rollups.rebuild)."""
+    CallLog = apps.get_model('crm', 'CallLog')
+    CallHourlyRollup = apps.get_model('crm', 'CallHourlyRollup')
+
+    answered = Q(answered_at__isnull=False)
+    aggregates = {
+        'call_count': Count('id'),
+        'talk_count': Count('id', filter=Q(duration__isnull=False)),
+        'talk_duration': Sum('duration'),
+        'wait_count': Count('id', filter=answered),
+        'wait_duration': Sum(F('answered_at') - F('started_at'), filter=answered),
+    }
+    grouped = (
+        CallLog.objects
+        .filter(started_at__isnull=False)
+        .annotate(
+            hour=TruncHour('started_at'),
+            did=Case(When(direction='inbound', then=F('recipient_number')), default=Value(''), output_field=CharField()),
+        )
+        .order_by()
+        .values('hour', 'handled_by_id', 'did', 'direction', 'status')
+        .annotate(**aggregates)
+    )
+    zero = {'talk_duration': datetime.timedelta(0), 'wait_duration': datetime.timedelta(0)}
+    CallHourlyRollup.objects.bulk_create([
+        CallHourlyRollup(
+            hour=row['hour'], handled_by_id=row['handled_by_id'], recipient_number=row['did'],
+            direction=row['direction'], status=row['status'],
+            **{field: row[field] or zero.get(field, 0) for field in aggregates},
+        )
+        for row in grouped.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crm', '0018_client_phone_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('recipient_number', models.CharField(blank=True, max_length=20)),
+                ('direction', models.CharField(choices=[('inbound', 'Inbound'), ('outbound', 'Outbound')], max_length=10)),
+                ('status', models.CharField(choices=[('initiated', 'Initiated'), ('ringing', 'Ringing'), ('answered', 'Answered'), ('missed', 'Missed'), ('busy', 'Busy'), ('no_answer', 'No Answer'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('transferred', 'Transferred'), ('ended', 'Ended'), ('recording', 'Recording'), ('on_hold', 'On Hold')], max_length=20)),
+                ('call_count', models.PositiveIntegerField(default=0)),
+                ('talk_count', models.PositiveIntegerField(default=0, help_text='Calls with a recorded duration')),
+                ('talk_duration', models.DurationField(default=datetime.timedelta)),
+                ('wait_count', models.PositiveIntegerField(default=0, help_text='Calls with an answered_at')),
+                ('wait_duration', models.DurationField(default=datetime.timedelta)),
+                ('handled_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='call_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour'], name='call_rollup_hour_idx'), models.Index(fields=['handled_by', 'hour'], name='call_rollup_user_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='callhourlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('handled_by__isnull', False)), fields=('hour', 'handled_by', 'recipient_number', 'direction', 'status'), name='call_rollup_user_hour_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='callhourlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('handled_by__isnull', True)), fields=('hour', 'recipient_number', 'direction', 'status'), name='call_rollup_nouser_hour_uniq'),
+        ),
+        migrations.RunPython(backfill_rollups, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0019_callhourlyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calllog',
+            index=models.Index(fields=['sip_call_id'], name='crm_calllog_sip_cal_c8fdda_idx'),
+        ),
+    ]
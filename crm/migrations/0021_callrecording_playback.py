@@ -0,0 +1,48 @@
+# Generated by Django 4.2.24 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0020_calllog_sip_call_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callrecording',
+            name='playback_path',
+            field=models.CharField(blank=True, help_text='Transcoded file in storage', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='playback_content_type',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='playback_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='waveform',
+            field=models.JSONField(blank=True, help_text='Peaks for waveform rendering', null=True),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='processed_source_url',
+            field=models.CharField(blank=True, help_text='Source URL the playback copy was made from', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='callrecording',
+            name='processing_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
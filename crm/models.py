@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.db import models
 from django.conf import settings
 import uuid
@@ -108,6 +110,9 @@ class Client(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=20, blank=True)
+    # Derived from ``phone`` on save; see crm/phone_index.py
+    phone_e164 = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
+    phone_reversed = models.CharField(max_length=20, blank=True, db_index=True, editable=False)
     company = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -119,6 +124,12 @@ class Client(models.Model):
     def __str__(self):
         return f"{self.name} ({self.email})"
 
+    def save(self, *args, **kwargs):
+        from crm import phone_index
+
+        kwargs['update_fields'] = phone_index.fill(self, kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
 
 class CallLog(models.Model):
     """Enhanced call log model for tracking phone calls with SIP integration"""
@@ -239,6 +250,7 @@ class CallLog(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['direction']),
             models.Index(fields=['started_at']),
+            models.Index(fields=['sip_call_id']),
         ]
     
     def __str__(self):
@@ -250,11 +262,10 @@ class CallLog(models.Model):
         if not self.client and (self.caller_number or self.recipient_number):
             phone_to_check = self.caller_number if self.direction == 'inbound' else self.recipient_number
             try:
-                # Clean phone number for matching
-                clean_phone = phone_to_check.replace('+', '').replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
-                self.client = Client.objects.filter(
-                    phone__icontains=clean_phone[-7:]  # Match last 7 digits
-                ).first()
+                from crm import phone_index
+
+                # Match last 7 digits via the reversed-phone index
+                self.client = phone_index.find_crm_client(phone_to_check)
             except:
                 pass
         super().save(*args, **kwargs)
@@ -332,6 +343,15 @@ class CallRecording(models.Model):
     # Transcription
     transcript = models.TextField(blank=True, help_text="Call transcript")
     transcript_confidence = models.FloatField(null=True, blank=True, help_text="Transcript confidence (0-1)")
+
+    # Processed copy in storage (see crm.recording_pipeline)
+    playback_path = models.CharField(max_length=500, blank=True, help_text="Transcoded file in storage")
+    playback_content_type = models.CharField(max_length=50, blank=True)
+    playback_size = models.BigIntegerField(null=True, blank=True)
+    waveform = models.JSONField(null=True, blank=True, help_text="Peaks for waveform rendering")
+    processed_source_url = models.CharField(max_length=1000, blank=True, help_text="Source URL the playback copy was made from")
+    processed_at = models.DateTimeField(null=True, blank=True)
+    processing_error = models.CharField(max_length=500, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -569,6 +589,57 @@ class CallRating(models.Model):
         return f"CallRating {self.caller_number} - {self.rating}/5"
 
 
+class CallHourlyRollup(models.Model):
+    """
+    Per-hour call totals by handling user, inbound DID, direction and status.
+
+    Maintained from CallLog saves and reconciled nightly (see
+    ``call_rollups``). The call statistics endpoints sum these rows instead
+    of scanning CallLog. ``hour`` is the local-time hour the call started in.
+    ``recipient_number`` is the inbound DID (queues are matched on it) and is
+    blank for outbound calls. Talk and wait totals are kept as durations so
+    sums and averages come out exactly as they did from the raw rows.
+    """
+    hour = models.DateTimeField()
+    handled_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='call_rollups'
+    )
+    recipient_number = models.CharField(max_length=20, blank=True)
+    direction = models.CharField(max_length=10, choices=CallLog.DIRECTION_CHOICES)
+    status = models.CharField(max_length=20, choices=CallLog.STATUS_CHOICES)
+    call_count = models.PositiveIntegerField(default=0)
+    talk_count = models.PositiveIntegerField(default=0, help_text="Calls with a recorded duration")
+    talk_duration = models.DurationField(default=timedelta)
+    wait_count = models.PositiveIntegerField(default=0, help_text="Calls with an answered_at")
+    wait_duration = models.DurationField(default=timedelta)
+
+    class Meta:
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'handled_by', 'recipient_number', 'direction', 'status'],
+                condition=models.Q(handled_by__isnull=False),
+                name='call_rollup_user_hour_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['hour', 'recipient_number', 'direction', 'status'],
+                condition=models.Q(handled_by__isnull=True),
+                name='call_rollup_nouser_hour_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='call_rollup_hour_idx'),
+            models.Index(fields=['handled_by', 'hour'], name='call_rollup_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.direction}/{self.status} user={self.handled_by_id}: {self.call_count}"
+
+
 # ---------------------------------------------------------------------------
 # PBX management panel models
 #
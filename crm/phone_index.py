@@ -0,0 +1,149 @@
+"""Normalised phone numbers and suffix lookup for caller → client matching.
+
+Caller IDs reach us in every format (``+995 555 12-34-56``, ``0555123456``,
+``555123456``), so clients were matched on the last seven digits with
+``phone__endswith`` / ``phone__icontains``. A B-tree index can't serve either,
+so every inbound call scanned the client tables.
+
+Both client models (``crm.Client`` and ``social_integrations.Client``) now
+keep two derived columns that are filled in ``save()``:
+
+* ``phone_e164``: the number in E.164 form (``+995555123456``), or ``''`` if
+  it can't be read as a full number (extensions, free text);
+* ``phone_reversed``: the digits in reverse order. "Ends with the last N
+  digits" becomes "starts with the reversed suffix", which Postgres answers
+  from the ``varchar_pattern_ops`` index Django creates for indexed
+  ``CharField`` columns.
+
+All matching goes through :func:`matching` / :func:`find_crm_client` /
+:func:`find_social_client`. Rows that existed before the columns were added
+are filled by the migrations that add them (``crm`` 0018, ``social_integrations``
+0058, which carry a frozen copy of :func:`fill`); ``manage.py
+backfill_phone_index`` re-fills them through :func:`backfill`.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Same tolerance as the old lookups: country code and trunk prefix may differ.
+MATCH_DIGITS = 7
+
+# Local numbers without a country code are Georgian (9-digit national number).
+DEFAULT_COUNTRY_CODE = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '995')
+NATIONAL_DIGITS = 9
+
+INDEX_FIELDS = ('phone_e164', 'phone_reversed')
+
+
+def digits_of(raw: Optional[str]) -> str:
+    return ''.join(ch for ch in (raw or '') if ch.isdigit())
+
+
+def normalize_e164(raw: Optional[str]) -> str:
+    """``raw`` as ``+<country><number>``, or ``''`` if it isn't a full number."""
+    raw = (raw or '').strip()
+    digits = digits_of(raw)
+    if not digits:
+        return ''
+    if raw.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == NATIONAL_DIGITS:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    elif len(digits) == NATIONAL_DIGITS + 1 and digits.startswith('0'):
+        digits = DEFAULT_COUNTRY_CODE + digits[1:]
+    # E.164 allows at most 15 digits; anything under 8 is an extension or junk.
+    if not 8 <= len(digits) <= 15:
+        return ''
+    return '+' + digits
+
+
+def reversed_digits(raw: Optional[str]) -> str:
+    return digits_of(raw)[::-1]
+
+
+def suffix_key(raw: Optional[str]) -> str:
+    """Reversed last ``MATCH_DIGITS`` digits (fewer if the number is shorter)."""
+    return reversed_digits(raw)[:MATCH_DIGITS]
+
+
+def fill(instance, update_fields=None):
+    """Refresh the derived columns from ``instance.phone`` before a save.
+
+    Returns ``update_fields`` extended with the derived columns when the
+    caller saves ``phone`` selectively, so they are written too.
+    """
+    phone = instance.phone or ''
+    instance.phone_e164 = normalize_e164(phone)
+    instance.phone_reversed = reversed_digits(phone)[:instance._meta.get_field('phone_reversed').max_length]
+    if update_fields is not None and 'phone' in update_fields:
+        update_fields = set(update_fields) | set(INDEX_FIELDS)
+    return update_fields
+
+
+def backfill(model, batch_size: int = 1000) -> int:
+    """Fill the derived columns on existing rows of ``model``; returns rows written.
+
+    Walks the table in primary-key order, one batch per transaction, and
+    only writes rows whose values changed, so it is safe to re-run.
+    """
+    updated = 0
+    last_pk = 0
+    fields = ('phone',) + INDEX_FIELDS
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only(*fields)[:batch_size])
+        if not batch:
+            return updated
+        last_pk = batch[-1].pk
+        changed = []
+        for row in batch:
+            before = (row.phone_e164, row.phone_reversed)
+            fill(row)
+            if (row.phone_e164, row.phone_reversed) != before:
+                changed.append(row)
+        if changed:
+            with transaction.atomic():
+                model.objects.bulk_update(changed, INDEX_FIELDS)
+            updated += len(changed)
+
+
+def matching(queryset, raw: Optional[str]):
+    """Rows of ``queryset`` whose phone ends with the same digits as ``raw``."""
+    key = suffix_key(raw)
+    if not key:
+        return queryset.none()
+    return queryset.filter(phone_reversed__startswith=key)
+
+
+def find_crm_client(raw: Optional[str]):
+    from crm.models import Client
+
+    return matching(Client.objects.all(), raw).first()
+
+
+def find_social_client(raw: Optional[str]):
+    from social_integrations.models import Client as SocialClient
+
+    return matching(SocialClient.objects.all(), raw).first()
+
+
+def match_clients(raw: Optional[str]) -> Tuple[Optional[object], Optional[object]]:
+    """``(crm_client, social_client)`` for a caller ID; the social list wins."""
+    try:
+        social_client = find_social_client(raw)
+    except Exception as exc:  # noqa: BLE001 — keep call logging working.
+        logger.warning('Social client phone lookup failed: %s', exc)
+        social_client = None
+    if social_client:
+        return None, social_client
+    crm_client = find_crm_client(raw)
+    if crm_client:
+        return crm_client, None
+    return None, None
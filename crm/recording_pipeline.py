@@ -0,0 +1,319 @@
+"""Download-once processing of call recordings: transcode + waveform peaks.
+
+``stream_recording`` used to proxy the PBX's WAV through Django with
+``requests`` on every playback. The UI also had to download the whole file
+to draw a waveform or to seek. Once a recording is known (``recording_webhook``
+reports it completed, or ``call_recording_url_webhook`` attaches a URL),
+:func:`enqueue` schedules the ``crm.process_call_recording`` task, which:
+
+* fetches the source recording once into a temp dir;
+* computes ``PEAK_COUNT`` normalised peaks (0..1) for waveform rendering,
+  stored on :attr:`CallRecording.waveform`;
+* transcodes it with ffmpeg to ``CALL_RECORDING_FORMAT`` (mp3 or opus, mono,
+  speech bitrate). If ffmpeg is missing or fails, the original file is kept;
+* saves the result to :func:`recording_storage` and records the path on
+  :attr:`CallRecording.playback_path`.
+
+Playback is then a redirect to the storage URL (:func:`playback_response`),
+which handles ``Range`` itself. On Spaces/S3 this is a short-lived signed URL
+to a private object, because recordings are admin-only.
+"""
+from __future__ import annotations
+
+import array
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import wave
+from datetime import timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+
+from amanati_crm.file_utils import private_storage
+from amanati_crm.redis_utils import get_redis
+
+logger = logging.getLogger(__name__)
+
+PEAK_COUNT = 800
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_SOURCE_BYTES = 200 * 1024 * 1024
+TRANSCODE_TIMEOUT = 240  # under CELERY_TASK_SOFT_TIME_LIMIT
+ENQUEUE_LOCK_KEY = 'call_recording_processing:{schema}:{call_log_id}'
+ENQUEUE_LOCK_SECONDS = 600
+
+# format → (file extension, content type, ffmpeg output arguments)
+FORMATS = {
+    'mp3': ('mp3', 'audio/mpeg', ['-ac', '1', '-codec:a', 'libmp3lame', '-b:a', '32k', '-f', 'mp3']),
+    'opus': ('ogg', 'audio/ogg', ['-ac', '1', '-codec:a', 'libopus', '-b:a', '24k', '-f', 'ogg']),
+}
+SOURCE_CONTENT_TYPES = {'wav': 'audio/wav', 'mp3': 'audio/mpeg', 'ogg': 'audio/ogg', 'gsm': 'audio/gsm'}
+
+
+class RecordingUnavailable(Exception):
+    """The PBX no longer serves this recording (4xx) or it is too large to fetch."""
+
+
+def _ffmpeg() -> str:
+    return getattr(settings, 'CALL_RECORDING_FFMPEG', 'ffmpeg')
+
+
+def _target_format() -> str:
+    target = getattr(settings, 'CALL_RECORDING_FORMAT', 'mp3')
+    return target if target in FORMATS else 'mp3'
+
+
+def recording_storage():
+    """Private storage for processed recordings; URLs expire after ``CALL_RECORDING_URL_TTL``."""
+    return private_storage(getattr(settings, 'CALL_RECORDING_URL_TTL', 900))
+
+
+def storage_path_for(recording, extension: str) -> str:
+    return f'call_recordings/{connection.schema_name}/{recording.recording_id}.{extension}'
+
+
+def source_url_of(call_log) -> str:
+    """The recording URL the PBX gave us: legacy CallLog field first, then the CallRecording."""
+    if call_log.recording_url:
+        return call_log.recording_url
+    from .models import CallRecording
+
+    try:
+        return call_log.recording.file_url or ''
+    except CallRecording.DoesNotExist:
+        return ''
+
+
+def is_ready(recording, source_url: str) -> bool:
+    return bool(recording and recording.playback_path and recording.processed_source_url == source_url)
+
+
+# ---------------------------------------------------------------------------
+# Waveform peaks
+# ---------------------------------------------------------------------------
+
+def _samples(frames: bytes, sample_width: int) -> Iterable[int]:
+    """Signed sample values of little-endian PCM ``frames`` (channels interleaved)."""
+    if sample_width == 1:
+        return (value - 128 for value in frames)
+    if sample_width == 3:
+        return (
+            int.from_bytes(frames[i:i + 3], 'little', signed=True)
+            for i in range(0, len(frames) - 2, 3)
+        )
+    samples = array.array({2: 'h', 4: 'i'}[sample_width], frames[:len(frames) - len(frames) % sample_width])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def compute_peaks(wav_path: str, count: int = PEAK_COUNT) -> dict:
+    """Peak amplitude (0..1, all channels) of ``count`` equal slices of a PCM WAV.
+
+    Reads one slice at a time, so hour-long recordings never sit in memory.
+    Raises ``wave.Error`` for non-PCM WAVs (GSM/WAV49); see :func:`decode_to_wav`.
+    """
+    with wave.open(wav_path, 'rb') as wav:
+        sample_width = wav.getsampwidth()
+        if sample_width not in (1, 2, 3, 4):
+            raise wave.Error(f'unsupported sample width {sample_width}')
+        frame_count = wav.getnframes()
+        sample_rate = wav.getframerate()
+        full_scale = float(1 << (8 * sample_width - 1))
+        frames_per_peak = max(1, math.ceil(frame_count / count)) if frame_count else 1
+        peaks = []
+        while True:
+            frames = wav.readframes(frames_per_peak)
+            if not frames:
+                break
+            peak = max((abs(value) for value in _samples(frames, sample_width)), default=0)
+            peaks.append(round(min(peak / full_scale, 1.0), 3))
+    return {
+        'sample_rate': sample_rate,
+        'duration': round(frame_count / sample_rate, 3) if sample_rate else 0,
+        'peaks': peaks,
+    }
+
+
+# ---------------------------------------------------------------------------
+# ffmpeg
+# ---------------------------------------------------------------------------
+
+def _run_ffmpeg(args) -> None:
+    subprocess.run(
+        [_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-y', *args],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=TRANSCODE_TIMEOUT,
+    )
+
+
+def decode_to_wav(source_path: str, wav_path: str) -> str:
+    """Decode anything ffmpeg reads into 16-bit mono PCM for :func:`compute_peaks`."""
+    _run_ffmpeg(['-i', source_path, '-ac', '1', '-codec:a', 'pcm_s16le', '-f', 'wav', wav_path])
+    return wav_path
+
+
+def transcode(source_path: str, output_path: str, target: str) -> str:
+    _run_ffmpeg(['-i', source_path, *FORMATS[target][2], output_path])
+    return output_path
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def download(url: str, dest_path: str) -> int:
+    """Stream ``url`` to ``dest_path``. Returns the size in bytes."""
+    import requests
+
+    with requests.get(url, stream=True, timeout=(5, 60)) as upstream:
+        if 400 <= upstream.status_code < 500:
+            raise RecordingUnavailable(f'{url}: HTTP {upstream.status_code}')
+        upstream.raise_for_status()
+        size = 0
+        with open(dest_path, 'wb') as out:
+            for chunk in upstream.iter_content(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_SOURCE_BYTES:
+                    raise RecordingUnavailable(f'{url}: larger than {MAX_SOURCE_BYTES} bytes')
+                out.write(chunk)
+    return size
+
+
+def process_file(recording, source_path: str, source_url: str, storage=None):
+    """Compute peaks for and store a locally available recording; saves ``recording``."""
+    storage = storage or recording_storage()
+    workdir = os.path.dirname(source_path)
+    source_ext = os.path.splitext(source_url.split('?')[0])[1].lstrip('.').lower() or 'wav'
+
+    try:
+        waveform = compute_peaks(source_path)
+    except (wave.Error, EOFError):
+        waveform = compute_peaks(decode_to_wav(source_path, os.path.join(workdir, 'decoded.wav')))
+
+    target = _target_format()
+    extension, content_type, _ = FORMATS[target]
+    output_path = os.path.join(workdir, f'playback.{extension}')
+    try:
+        transcode(source_path, output_path, target)
+    except (OSError, subprocess.SubprocessError) as exc:
+        # No/broken ffmpeg: storing the original still gives Range playback.
+        logger.warning('Recording %s transcode to %s failed, storing original: %s',
+                       recording.recording_id, target, exc)
+        output_path, extension = source_path, source_ext
+        content_type = SOURCE_CONTENT_TYPES.get(source_ext, 'application/octet-stream')
+
+    previous_path = recording.playback_path
+    with open(output_path, 'rb') as playback:
+        name = storage_path_for(recording, extension)
+        if storage.exists(name):
+            storage.delete(name)
+        saved_path = storage.save(name, File(playback))
+    if previous_path and previous_path != saved_path:
+        try:
+            storage.delete(previous_path)
+        except Exception:  # noqa: BLE001
+            logger.warning('Could not delete superseded recording %s', previous_path)
+
+    recording.playback_path = saved_path
+    recording.playback_content_type = content_type
+    recording.playback_size = os.path.getsize(output_path)
+    recording.waveform = waveform
+    recording.processed_source_url = source_url
+    recording.processed_at = timezone.now()
+    recording.processing_error = ''
+    update_fields = [
+        'playback_path', 'playback_content_type', 'playback_size', 'waveform',
+        'processed_source_url', 'processed_at', 'processing_error', 'updated_at',
+    ]
+    if not recording.duration and waveform['duration']:
+        recording.duration = timedelta(seconds=waveform['duration'])
+        update_fields.append('duration')
+    if not recording.file_size:
+        recording.file_size = os.path.getsize(source_path)
+        update_fields.append('file_size')
+    recording.save(update_fields=update_fields)
+    return recording
+
+
+def process_call_recording(call_log_id: int):
+    """Fetch, analyse and store a call's recording. Returns the CallRecording or None.
+
+    Idempotent: a recording already processed from the same source URL is
+    left alone. Raises :class:`RecordingUnavailable` / ``requests`` errors
+    from the download so the task can decide whether to retry.
+    """
+    from .models import CallLog, CallRecording
+
+    call_log = CallLog.objects.filter(pk=call_log_id).first()
+    if call_log is None:
+        return None
+    source_url = source_url_of(call_log)
+    if not source_url:
+        return None
+    recording, _ = CallRecording.objects.get_or_create(
+        call_log=call_log,
+        defaults={'status': 'completed', 'file_url': source_url, 'completed_at': timezone.now()},
+    )
+    if is_ready(recording, source_url):
+        return recording
+
+    with tempfile.TemporaryDirectory(prefix='call-recording-') as workdir:
+        source_ext = os.path.splitext(source_url.split('?')[0])[1].lower() or '.wav'
+        source_path = os.path.join(workdir, f'source{source_ext}')
+        try:
+            download(source_url, source_path)
+            return process_file(recording, source_path, source_url)
+        except Exception as exc:
+            CallRecording.objects.filter(pk=recording.pk).update(processing_error=str(exc)[:500])
+            raise
+
+
+def enqueue(call_log_ids: Iterable[int]) -> None:
+    """Schedule processing after the current transaction commits (deduped for ``ENQUEUE_LOCK_SECONDS``)."""
+    schema_name = connection.schema_name
+    call_log_ids = list(call_log_ids)
+    if not call_log_ids or schema_name == 'public':
+        return
+
+    def _send():
+        from .tasks import process_call_recording as task
+
+        try:
+            redis = get_redis()
+        except Exception:  # noqa: BLE001 — no Redis: enqueue without dedupe.
+            redis = None
+        for call_log_id in call_log_ids:
+            try:
+                key = ENQUEUE_LOCK_KEY.format(schema=schema_name, call_log_id=call_log_id)
+                if redis is not None and not redis.set(key, '1', nx=True, ex=ENQUEUE_LOCK_SECONDS):
+                    continue
+                task.delay(schema_name, call_log_id)
+            except Exception as exc:  # noqa: BLE001
+                logger.warning('Could not enqueue recording processing for call %s: %s', call_log_id, exc)
+
+    transaction.on_commit(_send)
+
+
+def release(call_log_id: int) -> None:
+    """Drop the enqueue dedupe lock so a retry or a new URL can be scheduled."""
+    try:
+        get_redis().delete(
+            ENQUEUE_LOCK_KEY.format(schema=connection.schema_name, call_log_id=call_log_id)
+        )
+    except Exception:  # noqa: BLE001
+        pass
+
+
+def playback_response(recording, storage=None) -> HttpResponseRedirect:
+    """Redirect the player to the stored file; storage serves ``Range`` itself."""
+    storage = storage or recording_storage()
+    response = HttpResponseRedirect(storage.url(recording.playback_path))
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
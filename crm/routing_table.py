@@ -0,0 +1,248 @@
+"""Precompiled per-tenant DID routing table for ``/api/pbx/call-routing/``.
+
+Asterisk asks for routing on every inbound call. Resolving it from the
+models takes up to ten queries in sequence (SIP config by DID suffix,
+PbxSettings, InboundRoute exact/suffix/trunk fallbacks, Queue, the
+group → extension join, fallback extensions). None of that changes between
+calls, so :func:`build` compiles it once per tenant into plain dicts:
+
+* ``sip``: per SIP configuration, the response fields taken from its
+  PbxSettings (sounds, after-hours behaviour, review method), the
+  working-hours inputs, and the fallback extension list;
+* ``routes``: per active InboundRoute, the ``inbound_route`` payload, the
+  resolved queue name and the destination extensions;
+* indexes that reproduce the old lookups: exact DID, DID suffix, trunk
+  number → route, and phone-number suffix → SIP configuration, each
+  keeping the first match in the old query's ordering.
+
+A call then costs a few dict lookups plus the working-hours check, which
+still runs against the clock at call time. Tables are cached per process
+and in Redis under a per-tenant version token
+(:mod:`amanati_crm.versioned_cache`). Saving or deleting any model they are
+built from replaces the token once the transaction commits (see
+``crm/signals.py``), and the next call rebuilds.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from amanati_crm.versioned_cache import VersionedCache
+
+logger = logging.getLogger(__name__)
+
+# The old queries matched ``did__endswith=clean_did[-9:]`` for routes and
+# ``phone_number__endswith=clean_did[-7:]`` for SIP configurations.
+ROUTE_SUFFIX_DIGITS = 9
+SIP_SUFFIX_DIGITS = 7
+
+_WORKING_HOURS_FIELDS = ('working_hours_enabled', 'working_hours_schedule', 'timezone', 'holidays')
+
+
+def clean_did(did: str) -> str:
+    return did.replace('+', '').replace(' ', '').replace('-', '')
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def _compile_sip(sip_config, pbx_settings) -> dict:
+    from crm.models import UserPhoneAssignment
+
+    return {
+        'hours': {field: getattr(pbx_settings, field) for field in _WORKING_HOURS_FIELDS},
+        'sounds': pbx_settings.get_sound_urls(),
+        'voicemail_enabled': pbx_settings.voicemail_enabled,
+        'after_hours_action': pbx_settings.after_hours_action,
+        'forward_number': (
+            pbx_settings.forward_number
+            if pbx_settings.after_hours_action == 'forward' else None
+        ),
+        'review_method': pbx_settings.review_method,
+        'fallback_extensions': list(
+            UserPhoneAssignment.objects.filter(
+                sip_configuration=sip_config, is_active=True
+            ).values_list('extension', flat=True)
+        ),
+    }
+
+
+def _compile_route(tenant_schema: str, route, queues: dict, use_prefix: bool) -> dict:
+    from crm.models import UserPhoneAssignment
+
+    dest_type = str(route.destination_type or 'queue')
+    info = {
+        'id': route.id,
+        'did': route.did,
+        'destination_type': dest_type,
+        'priority': route.priority,
+    }
+    queue_name = queue_slug = None
+    extensions = []
+    if dest_type == 'queue' and route.destination_queue_id:
+        queue = queues.get(route.destination_queue_id)
+        if queue:
+            # BYO PbxServers with use_tenant_prefix=False use the slug
+            # verbatim; legacy shared-DB deployments prepend the schema.
+            queue_slug = queue.slug
+            queue_name = f"{tenant_schema}_{queue.slug}" if use_prefix else queue.slug
+            info['queue_slug'] = queue_slug
+            info['queue_name'] = queue_name
+            extensions = list(
+                UserPhoneAssignment.objects.filter(
+                    user__tenant_groups=queue.group_id,
+                    is_active=True,
+                ).values_list('extension', flat=True).distinct()
+            )
+    elif dest_type == 'extension' and route.destination_extension_id:
+        assignment = UserPhoneAssignment.objects.filter(
+            id=route.destination_extension_id, is_active=True
+        ).first()
+        if assignment:
+            extensions = [assignment.extension]
+            info['extension'] = assignment.extension
+    elif dest_type == 'ivr_custom':
+        info['ivr_custom_context'] = route.ivr_custom_context
+    return {
+        'info': info,
+        'action': str(route.destination_type) if route.destination_type else None,
+        'extensions': extensions,
+        'queue_name': queue_name,
+        'queue_slug': queue_slug,
+    }
+
+
+def build(tenant_schema: str) -> dict:
+    """Compile the tenant's routing table. Runs inside ``tenant_schema``."""
+    from tenant_schemas.utils import schema_context
+    from crm.asterisk_db import get_active_pbx_for_current_tenant
+    from crm.models import InboundRoute, PbxSettings, Queue, SipConfiguration, Trunk
+
+    with schema_context(tenant_schema):
+        sip_configs = list(SipConfiguration.objects.all())
+        settings_by_sip = {s.sip_configuration_id: s for s in PbxSettings.objects.all()}
+        sip, sip_phones, sip_by_suffix = {}, [], {}
+        for sip_config in sip_configs:
+            # Unsaved defaults for configs that were never given settings;
+            # call setup should not write.
+            pbx_settings = settings_by_sip.get(sip_config.id) or PbxSettings(sip_configuration=sip_config)
+            sip[sip_config.id] = _compile_sip(sip_config, pbx_settings)
+            phone = sip_config.phone_number or ''
+            sip_phones.append((phone, sip_config.id))
+            if len(phone) >= SIP_SUFFIX_DIGITS:
+                sip_by_suffix.setdefault(phone[-SIP_SUFFIX_DIGITS:], sip_config.id)
+        default_sip = next((s.id for s in sip_configs if s.is_default), None)
+        if default_sip is None and sip_configs:
+            default_sip = sip_configs[0].id
+
+        pbx = get_active_pbx_for_current_tenant()
+        use_prefix = bool(pbx is not None and pbx.use_tenant_prefix)
+        queues = {q.id: q for q in Queue.objects.filter(is_active=True)}
+        active_routes = list(InboundRoute.objects.filter(is_active=True))
+        routes, route_dids, route_exact, route_by_suffix = {}, [], {}, {}
+        for route in active_routes:
+            routes[route.id] = _compile_route(tenant_schema, route, queues, use_prefix)
+            route_dids.append((route.did, route.id))
+            route_exact.setdefault(route.did, route.id)
+            if len(route.did) >= ROUTE_SUFFIX_DIGITS:
+                route_by_suffix.setdefault(route.did[-ROUTE_SUFFIX_DIGITS:], route.id)
+
+        # A trunk that owns the DID routes to its best-priority route, or to
+        # nothing at all if it has none (the old lookup stopped there too).
+        best_by_trunk = {}
+        for route in sorted(active_routes, key=lambda r: r.priority):
+            if route.trunk_id is not None:
+                best_by_trunk.setdefault(route.trunk_id, route.id)
+        trunk_numbers = {}
+        for trunk in Trunk.objects.filter(is_active=True):
+            for number in trunk.phone_numbers or []:
+                trunk_numbers.setdefault(number, best_by_trunk.get(trunk.id))
+
+    return {
+        'sip': sip,
+        'sip_phones': sip_phones,
+        'sip_by_suffix': sip_by_suffix,
+        'default_sip': default_sip,
+        'routes': routes,
+        'route_dids': route_dids,
+        'route_exact': route_exact,
+        'route_by_suffix': route_by_suffix,
+        'trunk_numbers': trunk_numbers,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+_cache = VersionedCache('pbx_routing', build)
+
+
+def get_table(tenant_schema: str) -> dict:
+    return _cache.get(tenant_schema)
+
+
+def invalidate_now(tenant_schema: str) -> None:
+    _cache.invalidate_now(tenant_schema)
+
+
+def invalidate(tenant_schema: str) -> None:
+    """Build from the DB for the rest of this transaction; new version once it commits."""
+    _cache.invalidate(tenant_schema)
+
+
+# ---------------------------------------------------------------------------
+# Resolve
+# ---------------------------------------------------------------------------
+
+def _match_suffix(index: dict, pairs: list, suffix: str, digits: int):
+    if len(suffix) >= digits:
+        return index.get(suffix)
+    # Short DIDs: same ``endswith`` test as the old query, over the compiled list.
+    return next((pk for value, pk in pairs if value.endswith(suffix)), None)
+
+
+def resolve(tenant_schema: str, did: str) -> Optional[dict]:
+    """Routing response for ``did``, or ``None`` if the tenant has no SIP config."""
+    from crm.models import PbxSettings
+
+    table = get_table(tenant_schema)
+    cleaned = clean_did(did)
+
+    sip_id = _match_suffix(
+        table['sip_by_suffix'], table['sip_phones'], cleaned[-SIP_SUFFIX_DIGITS:], SIP_SUFFIX_DIGITS,
+    ) or table['default_sip']
+    if sip_id is None:
+        return None
+    sip = table['sip'][sip_id]
+
+    route_id = table['route_exact'].get(did) or _match_suffix(
+        table['route_by_suffix'], table['route_dids'], cleaned[-ROUTE_SUFFIX_DIGITS:], ROUTE_SUFFIX_DIGITS,
+    )
+    if route_id is None:
+        route_id = table['trunk_numbers'].get(did)
+    route = table['routes'].get(route_id) if route_id is not None else None
+
+    is_working = PbxSettings(**sip['hours']).is_working_hours_now()
+    if route and not is_working:
+        action = 'after_hours'
+    elif route and route['action']:
+        action = route['action']
+    else:
+        action = 'queue' if is_working else 'after_hours'
+
+    return {
+        'is_working_hours': is_working,
+        'action': action,
+        'sounds': sip['sounds'],
+        'extensions': (route and route['extensions']) or sip['fallback_extensions'],
+        'voicemail_enabled': sip['voicemail_enabled'],
+        'after_hours_action': sip['after_hours_action'],
+        'forward_number': sip['forward_number'],
+        'review_method': sip['review_method'],
+        'inbound_route': dict(route['info']) if route else None,
+        'queue_name': route['queue_name'] if route else None,
+        'queue_slug': route['queue_slug'] if route else None,
+        'tenant_schema': tenant_schema,
+    }
@@ -284,9 +284,12 @@ class CallRecordingSerializer(serializers.ModelSerializer):
             'id', 'recording_id', 'file_path', 'file_url', 
             'file_size', 'file_size_display', 'duration', 'duration_display',
             'format', 'status', 'started_at', 'completed_at',
-            'transcript', 'transcript_confidence', 'created_at', 'updated_at'
+            'transcript', 'transcript_confidence', 'playback_content_type',
+            'processed_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'recording_id', 'playback_content_type', 'processed_at', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'recording_id', 'created_at', 'updated_at']
     
     @extend_schema_field(serializers.CharField)
     def get_duration_display(self, obj):
@@ -15,38 +15,51 @@ this module. Handlers:
   service method, not re-hook signals.
 * ``m2m_changed`` on ``User.tenant_groups.through`` → resync queue members
   for every queue backed by the affected group.
-
-All handlers resolve the current tenant via ``connection.schema_name`` (set
-by the tenant-schemas middleware), build an ``AsteriskStateSync`` and call
-the matching method. Errors are swallowed inside ``AsteriskStateSync._run``
-so product CRUD never crashes because of a realtime-DB hiccup.
+* any save/delete of a model the call-routing table is compiled from
+  (the four above plus ``PbxSettings``, ``SipConfiguration`` and
+  ``PbxServer``), and group membership changes → invalidate that tenant's
+  :mod:`crm.routing_table`.
+* ``pre_save`` / ``post_save`` / ``post_delete`` on :class:`crm.models.CallLog`
+  → refresh the affected :mod:`crm.call_rollups` buckets; deleting a user
+  folds their rollups into the unassigned buckets.
+
+The Asterisk handlers resolve the current tenant via ``connection.schema_name``
+(set by the tenant-schemas middleware) and only *mark* the object dirty in
+:mod:`crm.asterisk_sync_queue` once the transaction commits. A Celery drain
+applies the marks a couple of seconds later, one ``AsteriskStateSync`` call
+per object however often it changed, so product CRUD never waits on (or
+crashes because of) the realtime DB.
 """
 from __future__ import annotations
 
 import logging
 
+from django.conf import settings
 from django.db import connection
-from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from crm.asterisk_sync import AsteriskStateSync, _slugify_trunk
-from crm.models import InboundRoute, Queue, Trunk, UserPhoneAssignment
+from crm import asterisk_sync_queue, call_rollups, routing_table
+from crm.asterisk_sync import _slugify_trunk
+from crm.models import (
+    CallLog, InboundRoute, PbxServer, PbxSettings, Queue, SipConfiguration, Trunk, UserPhoneAssignment,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def _sync_for_current_tenant() -> AsteriskStateSync | None:
-    """Return an ``AsteriskStateSync`` bound to the current tenant schema.
+def _mark(kind: str, object_id=None, **payload) -> None:
+    """Queue a debounced Asterisk sync of one object for the current tenant.
 
-    Returns ``None`` when the connection is on the public schema — product
-    models don't run there, so a signal firing in public means something
-    upstream went sideways and we should bail quietly instead of writing
-    ``public_<ext>`` rows into the realtime DB.
+    Does nothing on the public schema — product models don't run there, so a
+    signal firing in public means something upstream went sideways and we
+    should bail quietly instead of writing ``public_<ext>`` rows into the
+    realtime DB.
     """
     schema = getattr(connection, "schema_name", None)
     if not schema or schema == "public":
-        return None
-    return AsteriskStateSync(schema)
+        return
+    asterisk_sync_queue.mark(schema, kind, object_id, **payload)
 
 
 # ---------------------------------------------------------------------------
@@ -56,27 +69,17 @@ def _sync_for_current_tenant() -> AsteriskStateSync | None:
 
 @receiver(post_save, sender=UserPhoneAssignment)
 def _on_assignment_saved(sender, instance: UserPhoneAssignment, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    if not instance.is_active:
-        # Inactive assignments should not have an Asterisk endpoint.
-        sync.tombstone_endpoint(instance.id, instance.extension)
-        return
-    sync.sync_endpoint(instance)
-    # If this extension is referenced by any queue, refresh its membership —
-    # membership is derived from (group ∩ active assignments), so flipping
-    # an assignment's ``is_active`` has knock-on queue-level effects.
-    _resync_queues_for_user(sync, instance.user_id)
+    # The drain syncs or (when inactive) tombstones the endpoint. Queue
+    # membership is derived from (group ∩ active assignments), so flipping an
+    # assignment's ``is_active`` also dirties the user's queues.
+    _mark("endpoint", instance.id, extension=instance.extension)
+    _mark("user", instance.user_id)
 
 
 @receiver(post_delete, sender=UserPhoneAssignment)
 def _on_assignment_deleted(sender, instance: UserPhoneAssignment, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    sync.tombstone_endpoint(instance.id, instance.extension)
-    _resync_queues_for_user(sync, instance.user_id)
+    _mark("endpoint", instance.id, extension=instance.extension)
+    _mark("user", instance.user_id)
 
 
 # ---------------------------------------------------------------------------
@@ -85,22 +88,10 @@ def _on_assignment_deleted(sender, instance: UserPhoneAssignment, **kwargs):
 
 
 @receiver(post_save, sender=Trunk)
-def _on_trunk_saved(sender, instance: Trunk, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    if not instance.is_active:
-        sync.tombstone_trunk(instance.id, slug=_slugify_trunk(instance))
-        return
-    sync.sync_trunk(instance)
-
-
 @receiver(post_delete, sender=Trunk)
-def _on_trunk_deleted(sender, instance: Trunk, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    sync.tombstone_trunk(instance.id, slug=_slugify_trunk(instance))
+def _on_trunk_changed(sender, instance: Trunk, **kwargs):
+    # The slug is captured now: after a delete the row is gone.
+    _mark("trunk", instance.id, slug=_slugify_trunk(instance))
 
 
 # ---------------------------------------------------------------------------
@@ -109,22 +100,9 @@ def _on_trunk_deleted(sender, instance: Trunk, **kwargs):
 
 
 @receiver(post_save, sender=Queue)
-def _on_queue_saved(sender, instance: Queue, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    if not instance.is_active:
-        sync.tombstone_queue(instance.id, instance.slug)
-        return
-    sync.sync_queue(instance)
-
-
 @receiver(post_delete, sender=Queue)
-def _on_queue_deleted(sender, instance: Queue, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    sync.tombstone_queue(instance.id, instance.slug)
+def _on_queue_changed(sender, instance: Queue, **kwargs):
+    _mark("queue", instance.id, slug=instance.slug)
 
 
 # ---------------------------------------------------------------------------
@@ -133,19 +111,77 @@ def _on_queue_deleted(sender, instance: Queue, **kwargs):
 
 
 @receiver(post_save, sender=InboundRoute)
-def _on_inbound_route_saved(sender, instance: InboundRoute, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    sync.sync_inbound_route(instance)
+@receiver(post_delete, sender=InboundRoute)
+def _on_inbound_route_changed(sender, instance: InboundRoute, **kwargs):
+    _mark("route", instance.id)
+
+
+# ---------------------------------------------------------------------------
+# Call-routing table
+# ---------------------------------------------------------------------------
 
 
+def _invalidate_routing_table() -> None:
+    schema = getattr(connection, "schema_name", None)
+    if schema and schema != "public":
+        routing_table.invalidate(schema)
+
+
+@receiver(post_save, sender=UserPhoneAssignment)
+@receiver(post_delete, sender=UserPhoneAssignment)
+@receiver(post_save, sender=Trunk)
+@receiver(post_delete, sender=Trunk)
+@receiver(post_save, sender=Queue)
+@receiver(post_delete, sender=Queue)
+@receiver(post_save, sender=InboundRoute)
 @receiver(post_delete, sender=InboundRoute)
-def _on_inbound_route_deleted(sender, instance: InboundRoute, **kwargs):
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
-    sync.tombstone_inbound_route(instance.id)
+@receiver(post_save, sender=PbxSettings)
+@receiver(post_delete, sender=PbxSettings)
+@receiver(post_save, sender=SipConfiguration)
+@receiver(post_delete, sender=SipConfiguration)
+@receiver(post_save, sender=PbxServer)
+@receiver(post_delete, sender=PbxServer)
+def _on_routing_input_changed(sender, instance, **kwargs):
+    _invalidate_routing_table()
+
+
+# ---------------------------------------------------------------------------
+# Call statistics rollups
+# ---------------------------------------------------------------------------
+
+
+@receiver(pre_save, sender=CallLog)
+def _remember_call_rollup_state(sender, instance: CallLog, update_fields=None, **kwargs):
+    """Note the rollup bucket an existing call is about to leave.
+
+    Only for saves that will refresh the rollups: updates while the call is
+    in progress and saves of untracked columns skip the extra SELECT (see
+    :func:`crm.call_rollups.is_tracked_save`).
+    """
+    instance._rollup_tracked = call_rollups.is_tracked_save(instance, update_fields)
+    instance._rollup_previous = call_rollups.stored_state(instance.pk) if instance._rollup_tracked else None
+
+
+@receiver(post_save, sender=CallLog)
+def _on_call_log_saved(sender, instance: CallLog, **kwargs):
+    if getattr(instance, "_rollup_tracked", True):
+        call_rollups.refresh_for(instance, previous=getattr(instance, "_rollup_previous", None))
+
+
+@receiver(post_delete, sender=CallLog)
+def _on_call_log_deleted(sender, instance: CallLog, **kwargs):
+    call_rollups.refresh_for(instance, deleted=True)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def _detach_user_call_rollups(sender, instance, **kwargs):
+    """The user's calls become unassigned; so do their rollups (see ``detach_user``)."""
+    instance._call_rollup_buckets = call_rollups.detach_user(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _refresh_unassigned_call_rollups(sender, instance, **kwargs):
+    call_rollups.refresh_buckets(getattr(instance, "_call_rollup_buckets", ()))
 
 
 # ---------------------------------------------------------------------------
@@ -160,26 +196,6 @@ def _on_inbound_route_deleted(sender, instance: InboundRoute, **kwargs):
 # ---------------------------------------------------------------------------
 
 
-def _resync_queues_for_user(sync: AsteriskStateSync, user_id: int) -> None:
-    """Resync member rows for every queue whose group includes ``user_id``."""
-    affected = Queue.objects.filter(
-        group__members__id=user_id, is_active=True
-    ).distinct()
-    for queue in affected:
-        sync.sync_queue_members(queue)
-
-
-def _resync_queues_for_group(sync: AsteriskStateSync, group_id: int) -> None:
-    affected = Queue.objects.filter(group_id=group_id, is_active=True)
-    for queue in affected:
-        sync.sync_queue_members(queue)
-
-
-def _resync_all_queues(sync: AsteriskStateSync) -> None:
-    for queue in Queue.objects.filter(is_active=True):
-        sync.sync_queue_members(queue)
-
-
 def _tenant_groups_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
     """Handle ``User.tenant_groups.through`` membership changes.
 
@@ -189,22 +205,21 @@ def _tenant_groups_m2m_changed(sender, instance, action, reverse, pk_set, **kwar
     """
     if action not in {"post_add", "post_remove", "post_clear"}:
         return
-    sync = _sync_for_current_tenant()
-    if sync is None:
-        return
+    # Queue routes ring the group's extensions.
+    _invalidate_routing_table()
 
     if action == "post_clear" or not pk_set:
         # Can't tell which groups were affected → resync everything tenant-wide.
-        _resync_all_queues(sync)
+        _mark("all_queues")
         return
 
     if reverse:
         # instance is a TenantGroup; pk_set is user ids that were added/removed.
-        _resync_queues_for_group(sync, instance.id)
+        _mark("group", instance.id)
     else:
         # instance is a User; pk_set is group ids.
         for group_id in pk_set:
-            _resync_queues_for_group(sync, group_id)
+            _mark("group", group_id)
 
 
 def register_group_membership_signal():
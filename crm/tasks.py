@@ -1,14 +1,14 @@
 """Celery tasks for the CRM / PBX app.
 
-Currently this module only houses the full-tenant Asterisk resync task,
-which doubles as a nightly cron target and a manual admin-button target.
-Other CRM-scoped background work (transcriptions, recording archival, etc.)
-can land here as it appears.
+Houses the full-tenant Asterisk resync task, which doubles as a nightly
+cron target and a manual admin-button target, the nightly call-rollup
+reconcile and call recording processing. Other CRM-scoped background work
+(transcriptions, etc.) can land here as it appears.
 """
 from __future__ import annotations
 
 import logging
-from typing import Dict
+from typing import Any, Dict
 
 from celery import shared_task
 
@@ -16,14 +16,15 @@ logger = logging.getLogger(__name__)
 
 
 @shared_task(name="crm.rebuild_tenant_asterisk_state")
-def rebuild_tenant_asterisk_state(tenant_schema: str) -> Dict[str, int]:
+def rebuild_tenant_asterisk_state(tenant_schema: str) -> Dict[str, Any]:
     """Full resync of a tenant's PBX state into the Asterisk realtime DB.
 
     Kicks off :meth:`crm.asterisk_sync.AsteriskStateSync.full_resync` inside
     the target tenant's schema context so tenant-scoped models resolve
     correctly. Errors inside the service are swallowed and logged (the
-    service is designed to never crash the caller); the return value is a
-    best-effort summary of how many rows we *attempted* to sync.
+    service is designed to never crash the caller); the return value counts
+    the product rows considered and, under ``changes``, the realtime rows
+    created/updated/deleted per table.
     """
     from tenant_schemas.utils import schema_context
 
@@ -36,9 +37,92 @@ def rebuild_tenant_asterisk_state(tenant_schema: str) -> Dict[str, int]:
         logger.exception(
             "rebuild_tenant_asterisk_state failed for tenant=%s", tenant_schema
         )
-        return {"trunks": 0, "extensions": 0, "queues": 0, "inbound_routes": 0}
+        return {"trunks": 0, "extensions": 0, "queues": 0, "inbound_routes": 0, "changes": None}
 
     logger.info(
         "rebuild_tenant_asterisk_state: tenant=%s summary=%s", tenant_schema, summary
     )
     return summary
+
+
+@shared_task(name="crm.reconcile_call_rollups")
+def reconcile_call_rollups(days: int = 7) -> int:
+    """Nightly: rebuild each tenant's recent CallHourlyRollup rows from CallLog."""
+    from tenant_schemas.utils import schema_context
+    from tenants.models import Tenant
+
+    from crm.call_rollups import reconcile
+
+    total = 0
+    for tenant in Tenant.objects.exclude(schema_name="public"):
+        try:
+            with schema_context(tenant.schema_name):
+                total += reconcile(days)
+        except Exception:  # noqa: BLE001
+            logger.exception("Call rollup reconcile failed for tenant=%s", tenant.schema_name)
+    logger.info("Call rollups reconciled: %s rows rebuilt over the last %s days", total, days)
+    return total
+
+
+@shared_task(name="crm.drain_asterisk_sync", ignore_result=True)
+def drain_asterisk_sync(tenant_schema: str) -> Dict[str, Any]:
+    """Apply the tenant's debounced Asterisk sync marks (see ``crm.asterisk_sync_queue``)."""
+    from tenant_schemas.utils import schema_context
+
+    from crm.asterisk_sync_queue import drain
+
+    with schema_context(tenant_schema):
+        summary = drain(tenant_schema)
+    if summary:
+        logger.info(
+            "drain_asterisk_sync: tenant=%s marks=%s operations=%s failed=%s",
+            tenant_schema, summary["marks"], summary["operations"], summary["failed"],
+        )
+    return summary
+
+
+@shared_task(name="crm.drain_pending_asterisk_sync", ignore_result=True)
+def drain_pending_asterisk_sync() -> int:
+    """Safety net: drain every tenant that still has Asterisk sync marks waiting."""
+    from crm.asterisk_sync_queue import pending_schemas
+
+    schemas = pending_schemas()
+    for tenant_schema in schemas:
+        drain_asterisk_sync.delay(tenant_schema)
+    return len(schemas)
+
+
+@shared_task(name="crm.poll_extension_presence", ignore_result=True)
+def poll_extension_presence() -> int:
+    """Refresh presence from the PBX status API for watched tenants without a live AMI feed."""
+    from tenant_schemas.utils import schema_context
+
+    from crm import extension_presence
+
+    polled = 0
+    for tenant_schema in extension_presence.watched_schemas():
+        try:
+            with schema_context(tenant_schema):
+                polled += extension_presence.refresh_if_stale(tenant_schema)
+        except Exception:  # noqa: BLE001
+            logger.exception("Extension presence poll failed for tenant=%s", tenant_schema)
+    return polled
+
+
+@shared_task(bind=True, name="crm.process_call_recording", max_retries=3, default_retry_delay=120, ignore_result=True)
+def process_call_recording(self, tenant_schema: str, call_log_id: int) -> None:
+    """Fetch, transcode and peak-analyse a call recording (see ``crm.recording_pipeline``)."""
+    from tenant_schemas.utils import schema_context
+
+    from crm import recording_pipeline
+
+    with schema_context(tenant_schema):
+        try:
+            recording_pipeline.process_call_recording(call_log_id)
+        except recording_pipeline.RecordingUnavailable as exc:
+            logger.warning("Call recording unavailable: tenant=%s call=%s: %s", tenant_schema, call_log_id, exc)
+        except Exception as exc:  # noqa: BLE001
+            if self.request.retries < self.max_retries:
+                raise self.retry(exc=exc)
+            logger.exception("Call recording processing failed: tenant=%s call=%s", tenant_schema, call_log_id)
+        recording_pipeline.release(call_log_id)
@@ -0,0 +1,103 @@
+"""Tests for the persistent AMI client (crm/ami.py) against a local fake Asterisk."""
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from crm.ami import AmiClient, AmiError, AmiUnavailable, parse_message
+
+
+class _FakeAsterisk(socketserver.StreamRequestHandler):
+    """Just enough AMI: Login, CoreShowChannels (with a stray event mixed in) and Redirect."""
+
+    def handle(self):
+        self.server.sessions += 1
+        self.server.handlers.append(self)
+        self.wfile.write(b'Asterisk Call Manager/7.0.3\r\n')
+        buffer = b''
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            buffer += data
+            while b'\r\n\r\n' in buffer:
+                block, buffer = buffer.split(b'\r\n\r\n', 1)
+                self._answer(parse_message(block.decode()))
+
+    def _answer(self, message):
+        action, action_id = message.get('action'), message.get('actionid')
+        write = self.wfile.write
+        if action == 'Login':
+            result = 'Success' if message.get('secret') == 'secret' else 'Error'
+            write(f'Response: {result}\r\nActionID: {action_id}\r\nMessage: Authentication\r\n\r\n'.encode())
+        elif action == 'CoreShowChannels':
+            write(f'Response: Success\r\nActionID: {action_id}\r\nEventList: start\r\n\r\n'.encode())
+            write(b'Event: Newstate\r\nChannel: PJSIP/101-00000009\r\nChannelState: 6\r\n\r\n')
+            for n in range(2):
+                write(f'Event: CoreShowChannel\r\nActionID: {action_id}\r\n'
+                      f'Channel: PJSIP/100-0000000{n}\r\nCallerIDNum: 100\r\n\r\n'.encode())
+            write(f'Event: CoreShowChannelsComplete\r\nActionID: {action_id}\r\nListItems: 2\r\n\r\n'.encode())
+        elif action == 'Redirect':
+            result = 'Error' if message.get('channel') == 'PJSIP/gone' else 'Success'
+            write(f'Response: {result}\r\nActionID: {action_id}\r\nMessage: Redirect\r\n\r\n'.encode())
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class TestAmiClient(SimpleTestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _FakeAsterisk)
+        self.server.sessions = 0
+        self.server.handlers = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+
+    def _client(self, secret='secret', **kwargs):
+        client = AmiClient('127.0.0.1', self.port, 'echodesk', secret, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_concurrent_actions_share_one_session(self):
+        events = []
+        client = self._client(on_event=events.append)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(
+                lambda _: client.collect('CoreShowChannels', 'CoreShowChannelsComplete'), range(16),
+            ))
+
+        self.assertEqual(self.server.sessions, 1)
+        for channels in results:
+            self.assertEqual([ch['channel'] for ch in channels], ['PJSIP/100-00000000', 'PJSIP/100-00000001'])
+        # Events without our ActionID go to the event callback.
+        self.assertEqual(len(events), 16)
+        self.assertEqual(events[0]['event'], 'Newstate')
+
+        self.assertEqual(client.send_action('Redirect', {'Channel': 'PJSIP/100-00000000'})['response'], 'Success')
+        with self.assertRaises(AmiError):
+            client.send_action('Redirect', {'Channel': 'PJSIP/gone'})
+
+    def test_reconnects_after_the_connection_drops(self):
+        client = self._client()
+        client.send_action('Redirect', {'Channel': 'PJSIP/100-00000000'})
+        self.server.handlers[0].request.shutdown(socket.SHUT_RDWR)
+        deadline = time.monotonic() + 5
+        while client.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        response = client.send_action('Redirect', {'Channel': 'PJSIP/100-00000000'}, timeout=5)
+        self.assertEqual(response['response'], 'Success')
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_rejected_login_reports_unavailable(self):
+        client = self._client(secret='wrong')
+        with self.assertRaises(AmiUnavailable):
+            client.send_action('Ping', timeout=0.5)
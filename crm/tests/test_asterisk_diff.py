@@ -0,0 +1,76 @@
+"""Tests for the realtime-table diff engine (crm/asterisk_diff.py)."""
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import SimpleTestCase
+
+from asterisk_state.models import (
+    AsteriskQueue, AsteriskQueueMember, PsAor, PsAuth, PsEndpoint, PsIdentify, PsRegistration,
+)
+from crm.asterisk_diff import SyncReport, plan_table
+from crm.asterisk_sync import AsteriskStateSync
+from crm.tests.conftest import CrmTestCase
+
+
+class TestPlanTable(SimpleTestCase):
+
+    def test_creates_updates_and_skips_unchanged_rows(self):
+        current = [
+            {'id': 'acme_100', 'max_contacts': 5, 'qualify_frequency': 0},
+            {'id': 'acme_101', 'max_contacts': 5, 'qualify_frequency': 0},
+        ]
+        plan = plan_table(PsAor, current, {
+            'acme_100': {'max_contacts': 5, 'qualify_frequency': 0},
+            'acme_101': {'max_contacts': 1, 'qualify_frequency': 0},
+            'acme_102': {'max_contacts': 5, 'qualify_frequency': 0},
+        })
+        self.assertEqual(plan.creates, [{'id': 'acme_102', 'max_contacts': 5, 'qualify_frequency': 0}])
+        self.assertEqual(plan.updates, [({'id': 'acme_101', 'max_contacts': 1, 'qualify_frequency': 0}, ['max_contacts'])])
+        self.assertEqual(plan.deletes, [])
+
+    def test_deletes_undesired_and_scoped_leftovers(self):
+        current = [{'id': 'acme_100'}, {'id': 'acme_old'}]
+        plan = plan_table(PsIdentify, current, {'acme_100': None, 'acme_200': None})
+        self.assertEqual(sorted(plan.deletes), ['acme_100', 'acme_old'])
+        self.assertEqual(plan.creates, [])
+
+    def test_queue_members_are_keyed_by_queue_and_interface(self):
+        current = [
+            {'uniqueid': 7, 'queue_name': 'support', 'interface': 'PJSIP/100', 'penalty': 0},
+            {'uniqueid': 8, 'queue_name': 'support', 'interface': 'PJSIP/101', 'penalty': 0},
+        ]
+        plan = plan_table(AsteriskQueueMember, current, {
+            ('support', 'PJSIP/100'): {'penalty': 0},
+            ('support', 'PJSIP/102'): {'penalty': 0},
+        })
+        self.assertEqual(plan.deletes, [8])
+        self.assertEqual(plan.creates, [{'queue_name': 'support', 'interface': 'PJSIP/102', 'penalty': 0}])
+
+        report = SyncReport(tables={'queue_members': plan.changes})
+        self.assertEqual(report.as_dict(), {'queue_members': {'created': 1, 'updated': 0, 'deleted': 1}})
+        self.assertEqual(str(report), 'queue_members +1 ~0 -1')
+
+
+class TestFullResyncPruning(CrmTestCase):
+
+    def test_tenant_without_trunks_or_queues_prunes_leftovers(self):
+        schema = connection.schema_name
+        sync = AsteriskStateSync(schema)
+        with patch.object(AsteriskStateSync, '_enabled', return_value=True), \
+                patch('crm.asterisk_diff.apply', return_value=SyncReport()) as apply:
+            sync.full_resync()
+
+        _, desired, scopes = apply.call_args.args
+        managed = (PsAuth, PsAor, PsEndpoint, PsIdentify, PsRegistration, AsteriskQueue, AsteriskQueueMember)
+        self.assertEqual(set(desired), set(managed))
+        self.assertEqual(set(scopes), set(managed))
+
+        # What the diff makes of the tenant's stale rows.
+        stale = {
+            PsRegistration: [{'id': f'{schema}_trunk_old'}],
+            AsteriskQueue: [{'name': f'{schema}_sales'}],
+            AsteriskQueueMember: [{'uniqueid': 3, 'queue_name': f'{schema}_sales', 'interface': 'PJSIP/100'}],
+        }
+        for model, rows in stale.items():
+            plan = plan_table(model, rows, desired[model])
+            self.assertEqual(len(plan.deletes), 1, model.__name__)
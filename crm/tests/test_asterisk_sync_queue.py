@@ -0,0 +1,87 @@
+"""Tests for the debounced Asterisk sync queue (crm/asterisk_sync_queue.py)."""
+from unittest.mock import patch
+
+from django.db import connection
+
+from crm import asterisk_sync_queue
+from crm.asterisk_diff import SyncReport, TableChanges
+from crm.models import Queue
+from crm.tests.conftest import CrmTestCase
+from users.models import TenantGroup
+
+
+class TestDrainPlanning(CrmTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('crm.asterisk_sync.AsteriskStateSync')
+        self.sync = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.sync._enabled.return_value = True
+        self.sync.sync_queue_members.return_value = SyncReport(
+            tables={'queue_members': TableChanges(created=['support/PJSIP/100'])}
+        )
+
+    def _process(self, *fields, **payloads):
+        marks = {field: {} for field in fields}
+        marks.update(payloads)
+        return asterisk_sync_queue._process(connection.schema_name, marks)
+
+    def test_user_and_group_marks_collapse_to_one_member_sync_per_queue(self):
+        agent = self.create_user(email='agent@test.com')
+        group = TenantGroup.objects.create(name='Support')
+        agent.tenant_groups.add(group)
+        support = Queue.objects.create(name='Support', slug='support', group=group)
+        Queue.objects.create(name='Sales', slug='sales', group=TenantGroup.objects.create(name='Sales'))
+
+        result = self._process(f'user:{agent.id}', f'group:{group.id}', f'queue_members:{support.id}')
+
+        self.sync.sync_queue_members.assert_called_once_with(support)
+        self.assertEqual(result['operations'], 1)
+        self.assertEqual(result['changes'], {'queue_members': {'created': 1, 'updated': 0, 'deleted': 0}})
+
+        # A full queue sync already covers membership.
+        self.sync.reset_mock()
+        self._process(f'queue:{support.id}', f'group:{group.id}')
+        self.sync.sync_queue.assert_called_once_with(support)
+        self.sync.sync_queue_members.assert_not_called()
+
+    def test_deleted_rows_are_tombstoned_and_failures_reported(self):
+        self.sync.tombstone_queue.return_value = False
+        self.sync.tombstone_endpoint.return_value = True
+
+        result = self._process(**{
+            'queue:999': {'slug': 'gone'},
+            'endpoint:998': {'extension': '150'},
+        })
+
+        self.sync.tombstone_queue.assert_called_once_with(999, 'gone')
+        self.sync.tombstone_endpoint.assert_called_once_with(998, '150')
+        self.assertEqual(result['failed'], {'queue:999': {'slug': 'gone'}})
+
+
+class TestDrainFailure(CrmTestCase):
+
+    def test_marks_are_restored_when_processing_raises(self):
+        schema = connection.schema_name
+        redis = asterisk_sync_queue.get_redis()
+        dirty_key = asterisk_sync_queue.DIRTY_KEY.format(schema=schema)
+        redis.delete(dirty_key, asterisk_sync_queue.LOCK_KEY.format(schema=schema))
+        self.addCleanup(redis.delete, dirty_key)
+        redis.hset(dirty_key, mapping={'queue:1': '{}', 'queue:2': '{"slug": "old"}'})
+
+        def concurrent_mark(*args):
+            # A newer mark for the same object lands while the drain runs.
+            redis.hset(dirty_key, 'queue:2', '{"slug": "new"}')
+            raise RuntimeError('pbx database down')
+
+        with patch.object(asterisk_sync_queue, '_process', side_effect=concurrent_mark), \
+                patch('crm.tasks.drain_asterisk_sync.apply_async') as schedule:
+            with self.assertRaises(RuntimeError):
+                asterisk_sync_queue.drain(schema)
+
+        self.assertEqual(
+            {asterisk_sync_queue.decode(k): asterisk_sync_queue.decode(v) for k, v in redis.hgetall(dirty_key).items()},
+            {'queue:1': '{}', 'queue:2': '{"slug": "new"}'},
+        )
+        schedule.assert_called_once()
@@ -0,0 +1,101 @@
+"""Tests for batched call event ingestion (crm/call_ingest.py and the call-events webhook)."""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from crm.call_ingest import ingest_recordings, ingest_sip_events
+from crm.models import CallEvent, CallLog, CallRecording
+from crm.tests.conftest import CrmTestCase
+
+
+class TestIngestSipEvents(CrmTestCase):
+
+    def test_batch_creates_and_updates_calls(self):
+        self.create_sip_config(is_default=True)
+        admin = self.create_admin()
+        existing = self.create_call_log(handled_by=admin, sip_call_id='sip-existing', status='ringing')
+
+        results = ingest_sip_events([
+            {'event_type': 'call_ringing', 'sip_call_id': 'sip-new',
+             'caller_number': '+995555111111', 'recipient_number': '+995555222222'},
+            {'event_type': 'call_answered', 'sip_call_id': 'sip-existing'},
+            {'event_type': 'call_answered', 'sip_call_id': 'sip-new'},
+            {'event_type': 'call_ended', 'sip_call_id': 'sip-existing'},
+            {'event_type': 'call_ended', 'sip_call_id': 'sip-unknown'},
+            {'event_type': 'call_ended'},
+        ])
+
+        by_id = {r.get('sip_call_id', r.get('index')): r for r in results}
+        self.assertEqual(by_id['sip-existing']['status'], 'ended')
+        self.assertEqual(by_id['sip-new']['status'], 'answered')
+        self.assertEqual(by_id['sip-unknown']['error'], 'not_found')
+        self.assertIn('error', by_id[5])
+
+        existing.refresh_from_db()
+        self.assertEqual(existing.status, 'ended')
+        self.assertIsNotNone(existing.answered_at)
+        self.assertIsNotNone(existing.duration)
+        created = CallLog.objects.get(sip_call_id='sip-new')
+        self.assertEqual(created.direction, 'inbound')
+        self.assertIsNotNone(created.answered_at)
+
+        self.assertEqual(
+            list(CallEvent.objects.filter(call_log=existing).order_by('id').values_list('event_type', flat=True)),
+            ['answered', 'ended'],
+        )
+        self.assertEqual(CallEvent.objects.filter(call_log=created).count(), 2)
+
+    def test_event_timestamps_are_used(self):
+        admin = self.create_admin()
+        call = self.create_call_log(handled_by=admin, sip_call_id='sip-ts', status='ringing')
+        answered = timezone.now() - timedelta(minutes=3)
+        ingest_sip_events([
+            {'event_type': 'call_answered', 'sip_call_id': 'sip-ts', 'timestamp': answered.isoformat()},
+            {'event_type': 'call_ended', 'sip_call_id': 'sip-ts',
+             'timestamp': (answered + timedelta(seconds=90)).isoformat()},
+        ])
+        call.refresh_from_db()
+        self.assertEqual(call.duration.total_seconds(), 90)
+
+
+class TestIngestRecordings(CrmTestCase):
+
+    def test_batch_creates_and_updates_recordings(self):
+        admin = self.create_admin()
+        first = self.create_call_log(handled_by=admin)
+        second = self.create_call_log(handled_by=admin)
+        CallRecording.objects.create(call_log=second, status='recording')
+
+        results = ingest_recordings([
+            {'call_id': str(first.call_id), 'status': 'started'},
+            {'call_id': str(second.call_id), 'status': 'completed',
+             'file_url': 'https://storage.example.com/2.wav', 'duration': 42},
+            {'call_id': 'not-a-uuid', 'status': 'completed'},
+        ])
+
+        self.assertEqual([r.get('status') for r in results], ['started', 'completed', None])
+        self.assertEqual(results[2]['error'], 'not_found')
+        self.assertIsNotNone(CallRecording.objects.get(call_log=first).started_at)
+        recording = CallRecording.objects.get(call_log=second)
+        self.assertEqual(recording.status, 'completed')
+        self.assertEqual(recording.duration.total_seconds(), 42)
+        second.refresh_from_db()
+        self.assertEqual(second.recording_url, 'https://storage.example.com/2.wav')
+
+
+class TestCallEventsWebhook(CrmTestCase):
+
+    def test_batch_endpoint(self):
+        admin = self.create_admin()
+        call = self.create_call_log(handled_by=admin, sip_call_id='sip-batch', status='ringing')
+        resp = self.api_post('/api/webhooks/call-events/', {
+            'events': [{'event_type': 'call_answered', 'sip_call_id': 'sip-batch'}],
+            'recordings': [{'call_id': str(call.call_id), 'status': 'started'}],
+        })
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['events'][0]['status'], 'answered')
+        self.assertEqual(resp.data['recordings'][0]['status'], 'started')
+
+    def test_batch_endpoint_rejects_non_lists(self):
+        resp = self.api_post('/api/webhooks/call-events/', {'events': 'nope'})
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,91 @@
+"""Tests for the hourly call rollups behind the call statistics endpoints."""
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db.models import Q
+from django.utils import timezone
+
+from crm import call_rollups
+from crm.models import CallHourlyRollup
+from crm.tests.conftest import CrmTestCase
+
+
+class TestCallRollups(CrmTestCase):
+
+    def _rollups(self):
+        return sorted(
+            CallHourlyRollup.objects.values_list(
+                'handled_by_id', 'recipient_number', 'direction', 'status', 'call_count', 'talk_duration',
+            )
+        )
+
+    def test_status_changes_move_the_call_between_buckets(self):
+        agent = self.create_user(email='agent@test.com')
+        call = self.create_call_log(handled_by=agent, status='ringing')
+        # In-progress saves leave the rollups alone; a reconcile picks them up.
+        self.assertEqual(self._rollups(), [])
+        with patch.object(call_rollups, 'stored_state') as stored_state:
+            call.status = 'answered'
+            call.save()
+        stored_state.assert_not_called()
+        call_rollups.reconcile(days=1)
+        self.assertEqual(
+            self._rollups(),
+            [(agent.id, '+995555222222', 'inbound', 'answered', 1, timedelta(0))],
+        )
+
+        # Ending the call moves it out of the bucket the reconcile put it in.
+        call.status = 'ended'
+        call.answered_at = call.started_at + timedelta(seconds=10)
+        call.duration = timedelta(seconds=95)
+        call.save()
+        self.assertEqual(
+            self._rollups(),
+            [(agent.id, '+995555222222', 'inbound', 'ended', 1, timedelta(seconds=95))],
+        )
+
+        call.notes = 'called back'
+        call.save()
+        call.delete()
+        self.assertEqual(self._rollups(), [])
+
+    def test_summarize_matches_raw_calls_and_rebuild(self):
+        agent = self.create_user(email='agent@test.com')
+        self.create_call_log(handled_by=agent, status='ended', duration=timedelta(seconds=60))
+        self.create_call_log(handled_by=agent, status='missed')
+        self.create_call_log(handled_by=agent, status='transferred', direction='outbound',
+                             recipient_number='+995599000000', duration=timedelta(seconds=30))
+        incremental = self._rollups()
+        now = timezone.now()
+        start = call_rollups.hour_of(now) - timedelta(days=1)
+        end = call_rollups.hour_of(now) + timedelta(hours=1)
+        call_rollups.rebuild(start, end)
+        self.assertEqual(self._rollups(), incremental)
+
+        # Hour-aligned range reads rollups only; an unaligned one mixes in raw edges.
+        for range_start in (start, now - timedelta(minutes=90)):
+            per_user = call_rollups.summarize(range_start, now + timedelta(minutes=1), Q(handled_by__isnull=False),
+                                              group_by='user')
+            row = per_user[agent.id]
+            self.assertEqual(row['total_calls'], 3)
+            self.assertEqual(row['answered_inbound'], 1)
+            self.assertEqual(row['missed_inbound'], 1)
+            self.assertEqual(row['outbound_calls'], 1)
+            self.assertEqual(row['talk_count'], 2)
+            self.assertEqual(row['talk_duration'], timedelta(seconds=90))
+
+        queue = call_rollups.summarize(start, end, Q(direction='inbound', recipient_number__in=['+995555222222']))
+        self.assertEqual(queue[None]['total_calls'], 2)
+        self.assertEqual(call_rollups.summarize(start, start)[None], call_rollups.empty_metrics())
+
+    def test_deleting_a_user_moves_their_rollups_to_unassigned(self):
+        agent = self.create_user(email='agent@test.com')
+        self.create_call_log(handled_by=agent, status='ended', duration=timedelta(seconds=60))
+        other = self.create_call_log(handled_by=agent, status='ended', duration=timedelta(seconds=30))
+        other.handled_by = None
+        other.save()
+        rows = CallHourlyRollup.objects.values_list('handled_by_id', 'call_count', 'talk_duration')
+        self.assertCountEqual(rows, [(None, 1, timedelta(seconds=30)), (agent.id, 1, timedelta(seconds=60))])
+
+        agent.delete()
+        self.assertCountEqual(rows.all(), [(None, 2, timedelta(seconds=90))])
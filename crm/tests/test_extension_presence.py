@@ -0,0 +1,126 @@
+"""Tests for mapping AMI device state onto extension presence (crm/extension_presence.py)."""
+import uuid
+from unittest.mock import Mock, patch
+
+import requests
+from django.db import connection
+from django.test import SimpleTestCase
+from rest_framework import status
+
+from crm import extension_presence
+from crm.extension_presence import device_entry, extension_of
+from crm.tests.conftest import CrmTestCase
+
+
+class TestExtensionPresence(SimpleTestCase):
+
+    def test_extension_of_strips_technology_and_tenant_prefix(self):
+        self.assertEqual(extension_of('PJSIP/100'), '100')
+        self.assertEqual(extension_of('acme_101', prefix='acme_'), '101')
+        self.assertEqual(extension_of('PJSIP/acme_101', prefix='acme_'), '101')
+        # Other tenants on a shared PBX, trunks and non-numeric devices are ignored.
+        self.assertIsNone(extension_of('PJSIP/globex_101', prefix='acme_'))
+        self.assertIsNone(extension_of('PJSIP/acme_trunk_magti', prefix='acme_'))
+        self.assertIsNone(extension_of('Queue:support_avail'))
+
+    def test_device_states_map_to_ui_statuses(self):
+        self.assertEqual(device_entry('NOT_INUSE'), {'status': 'online', 'device_state': 'NOT_INUSE'})
+        self.assertEqual(device_entry('inuse')['status'], 'busy')
+        self.assertEqual(device_entry('RINGING')['status'], 'ringing')
+        self.assertEqual(device_entry('UNAVAILABLE')['status'], 'offline')
+        self.assertEqual(device_entry('')['status'], 'offline')
+
+
+class TestPresenceStore(SimpleTestCase):
+
+    def setUp(self):
+        self.schema = f'presence_test_{uuid.uuid4().hex[:8]}'
+        patcher = patch.object(extension_presence, '_broadcast')
+        self.broadcast = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        redis = extension_presence.get_redis()
+        for key in redis.scan_iter(match=f'*{self.schema}*'):
+            redis.delete(key)
+
+    def _statuses(self):
+        return {entry['extension']: entry['status'] for entry in extension_presence.snapshot(self.schema)}
+
+    def _api_response(self, payload=None, error=None):
+        response = Mock()
+        response.json.return_value = payload
+        response.raise_for_status.side_effect = error
+        return response
+
+    def test_update_merges_and_broadcasts_only_changes(self):
+        extension_presence.update(self.schema, {'100': device_entry('NOT_INUSE'), '101': device_entry('INUSE')})
+        self.broadcast.reset_mock()
+
+        changed = extension_presence.update(self.schema, {'100': {'registered': True}, '101': {'status': 'busy'}})
+
+        self.assertEqual([entry['extension'] for entry in changed], ['100'])
+        self.assertEqual(changed[0]['status'], 'online')
+        self.assertTrue(changed[0]['registered'])
+        self.broadcast.assert_called_once_with(self.schema, changed)
+
+    def test_replace_drops_missing_extensions(self):
+        extension_presence.update(self.schema, {'100': device_entry('NOT_INUSE'), '101': device_entry('INUSE')})
+
+        changed = extension_presence.update(self.schema, {'100': device_entry('NOT_INUSE')}, replace=True)
+
+        self.assertEqual(changed, [{'extension': '101', 'status': 'offline', 'removed': True}])
+        self.assertEqual(self._statuses(), {'100': 'online'})
+
+    def test_status_api_is_polled_once_per_window(self):
+        payload = {'extensions': [{'extension': 100, 'status': 'online'}]}
+        with patch('requests.get', return_value=self._api_response(payload)) as get:
+            self.assertTrue(extension_presence.refresh_from_status_api(self.schema, 'pbx.test.com'))
+            self.assertFalse(extension_presence.refresh_from_status_api(self.schema, 'pbx.test.com'))
+
+        get.assert_called_once()
+        self.assertEqual(self._statuses(), {'100': 'online'})
+        self.assertTrue(extension_presence.is_fresh(self.schema))
+
+    def test_failed_or_malformed_status_api_keeps_the_stored_entries(self):
+        extension_presence.update(self.schema, {'100': device_entry('NOT_INUSE')})
+        lock_key = extension_presence.POLL_LOCK_KEY.format(schema=self.schema)
+        responses = [
+            self._api_response(error=requests.HTTPError('502 Bad Gateway')),
+            self._api_response({'error': 'extension list unavailable'}),
+        ]
+        for response in responses:
+            extension_presence.get_redis().delete(lock_key)
+            with patch('requests.get', return_value=response):
+                self.assertFalse(extension_presence.refresh_from_status_api(self.schema, 'pbx.test.com'))
+
+        self.assertEqual(self._statuses(), {'100': 'online'})
+        self.assertFalse(extension_presence.is_fresh(self.schema))
+
+
+class TestExtensionStatusView(CrmTestCase):
+    url = '/api/extensions/status/'
+
+    def setUp(self):
+        super().setUp()
+        self.schema = connection.schema_name
+        self.agent = self.create_user(email='presence-agent@test.com')
+
+    def tearDown(self):
+        redis = extension_presence.get_redis()
+        for pattern in (extension_presence.PRESENCE_KEY, extension_presence.LIVE_KEY, extension_presence.WATCHED_KEY):
+            redis.delete(pattern.format(schema=self.schema))
+        super().tearDown()
+
+    def test_serves_the_cache_without_polling_while_ami_is_live(self):
+        with patch.object(extension_presence, '_broadcast'):
+            extension_presence.update(self.schema, {'100': device_entry('RINGING')}, replace=True)
+        extension_presence.set_live(self.schema, 60)
+
+        with patch('requests.get') as get:
+            resp = self.api_get(self.url, user=self.agent)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(e['extension'], e['status']) for e in resp.data['extensions']], [('100', 'ringing')])
+        get.assert_not_called()
+        self.assertIn(self.schema, extension_presence.watched_schemas())
@@ -0,0 +1,103 @@
+"""
+Tests for the FastAGI routing server (crm/fastagi.py).
+"""
+import asyncio
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+from crm.fastagi import RoutingServer, pbx_token_from_env, routing_variables
+
+
+ROUTING = {
+    'is_working_hours': True,
+    'action': 'queue',
+    'sounds': {'greeting': 'https://cdn.test/greeting.wav'},
+    'extensions': ['100', '101'],
+    'voicemail_enabled': False,
+    'after_hours_action': 'announcement',
+    'forward_number': None,
+    'inbound_route': {'id': 1, 'ivr_custom_context': None},
+    'queue_name': 'support',
+    'queue_slug': 'support',
+    'tenant_schema': 'acme',
+}
+
+
+class TestRoutingVariables(SimpleTestCase):
+
+    def test_maps_routing_response(self):
+        variables = dict(routing_variables(ROUTING))
+        self.assertEqual(variables['IS_WORKING'], 'true')
+        self.assertEqual(variables['SOUND_GREETING'], 'https://cdn.test/greeting.wav')
+        self.assertEqual(variables['SOUND_AFTER_HOURS'], '')
+        self.assertEqual(variables['DEST_EXTENSIONS'], '100,101')
+        self.assertEqual(variables['TENANT_SCHEMA'], 'acme')
+
+    def test_fallback_matches_classic_script(self):
+        variables = dict(routing_variables(None))
+        self.assertEqual(variables['ROUTE_ACTION'], 'queue')
+        self.assertEqual(variables['QUEUE_NAME'], 'support')
+
+    def test_token_from_argument_or_url(self):
+        self.assertEqual(pbx_token_from_env({'agi_arg_1': 'tok'}), 'tok')
+        self.assertEqual(
+            pbx_token_from_env({'agi_network_script': 'echodesk-routing?pbx_token=abc'}), 'abc',
+        )
+
+
+class TestRoutingServer(SimpleTestCase):
+
+    def _call(self, server, port, did):
+        async def session():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(
+                f'agi_network: yes\nagi_extension: {did}\nagi_arg_1: tok\n\n'.encode()
+            )
+            commands = []
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                commands.append(line.decode().strip())
+                writer.write(b'200 result=1\n')
+            writer.close()
+            return commands
+        return session()
+
+    def test_concurrent_channels_share_one_lookup(self):
+        calls = []
+
+        def resolver(did, token, legacy_scan):
+            calls.append((did, token))
+            return ROUTING
+
+        async def scenario():
+            server = RoutingServer(resolver=resolver)
+            srv = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+            port = srv.sockets[0].getsockname()[1]
+            try:
+                results = await asyncio.gather(*[self._call(server, port, '995322421219') for _ in range(5)])
+            finally:
+                srv.close()
+                await srv.wait_closed()
+                server.shutdown()
+            return server, results
+
+        server, results = asyncio.run(scenario())
+        self.assertEqual(calls, [('995322421219', 'tok')])
+        for commands in results:
+            self.assertIn('SET VARIABLE QUEUE_NAME "support"', commands)
+            self.assertIn('SET VARIABLE DEST_EXTENSIONS "100,101"', commands)
+        snapshot = server.metrics.snapshot()
+        self.assertEqual(snapshot['calls'], 5)
+        self.assertEqual(snapshot['active'], 0)
+        self.assertEqual(snapshot['fallbacks'], 0)
+        self.assertIn('echodesk_fastagi_calls_total 5', server.metrics.prometheus())
+
+
+class TestRunFastagiCommand(SimpleTestCase):
+
+    def test_legacy_scan_refused_off_loopback(self):
+        with self.assertRaisesMessage(CommandError, 'refusing to serve it on 0.0.0.0'):
+            call_command('run_fastagi', '--legacy-scan', '--host', '0.0.0.0')
@@ -0,0 +1,58 @@
+"""Tests for the AMI-fed live channel state (crm/live_calls.py)."""
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from crm import live_calls
+
+
+class TestLiveStateSeed(SimpleTestCase):
+
+    def setUp(self):
+        self.schema = f'live_test_{uuid.uuid4().hex[:8]}'
+        pbx = SimpleNamespace(
+            ami_host='pbx.test.com', fqdn='', ami_port=5038, ami_username='u', ami_password='p',
+            use_tenant_prefix=False,
+        )
+        with patch.object(live_calls, 'AmiClient'):
+            self.listener = live_calls.LiveStateListener(self.schema, pbx)
+
+    def tearDown(self):
+        redis = live_calls.get_redis()
+        for key in redis.scan_iter(match=f'*{self.schema}*'):
+            redis.delete(key)
+
+    def _client(self, during_snapshot, channel='PJSIP/100-1'):
+        listener = self.listener
+        snapshot = [{'event': 'CoreShowChannel', 'channel': channel, 'channelstate': '6'}]
+
+        def collect(action, complete_event, **kwargs):
+            if action == 'CoreShowChannels':
+                # Events the reader thread delivers while the snapshot is in flight.
+                for event in during_snapshot:
+                    listener.handle(event)
+                return snapshot
+            return []
+
+        return SimpleNamespace(collect=collect)
+
+    def _channels(self):
+        return {channel['channel']: channel for channel in live_calls.channels(self.schema)}
+
+    def test_hangup_during_seed_is_not_overwritten_by_the_snapshot(self):
+        self.listener.seed(self._client([{'event': 'Hangup', 'channel': 'PJSIP/100-1'}]))
+
+        self.assertEqual(self._channels(), {})
+
+    def test_replayed_rename_keeps_the_snapshot_state(self):
+        # The snapshot already shows the new name; the buffered rename is replayed on top.
+        self.listener.seed(self._client(
+            [{'event': 'Rename', 'channel': 'PJSIP/100-1', 'newname': 'PJSIP/100-1<ZOMBIE>'}],
+            channel='PJSIP/100-1<ZOMBIE>',
+        ))
+
+        self.assertEqual(self._channels(), {
+            'PJSIP/100-1<ZOMBIE>': {'channel': 'PJSIP/100-1<ZOMBIE>', 'channelstate': '6'},
+        })
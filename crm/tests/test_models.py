@@ -132,6 +132,28 @@ class TestClient(CrmTestCase):
         client = self.create_client(name='Acme', email='acme@test.com')
         self.assertEqual(str(client), 'Acme (acme@test.com)')
 
+    def test_phone_index_columns_maintained_on_save(self):
+        client = self.create_client(phone='0555 12-34-56')
+        self.assertEqual(client.phone_e164, '+995555123456')
+        self.assertEqual(client.phone_reversed, '6543215550')
+
+        client.phone = '+1 (202) 555-0100'
+        client.save(update_fields=['phone'])
+        client.refresh_from_db()
+        self.assertEqual(client.phone_e164, '+12025550100')
+        self.assertEqual(client.phone_reversed, '00105552021')
+
+    def test_phone_index_lookup_matches_suffix(self):
+        from crm import phone_index
+
+        client = self.create_client(phone='+995555123456')
+        self.create_client(phone='+995555999999')
+        self.assertEqual(phone_index.find_crm_client('555 123 456'), client)
+        self.assertEqual(phone_index.find_crm_client('00995555123456'), client)
+        self.assertIsNone(phone_index.find_crm_client('5123456000'))
+        self.assertIsNone(phone_index.find_crm_client(''))
+        self.assertEqual(phone_index.match_clients('555123456'), (client, None))
+
 
 # ============================================================================
 # CallLog
@@ -435,3 +435,35 @@ class TestCallRouting(CrmTestCase):
         self.assertEqual(resp.status_code, 200)
         # Default fallback should be open
         self.assertTrue(resp.data['is_working_hours'])
+
+    def test_call_routing_served_from_compiled_table(self):
+        """Second call needs no queries; saving a route rebuilds the table."""
+        from django.db import connection
+        from crm import routing_table
+        from crm.models import InboundRoute
+
+        admin, sip, _ = self._create_routing_setup(working_hours_enabled=False)
+        target = self.create_phone_assignment(sip_config=sip, extension='205')
+        route = InboundRoute.objects.create(
+            did='+995322421219', destination_type='extension', destination_extension=target,
+        )
+        url = '/api/pbx/call-routing/?did=995322421219'
+        # Until commit the writer builds from the DB every time. Stand in for
+        # the commit hook (the others would push to the Asterisk sync queue),
+        # and drop the "committed" table again when the test rolls back.
+        routing_table.invalidate_now(connection.schema_name)
+        self.addCleanup(routing_table.invalidate_now, connection.schema_name)
+
+        resp = self.client.get(url, HTTP_HOST='tenant.test.com')
+        self.assertEqual(resp.data['extensions'], ['205'])
+        self.assertEqual(resp.data['inbound_route']['id'], route.id)
+        self.assertEqual(resp.data['action'], 'extension')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(routing_table.resolve(connection.schema_name, '995322421219')['extensions'], ['205'])
+
+        route.destination_type = 'voicemail'
+        route.save()
+        resp = self.client.get(url, HTTP_HOST='tenant.test.com')
+        self.assertEqual(resp.data['action'], 'voicemail')
+        self.assertCountEqual(resp.data['extensions'], ['100', '205'])
@@ -0,0 +1,115 @@
+"""Tests for call recording processing (crm/recording_pipeline.py), using local WAV fixtures."""
+import math
+import os
+import shutil
+import struct
+import tempfile
+import wave
+from unittest import mock, skipUnless
+
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, override_settings
+
+from crm import recording_pipeline
+from crm.models import CallRecording
+from crm.tests.conftest import CrmTestCase
+
+
+def write_wav(path, samples, sample_width=2, channels=1, rate=8000):
+    """Write interleaved integer ``samples`` as a PCM WAV fixture."""
+    if sample_width == 1:
+        frames = bytes(value + 128 for value in samples)
+    else:
+        frames = struct.pack(f'<{len(samples)}{"h" if sample_width == 2 else "i"}', *samples)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return path
+
+
+def tone(seconds, amplitude, rate=8000, frequency=440):
+    return [int(amplitude * math.sin(2 * math.pi * frequency * i / rate)) for i in range(int(seconds * rate))]
+
+
+class FixtureMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def fixture(self, name, *args, **kwargs):
+        return write_wav(os.path.join(self.tmp, name), *args, **kwargs)
+
+
+class TestComputePeaks(FixtureMixin, SimpleTestCase):
+
+    def test_half_scale_tone_then_silence(self):
+        path = self.fixture('call.wav', tone(1, 16384) + [0] * 8000)
+        waveform = recording_pipeline.compute_peaks(path, count=10)
+        self.assertEqual(waveform['sample_rate'], 8000)
+        self.assertEqual(waveform['duration'], 2.0)
+        self.assertEqual(len(waveform['peaks']), 10)
+        for peak in waveform['peaks'][:5]:
+            self.assertAlmostEqual(peak, 0.5, places=2)
+        self.assertEqual(waveform['peaks'][5:], [0.0] * 5)
+
+    def test_8bit_stereo(self):
+        path = self.fixture('stereo.wav', [127, -64] * 800, sample_width=1, channels=2)
+        waveform = recording_pipeline.compute_peaks(path, count=4)
+        self.assertEqual(waveform['duration'], 0.1)
+        self.assertEqual(waveform['peaks'], [0.992] * 4)
+
+    def test_short_recording_gets_one_peak_per_frame(self):
+        path = self.fixture('blip.wav', [32767, -32768, 0])
+        self.assertEqual(recording_pipeline.compute_peaks(path, count=800)['peaks'], [1.0, 1.0, 0.0])
+
+
+class TestProcessFile(FixtureMixin, CrmTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = FileSystemStorage(location=os.path.join(self.tmp, 'storage'), base_url='/media/')
+        self.admin = self.create_admin()
+        self.call = self.create_call_log(handled_by=self.admin, recording_url='http://pbx.test/rec/call.wav')
+        self.recording = CallRecording.objects.create(call_log=self.call, status='completed')
+
+    @override_settings(CALL_RECORDING_FFMPEG='/nonexistent/ffmpeg')
+    def test_without_ffmpeg_stores_original(self):
+        source = self.fixture('source.wav', tone(2, 8192))
+        recording_pipeline.process_file(self.recording, source, self.call.recording_url, storage=self.storage)
+
+        self.recording.refresh_from_db()
+        self.assertTrue(self.recording.playback_path.endswith('.wav'))
+        self.assertEqual(self.recording.playback_content_type, 'audio/wav')
+        self.assertTrue(self.storage.exists(self.recording.playback_path))
+        self.assertEqual(len(self.recording.waveform['peaks']), recording_pipeline.PEAK_COUNT)
+        self.assertEqual(self.recording.duration.total_seconds(), 2)
+        self.assertTrue(recording_pipeline.is_ready(self.recording, self.call.recording_url))
+        self.assertFalse(recording_pipeline.is_ready(self.recording, 'http://pbx.test/rec/other.wav'))
+
+    @skipUnless(shutil.which('ffmpeg'), 'ffmpeg not installed')
+    @override_settings(CALL_RECORDING_FFMPEG='ffmpeg', CALL_RECORDING_FORMAT='mp3')
+    def test_transcodes_to_mp3(self):
+        source = self.fixture('source.wav', tone(2, 8192))
+        recording_pipeline.process_file(self.recording, source, self.call.recording_url, storage=self.storage)
+
+        self.recording.refresh_from_db()
+        self.assertTrue(self.recording.playback_path.endswith('.mp3'))
+        self.assertEqual(self.recording.playback_content_type, 'audio/mpeg')
+        self.assertLess(self.recording.playback_size, os.path.getsize(source))
+
+    @override_settings(CALL_RECORDING_FFMPEG='/nonexistent/ffmpeg')
+    def test_playback_redirects_to_storage(self):
+        source = self.fixture('source.wav', tone(1, 8192))
+        recording_pipeline.process_file(self.recording, source, self.call.recording_url, storage=self.storage)
+
+        with mock.patch('crm.recording_pipeline.recording_storage', return_value=self.storage):
+            resp = self.api_get(f'/api/call-logs/{self.call.id}/recording/', user=self.admin)
+            waveform = self.api_get(f'/api/call-logs/{self.call.id}/recording/waveform/', user=self.admin)
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp['Location'], f'/media/{self.recording.playback_path}')
+        self.assertEqual(waveform.status_code, 200)
+        self.assertEqual(waveform.data['status'], 'ready')
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     CallLogViewSet, ClientViewSet, SipConfigurationViewSet, UserPhoneAssignmentViewSet,
     pbx_settings_detail, pbx_settings_upload_sound, pbx_settings_remove_sound,
-    sip_webhook, recording_webhook, call_rating_webhook, call_recording_url_webhook,
+    sip_webhook, recording_webhook, call_events_webhook, call_rating_webhook, call_recording_url_webhook,
     extension_status, call_routing, send_call_review_sms,
 )
 from . import views_pbx, views_stats, views_pbx_install
@@ -25,6 +25,7 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/webhooks/sip/', sip_webhook, name='sip-webhook'),
     path('api/webhooks/recording/', recording_webhook, name='recording-webhook'),
+    path('api/webhooks/call-events/', call_events_webhook, name='call-events-webhook'),
     path('api/extensions/status/', extension_status, name='extension-status'),
     path('api/webhooks/call-rating/', call_rating_webhook, name='call-rating-webhook'),
     path('api/webhooks/call-recording-url/', call_recording_url_webhook, name='call-recording-url-webhook'),
@@ -1,5 +1,4 @@
 import logging
-import socket
 
 from rest_framework import serializers as drf_serializers, viewsets, permissions, status, filters
 from rest_framework.decorators import action, api_view, permission_classes
@@ -13,6 +12,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
 from .models import CallLog, Client, SipConfiguration, CallEvent, CallRecording, UserPhoneAssignment, PbxSettings, CallRating
+from . import call_ingest, phone_index, recording_pipeline
 from .serializers import (
     CallLogSerializer, ClientSerializer, SipConfigurationSerializer,
     SipConfigurationListSerializer, SipConfigurationDetailSerializer,
@@ -26,143 +26,45 @@ from .serializers import (
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
-# Asterisk AMI helpers (raw TCP, no external library)
+# Asterisk AMI helpers
 #
 # Phase 2 (BYO Asterisk): AMI credentials come from the current tenant's
-# PbxServer row, not module-level constants. Each helper now takes host +
-# username + password (+ optional port) so callers can resolve these from
-# their tenant's PbxServer and stay isolated from every other tenant's AMI.
+# PbxServer row. Actions run over the process-wide persistent session for
+# that PBX (see crm.ami); channel lookups read the live state kept by the
+# run_ami_listener command (see crm.live_calls) and only fall back to
+# CoreShowChannels while the listener is down.
 # ---------------------------------------------------------------------------
 
-def _ami_send_action(sock, action_lines):
-    """Send a single AMI action (dict of key/value pairs) and return the raw response."""
-    msg = ""
-    for key, value in action_lines:
-        msg += f"{key}: {value}\r\n"
-    msg += "\r\n"
-    sock.sendall(msg.encode("utf-8"))
-    return _ami_read_response(sock)
-
-
-def _ami_read_response(sock, timeout=5):
-    """Read from the AMI socket until we get a complete response (ends with \\r\\n\\r\\n)."""
-    sock.settimeout(timeout)
-    data = b""
-    while True:
-        try:
-            chunk = sock.recv(4096)
-            if not chunk:
-                break
-            data += chunk
-            # AMI responses are terminated by a blank line
-            if b"\r\n\r\n" in data:
-                break
-        except socket.timeout:
-            break
-    return data.decode("utf-8", errors="replace")
-
-
-def _ami_connect_and_login(host, username, password, port=5038):
-    """Open a TCP connection to AMI, read the banner, and log in.
-
-    Returns the socket on success; raises on failure.
-    """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(10)
-    sock.connect((host, port))
-
-    # Read the AMI banner (e.g. "Asterisk Call Manager/...")
-    _ami_read_response(sock, timeout=3)
-
-    # Login
-    resp = _ami_send_action(sock, [
-        ("Action", "Login"),
-        ("Username", username),
-        ("Secret", password),
-    ])
-    if "Success" not in resp:
-        sock.close()
-        raise ConnectionError(f"AMI login failed: {resp.strip()}")
-    return sock
-
-
-def _ami_logoff(sock):
-    """Send Logoff and close the socket."""
-    try:
-        _ami_send_action(sock, [("Action", "Logoff")])
-    except Exception:
-        pass
-    try:
-        sock.close()
-    except Exception:
-        pass
-
-
-def _ami_get_channels(host, username, password, port=5038):
-    """Connect to AMI, run CoreShowChannels, and return a list of channel dicts.
+def _ami_get_channels(pbx):
+    """Return the PBX's active channels as dicts.
 
     Each dict has at least:
         - channel: full channel name (e.g. PJSIP/geo-provider-endpoint-00000001)
-        - context, exten, calleridnum, duration, application, bridgeid, ...
+        - context, exten, calleridnum, connectedlinenum, bridgeid, ...
     """
-    sock = _ami_connect_and_login(host, username, password, port=port)
-    try:
-        # CoreShowChannels returns multiple "Event: CoreShowChannel" messages
-        # followed by "Event: CoreShowChannelsComplete".
-        msg = "Action: CoreShowChannels\r\n\r\n"
-        sock.sendall(msg.encode("utf-8"))
-
-        raw = b""
-        sock.settimeout(5)
-        while True:
-            try:
-                chunk = sock.recv(8192)
-                if not chunk:
-                    break
-                raw += chunk
-                if b"CoreShowChannelsComplete" in raw:
-                    break
-            except socket.timeout:
-                break
-
-        text = raw.decode("utf-8", errors="replace")
-        channels = []
-        # Split into blocks by double CRLF
-        blocks = text.split("\r\n\r\n")
-        for block in blocks:
-            if "Event: CoreShowChannel\r\n" not in block and "Event: CoreShowChannel\n" not in block:
-                continue
-            channel_info = {}
-            for line in block.strip().splitlines():
-                if ": " in line:
-                    key, _, value = line.partition(": ")
-                    channel_info[key.strip().lower()] = value.strip()
-            if channel_info.get("channel"):
-                channels.append(channel_info)
-        return channels
-    finally:
-        _ami_logoff(sock)
-
-
-def _ami_redirect_to_confbridge(host, channel, conference_room, username, password, port=5038):
+    from django.db import connection
+    from . import ami, live_calls
+
+    channels = live_calls.channels(connection.schema_name)
+    if channels is None:
+        channels = ami.client_for(pbx).collect('CoreShowChannels', 'CoreShowChannelsComplete')
+    return [ch for ch in channels if ch.get("channel")]
+
+
+def _ami_redirect_to_confbridge(pbx, channel, conference_room):
     """Redirect a single Asterisk channel into a ConfBridge room.
 
-    Uses the ``confbridge-dynamic`` dialplan context.
+    Uses the ``confbridge-dynamic`` dialplan context. Raises
+    :class:`crm.ami.AmiError` when Asterisk rejects the redirect.
     """
-    sock = _ami_connect_and_login(host, username, password, port=port)
-    try:
-        resp = _ami_send_action(sock, [
-            ("Action", "Redirect"),
-            ("Channel", channel),
-            ("Context", "confbridge-dynamic"),
-            ("Exten", conference_room),
-            ("Priority", "1"),
-        ])
-        if "Success" not in resp:
-            raise RuntimeError(f"AMI Redirect failed for {channel}: {resp.strip()}")
-        return resp
-    finally:
-        _ami_logoff(sock)
+    from . import ami
+
+    return ami.client_for(pbx).send_action("Redirect", [
+        ("Channel", channel),
+        ("Context", "confbridge-dynamic"),
+        ("Exten", conference_room),
+        ("Priority", "1"),
+    ])
 
 
 class SipConfigurationViewSet(viewsets.ModelViewSet):
@@ -353,30 +255,11 @@ class CallLogViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def _match_client(phone_number):
-        """Match a phone number to a social client by last 7 digits.
+        """Match a phone number to a client by its last 7 digits.
         Returns (crm_client, social_client) tuple."""
         if not phone_number:
             return None, None
-        clean = phone_number.replace('+', '').replace(' ', '').replace('-', '')
-        last_digits = clean[-7:] if len(clean) >= 7 else clean
-        if not last_digits:
-            return None, None
-
-        # Try social_integrations.Client (the main client list)
-        try:
-            from social_integrations.models import Client as SocialClient
-            social_client = SocialClient.objects.filter(phone__endswith=last_digits).first()
-            if social_client:
-                return None, social_client
-        except Exception:
-            pass
-
-        # Fallback: try CRM Client
-        crm_client = Client.objects.filter(phone__endswith=last_digits).first()
-        if crm_client:
-            return crm_client, None
-
-        return None, None
+        return phone_index.match_clients(phone_number)
     
     @extend_schema(
         summary="Initiate an outbound call",
@@ -716,13 +599,14 @@ class CallLogViewSet(viewsets.ModelViewSet):
     @extend_schema(
         summary="Stream call recording audio",
         description=(
-            "Proxy the recording WAV bytes from the PBX recording host through "
-            "this API. Solves the browser's 403/CORS against the PBX recording "
-            "host, keeps the underlying URL private, and supports HTTP Range "
-            "so the <audio> element can seek."
+            "Redirect to the transcoded recording in storage (a short-lived, "
+            "Range-capable URL) once it has been processed. Until then, proxy "
+            "the recording WAV bytes from the PBX recording host through this "
+            "API with HTTP Range support, and queue the processing."
         ),
         responses={
             200: OpenApiTypes.BINARY,
+            302: OpenApiTypes.NONE,
             404: OpenApiTypes.OBJECT,
             502: OpenApiTypes.OBJECT,
         },
@@ -745,18 +629,21 @@ class CallLogViewSet(viewsets.ModelViewSet):
         call_log = self.get_object()
 
         # Pick the first non-empty URL: legacy field, then related CallRecording.
-        source_url = call_log.recording_url
-        if not source_url:
-            try:
-                source_url = call_log.recording.file_url
-            except CallRecording.DoesNotExist:
-                source_url = None
+        source_url = recording_pipeline.source_url_of(call_log)
         if not source_url:
             return Response(
                 {'error': 'No recording on this call'},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
+        # Processed copy in storage: redirect, storage serves Range itself.
+        recording = CallRecording.objects.filter(call_log=call_log).first()
+        if recording_pipeline.is_ready(recording, source_url):
+            return recording_pipeline.playback_response(recording)
+        # Not processed yet (older recordings, or the task is still running):
+        # proxy this time and make sure a copy is on its way.
+        recording_pipeline.enqueue([call_log.id])
+
         # Forward a Range request so the audio element can seek.
         upstream_headers = {}
         if 'HTTP_RANGE' in request.META:
@@ -829,6 +716,41 @@ class CallLogViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = f'inline; filename="call-{call_log.pk}.wav"'
         return response
 
+    @extend_schema(
+        summary="Call recording waveform",
+        description=(
+            "Precomputed peak amplitudes (0..1) for drawing the recording's "
+            "waveform without downloading the audio. Returns 202 while the "
+            "recording is still being processed."
+        ),
+        responses={200: OpenApiTypes.OBJECT, 202: OpenApiTypes.OBJECT, 404: OpenApiTypes.OBJECT},
+    )
+    @action(detail=True, methods=['get'], url_path='recording/waveform')
+    def recording_waveform(self, request, pk=None):
+        """Return the waveform peaks for a call's recording."""
+        if not (request.user.is_staff or request.user.is_superuser):
+            return Response(
+                {'error': 'Only tenant admins can access call recordings.'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        call_log = self.get_object()
+        source_url = recording_pipeline.source_url_of(call_log)
+        if not source_url:
+            return Response(
+                {'error': 'No recording on this call'},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        recording = CallRecording.objects.filter(call_log=call_log).first()
+        if not recording_pipeline.is_ready(recording, source_url) or not recording.waveform:
+            recording_pipeline.enqueue([call_log.id])
+            return Response({'status': 'processing'}, status=status.HTTP_202_ACCEPTED)
+
+        response = Response({'status': 'ready', **recording.waveform})
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
     @extend_schema(
         summary="Start call recording",
         description="Start recording for an active call",
@@ -1107,7 +1029,8 @@ class CallLogViewSet(viewsets.ModelViewSet):
         if consultation_log.transferred_to_user:
             original_call.transferred_to_user = consultation_log.transferred_to_user
         else:
-            # Try to find user by phone assignment
+            # Try to find user by phone assignment (a few rows per tenant, so
+            # the suffix scan stays; client matching goes through crm.phone_index)
             assignment = UserPhoneAssignment.objects.filter(
                 phone_number__endswith=target_number[-7:], is_active=True
             ).first()
@@ -1261,10 +1184,7 @@ class CallLogViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE,
             )
         pbx_host = pbx.ami_host or pbx.fqdn
-        ami_user = pbx.ami_username
-        ami_pass = pbx.ami_password
-        ami_port = pbx.ami_port or 5038
-        if not (pbx_host and ami_user and ami_pass):
+        if not (pbx_host and pbx.ami_username and pbx.ami_password):
             return Response(
                 {"error": "PbxServer missing AMI credentials"},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -1275,7 +1195,7 @@ class CallLogViewSet(viewsets.ModelViewSet):
 
         # --- Discover active channels via AMI ---------------------------
         try:
-            all_channels = _ami_get_channels(pbx_host, ami_user, ami_pass, port=ami_port)
+            all_channels = _ami_get_channels(pbx)
         except Exception as exc:
             logger.error("AMI CoreShowChannels failed on %s: %s", pbx_host, exc)
             return Response(
@@ -1344,10 +1264,7 @@ class CallLogViewSet(viewsets.ModelViewSet):
         errors = []
         for ch_name in unique_channels:
             try:
-                _ami_redirect_to_confbridge(
-                    pbx_host, ch_name, conference_room,
-                    ami_user, ami_pass, port=ami_port,
-                )
+                _ami_redirect_to_confbridge(pbx, ch_name, conference_room)
                 redirected.append(ch_name)
             except Exception as exc:
                 logger.error("AMI Redirect failed for %s: %s", ch_name, exc)
@@ -1544,8 +1461,8 @@ class ClientViewSet(viewsets.ModelViewSet):
         summary="Lookup client by phone number (CRM + Social)",
         description=(
             "Find the most likely Client/SocialClient match for an arbitrary "
-            "phone number. Cleans the input, takes the last 7 digits, and "
-            "icontains-matches both crm.Client and social_integrations.SocialClient. "
+            "phone number. Matches the last 7 digits of the input against the "
+            "phone suffix index of crm.Client and social_integrations.SocialClient. "
             "Returns the first hit (CRM preferred since it's manually curated) "
             "in a unified shape so the call sidebar can render either source. "
             "Used by the live-call sidebar so a number like 597147515 finds a "
@@ -1569,13 +1486,11 @@ class ClientViewSet(viewsets.ModelViewSet):
         if not phone:
             return Response({'results': [], 'count': 0})
 
-        cleaned = ''.join(ch for ch in phone if ch.isdigit())
-        if not cleaned:
+        if not phone_index.digits_of(phone):
             return Response({'results': [], 'count': 0})
-        last_digits = cleaned[-7:] if len(cleaned) >= 7 else cleaned
 
         # Prefer the CRM Client (manually curated) over SocialClient.
-        client = Client.objects.filter(phone__icontains=last_digits).first()
+        client = phone_index.find_crm_client(phone)
         if client:
             return Response({
                 'results': [{
@@ -1589,8 +1504,7 @@ class ClientViewSet(viewsets.ModelViewSet):
                 'count': 1,
             })
 
-        from social_integrations.models import SocialClient
-        sc = SocialClient.objects.filter(phone__icontains=last_digits).first()
+        sc = phone_index.find_social_client(phone)
         if sc:
             display_name = sc.name or f'{sc.first_name or ""} {sc.last_name or ""}'.strip()
             return Response({
@@ -1634,109 +1548,33 @@ class ClientViewSet(viewsets.ModelViewSet):
 def sip_webhook(request):
     """
     Webhook endpoint for receiving SIP call events
-    This endpoint should be called by your SIP server to update call status
+    This endpoint should be called by your SIP server to update call status.
+    Batching servers should POST to ``call_events_webhook`` instead.
     """
     try:
         data = request.data
         event_type = data.get('event_type')
         sip_call_id = data.get('sip_call_id')
-        caller_number = data.get('caller_number', '')
-        recipient_number = data.get('recipient_number', '')
-        metadata = data.get('metadata', {})
-        
+
         if not event_type or not sip_call_id:
             return Response(
                 {'error': 'event_type and sip_call_id are required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Map SIP events to our call statuses
-        event_status_map = {
-            'call_initiated': 'initiated',
-            'call_ringing': 'ringing',
-            'call_answered': 'answered',
-            'call_ended': 'ended',
-            'call_failed': 'failed',
-            'call_busy': 'busy',
-            'call_no_answer': 'no_answer'
-        }
-        
-        call_status = event_status_map.get(event_type, 'ringing')
-        
-        # Try to find existing call log by SIP call ID
-        try:
-            call_log = CallLog.objects.get(sip_call_id=sip_call_id)
-            
-            # Update existing call
-            old_status = call_log.status
-            call_log.status = call_status
-            
-            if call_status == 'answered' and not call_log.answered_at:
-                call_log.answered_at = timezone.now()
-            elif call_status in ['ended', 'failed', 'busy', 'no_answer']:
-                if not call_log.ended_at:
-                    call_log.ended_at = timezone.now()
-                    if call_log.answered_at:
-                        call_log.duration = call_log.ended_at - call_log.answered_at
-                    else:
-                        call_log.duration = timedelta(seconds=0)
-            
-            call_log.save()
-            
-            # Create call event
-            CallEvent.objects.create(
-                call_log=call_log,
-                event_type=event_type.replace('call_', ''),
-                metadata={
-                    'sip_event': True,
-                    'old_status': old_status,
-                    'new_status': call_status,
-                    **metadata
-                }
+
+        result = call_ingest.ingest_sip_events([data])[0]
+        if result.get('error'):
+            return Response(
+                {'error': f'Call not found for sip_call_id: {sip_call_id}'},
+                status=status.HTTP_404_NOT_FOUND
             )
-            
-        except CallLog.DoesNotExist:
-            # Create new call log for incoming calls
-            if event_type in ['call_initiated', 'call_ringing']:
-                # Get default SIP configuration
-                sip_config = SipConfiguration.objects.filter(
-                    is_default=True,
-                    is_active=True
-                ).first()
-                
-                call_log = CallLog.objects.create(
-                    caller_number=caller_number,
-                    recipient_number=recipient_number,
-                    direction='inbound' if caller_number != recipient_number else 'outbound',
-                    status=call_status,
-                    sip_call_id=sip_call_id,
-                    sip_configuration=sip_config,
-                    started_at=timezone.now()
-                )
-                
-                # Create initial event
-                CallEvent.objects.create(
-                    call_log=call_log,
-                    event_type=event_type.replace('call_', ''),
-                    metadata={
-                        'sip_event': True,
-                        'caller': caller_number,
-                        'recipient': recipient_number,
-                        **metadata
-                    }
-                )
-            else:
-                return Response(
-                    {'error': f'Call not found for sip_call_id: {sip_call_id}'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        
+
         return Response({
             'message': 'Event processed successfully',
-            'call_id': str(call_log.call_id),
-            'status': call_log.status
+            'call_id': result['call_id'],
+            'status': result['status']
         })
-        
+
     except Exception as e:
         return Response(
             {'error': f'Error processing webhook: {str(e)}'},
@@ -1775,81 +1613,82 @@ def recording_webhook(request):
         data = request.data
         call_id = data.get('call_id')
         recording_status = data.get('status')
-        file_url = data.get('file_url', '')
-        file_size = data.get('file_size')
-        duration_seconds = data.get('duration')
-        format_type = data.get('format', 'wav')
-        
+
         if not call_id or not recording_status:
             return Response(
                 {'error': 'call_id and status are required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Find call log
-        try:
-            call_log = CallLog.objects.get(call_id=call_id)
-        except CallLog.DoesNotExist:
+
+        result = call_ingest.ingest_recordings([data])[0]
+        if result.get('error'):
             return Response(
                 {'error': f'Call not found for call_id: {call_id}'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Get or create recording
-        recording, created = CallRecording.objects.get_or_create(
-            call_log=call_log,
-            defaults={
-                'status': 'pending',
-                'format': format_type
-            }
+
+        return Response({
+            'message': 'Recording update processed successfully',
+            'recording_id': result['recording_id'],
+            'status': result['status']
+        })
+
+    except Exception as e:
+        return Response(
+            {'error': f'Error processing recording webhook: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
-        
-        # Update recording
-        recording.status = recording_status
-        if file_url:
-            recording.file_url = file_url
-        if file_size:
-            recording.file_size = file_size
-        if duration_seconds:
-            recording.duration = timedelta(seconds=duration_seconds)
-
-        if recording_status == 'started':
-            recording.started_at = timezone.now()
-        elif recording_status == 'completed':
-            recording.completed_at = timezone.now()
 
-        recording.save()
 
-        # Also mirror the URL onto the legacy CallLog.recording_url field so
-        # list endpoints / older clients still see the recording even without
-        # the serializer fallback.
-        if file_url and call_log.recording_url != file_url:
-            call_log.recording_url = file_url
-            call_log.save(update_fields=['recording_url'])
-        
-        # Create call event
-        event_type = f'recording_{recording_status}'
-        CallEvent.objects.create(
-            call_log=call_log,
-            event_type=event_type,
-            metadata={
-                'recording_webhook': True,
-                'recording_id': str(recording.recording_id),
-                'file_url': file_url,
-                'file_size': file_size,
-                'duration_seconds': duration_seconds
+@extend_schema(
+    summary="Batched Call Events Webhook",
+    description=(
+        "Batched form of the SIP and recording webhooks. Events are applied in order; "
+        "each call is written once per batch and live-call listeners get one update per batch."
+    ),
+    request={
+        "application/json": {
+            "type": "object",
+            "properties": {
+                "events": {"type": "array", "items": {"type": "object"},
+                           "description": "SIP events, same shape as the SIP webhook body"},
+                "recordings": {"type": "array", "items": {"type": "object"},
+                               "description": "Recording updates, same shape as the recording webhook body"},
             }
+        }
+    },
+    responses={200: "Batch processed"}
+)
+@api_view(['POST'])
+@permission_classes([])
+@csrf_exempt
+def call_events_webhook(request):
+    """
+    Webhook endpoint for batches of SIP events and recording updates.
+    Results are returned per call; a bad item does not fail the batch.
+    """
+    events = request.data.get('events') or []
+    recordings = request.data.get('recordings') or []
+    if not isinstance(events, list) or not isinstance(recordings, list):
+        return Response(
+            {'error': 'events and recordings must be lists'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        
+    if len(events) + len(recordings) > call_ingest.MAX_BATCH:
+        return Response(
+            {'error': f'At most {call_ingest.MAX_BATCH} items per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
         return Response({
-            'message': 'Recording update processed successfully',
-            'recording_id': str(recording.recording_id),
-            'status': recording.status
+            'events': call_ingest.ingest_sip_events(events) if events else [],
+            'recordings': call_ingest.ingest_recordings(recordings) if recordings else [],
         })
-        
     except Exception as e:
+        logger.exception('Batched call event ingestion failed')
         return Response(
-            {'error': f'Error processing recording webhook: {str(e)}'},
+            {'error': f'Error processing webhook: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
@@ -1988,7 +1827,7 @@ def send_call_review_sms(request):
     for tenant in tenants:
         try:
             with schema_context(tenant.schema_name):
-                # Find matching SIP config
+                # Find matching SIP config (one row per trunk; no phone index needed)
                 sip_config = None
                 if clean_did:
                     sip_config = SipConfiguration.objects.filter(
@@ -2072,35 +1911,25 @@ def send_call_review_sms(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def extension_status(request):
-    """Proxy to PBX status API — returns which extensions are online.
-
-    Resolves the tenant's active :class:`PbxServer` first so each tenant
-    gets a response from their own Asterisk. Falls back to the default
-    SipConfiguration when no PbxServer is registered yet, keeping the
-    legacy shared-pbx2 path alive during the BYO migration window.
+    """Which extensions are online, served from the tenant's presence cache.
+
+    The cache is fed by AMI device-state events (``run_ami_listener``) or,
+    without a live feed, by polling the PBX status API at most once every
+    few seconds per tenant however many tabs ask (see
+    :mod:`crm.extension_presence`). Resolves the tenant's active
+    :class:`PbxServer` first so each tenant gets their own Asterisk. Falls
+    back to the default SipConfiguration when no PbxServer is registered
+    yet, keeping the legacy shared-pbx2 path alive during the BYO migration
+    window. Live updates are pushed on ``ws/extension-presence/<tenant>/``.
     """
-    import requests as http_requests
-    from crm.asterisk_db import get_active_pbx_for_current_tenant
+    from django.db import connection
+    from crm import extension_presence
 
+    schema_name = connection.schema_name
     try:
-        pbx = get_active_pbx_for_current_tenant()
-        if pbx is not None:
-            pbx_host = pbx.ami_host or pbx.fqdn
-        else:
-            sip_config = SipConfiguration.objects.filter(
-                is_default=True, is_active=True
-            ).first()
-            if not sip_config:
-                return Response({'extensions': []})
-            pbx_host = sip_config.sip_server
-
-        if not pbx_host:
-            return Response({'extensions': []})
-
-        resp = http_requests.get(
-            f'http://{pbx_host}:8081/api/extensions/status', timeout=3
-        )
-        return Response(resp.json())
+        extension_presence.watch(schema_name)
+        extension_presence.refresh_if_stale(schema_name)
+        return Response({'extensions': extension_presence.snapshot(schema_name)})
     except Exception:
         return Response({'extensions': []})
 
@@ -2142,6 +1971,7 @@ def call_recording_url_webhook(request):
 
         call_log.recording_url = recording_url
         call_log.save(update_fields=['recording_url'])
+        recording_pipeline.enqueue([call_log.id])
 
         return Response({
             'message': f'Recording URL saved for call {call_log.call_id}',
@@ -2322,135 +2152,12 @@ def _resolve_routing_for_tenant(tenant_schema: str, did: str):
 
     Returns a response dict ready to return from :func:`call_routing`, or
     ``None`` if no SIP config / routing data was found in this tenant.
+    Served from the tenant's compiled routing table (see
+    :mod:`crm.routing_table`); only the working-hours check runs per call.
     """
-    from django.conf import settings as django_settings
-    from tenant_schemas.utils import schema_context
-
-    clean_did = did.replace('+', '').replace(' ', '').replace('-', '')
-
-    with schema_context(tenant_schema):
-        from crm.models import InboundRoute, Queue, Trunk
+    from crm import routing_table
 
-        # Try matching by phone number first, then fall back to default config
-        sip_config = SipConfiguration.objects.filter(
-            phone_number__endswith=clean_did[-7:]
-        ).first()
-        if not sip_config:
-            sip_config = SipConfiguration.objects.filter(is_default=True).first()
-        if not sip_config:
-            sip_config = SipConfiguration.objects.first()
-        if not sip_config:
-            return None
-
-        pbx_settings, _ = PbxSettings.objects.get_or_create(
-            sip_configuration=sip_config
-        )
-
-        is_working = pbx_settings.is_working_hours_now()
-        sound_urls = pbx_settings.get_sound_urls()
-
-        # Resolve InboundRoute for this DID (exact, then any route whose
-        # trunk owns this DID). When matched we can override extensions
-        # and action with the route's configured destination.
-        route = InboundRoute.objects.filter(
-            did=did, is_active=True
-        ).first() or InboundRoute.objects.filter(
-            did__endswith=clean_did[-9:], is_active=True
-        ).first()
-        if not route:
-            trunk_for_did = Trunk.objects.filter(
-                phone_numbers__contains=[did], is_active=True
-            ).first()
-            if trunk_for_did:
-                route = InboundRoute.objects.filter(
-                    trunk=trunk_for_did, is_active=True
-                ).order_by('priority').first()
-
-        inbound_route_info = None
-        queue_name = None
-        queue_slug = None
-        destination_extensions = []
-        if route:
-            dest_type = str(route.destination_type or 'queue')
-            inbound_route_info = {
-                'id': route.id,
-                'did': route.did,
-                'destination_type': dest_type,
-                'priority': route.priority,
-            }
-            if dest_type == 'queue' and route.destination_queue_id:
-                queue = Queue.objects.filter(
-                    id=route.destination_queue_id, is_active=True
-                ).select_related('group').first()
-                if queue:
-                    # Asterisk queue name. For BYO PbxServers with
-                    # use_tenant_prefix=False (isolated DB), the slug is
-                    # used verbatim. For legacy shared-DB deployments
-                    # (use_tenant_prefix=True) we prepend the schema.
-                    from crm.asterisk_db import get_active_pbx_for_current_tenant
-                    pbx = get_active_pbx_for_current_tenant()
-                    use_prefix = bool(
-                        pbx is not None and pbx.use_tenant_prefix
-                    )
-                    queue_slug = queue.slug
-                    queue_name = (
-                        f"{tenant_schema}_{queue.slug}" if use_prefix else queue.slug
-                    )
-                    inbound_route_info['queue_slug'] = queue.slug
-                    inbound_route_info['queue_name'] = queue_name
-                    # Derive ringing extensions from the backing group.
-                    destination_extensions = list(
-                        UserPhoneAssignment.objects.filter(
-                            user__tenant_groups=queue.group,
-                            is_active=True,
-                        ).values_list('extension', flat=True).distinct()
-                    )
-            elif dest_type == 'extension' and route.destination_extension_id:
-                assignment = UserPhoneAssignment.objects.filter(
-                    id=route.destination_extension_id, is_active=True
-                ).first()
-                if assignment:
-                    destination_extensions = [assignment.extension]
-                    inbound_route_info['extension'] = assignment.extension
-            elif dest_type == 'ivr_custom':
-                inbound_route_info['ivr_custom_context'] = route.ivr_custom_context
-            elif dest_type in ('voicemail', 'hangup'):
-                pass  # handled below by action
-
-        # Legacy: if no InboundRoute matched, fall back to all active
-        # extensions on the SIP config (prior behavior).
-        fallback_extensions = list(
-            UserPhoneAssignment.objects.filter(
-                sip_configuration=sip_config, is_active=True
-            ).values_list('extension', flat=True)
-        )
-        extensions = destination_extensions or fallback_extensions
-
-        # Determine action: InboundRoute overrides, else working-hours gate
-        if route and not is_working:
-            route_action = 'after_hours'
-        elif route and route.destination_type:
-            route_action = str(route.destination_type)
-        else:
-            route_action = 'queue' if is_working else 'after_hours'
-
-        return {
-            'is_working_hours': is_working,
-            'action': route_action,
-            'sounds': sound_urls,
-            'extensions': extensions,
-            'voicemail_enabled': pbx_settings.voicemail_enabled,
-            'after_hours_action': pbx_settings.after_hours_action,
-            'forward_number': (
-                pbx_settings.forward_number
-                if pbx_settings.after_hours_action == 'forward' else None
-            ),
-            'review_method': pbx_settings.review_method,
-            'inbound_route': inbound_route_info,
-            'queue_name': queue_name,
-            'queue_slug': queue_slug,
-            'tenant_schema': tenant_schema,
-        }
+    return routing_table.resolve(tenant_schema, did)
 
 
 @csrf_exempt
@@ -1,8 +1,9 @@
 """ViewSets for the PBX management panel (Trunks, Queues, Inbound routes).
 
 All endpoints are gated by the ``ip_calling`` subscription feature via the
-``HasSubscriptionFeature`` DRF permission class. The sync layer that mirrors
-these rows into Asterisk's realtime Postgres is built in a follow-up step.
+``HasSubscriptionFeature`` DRF permission class. Saving these rows marks
+them for the debounced realtime sync (``crm.asterisk_sync_queue``), whose
+progress is exposed at ``/api/pbx-servers/sync-status/``.
 """
 
 from django_filters.rest_framework import DjangoFilterBackend
@@ -166,3 +167,19 @@ class PbxServerViewSet(viewsets.ModelViewSet):
         pbx = self.get_object()
         pbx.regenerate_enrollment_token()
         return Response(self.get_serializer(pbx).data)
+
+    @extend_schema(
+        summary='Asterisk sync status',
+        description=(
+            'Changes to extensions, trunks, queues and group membership are synced to the '
+            'realtime DB in debounced batches. Returns the marks still pending, whether a '
+            'drain is scheduled or running, and the summary of the last drain.'
+        ),
+    )
+    @action(detail=False, methods=['get'], url_path='sync-status')
+    def sync_status(self, request):
+        from django.db import connection
+
+        from .asterisk_sync_queue import status
+
+        return Response(status(connection.schema_name))
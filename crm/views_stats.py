@@ -1,9 +1,10 @@
 """Call statistics endpoints for the PBX management panel.
 
-All aggregation is performed DB-side via ``annotate``/``aggregate`` plus
-``TruncDate``/``Extract`` — there are no Python loops over large
-querysets. All endpoints are gated by the ``ip_calling`` subscription
-feature and require an authenticated user.
+Counts and talk/wait totals come from the hourly ``CallHourlyRollup`` rows
+via :func:`crm.call_rollups.summarize` (partial hours at the edges of a
+range are read from CallLog), so cost does not grow with call history. All
+endpoints are gated by the ``ip_calling`` subscription feature and require
+an authenticated user.
 """
 
 from __future__ import annotations
@@ -12,8 +13,8 @@ import calendar
 from datetime import date, datetime, time, timedelta
 from typing import Tuple
 
-from django.db.models import Avg, Count, F, Q, Sum
-from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncDate
+from django.contrib.auth import get_user_model
+from django.db.models import Q
 from django.utils import timezone
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema
@@ -24,7 +25,8 @@ from rest_framework.response import Response
 
 from tenants.permissions import require_subscription_feature
 
-from .models import CallLog, InboundRoute
+from . import call_rollups
+from .models import InboundRoute
 
 
 # ---------------------------------------------------------------------------
@@ -75,9 +77,40 @@ def _parse_range(range_str: str | None) -> Tuple[datetime, datetime]:
     return start, now
 
 
-def _answered_durations_filter() -> Q:
-    """Filter for answered calls with a non-null duration — used for talk time."""
-    return Q(status__in=['answered', 'ended', 'transferred']) & Q(duration__isnull=False)
+def _to_seconds(d) -> int:
+    if not d:
+        return 0
+    return int(d.total_seconds())
+
+
+def _average_seconds(total, count) -> int:
+    return _to_seconds(total / count) if count else 0
+
+
+def _users_by_id(user_ids) -> dict:
+    return {
+        row['id']: row
+        for row in get_user_model().objects.filter(id__in=list(user_ids)).values(
+            'id', 'first_name', 'last_name', 'email',
+        )
+    }
+
+
+def _user_fields(user_id, users: dict) -> dict:
+    user = users.get(user_id) or {}
+    full_name = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+    return {
+        'user_id': user_id,
+        'user_name': full_name or user.get('email'),
+        'user_email': user.get('email'),
+    }
+
+
+def _peak(rows: dict):
+    """Key with the most calls (lowest key on ties), or ``None``."""
+    if not rows:
+        return None
+    return min(rows, key=lambda key: (-rows[key]['total_calls'], key))
 
 
 # ---------------------------------------------------------------------------
@@ -123,48 +156,20 @@ def users_stats(request):
         assert parsed is not None  # Guaranteed by strftime above.
         start, end = parsed
 
-    queryset = (
-        CallLog.objects
-        .filter(started_at__gte=start, started_at__lt=end, handled_by__isnull=False)
-        .values('handled_by')
-        .annotate(
-            answered_count=Count('id', filter=Q(status__in=['answered', 'ended', 'transferred']) & Q(direction='inbound')),
-            missed_count=Count('id', filter=Q(status__in=['missed', 'no_answer']) & Q(direction='inbound')),
-            outbound_count=Count('id', filter=Q(direction='outbound')),
-            total_talk_seconds=Sum('duration', filter=_answered_durations_filter()),
-            avg_talk_seconds=Avg('duration', filter=_answered_durations_filter()),
-            user_first_name=F('handled_by__first_name'),
-            user_last_name=F('handled_by__last_name'),
-            user_email=F('handled_by__email'),
-        )
-        .order_by('-total_talk_seconds')
-    )
-
-    def _to_seconds(d):
-        if d is None:
-            return 0
-        # ``Sum``/``Avg`` over a DurationField returns a timedelta on Postgres.
-        if isinstance(d, timedelta):
-            return int(d.total_seconds())
-        # Some backends return microseconds as an int.
-        try:
-            return int(d) // 1_000_000
-        except (TypeError, ValueError):
-            return 0
+    rows = call_rollups.summarize(start, end, Q(handled_by__isnull=False), group_by='user')
+    users = _users_by_id(rows)
 
     data = []
-    for row in queryset:
-        full_name = f"{row['user_first_name'] or ''} {row['user_last_name'] or ''}".strip()
+    for user_id, row in rows.items():
         data.append({
-            'user_id': row['handled_by'],
-            'user_name': full_name or row['user_email'],
-            'user_email': row['user_email'],
-            'answered_count': row['answered_count'],
-            'missed_count': row['missed_count'],
-            'outbound_count': row['outbound_count'],
-            'total_talk_seconds': _to_seconds(row['total_talk_seconds']),
-            'avg_talk_seconds': _to_seconds(row['avg_talk_seconds']),
+            **_user_fields(user_id, users),
+            'answered_count': row['answered_inbound'],
+            'missed_count': row['missed_inbound'],
+            'outbound_count': row['outbound_calls'],
+            'total_talk_seconds': _to_seconds(row['talk_duration']),
+            'avg_talk_seconds': _average_seconds(row['talk_duration'], row['talk_count']),
         })
+    data.sort(key=lambda item: item['total_talk_seconds'], reverse=True)
 
     return Response({
         'month': month_str or start.strftime('%Y-%m'),
@@ -212,41 +217,18 @@ def user_timeline(request, user_id: int):
         assert parsed is not None
         start, end = parsed
 
-    queryset = (
-        CallLog.objects
-        .filter(handled_by_id=user_id, started_at__gte=start, started_at__lt=end)
-        .annotate(day=TruncDate('started_at'))
-        .values('day')
-        .annotate(
-            total_calls=Count('id'),
-            answered_count=Count('id', filter=Q(status__in=['answered', 'ended', 'transferred']) & Q(direction='inbound')),
-            missed_count=Count('id', filter=Q(status__in=['missed', 'no_answer']) & Q(direction='inbound')),
-            outbound_count=Count('id', filter=Q(direction='outbound')),
-            total_talk_seconds=Sum('duration', filter=_answered_durations_filter()),
-        )
-        .order_by('day')
-    )
-
-    def _to_seconds(d):
-        if d is None:
-            return 0
-        if isinstance(d, timedelta):
-            return int(d.total_seconds())
-        try:
-            return int(d) // 1_000_000
-        except (TypeError, ValueError):
-            return 0
+    rows = call_rollups.summarize(start, end, Q(handled_by_id=user_id), group_by='day')
 
     buckets = [
         {
-            'day': row['day'].isoformat() if row['day'] else None,
+            'day': day.isoformat() if day else None,
             'total_calls': row['total_calls'],
-            'answered_count': row['answered_count'],
-            'missed_count': row['missed_count'],
-            'outbound_count': row['outbound_count'],
-            'total_talk_seconds': _to_seconds(row['total_talk_seconds']),
+            'answered_count': row['answered_inbound'],
+            'missed_count': row['missed_inbound'],
+            'outbound_count': row['outbound_calls'],
+            'total_talk_seconds': _to_seconds(row['talk_duration']),
         }
-        for row in queryset
+        for day, row in sorted(rows.items())
     ]
 
     return Response({
@@ -313,48 +295,14 @@ def queue_stats(request):
         .values_list('did', flat=True)
     )
 
-    base_qs = CallLog.objects.filter(
-        started_at__gte=start, started_at__lt=end,
-        direction='inbound',
-    )
     if dids:
-        base_qs = base_qs.filter(recipient_number__in=dids)
+        queue_calls = Q(direction='inbound', recipient_number__in=dids)
+        summary = call_rollups.summarize(start, end, queue_calls)[None]
+        # Peak hour — local hour of day with the most calls.
+        peak_hour = _peak(call_rollups.summarize(start, end, queue_calls, group_by='hour'))
     else:
-        base_qs = base_qs.none()
-
-    # Wait time = answered_at - started_at (seconds)
-    wait_seconds_expr = (F('answered_at') - F('started_at'))
-
-    summary = base_qs.aggregate(
-        total_calls=Count('id'),
-        answered_count=Count('id', filter=Q(status__in=['answered', 'ended', 'transferred'])),
-        abandoned_count=Count('id', filter=Q(status__in=['missed', 'no_answer'])),
-        avg_wait_interval=Avg(
-            wait_seconds_expr,
-            filter=Q(answered_at__isnull=False),
-        ),
-    )
-
-    # Peak hour — DB-side EXTRACT(HOUR FROM started_at).
-    hour_rows = (
-        base_qs
-        .annotate(hour=ExtractHour('started_at'))
-        .values('hour')
-        .annotate(count=Count('id'))
-        .order_by('-count', 'hour')
-    )
-    peak_hour = hour_rows[0]['hour'] if hour_rows else None
-
-    avg_wait_interval = summary.get('avg_wait_interval')
-    if isinstance(avg_wait_interval, timedelta):
-        avg_wait_seconds = int(avg_wait_interval.total_seconds())
-    elif avg_wait_interval is None:
-        avg_wait_seconds = 0
-    else:
-        try:
-            avg_wait_seconds = int(avg_wait_interval) // 1_000_000
-        except (TypeError, ValueError):
-            avg_wait_seconds = 0
+        summary = call_rollups.empty_metrics()
+        peak_hour = None
 
     return Response({
         'queue_id': queue_id,
@@ -362,10 +310,10 @@ def queue_stats(request):
         'start': start.isoformat(),
         'end': end.isoformat(),
         'matched_dids': dids,
-        'total_calls': summary['total_calls'] or 0,
-        'answered_count': summary['answered_count'] or 0,
-        'abandoned_count': summary['abandoned_count'] or 0,
-        'avg_wait_seconds': avg_wait_seconds,
+        'total_calls': summary['total_calls'],
+        'answered_count': summary['answered_calls'],
+        'abandoned_count': summary['missed_calls'],
+        'avg_wait_seconds': _average_seconds(summary['wait_duration'], summary['wait_count']),
         'peak_hour': peak_hour,
     })
 
@@ -397,94 +345,41 @@ def overview_stats(request):
     range_str = request.query_params.get('range', 'month')
     start, end = _parse_range(range_str)
 
-    base_qs = CallLog.objects.filter(started_at__gte=start, started_at__lt=end)
-
-    summary = base_qs.aggregate(
-        total_calls=Count('id'),
-        answered_calls=Count('id', filter=Q(status__in=['answered', 'ended', 'transferred'])),
-        missed_calls=Count('id', filter=Q(status__in=['missed', 'no_answer'])),
-        inbound_calls=Count('id', filter=Q(direction='inbound')),
-        outbound_calls=Count('id', filter=Q(direction='outbound')),
-        avg_talk_seconds_raw=Avg('duration', filter=_answered_durations_filter()),
-    )
-
-    avg_talk_raw = summary.get('avg_talk_seconds_raw')
-    if isinstance(avg_talk_raw, timedelta):
-        avg_talk_seconds = int(avg_talk_raw.total_seconds())
-    elif avg_talk_raw is None:
-        avg_talk_seconds = 0
-    else:
-        try:
-            avg_talk_seconds = int(avg_talk_raw) // 1_000_000
-        except (TypeError, ValueError):
-            avg_talk_seconds = 0
+    summary = call_rollups.summarize(start, end)[None]
 
     # Busiest hour (0–23)
-    hour_rows = list(
-        base_qs.annotate(hour=ExtractHour('started_at'))
-        .values('hour')
-        .annotate(count=Count('id'))
-        .order_by('-count', 'hour')
-    )
-    busiest_hour = hour_rows[0]['hour'] if hour_rows else None
+    busiest_hour = _peak(call_rollups.summarize(start, end, group_by='hour'))
 
     # Busiest weekday — ISO weekday: 1=Monday..7=Sunday. Convert to 0..6 (Mon..Sun).
-    weekday_rows = list(
-        base_qs.annotate(iso_weekday=ExtractIsoWeekDay('started_at'))
-        .values('iso_weekday')
-        .annotate(count=Count('id'))
-        .order_by('-count', 'iso_weekday')
-    )
-    busiest_weekday = (weekday_rows[0]['iso_weekday'] - 1) if weekday_rows else None
+    busiest_iso_weekday = _peak(call_rollups.summarize(start, end, group_by='weekday'))
+    busiest_weekday = (busiest_iso_weekday - 1) if busiest_iso_weekday else None
 
     # Top 5 users by total talk time (reuse the per-user aggregate shape).
-    top_rows = (
-        base_qs
-        .filter(handled_by__isnull=False)
-        .values('handled_by')
-        .annotate(
-            total_talk_seconds=Sum('duration', filter=_answered_durations_filter()),
-            answered_count=Count('id', filter=Q(status__in=['answered', 'ended', 'transferred']) & Q(direction='inbound')),
-            outbound_count=Count('id', filter=Q(direction='outbound')),
-            user_first_name=F('handled_by__first_name'),
-            user_last_name=F('handled_by__last_name'),
-            user_email=F('handled_by__email'),
-        )
-        .order_by(F('total_talk_seconds').desc(nulls_last=True))[:5]
-    )
-
-    def _to_seconds(d):
-        if d is None:
-            return 0
-        if isinstance(d, timedelta):
-            return int(d.total_seconds())
-        try:
-            return int(d) // 1_000_000
-        except (TypeError, ValueError):
-            return 0
-
-    top_5_users = []
-    for row in top_rows:
-        full_name = f"{row['user_first_name'] or ''} {row['user_last_name'] or ''}".strip()
-        top_5_users.append({
-            'user_id': row['handled_by'],
-            'user_name': full_name or row['user_email'],
-            'user_email': row['user_email'],
-            'answered_count': row['answered_count'],
-            'outbound_count': row['outbound_count'],
-            'total_talk_seconds': _to_seconds(row['total_talk_seconds']),
-        })
+    user_rows = call_rollups.summarize(start, end, Q(handled_by__isnull=False), group_by='user')
+    top_ids = sorted(
+        user_rows, key=lambda user_id: user_rows[user_id]['talk_duration'], reverse=True,
+    )[:5]
+    users = _users_by_id(top_ids)
+    top_5_users = [
+        {
+            **_user_fields(user_id, users),
+            'answered_count': user_rows[user_id]['answered_inbound'],
+            'outbound_count': user_rows[user_id]['outbound_calls'],
+            'total_talk_seconds': _to_seconds(user_rows[user_id]['talk_duration']),
+        }
+        for user_id in top_ids
+    ]
 
     return Response({
         'range': range_str,
         'start': start.isoformat(),
         'end': end.isoformat(),
-        'total_calls': summary['total_calls'] or 0,
-        'answered_calls': summary['answered_calls'] or 0,
-        'missed_calls': summary['missed_calls'] or 0,
-        'inbound_calls': summary['inbound_calls'] or 0,
-        'outbound_calls': summary['outbound_calls'] or 0,
-        'avg_talk_seconds': avg_talk_seconds,
+        'total_calls': summary['total_calls'],
+        'answered_calls': summary['answered_calls'],
+        'missed_calls': summary['missed_calls'],
+        'inbound_calls': summary['inbound_calls'],
+        'outbound_calls': summary['outbound_calls'],
+        'avg_talk_seconds': _average_seconds(summary['talk_duration'], summary['talk_count']),
         'busiest_hour': busiest_hour,
         'busiest_weekday': busiest_weekday,
         'top_5_users': top_5_users,
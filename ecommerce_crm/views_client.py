@@ -1589,9 +1589,9 @@ def get_store_theme(request):
     try:
         from django.db import connection as _db_connection
         from widget_registry.models import WidgetConnection
-        from social_integrations.models import SocialIntegrationSettings
+        from social_integrations.settings_cache import get_settings
 
-        social = SocialIntegrationSettings.objects.first()
+        social = get_settings()
         if social and getattr(social, 'widget_enabled', False):
             conn = (
                 WidgetConnection.objects
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class SocialIntegrationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'social_integrations'
\ No newline at end of file
+    name = 'social_integrations'
+
+    def ready(self):
+        # Widget polling ETags and rating rollups follow model writes.
+        from . import signals  # noqa: F401
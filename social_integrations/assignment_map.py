@@ -0,0 +1,188 @@
+"""Per-tenant map of live chat assignments, held in Redis.
+
+Every inbound webhook message asks "who owns this conversation?", and the
+unified inbox asks the same question for each conversation it lists. Both
+used to query ``ChatAssignment`` for the answer. Now one hash per tenant,
+``chat_assign:<schema>``, answers it:
+
+* fields are ``platform|account_id|conversation_id`` and values are the
+  assigned user id. Only ``active``/``in_session`` assignments with a user
+  have a field, so a missing field means "unassigned";
+* the ``__ready__`` field marks a fully loaded map. Without it (first use,
+  expiry, Redis flush), readers go to the database and load the whole map
+  in one query;
+* ``post_save``/``post_delete`` on ``ChatAssignment`` apply each change after
+  commit and bump ``chat_assign_gen:<schema>``. A load only installs its
+  snapshot if the generation hasn't moved since it started reading, so a
+  change that commits mid-load can never be overwritten with stale data;
+* ``QuerySet.update`` skips signals, so call sites that use it call
+  :func:`forget` themselves. ``MAP_TTL`` bounds any drift that still slips
+  through.
+
+With Redis unavailable every reader falls back to the database.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import connection, transaction
+
+from amanati_crm.redis_utils import decode, get_redis
+
+from .models import ChatAssignment
+
+logger = logging.getLogger(__name__)
+
+MAP_KEY = 'chat_assign:{schema}'
+GEN_KEY = 'chat_assign_gen:{schema}'
+READY_FIELD = '__ready__'
+MAP_TTL = 60 * 60 * 6
+
+LIVE_STATUSES = ('active', 'in_session')
+
+Key = Tuple[str, str, str]
+
+# KEYS[1] map, KEYS[2] generation; ARGV: expected generation, ttl, then
+# field/value pairs. Installs the snapshot only if no change landed meanwhile.
+_LOAD = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS[1] map, KEYS[2] generation; ARGV: field, user id ('' to remove).
+# A map that isn't loaded is left alone; the next reader loads it fresh.
+_APPLY = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if ARGV[2] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    else
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    end
+end
+redis.call('INCR', KEYS[2])
+return 1
+"""
+
+
+def _field(platform: str, account_id, conversation_id) -> str:
+    return f'{platform}|{account_id}|{conversation_id}'
+
+
+def _live_assignments():
+    return ChatAssignment.objects.filter(status__in=LIVE_STATUSES, assigned_user__isnull=False)
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def _load(redis, schema: str) -> Dict[Key, int]:
+    """Read every live assignment from the DB and install it as the map."""
+    gen = decode(redis.get(GEN_KEY.format(schema=schema))) or '0'
+    rows = list(_live_assignments().values_list('platform', 'account_id', 'conversation_id', 'assigned_user_id'))
+    args = [gen, MAP_TTL]
+    for platform, account_id, conversation_id, user_id in rows:
+        args.extend([_field(platform, account_id, conversation_id), user_id])
+    args.extend([READY_FIELD, 1])
+    redis.eval(_LOAD, 2, MAP_KEY.format(schema=schema), GEN_KEY.format(schema=schema), *args)
+    return {(platform, account_id, conversation_id): user_id for platform, account_id, conversation_id, user_id in rows}
+
+
+def lookup(platform: str, conversation_id, account_id) -> Optional[int]:
+    """User id the conversation is assigned to, or ``None``. One HMGET when warm."""
+    schema = connection.schema_name
+    field = _field(platform, account_id, conversation_id)
+    try:
+        redis = get_redis()
+        value, ready = redis.hmget(MAP_KEY.format(schema=schema), [field, READY_FIELD])
+        if ready is not None:
+            return int(value) if value is not None else None
+        return _load(redis, schema).get((platform, str(account_id), str(conversation_id)))
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Chat assignment map unavailable, reading from DB: %s', exc)
+    return (
+        _live_assignments()
+        .filter(platform=platform, conversation_id=conversation_id, account_id=account_id)
+        .values_list('assigned_user_id', flat=True)
+        .first()
+    )
+
+
+def assigned_users(platforms: Optional[Iterable[str]] = None) -> Dict[Key, int]:
+    """``{(platform, account_id, conversation_id): user_id}`` for live assignments."""
+    platforms = set(platforms) if platforms is not None else None
+    schema = connection.schema_name
+    try:
+        redis = get_redis()
+        raw = redis.hgetall(MAP_KEY.format(schema=schema))
+        if raw:
+            entries = {decode(field): decode(value) for field, value in raw.items()}
+            if READY_FIELD in entries:
+                result = {}
+                for field, user_id in entries.items():
+                    if field == READY_FIELD:
+                        continue
+                    platform, account_id, conversation_id = field.split('|', 2)
+                    if platforms is None or platform in platforms:
+                        result[(platform, account_id, conversation_id)] = int(user_id)
+                return result
+        assignments = _load(redis, schema)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Chat assignment map unavailable, reading from DB: %s', exc)
+        assignments = {
+            (platform, account_id, conversation_id): user_id
+            for platform, account_id, conversation_id, user_id in _live_assignments().values_list(
+                'platform', 'account_id', 'conversation_id', 'assigned_user_id',
+            )
+        }
+    if platforms is None:
+        return assignments
+    return {key: user_id for key, user_id in assignments.items() if key[0] in platforms}
+
+
+# ---------------------------------------------------------------------------
+# Writes
+# ---------------------------------------------------------------------------
+
+def _apply_now(schema: str, field: str, user_id: Optional[int]) -> None:
+    try:
+        get_redis().eval(
+            _APPLY, 2, MAP_KEY.format(schema=schema), GEN_KEY.format(schema=schema),
+            field, '' if user_id is None else user_id,
+        )
+    except Exception as exc:  # noqa: BLE001
+        # The change is committed but the map missed it; drop the map so the
+        # next reader reloads it instead of serving the stale entry.
+        logger.warning('Chat assignment map update failed for %s: %s', field, exc)
+        try:
+            get_redis().delete(MAP_KEY.format(schema=schema))
+        except Exception:  # noqa: BLE001
+            pass
+
+
+def _apply(platform: str, conversation_id, account_id, user_id: Optional[int]) -> None:
+    schema = connection.schema_name
+    field = _field(platform, account_id, conversation_id)
+    transaction.on_commit(lambda: _apply_now(schema, field, user_id))
+
+
+def record(assignment: ChatAssignment) -> None:
+    """Reflect a saved assignment once the transaction commits."""
+    live = assignment.status in LIVE_STATUSES and assignment.assigned_user_id
+    _apply(
+        assignment.platform, assignment.conversation_id, assignment.account_id,
+        assignment.assigned_user_id if live else None,
+    )
+
+
+def forget(platform: str, conversation_id, account_id) -> None:
+    """Mark the conversation unassigned once the transaction commits."""
+    _apply(platform, conversation_id, account_id, None)
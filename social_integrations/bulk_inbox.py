@@ -0,0 +1,293 @@
+"""Set-based bulk inbox operations: archive-all and mark-all-read.
+
+Both used to walk every connection and every distinct sender in Python. Here
+each platform is one ``INSERT ... SELECT DISTINCT ... ON CONFLICT DO NOTHING``
+into ``ConversationArchive`` plus one ``UPDATE`` per message model, so the
+query count no longer grows with the size of the inbox.
+
+For very large tenants the same work can run as a Celery job
+(:func:`start_job`); progress is kept in the cache under a job id and read
+back by the ``bulk-jobs/<job_id>/`` status endpoint.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from typing import Iterable, List, Optional
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import CharField, Exists, F, Func, OuterRef, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import widget_poll
+from .models import (
+    ChatAssignment, ConversationArchive, EmailMessage, FacebookMessage,
+    InstagramMessage, WhatsAppMessage, WidgetMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+READ_PLATFORMS = ('facebook', 'instagram', 'whatsapp', 'email', 'widget')
+# Widget sessions are closed by visitors/agents, never bulk-archived.
+ARCHIVE_PLATFORMS = ('facebook', 'instagram', 'whatsapp', 'email')
+
+JOB_TTL = 60 * 60
+JOB_CACHE_PREFIX = 'social_bulk_job'
+
+
+def parse_platforms(platform_param: str) -> List[str]:
+    """``"all"`` / ``"facebook,instagram"`` -> the list of platforms asked for."""
+    return [p.strip() for p in (platform_param or 'all').lower().split(',') if p.strip()]
+
+
+def _selected(platforms: Iterable[str], supported) -> List[str]:
+    platforms = list(platforms)
+    if 'all' in platforms:
+        return list(supported)
+    return [p for p in supported if p in platforms]
+
+
+def broadcast_platforms(platforms: Iterable[str]) -> List[str]:
+    """Platforms that get a bulk WS frame (``conversation_id=None``)."""
+    platforms = list(platforms)
+    return [p for p in platforms if p != 'all'] or (list(READ_PLATFORMS) if 'all' in platforms else [])
+
+
+# ---------------------------------------------------------------------------
+# Mark-all-read
+# ---------------------------------------------------------------------------
+
+def _unread_inbound(platform: str):
+    if platform == 'facebook':
+        return FacebookMessage.objects.filter(is_from_page=False, is_read_by_staff=False)
+    if platform == 'instagram':
+        return InstagramMessage.objects.filter(is_from_business=False, is_read_by_staff=False)
+    if platform == 'whatsapp':
+        return WhatsAppMessage.objects.filter(is_from_business=False, is_read_by_staff=False)
+    if platform == 'email':
+        return EmailMessage.objects.filter(is_from_business=False, is_read_by_staff=False)
+    if platform == 'widget':
+        return WidgetMessage.objects.filter(is_from_visitor=True, is_read_by_staff=False)
+    raise ValueError(f'Unknown platform: {platform}')
+
+
+def mark_platform_read(platform: str, now=None) -> int:
+    """One ``UPDATE`` marking every unread inbound message on ``platform`` read."""
+    now = now or timezone.now()
+    qs = _unread_inbound(platform)
+    if platform != 'widget':
+        return qs.update(is_read_by_staff=True, read_by_staff_at=now)
+    # Visitors see staff read receipts, so their polling ETags must move too.
+    session_ids = set(qs.values_list('session__session_id', flat=True).distinct())
+    count = qs.update(is_read_by_staff=True, read_by_staff_at=now)
+    for session_id in session_ids:
+        widget_poll.bump(session_id)
+    return count
+
+
+def mark_all_read(platforms: Iterable[str], now=None, supported=READ_PLATFORMS) -> int:
+    now = now or timezone.now()
+    total = 0
+    for platform in _selected(platforms, supported):
+        count = mark_platform_read(platform, now)
+        logger.info('Marked %s %s messages as read', count, platform)
+        total += count
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Archive-all
+# ---------------------------------------------------------------------------
+
+def _conversation_keys(platform: str):
+    """A ``values('conv_id', 'acct_id').distinct()`` queryset of archivable conversations.
+
+    Mirrors the keys the conversation list uses: sender id / page id for
+    Meta channels, ``+``-stripped phone / WABA id for WhatsApp and
+    thread id / connection pk for INBOX email threads. Conversations with
+    an in-session assignment are left alone.
+    """
+    if platform == 'facebook':
+        qs = FacebookMessage.objects.filter(page_connection__is_active=True, is_deleted=False).annotate(
+            conv_id=F('sender_id'), acct_id=F('page_connection__page_id'),
+        )
+    elif platform == 'instagram':
+        qs = InstagramMessage.objects.filter(account_connection__is_active=True, is_deleted=False).annotate(
+            conv_id=F('sender_id'), acct_id=F('account_connection__instagram_account_id'),
+        )
+    elif platform == 'whatsapp':
+        qs = WhatsAppMessage.objects.filter(business_account__is_active=True, is_deleted=False).annotate(
+            conv_id=Func(F('from_number'), Value('+'), function='LTRIM', output_field=CharField()),
+            acct_id=F('business_account__waba_id'),
+        )
+    elif platform == 'email':
+        qs = EmailMessage.objects.filter(connection__is_active=True, is_deleted=False, folder='INBOX').annotate(
+            conv_id=F('thread_id'), acct_id=Cast('connection_id', output_field=CharField()),
+        )
+    else:
+        raise ValueError(f'Platform cannot be bulk-archived: {platform}')
+
+    in_session = ChatAssignment.objects.filter(
+        status='in_session',
+        platform=platform,
+        conversation_id=OuterRef('conv_id'),
+        account_id=OuterRef('acct_id'),
+    )
+    return qs.filter(~Exists(in_session)).order_by().values('conv_id', 'acct_id').distinct()
+
+
+def archive_platform(platform: str, archived_by_id: Optional[int] = None, now=None) -> int:
+    """Archive every conversation on ``platform`` in a single statement.
+
+    Returns the number of archive rows actually inserted; conversations that
+    were already archived hit ``ON CONFLICT DO NOTHING`` and are not counted.
+    """
+    now = now or timezone.now()
+    select_sql, select_params = _conversation_keys(platform).query.sql_with_params()
+    table = connection.ops.quote_name(ConversationArchive._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} (platform, conversation_id, account_id, archived_by_id, archived_at) '
+        f'SELECT %s, src.conv_id, src.acct_id, %s, %s FROM ({select_sql}) AS src '
+        f'WHERE src.conv_id IS NOT NULL '
+        f'ON CONFLICT (platform, conversation_id, account_id) DO NOTHING'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [platform, archived_by_id, now, *select_params])
+        return max(cursor.rowcount, 0)
+
+
+def archive_all(platforms: Iterable[str], archived_by_id: Optional[int] = None, now=None,
+                progress=None) -> dict:
+    """Archive and mark read everything on ``platforms``.
+
+    ``progress`` is called as ``progress(platform, archived, marked_read)``
+    after each platform commits, which is what the async job reports.
+    """
+    now = now or timezone.now()
+    archived_count = 0
+    messages_marked_read = 0
+    for platform in _selected(platforms, ARCHIVE_PLATFORMS):
+        with transaction.atomic():
+            archived = archive_platform(platform, archived_by_id, now)
+            marked = mark_platform_read(platform, now)
+        archived_count += archived
+        messages_marked_read += marked
+        logger.info('Archived %s %s conversations, marked %s messages read', archived, platform, marked)
+        if progress:
+            progress(platform, archived, marked)
+    return {'archived_count': archived_count, 'messages_marked_read': messages_marked_read}
+
+
+# ---------------------------------------------------------------------------
+# Broadcasts
+# ---------------------------------------------------------------------------
+
+def broadcast_bulk(operation: str, platforms: Iterable[str], now, by_user_id=None,
+                   tenant_schema: Optional[str] = None) -> None:
+    """One ``conversation_id=None`` frame per touched platform; never raises."""
+    from .consumers import send_archive_update, send_read_state_update
+
+    tenant_schema = tenant_schema or connection.schema_name
+    for platform in broadcast_platforms(platforms):
+        try:
+            if operation == 'archive_all':
+                async_to_sync(send_archive_update)(
+                    tenant_schema,
+                    platform=platform,
+                    conversation_id=None,
+                    account_id=None,
+                    archived=True,
+                    archived_at=now.isoformat(),
+                    by_user_id=by_user_id,
+                )
+            else:
+                async_to_sync(send_read_state_update)(
+                    tenant_schema,
+                    platform=platform,
+                    conversation_id=None,
+                    account_id=None,
+                    unread_count=0,
+                    last_read_at=now.isoformat(),
+                    by_user_id=by_user_id,
+                )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('%s broadcast failed for %s: %s', operation, platform, exc)
+
+
+# ---------------------------------------------------------------------------
+# Async jobs
+# ---------------------------------------------------------------------------
+
+def _job_key(tenant_schema: str, job_id: str) -> str:
+    return f'{JOB_CACHE_PREFIX}:{tenant_schema}:{job_id}'
+
+
+def get_job(tenant_schema: str, job_id: str) -> Optional[dict]:
+    return cache.get(_job_key(tenant_schema, job_id))
+
+
+def _save_job(tenant_schema: str, job: dict) -> None:
+    job['updated_at'] = timezone.now().isoformat()
+    cache.set(_job_key(tenant_schema, job['job_id']), job, JOB_TTL)
+
+
+def start_job(operation: str, platforms: List[str], user_id: Optional[int]) -> dict:
+    """Record a pending job and hand it to Celery. Returns the initial job state."""
+    from .tasks import run_bulk_inbox_job
+
+    tenant_schema = connection.schema_name
+    supported = ARCHIVE_PLATFORMS if operation == 'archive_all' else READ_PLATFORMS
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'operation': operation,
+        'status': 'pending',
+        'platforms': platforms,
+        'total_steps': len(_selected(platforms, supported)),
+        'completed_steps': 0,
+        'archived_count': 0,
+        'messages_marked_read': 0,
+        'error': None,
+    }
+    _save_job(tenant_schema, job)
+    run_bulk_inbox_job.delay(tenant_schema, job['job_id'], operation, platforms, user_id)
+    return job
+
+
+def run_job(tenant_schema: str, job_id: str, operation: str, platforms: List[str],
+            user_id: Optional[int]) -> dict:
+    """Body of the Celery task; expects to already be inside ``schema_context``."""
+    job = get_job(tenant_schema, job_id) or {
+        'job_id': job_id, 'operation': operation, 'platforms': platforms,
+        'completed_steps': 0, 'archived_count': 0, 'messages_marked_read': 0, 'error': None,
+    }
+    job['status'] = 'running'
+    _save_job(tenant_schema, job)
+
+    def progress(platform, archived, marked):
+        job['completed_steps'] += 1
+        job['current_platform'] = platform
+        job['archived_count'] += archived
+        job['messages_marked_read'] += marked
+        _save_job(tenant_schema, job)
+
+    now = timezone.now()
+    try:
+        if operation == 'archive_all':
+            archive_all(platforms, user_id, now, progress=progress)
+        else:
+            for platform in _selected(platforms, READ_PLATFORMS):
+                progress(platform, 0, mark_platform_read(platform, now))
+    except Exception as exc:
+        logger.exception('Bulk inbox job %s (%s) failed', job_id, operation)
+        job['status'] = 'failed'
+        job['error'] = str(exc)
+        _save_job(tenant_schema, job)
+        raise
+
+    job['status'] = 'completed'
+    _save_job(tenant_schema, job)
+    broadcast_bulk(operation, platforms, now, by_user_id=user_id, tenant_schema=tenant_schema)
+    return job
@@ -4,6 +4,9 @@ WebSocket consumers for real-time messaging functionality.
 
 import json
 import asyncio
+import hashlib
+import re
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
@@ -11,6 +14,49 @@ from tenant_schemas.utils import schema_context
 from .models import FacebookMessage, FacebookPageConnection
 
 
+# ---------------------------------------------------------------------------
+# Channel-layer group names for the messages socket.
+#
+# ``messages_<tenant>``            every agent: tenant-wide control events
+#                                  (assignment/read/archive) and new messages
+#                                  on *unassigned* conversations (the inbox).
+# ``messages_<tenant>_all``        agents in the default "all" delivery scope:
+#                                  also receive messages on conversations
+#                                  assigned to someone else.
+# ``messages_<tenant>_user_<id>``  messages on conversations assigned to <id>.
+# ``conversation_<tenant>_<conv>`` whoever currently has <conv> open.
+#
+# Agents that switch to the "assigned" scope leave ``_all`` so Redis only
+# fans a message out to the assignee plus the people looking at it.
+# ---------------------------------------------------------------------------
+DELIVERY_SCOPE_ALL = 'all'
+DELIVERY_SCOPE_ASSIGNED = 'assigned'
+
+# Channels only accepts [A-Za-z0-9_.-] group names shorter than 100 chars.
+_GROUP_UNSAFE = re.compile(r'[^0-9A-Za-z_.-]')
+_GROUP_MAX_LEN = 99
+
+
+def tenant_messages_group(tenant_schema):
+    return f'messages_{tenant_schema}'
+
+
+def all_messages_group(tenant_schema):
+    return f'messages_{tenant_schema}_all'
+
+
+def user_messages_group(tenant_schema, user_id):
+    return f'messages_{tenant_schema}_user_{user_id}'
+
+
+def conversation_group(tenant_schema, conversation_id):
+    name = f'conversation_{tenant_schema}_{_GROUP_UNSAFE.sub("-", str(conversation_id))}'
+    if len(name) > _GROUP_MAX_LEN:
+        digest = hashlib.sha1(str(conversation_id).encode()).hexdigest()[:24]
+        name = f'conversation_{tenant_schema}_{digest}'
+    return name
+
+
 class MessagesConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for real-time message updates.
@@ -26,12 +72,20 @@ class MessagesConsumer(AsyncWebsocketConsumer):
         print(f"[WebSocket] Connection attempt - User: {self.user}, Tenant: {self.tenant_schema}")
         
         # Join the messages group for this tenant
-        self.messages_group_name = f'messages_{self.tenant_schema}'
+        self.messages_group_name = tenant_messages_group(self.tenant_schema)
+        self.conversation_groups = set()
+        self.delivery_scope = None
         
         await self.channel_layer.group_add(
             self.messages_group_name,
             self.channel_name
         )
+        if not self.user.is_anonymous:
+            self.user_group_name = user_messages_group(self.tenant_schema, self.user.id)
+            await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+
+        query = parse_qs((self.scope.get('query_string') or b'').decode())
+        await self._set_delivery_scope((query.get('scope') or [DELIVERY_SCOPE_ALL])[0])
         
         await self.accept()
         
@@ -40,18 +94,38 @@ class MessagesConsumer(AsyncWebsocketConsumer):
             'type': 'connection',
             'status': 'connected',
             'tenant': self.tenant_schema,
-            'user_authenticated': not self.user.is_anonymous
+            'user_authenticated': not self.user.is_anonymous,
+            'delivery_scope': self.delivery_scope,
         }))
         
         print(f"[WebSocket] Connected successfully for tenant: {self.tenant_schema}")
     
     async def disconnect(self, close_code):
-        # Leave the messages group
-        if hasattr(self, 'messages_group_name'):
-            await self.channel_layer.group_discard(
-                self.messages_group_name,
-                self.channel_name
-            )
+        # Leave every group this socket joined
+        groups = set(getattr(self, 'conversation_groups', set()))
+        for attr in ('messages_group_name', 'user_group_name'):
+            if hasattr(self, attr):
+                groups.add(getattr(self, attr))
+        if getattr(self, 'delivery_scope', None) == DELIVERY_SCOPE_ALL:
+            groups.add(all_messages_group(self.tenant_schema))
+        for group in groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def _set_delivery_scope(self, scope):
+        """Switch between receiving every assigned chat (``all``) or only our own.
+
+        Anonymous sockets have no user group, so they always stay on ``all``.
+        """
+        if scope != DELIVERY_SCOPE_ASSIGNED or self.user.is_anonymous:
+            scope = DELIVERY_SCOPE_ALL
+        if scope == self.delivery_scope:
+            return
+        group = all_messages_group(self.tenant_schema)
+        if scope == DELIVERY_SCOPE_ALL:
+            await self.channel_layer.group_add(group, self.channel_name)
+        elif self.delivery_scope is not None:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.delivery_scope = scope
     
     async def receive(self, text_data):
         """Handle incoming WebSocket messages from client"""
@@ -66,15 +140,21 @@ class MessagesConsumer(AsyncWebsocketConsumer):
                     'timestamp': data.get('timestamp')
                 }))
             
+            elif message_type == 'set_delivery_scope':
+                await self._set_delivery_scope(data.get('scope'))
+                await self.send(text_data=json.dumps({
+                    'type': 'delivery_scope',
+                    'scope': self.delivery_scope,
+                }))
+            
             elif message_type == 'subscribe_conversation':
                 # Subscribe to specific conversation updates
                 conversation_id = data.get('conversation_id')
                 if conversation_id:
-                    self.conversation_group_name = f'conversation_{self.tenant_schema}_{conversation_id}'
-                    await self.channel_layer.group_add(
-                        self.conversation_group_name,
-                        self.channel_name
-                    )
+                    group = conversation_group(self.tenant_schema, conversation_id)
+                    if group not in self.conversation_groups:
+                        await self.channel_layer.group_add(group, self.channel_name)
+                        self.conversation_groups.add(group)
                     
                     await self.send(text_data=json.dumps({
                         'type': 'subscription',
@@ -85,11 +165,10 @@ class MessagesConsumer(AsyncWebsocketConsumer):
             elif message_type == 'unsubscribe_conversation':
                 # Unsubscribe from conversation updates
                 conversation_id = data.get('conversation_id')
-                if conversation_id and hasattr(self, 'conversation_group_name'):
-                    await self.channel_layer.group_discard(
-                        self.conversation_group_name,
-                        self.channel_name
-                    )
+                group = conversation_group(self.tenant_schema, conversation_id) if conversation_id else None
+                if group in self.conversation_groups:
+                    await self.channel_layer.group_discard(group, self.channel_name)
+                    self.conversation_groups.discard(group)
                     
                     await self.send(text_data=json.dumps({
                         'type': 'subscription',
@@ -103,9 +182,32 @@ class MessagesConsumer(AsyncWebsocketConsumer):
                 'message': 'Invalid JSON format'
             }))
     
+    def _is_duplicate(self, event):
+        """Whether another group already delivers this scoped event to this socket.
+
+        Events on an assigned conversation are published to the assignee,
+        the ``_all`` group and the conversation's viewers (see
+        :func:`send_scoped_event`); a socket may sit in several of them.
+        The ``_all`` copy wins, then the assignee copy.
+        """
+        audience = event.get('audience')
+        if audience is None or audience == 'all':
+            return False
+        if self.delivery_scope == DELIVERY_SCOPE_ALL:
+            return True
+        if audience == 'conversation':
+            assigned_user_id = event.get('assigned_user_id')
+            return (
+                not self.user.is_anonymous and assigned_user_id is not None
+                and str(assigned_user_id) == str(self.user.id)
+            )
+        return False
+
     # Handlers for messages sent from Django views/signals
     async def new_message(self, event):
         """Send new message to WebSocket"""
+        if self._is_duplicate(event):
+            return
         await self.send(text_data=json.dumps({
             'type': 'new_message',
             'message': event['message'],
@@ -123,6 +225,17 @@ class MessagesConsumer(AsyncWebsocketConsumer):
             'timestamp': event['timestamp']
         }))
     
+    async def message_status_batch(self, event):
+        """Delivery/read receipts for one conversation, collapsed per flush."""
+        await self.send(text_data=json.dumps({
+            'type': 'message_status_batch',
+            'platform': event.get('platform'),
+            'conversation_id': event.get('conversation_id'),
+            'account_id': event.get('account_id'),
+            'statuses': event.get('statuses', []),
+            'timestamp': event.get('timestamp'),
+        }))
+
     async def conversation_update(self, event):
         """Send conversation update to WebSocket"""
         await self.send(text_data=json.dumps({
@@ -141,7 +254,11 @@ class MessagesConsumer(AsyncWebsocketConsumer):
         consumers forward the event to their respective sockets — the agent
         UI uses this to refresh the conversation and mark the chat ended,
         the visitor iframe uses it to flip to the post-chat review form.
+        Assigned chats are published like new messages (see
+        :func:`send_scoped_event`).
         """
+        if self._is_duplicate(event):
+            return
         await self.send(text_data=json.dumps({
             'type': 'session_ended',
             'platform': 'widget',
@@ -212,8 +329,13 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
     - Messages sent by the client create a WidgetMessage row and broadcast to
       both the visitor's group AND the agent's `messages_<tenant_schema>` group
       (reused as-is from Facebook / WhatsApp / etc.).
+    - Visitor messages and pings go through the write-behind buffer in
+      ``widget_write_behind``; agents get the frame before the row exists.
     """
 
+    # Seconds between buffered last-seen heartbeats for one socket.
+    HEARTBEAT_INTERVAL = 30
+
     async def connect(self):
         self.token = self.scope['url_route']['kwargs']['token']
         self.session_id = self.scope['url_route']['kwargs']['session_id']
@@ -223,14 +345,22 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
             await self.close(code=4004)
             return
 
-        self.connection_id, self.tenant_schema, self.widget_connection_pk = resolved
+        self.connection_id, self.tenant_schema, self.widget_connection_pk, self.session_last_seen = resolved
+        self._last_heartbeat = 0.0
         # Match the pattern the rest of social messages uses: one broadcast
         # group per tenant (``messages_<tenant>``). The visitor's consumer
         # filters frames by session_id in new_message so only messages for
         # this session land on the iframe. No separate widget_visitor_*
         # group, no double broadcast, no double delivery.
-        self.tenant_group = f'messages_{self.tenant_schema}'
+        self.tenant_group = tenant_messages_group(self.tenant_schema)
         await self.channel_layer.group_add(self.tenant_group, self.channel_name)
+        # Once an agent picks the chat up, new messages are published to the
+        # assignee and the conversation group instead of the tenant group,
+        # so the visitor also listens on its own conversation group.
+        self.conversation_group = conversation_group(
+            self.tenant_schema, f"widget_{self.connection_id}_{self.session_id}"
+        )
+        await self.channel_layer.group_add(self.conversation_group, self.channel_name)
 
         # MUST accept the connection before sending any frames — Channels
         # silently drops `send()` calls until the handshake completes.
@@ -253,26 +383,30 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def _resolve(self):
-        """Validate token + session_id. Returns (connection_id, tenant_schema, pk) or None."""
-        from widget_registry.models import WidgetConnection
+        """Validate token + session_id.
+
+        Returns ``(connection_id, tenant_schema, pk, last_seen_at)`` or None.
+        """
         from .models import WidgetSession
-        from tenant_schemas.utils import schema_context, get_public_schema_name
+        from .widget_utils import resolve_widget_connection
+        from tenant_schemas.utils import schema_context
 
-        with schema_context(get_public_schema_name()):
-            try:
-                conn = WidgetConnection.objects.get(widget_token=self.token, is_active=True)
-            except WidgetConnection.DoesNotExist:
-                return None
-            conn_id = conn.id
-            conn_pk = conn.pk
-            tenant_schema = conn.tenant_schema
+        conn, err = resolve_widget_connection(self.token)
+        if err:
+            return None
+        conn_id = conn.id
+        conn_pk = conn.pk
+        tenant_schema = conn.tenant_schema
         with schema_context(tenant_schema):
-            exists = WidgetSession.objects.filter(
-                session_id=self.session_id, connection_id=conn_id
-            ).exists()
-        if not exists:
+            last_seen_at = (
+                WidgetSession.objects
+                .filter(session_id=self.session_id, connection_id=conn_id)
+                .values_list('last_seen_at', flat=True)
+                .first()
+            )
+        if last_seen_at is None:
             return None
-        return conn_id, tenant_schema, conn_pk
+        return conn_id, tenant_schema, conn_pk, last_seen_at
 
     @database_sync_to_async
     def _fetch_ended_state(self):
@@ -302,6 +436,8 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         if hasattr(self, 'tenant_group'):
             await self.channel_layer.group_discard(self.tenant_group, self.channel_name)
+        if hasattr(self, 'conversation_group'):
+            await self.channel_layer.group_discard(self.conversation_group, self.channel_name)
 
     async def receive(self, text_data):
         try:
@@ -313,6 +449,7 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
         mtype = data.get('type')
         if mtype == 'ping':
             await self.send(text_data=json.dumps({'type': 'pong', 'timestamp': data.get('timestamp')}))
+            await self._heartbeat()
             return
         if mtype == 'message':
             text = (data.get('text') or '').strip()
@@ -320,22 +457,71 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
             if not text and not attachments:
                 await self.send(text_data=json.dumps({'type': 'error', 'message': 'empty_message'}))
                 return
-            msg_dict = await self._persist_visitor_message(text, attachments if isinstance(attachments, list) else [])
+            msg_dict = await self._accept_visitor_message(text, attachments if isinstance(attachments, list) else [])
             if not msg_dict:
                 await self.send(text_data=json.dumps({'type': 'error', 'message': 'session_expired'}))
                 return
-            # Single broadcast to the tenant group — agent sidebar AND any
-            # other visitor tabs of this session all listen there and filter
-            # by session_id in new_message.
+            # Same fan-out as every other platform: the tenant group while
+            # unassigned, then the assignee / ``_all`` / conversation groups.
+            # Other visitor tabs of this session listen on the tenant and
+            # conversation groups and filter by session_id in new_message.
             conversation_id = f"widget_{self.connection_id}_{self.session_id}"
-            await self.channel_layer.group_send(self.tenant_group, {
-                'type': 'new_message',
-                'message': msg_dict,
-                'conversation_id': conversation_id,
-                'timestamp': msg_dict.get('timestamp'),
-            })
+            assigned_user_id = await self._assigned_user_id()
+            await send_scoped_message_notification(
+                self.tenant_schema, conversation_id, msg_dict, assigned_user_id
+            )
             return
 
+    @database_sync_to_async
+    def _assigned_user_id(self):
+        from .assignment_map import lookup
+
+        with schema_context(self.tenant_schema):
+            return lookup('widget', self.session_id, str(self.connection_id))
+
+    async def _heartbeat(self):
+        """Buffer a last-seen update, at most once per HEARTBEAT_INTERVAL."""
+        import time
+        from asgiref.sync import sync_to_async
+        from .widget_write_behind import record_heartbeat
+
+        now = time.monotonic()
+        if now - self._last_heartbeat < self.HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = now
+        await sync_to_async(record_heartbeat, thread_sensitive=False)(self.tenant_schema, self.session_id)
+
+    async def _accept_visitor_message(self, text, attachments):
+        """Hand the message to the write-behind buffer and return its payload.
+
+        The staleness check uses the session's ``last_seen_at`` captured at
+        connect and advanced here, so the hot path never reads the tenant
+        schema. Falls back to a synchronous insert when Redis is down.
+        """
+        from datetime import timedelta
+        from asgiref.sync import sync_to_async
+        from django.utils import timezone
+        from .widget_write_behind import enqueue_message, message_record
+
+        now = timezone.now()
+        if now - self.session_last_seen > timedelta(hours=24):
+            return None
+        record = message_record(self.session_id, text, attachments, now)
+        buffered = await sync_to_async(enqueue_message, thread_sensitive=False)(self.tenant_schema, record)
+        if not buffered:
+            return await self._persist_visitor_message(text, attachments)
+        self.session_last_seen = now
+        return {
+            'message_id': record['message_id'],
+            'message_text': text,
+            'attachments': attachments,
+            'is_from_visitor': True,
+            'timestamp': now.isoformat(),
+            'session_id': self.session_id,
+            'connection_id': self.connection_id,
+            'platform': 'widget',
+        }
+
     @database_sync_to_async
     def _persist_visitor_message(self, text, attachments):
         import uuid
@@ -366,6 +552,7 @@ class WidgetVisitorConsumer(AsyncWebsocketConsumer):
             )
             session.last_seen_at = now
             session.save(update_fields=['last_seen_at'])
+            self.session_last_seen = now
             return {
                 'message_id': msg.message_id,
                 'message_text': msg.message_text,
@@ -558,38 +745,55 @@ class TypingConsumer(AsyncWebsocketConsumer):
 
 
 # Utility functions for sending WebSocket messages from Django views
-async def send_new_message_notification(tenant_schema, conversation_id, message_data):
+async def send_scoped_event(tenant_schema, conversation_id, event, assigned_user_id=None):
     """
-    Send new message notification to all connected clients.
-    Call this from views when a new message is received or sent.
+    Publish a conversation event to the smallest set of groups that need it.
+
+    Unassigned conversations go to the tenant-wide group (every agent's
+    inbox). Assigned ones go to the assignee, to agents in the ``all``
+    delivery scope, and to whoever has the conversation open; the three
+    sends run concurrently and each copy is tagged with its ``audience`` so
+    a socket in several of those groups forwards it only once.
     """
     from channels.layers import get_channel_layer
-    
+
     channel_layer = get_channel_layer()
-    
-    # Send to general messages group
-    await channel_layer.group_send(
-        f'messages_{tenant_schema}',
-        {
-            'type': 'new_message',
-            'message': message_data,
-            'conversation_id': conversation_id,
-            'timestamp': message_data.get('timestamp')
-        }
-    )
-    
-    # Send to specific conversation group
-    await channel_layer.group_send(
-        f'conversation_{tenant_schema}_{conversation_id}',
-        {
-            'type': 'new_message',
-            'message': message_data,
-            'conversation_id': conversation_id,
-            'timestamp': message_data.get('timestamp')
-        }
+    event = {**event, 'conversation_id': conversation_id, 'assigned_user_id': assigned_user_id}
+
+    if assigned_user_id is None:
+        await channel_layer.group_send(tenant_messages_group(tenant_schema), event)
+        return
+
+    await asyncio.gather(
+        channel_layer.group_send(
+            user_messages_group(tenant_schema, assigned_user_id), {**event, 'audience': 'user'}
+        ),
+        channel_layer.group_send(
+            all_messages_group(tenant_schema), {**event, 'audience': 'all'}
+        ),
+        channel_layer.group_send(
+            conversation_group(tenant_schema, conversation_id), {**event, 'audience': 'conversation'}
+        ),
     )
 
 
+async def send_scoped_message_notification(tenant_schema, conversation_id, message_data, assigned_user_id=None):
+    """Publish a new message with :func:`send_scoped_event`."""
+    await send_scoped_event(tenant_schema, conversation_id, {
+        'type': 'new_message',
+        'message': message_data,
+        'timestamp': message_data.get('timestamp'),
+    }, assigned_user_id)
+
+
+async def send_new_message_notification(tenant_schema, conversation_id, message_data, assigned_user_id=None):
+    """
+    Send new message notification to all connected clients.
+    Call this from views when a new message is received or sent.
+    """
+    await send_scoped_message_notification(tenant_schema, conversation_id, message_data, assigned_user_id)
+
+
 async def send_conversation_update(tenant_schema, conversation_id, last_message_data):
     """
     Send conversation update notification.
@@ -600,7 +804,7 @@ async def send_conversation_update(tenant_schema, conversation_id, last_message_
     channel_layer = get_channel_layer()
 
     await channel_layer.group_send(
-        f'messages_{tenant_schema}',
+        tenant_messages_group(tenant_schema),
         {
             'type': 'conversation_update',
             'conversation_id': conversation_id,
@@ -629,7 +833,7 @@ async def _safe_group_send(tenant_schema, payload):
         channel_layer = get_channel_layer()
         if channel_layer is None:
             return  # Channel layer not configured (some test envs) — swallow.
-        await channel_layer.group_send(f'messages_{tenant_schema}', payload)
+        await channel_layer.group_send(tenant_messages_group(tenant_schema), payload)
     except Exception as exc:  # noqa: BLE001 — broadcast is best-effort.
         _realtime_logger.warning(
             'Cross-user broadcast failed for tenant=%s type=%s: %s',
@@ -718,3 +922,20 @@ async def send_archive_update(
         'by_user_id': by_user_id,
         'timestamp': datetime.now(timezone.utc).isoformat(),
     })
+
+
+async def send_message_status_batch(tenant_schema, *, platform, conversation_id, account_id, statuses):
+    """Broadcast every status change for one conversation as a single frame.
+
+    ``statuses`` is a list of ``{message_id, status, timestamp}`` dicts.
+    """
+    from datetime import datetime, timezone
+
+    await _safe_group_send(tenant_schema, {
+        'type': 'message_status_batch',
+        'platform': platform,
+        'conversation_id': conversation_id,
+        'account_id': account_id,
+        'statuses': statuses,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    })
@@ -0,0 +1,392 @@
+"""Shared client for the Meta Graph API (Facebook, Instagram, WhatsApp Cloud).
+
+Every outbound call to ``graph.facebook.com`` — sending messages, fetching
+sender profiles, resolving WhatsApp media, managing templates — goes through
+:func:`get_graph_client`. Compared to bare ``requests.get``/``requests.post``
+calls this gives us:
+
+1. **Connection pooling.** One ``requests.Session`` per worker thread keeps
+   TLS connections to Graph alive between calls. The session is rebuilt
+   after ``fork()`` so gunicorn/celery prefork children never share sockets.
+2. **Per-token rate limiting.** A token bucket keyed by the page / WABA
+   access token smooths bursts (e.g. a campaign fan-out) before Meta starts
+   answering with error code 4 / 80007.
+3. **Usage-header back-off.** ``X-Business-Use-Case-Usage`` and
+   ``X-App-Usage`` are parsed on every response. When Meta reports that a
+   token is close to (or over) its quota, the bucket for that token is
+   paused until the advertised ``estimated_time_to_regain_access``.
+4. **Batching.** :meth:`GraphClient.get_objects` folds N profile / media
+   lookups into ``ceil(N / 50)`` calls to the Graph ``batch`` endpoint.
+
+Methods return plain ``requests.Response`` objects so call sites keep their
+existing ``status_code`` / ``json()`` handling. The base URL is configurable
+via ``SOCIAL_INTEGRATIONS['GRAPH_API_BASE_URL']`` so tests can point the
+client at a local stub server.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRAPH_BASE_URL = 'https://graph.facebook.com'
+DEFAULT_TIMEOUT = 30
+
+# Graph refuses batches larger than this.
+MAX_BATCH_SIZE = 50
+
+# Usage percentage (0-100) above which we start slowing a token down even
+# though Meta has not cut it off yet.
+USAGE_SLOWDOWN_THRESHOLD = 90
+# How long a token is paused when usage crosses the threshold but Meta did
+# not tell us how long to wait.
+USAGE_SLOWDOWN_SECONDS = 5.0
+
+_VERSION_PREFIX = re.compile(r'v\d+\.\d+(/|$)')
+
+
+class GraphRateLimitError(requests.exceptions.RequestException):
+    """Raised when a token is paused for longer than the caller is willing to wait.
+
+    Subclasses ``RequestException`` so existing ``except`` blocks around
+    Graph calls treat it like any other transport failure.
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _graph_settings() -> Dict[str, Any]:
+    return getattr(settings, 'SOCIAL_INTEGRATIONS', {}) or {}
+
+
+def graph_base_url() -> str:
+    return (_graph_settings().get('GRAPH_API_BASE_URL') or DEFAULT_GRAPH_BASE_URL).rstrip('/')
+
+
+def graph_api_version() -> str:
+    return _graph_settings().get('FACEBOOK_API_VERSION') or 'v23.0'
+
+
+class TokenBucket:
+    """Thread-safe token bucket with an optional hard pause.
+
+    ``rate`` tokens are added per second up to ``capacity``. :meth:`acquire`
+    blocks until a token is available, or raises :class:`GraphRateLimitError`
+    when the wait would exceed ``max_wait`` seconds.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        """Refuse to hand out tokens for the next ``seconds`` seconds."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._tokens = 0.0
+
+    def paused_for(self) -> float:
+        with self._lock:
+            return max(0.0, self._paused_until - self._clock())
+
+    def acquire(self, max_wait: float) -> None:
+        deadline = self._clock() + max_wait
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return
+                    wait = (1.0 - self._tokens) / self.rate if self.rate > 0 else max_wait
+            if now + wait > deadline:
+                raise GraphRateLimitError(
+                    f'Graph token rate-limited for {wait:.1f}s', retry_after=wait
+                )
+            self._sleep(wait)
+
+
+def parse_usage_headers(headers) -> Tuple[float, float]:
+    """Return ``(max_usage_percent, regain_access_seconds)`` from Graph usage headers.
+
+    Reads ``X-Business-Use-Case-Usage`` (per business/WABA, may contain
+    ``estimated_time_to_regain_access`` in minutes) plus the app-level
+    ``X-App-Usage`` / ``X-Ad-Account-Usage``. Malformed headers are ignored.
+    """
+    max_usage = 0.0
+    regain_seconds = 0.0
+
+    def _consume(entry: Dict[str, Any]) -> None:
+        nonlocal max_usage, regain_seconds
+        for key in ('call_count', 'total_cputime', 'total_time', 'acc_id_util_pct'):
+            try:
+                max_usage = max(max_usage, float(entry.get(key) or 0))
+            except (TypeError, ValueError):
+                continue
+        try:
+            minutes = float(entry.get('estimated_time_to_regain_access') or 0)
+        except (TypeError, ValueError):
+            minutes = 0.0
+        regain_seconds = max(regain_seconds, minutes * 60)
+
+    buc = headers.get('X-Business-Use-Case-Usage')
+    if buc:
+        try:
+            for entries in json.loads(buc).values():
+                for entry in entries or []:
+                    if isinstance(entry, dict):
+                        _consume(entry)
+        except (ValueError, AttributeError):
+            logger.debug('Ignoring malformed X-Business-Use-Case-Usage: %s', buc)
+
+    for header in ('X-App-Usage', 'X-Ad-Account-Usage'):
+        raw = headers.get(header)
+        if not raw:
+            continue
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            logger.debug('Ignoring malformed %s: %s', header, raw)
+            continue
+        if isinstance(entry, dict):
+            _consume(entry)
+
+    return max_usage, regain_seconds
+
+
+def _token_from(params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]],
+                data: Any = None) -> str:
+    if params and params.get('access_token'):
+        return str(params['access_token'])
+    if headers:
+        auth = headers.get('Authorization') or headers.get('authorization') or ''
+        if auth.lower().startswith('bearer '):
+            return auth[7:].strip()
+    if isinstance(data, dict) and data.get('access_token'):
+        return str(data['access_token'])
+    return ''
+
+
+def _bucket_key(token: str) -> str:
+    # Never keep raw access tokens around as dict keys / log fields.
+    return hashlib.sha256(token.encode()).hexdigest()[:16] if token else 'anonymous'
+
+
+class GraphClient:
+    """Pooled, rate-limited Graph API client. Use :func:`get_graph_client`."""
+
+    def __init__(self, rate_per_second: Optional[float] = None, burst: Optional[float] = None,
+                 max_wait: Optional[float] = None):
+        conf = _graph_settings()
+        self.rate_per_second = float(
+            rate_per_second if rate_per_second is not None
+            else conf.get('GRAPH_RATE_LIMIT_PER_SECOND', 20)
+        )
+        self.burst = float(burst if burst is not None else conf.get('GRAPH_RATE_LIMIT_BURST', 40))
+        self.max_wait = float(max_wait if max_wait is not None else conf.get('GRAPH_RATE_LIMIT_MAX_WAIT', 5))
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------
+    # Plumbing
+    # ------------------------------------------------------------------
+
+    @property
+    def session(self) -> requests.Session:
+        """Per-thread session, recreated after fork."""
+        pid = os.getpid()
+        sess = getattr(self._local, 'session', None)
+        if sess is None or getattr(self._local, 'pid', None) != pid:
+            sess = requests.Session()
+            # Retry only connection setup failures — never replay a POST that
+            # may already have reached Meta (duplicate messages).
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+            )
+            sess.mount('https://', adapter)
+            sess.mount('http://', adapter)
+            self._local.session = sess
+            self._local.pid = pid
+        return sess
+
+    def bucket_for(self, token: str) -> TokenBucket:
+        key = _bucket_key(token)
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_second, self.burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def url(self, path: str) -> str:
+        """Resolve ``path`` against the configured Graph base URL.
+
+        Accepts either a relative path (``"me/messages"``, ``"v23.0/123"``)
+        or an absolute ``https://graph.facebook.com/...`` URL; the latter is
+        rewritten onto the configured base so call sites that still build
+        absolute URLs also hit the stub server in tests. Other absolute URLs
+        (e.g. lookaside.fbsbx.com media downloads) pass through unchanged.
+        """
+        base = graph_base_url()
+        if path.startswith(DEFAULT_GRAPH_BASE_URL):
+            return base + path[len(DEFAULT_GRAPH_BASE_URL):]
+        if path.startswith(('http://', 'https://')):
+            return path
+        path = path.lstrip('/')
+        if not _VERSION_PREFIX.match(path):
+            path = f'{graph_api_version()}/{path}'
+        return f'{base}/{path}'
+
+    def _observe(self, bucket: TokenBucket, response: requests.Response) -> None:
+        usage, regain = parse_usage_headers(response.headers)
+        if regain > 0:
+            logger.warning('Graph token throttled by Meta for %.0fs (usage=%.0f%%)', regain, usage)
+            bucket.pause(regain)
+        elif usage >= USAGE_SLOWDOWN_THRESHOLD:
+            logger.info('Graph token at %.0f%% usage, slowing down', usage)
+            bucket.pause(USAGE_SLOWDOWN_SECONDS)
+
+    def request(self, method: str, path: str, *, params: Optional[Dict[str, Any]] = None,
+                headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                max_wait: Optional[float] = None, **kwargs) -> requests.Response:
+        token = _token_from(params, headers, kwargs.get('data'))
+        bucket = self.bucket_for(token)
+        bucket.acquire(self.max_wait if max_wait is None else max_wait)
+        response = self.session.request(
+            method, self.url(path), params=params, headers=headers,
+            timeout=timeout or DEFAULT_TIMEOUT, **kwargs,
+        )
+        self._observe(bucket, response)
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Batching
+    # ------------------------------------------------------------------
+
+    def batch(self, calls: List[Dict[str, Any]], access_token: str,
+              timeout: Optional[float] = None) -> List[Tuple[int, Any]]:
+        """Run ``calls`` through the Graph ``batch`` endpoint.
+
+        ``calls`` is a list of ``{"method": "GET", "relative_url": "..."}``
+        dicts. Returns a list aligned with ``calls`` of ``(status_code, body)``
+        tuples where ``body`` is the decoded JSON (or ``None``). A chunk that
+        fails as a whole yields ``(status_code, None)`` for each of its calls.
+        """
+        results: List[Tuple[int, Any]] = []
+        for start in range(0, len(calls), MAX_BATCH_SIZE):
+            chunk = calls[start:start + MAX_BATCH_SIZE]
+            response = self.post(
+                '',
+                data={
+                    'access_token': access_token,
+                    'include_headers': 'false',
+                    'batch': json.dumps(chunk),
+                },
+                timeout=timeout,
+            )
+            try:
+                items = response.json() if response.status_code == 200 else None
+            except ValueError:
+                items = None
+            if not isinstance(items, list):
+                logger.warning('Graph batch failed: %s %s', response.status_code, response.text[:200])
+                results.extend((response.status_code, None) for _ in chunk)
+                continue
+            for item in items:
+                if not item:
+                    results.append((0, None))
+                    continue
+                try:
+                    body = json.loads(item.get('body') or 'null')
+                except ValueError:
+                    body = None
+                results.append((item.get('code', 0), body))
+        return results
+
+    def get_objects(self, ids: Iterable[str], access_token: str,
+                    fields: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Fetch many Graph nodes (profiles, media) with as few calls as possible.
+
+        Returns ``{id: node}`` for every id that resolved with HTTP 200.
+        A single id is fetched directly; more go through :meth:`batch`.
+        """
+        unique_ids = [i for i in dict.fromkeys(ids) if i]
+        if not unique_ids or not access_token:
+            return {}
+        query = f'?fields={fields}' if fields else ''
+        if len(unique_ids) == 1:
+            params = {'access_token': access_token}
+            if fields:
+                params['fields'] = fields
+            response = self.get(unique_ids[0], params=params, timeout=10)
+            if response.status_code != 200:
+                return {}
+            return {unique_ids[0]: response.json()}
+
+        calls = [{'method': 'GET', 'relative_url': f'{node_id}{query}'} for node_id in unique_ids]
+        found = {}
+        for node_id, (code, body) in zip(unique_ids, self.batch(calls, access_token, timeout=15)):
+            if code == 200 and isinstance(body, dict):
+                found[node_id] = body
+        return found
+
+    def get_media_urls(self, media_ids: Iterable[str], access_token: str) -> Dict[str, str]:
+        """Resolve WhatsApp media ids to their (short-lived) download URLs."""
+        return {
+            media_id: node.get('url', '')
+            for media_id, node in self.get_objects(media_ids, access_token).items()
+        }
+
+
+_client: Optional[GraphClient] = None
+_client_lock = threading.Lock()
+
+
+def get_graph_client() -> GraphClient:
+    """Return the process-wide :class:`GraphClient`."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphClient()
+    return _client
@@ -0,0 +1,41 @@
+"""
+Make attachments cached before the media cache switched to private objects
+unreadable without a signed URL.
+
+Objects written by earlier deploys inherited the bucket's ``public-read``
+ACL. This sets each one to ``private``; new objects are private already.
+"""
+from django.core.management.base import BaseCommand
+from tenant_schemas.utils import get_tenant_model, tenant_context
+
+from social_integrations.media_cache import media_storage
+from social_integrations.models import CachedMedia
+
+
+class Command(BaseCommand):
+    help = 'Set a private ACL on every cached WhatsApp/Instagram attachment in object storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help='Only this tenant schema (default: all tenants)')
+
+    def handle(self, *args, **options):
+        storage = media_storage()
+        bucket = getattr(storage, 'bucket', None)
+        if bucket is None:
+            self.stdout.write('Storage backend has no object ACLs; nothing to do.')
+            return
+
+        tenants = get_tenant_model().objects.exclude(schema_name='public')
+        if options.get('schema'):
+            tenants = tenants.filter(schema_name=options['schema'])
+
+        total = 0
+        for tenant in tenants:
+            with tenant_context(tenant):
+                for storage_path in CachedMedia.objects.values_list('storage_path', flat=True).iterator():
+                    try:
+                        bucket.Object(storage._normalize_name(storage_path)).Acl().put(ACL='private')
+                        total += 1
+                    except Exception as e:
+                        self.stderr.write(f'{tenant.schema_name}: {storage_path}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Made {total} cached attachments private'))
@@ -0,0 +1,250 @@
+"""Download-once cache for WhatsApp / Instagram attachments.
+
+The media proxy endpoints used to resolve a fresh Meta URL and buffer the
+whole file in memory on *every* view. This module persists each attachment
+to storage the first time it is requested and records it in
+:class:`~social_integrations.models.CachedMedia`; later views are served
+straight from storage, either as a redirect to a signed, short-lived URL or
+as a Range-capable streaming response.
+
+Attachments are customer data: objects are stored with a private ACL (see
+:func:`media_storage`) under an unguessable name, and every response is
+``Cache-Control: private``. Callers check the account before looking up
+the cache.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import uuid
+from typing import Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, connection
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+
+from amanati_crm.file_utils import private_storage
+
+from .graph_client import get_graph_client
+from .models import CachedMedia
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class MediaUnavailable(Exception):
+    """Meta no longer serves this attachment (expired or deleted)."""
+
+
+def _redirect_enabled() -> bool:
+    return getattr(settings, 'SOCIAL_MEDIA_CACHE_REDIRECT', True)
+
+
+def media_storage():
+    """Private storage; URLs expire after ``SOCIAL_MEDIA_URL_TTL`` seconds."""
+    return private_storage(getattr(settings, 'SOCIAL_MEDIA_URL_TTL', 900))
+
+
+def storage_path_for(platform: str, media_id: str) -> str:
+    safe_id = re.sub(r'[^A-Za-z0-9._-]+', '_', media_id)[:200]
+    return f'social_media/{connection.schema_name}/{platform}/{safe_id}-{uuid.uuid4().hex}'
+
+
+def get_cached(platform: str, media_id: str, account_id: str) -> Optional[CachedMedia]:
+    """The cached copy of ``media_id``, only if it was downloaded for ``account_id``."""
+    return CachedMedia.objects.filter(platform=platform, media_id=media_id, account_id=account_id).first()
+
+
+class _UpstreamBody:
+    """Read-only, forward-only file over a streamed response body.
+
+    Storage backends copy it chunk by chunk (``File.chunks()`` locally,
+    ``upload_fileobj`` on S3), so the download is never held in memory or
+    spooled to disk.
+    """
+
+    def __init__(self, upstream):
+        self._raw = upstream.raw
+        self._raw.decode_content = True
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._raw.read(None if size is None or size < 0 else size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def seekable(self):
+        return False
+
+
+def store_from_url(platform: str, media_id: str, url: str, account_id: str = '',
+                   headers: Optional[dict] = None,
+                   content_type: Optional[str] = None) -> CachedMedia:
+    """Stream ``url`` into storage and index it. Returns the (possibly pre-existing) row.
+
+    Raises :class:`MediaUnavailable` when the upstream answers 4xx, or when
+    the id is already cached under a different account.
+    """
+    with get_graph_client().get(url, headers=headers, timeout=30, stream=True) as upstream:
+        if 400 <= upstream.status_code < 500:
+            raise MediaUnavailable(f'{platform} media {media_id}: HTTP {upstream.status_code}')
+        upstream.raise_for_status()
+        content_type = (
+            content_type
+            or upstream.headers.get('Content-Type', '').split(';')[0]
+            or 'application/octet-stream'
+        )
+        body = _UpstreamBody(upstream)
+        saved_path = media_storage().save(storage_path_for(platform, media_id), File(body))
+        size = body.bytes_read
+
+    try:
+        return CachedMedia.objects.create(
+            platform=platform,
+            media_id=media_id,
+            account_id=account_id,
+            storage_path=saved_path,
+            content_type=content_type,
+            size=size,
+        )
+    except IntegrityError:
+        # Two viewers raced on the first download — keep the winner's row
+        # and drop our duplicate object.
+        try:
+            media_storage().delete(saved_path)
+        except Exception:  # noqa: BLE001
+            logger.warning('Could not delete duplicate cached media %s', saved_path)
+        winner = get_cached(platform, media_id, account_id)
+        if winner is None:
+            # The row belongs to another account; never hand it to this one.
+            raise MediaUnavailable(f'{platform} media {media_id}: cached for another account')
+        return winner
+
+
+def resolve_whatsapp_media(account, media_id: str) -> Tuple[str, Optional[str]]:
+    """Ask Graph for a fresh ``(download_url, mime_type)`` for a WhatsApp media id.
+
+    Raises :class:`MediaUnavailable` when Meta answers 4xx (expired media)
+    and ``requests.HTTPError`` on upstream 5xx.
+    """
+    info = get_graph_client().get(
+        media_id,
+        headers={'Authorization': f'Bearer {account.access_token}'},
+        timeout=10,
+    )
+    if 400 <= info.status_code < 500:
+        try:
+            meta_code = (info.json().get('error') or {}).get('code')
+        except ValueError:
+            meta_code = None
+        logger.warning(
+            "WhatsApp media info fetch failed: media_id=%s http=%s meta_code=%s body=%s",
+            media_id, info.status_code, meta_code, info.text[:500],
+        )
+        raise MediaUnavailable(f'whatsapp media {media_id}: HTTP {info.status_code}')
+    info.raise_for_status()
+    data = info.json()
+    if not data.get('url'):
+        raise MediaUnavailable(f'whatsapp media {media_id}: no download URL')
+    return data['url'], data.get('mime_type')
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return an inclusive ``(start, end)`` for a single-range header.
+
+    ``None`` means "no usable range, send the whole file"; a ``(start, end)``
+    with ``start > end`` means the range is unsatisfiable.
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or size == 0:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # Suffix range: last N bytes.
+        length = int(end)
+        return (max(0, size - length), size - 1)
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    return (start, end)
+
+
+def _iter_file(fileobj, start: int, length: int) -> Iterator[bytes]:
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fileobj.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def _iter_upstream(upstream) -> Iterator[bytes]:
+    try:
+        yield from upstream.iter_content(STREAM_CHUNK_SIZE)
+    finally:
+        upstream.close()
+
+
+def serve_cached(request, cached: CachedMedia) -> HttpResponse:
+    """Answer a proxy request from storage: CDN redirect or ranged stream."""
+    if _redirect_enabled():
+        response = HttpResponseRedirect(media_storage().url(cached.storage_path))
+        # The signed URL expires; don't let the browser reuse the redirect past it.
+        response['Cache-Control'] = 'private, max-age=60'
+        return response
+
+    size = cached.size
+    byte_range = _parse_range(request.headers.get('Range', ''), size)
+    if byte_range and byte_range[0] > byte_range[1]:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fileobj = media_storage().open(cached.storage_path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _iter_file(fileobj, start, end - start + 1),
+            status=206,
+            content_type=cached.content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = StreamingHttpResponse(_iter_file(fileobj, 0, size), content_type=cached.content_type)
+        response['Content-Length'] = str(size)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+def stream_upstream(request, url: str, headers: Optional[dict] = None,
+                    content_type: Optional[str] = None) -> HttpResponse:
+    """Pass-through streaming fallback used when storage is unavailable.
+
+    Forwards the client's ``Range`` header to Meta so seeking still works.
+    """
+    headers = dict(headers or {})
+    if request.headers.get('Range'):
+        headers['Range'] = request.headers['Range']
+    upstream = get_graph_client().get(url, headers=headers, timeout=30, stream=True)
+    response = StreamingHttpResponse(
+        _iter_upstream(upstream),
+        status=upstream.status_code,
+        content_type=content_type or upstream.headers.get('Content-Type', 'application/octet-stream'),
+    )
+    for header in ('Content-Length', 'Content-Range', 'Accept-Ranges'):
+        if upstream.headers.get(header):
+            response[header] = upstream.headers[header]
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
@@ -0,0 +1,187 @@
+"""Ranked full-history message search across every social channel.
+
+One ``UNION ALL`` over Facebook, Instagram, WhatsApp and widget messages,
+ordered by trigram word-similarity and then recency. The ``WHERE`` clauses
+are plain ``icontains`` filters; on PostgreSQL they compile to
+``UPPER(col) LIKE UPPER(%s)``, which the ``*_trgm`` GIN indexes (migration
+0055) answer, so cost follows the number of matches rather than the size of
+the message history.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Iterable, List, Optional
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import (
+    BooleanField, Case, CharField, Exists, F, FloatField, Func, OuterRef, Q, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Greatest
+
+from .models import (
+    ChatAssignment, FacebookMessage, InstagramMessage, WhatsAppMessage, WidgetMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PLATFORMS = ('facebook', 'instagram', 'whatsapp', 'widget')
+MIN_QUERY_LENGTH = 2
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Column order of every UNION branch; each branch annotates exactly these.
+UNION_COLUMNS = (
+    'platform', 'message_pk', 'conversation_id', 'account_id', 'result_sender_name',
+    'result_text', 'result_timestamp', 'is_from_customer', 'rank',
+)
+
+
+def _rank(query: str, *fields: str):
+    similarities = [
+        TrigramWordSimilarity(Value(query), Coalesce(F(field), Value('')))
+        for field in fields
+    ]
+    if len(similarities) == 1:
+        return similarities[0]
+    return Greatest(*similarities, output_field=FloatField())
+
+
+def _match(query: str, *fields: str) -> Q:
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__icontains': query})
+    return condition
+
+
+def _platform_queryset(platform: str, query: str):
+    """Per-channel branch of the union. Every branch annotates ``UNION_COLUMNS``
+    in the same order so the ``UNION`` columns line up."""
+    if platform == 'facebook':
+        fields = ('message_text', 'sender_name')
+        qs = FacebookMessage.objects.filter(is_deleted=False).annotate(
+            platform=Value('facebook', output_field=CharField()),
+            message_pk=F('id'),
+            conversation_id=F('sender_id'),
+            account_id=F('page_connection__page_id'),
+            result_sender_name=F('sender_name'),
+            result_text=F('message_text'),
+            result_timestamp=F('timestamp'),
+            is_from_customer=Case(When(is_from_page=False, then=Value(True)), default=Value(False),
+                                  output_field=BooleanField()),
+            rank=_rank(query, *fields),
+        )
+    elif platform == 'instagram':
+        fields = ('message_text', 'sender_name', 'sender_username')
+        qs = InstagramMessage.objects.filter(is_deleted=False).annotate(
+            platform=Value('instagram', output_field=CharField()),
+            message_pk=F('id'),
+            conversation_id=F('sender_id'),
+            account_id=F('account_connection__instagram_account_id'),
+            result_sender_name=Case(
+                When(sender_name='', then='sender_username'),
+                default='sender_name',
+                output_field=CharField(),
+            ),
+            result_text=F('message_text'),
+            result_timestamp=F('timestamp'),
+            is_from_customer=Case(When(is_from_business=False, then=Value(True)), default=Value(False),
+                                  output_field=BooleanField()),
+            rank=_rank(query, *fields),
+        )
+    elif platform == 'whatsapp':
+        fields = ('message_text', 'contact_name', 'from_number')
+        qs = WhatsAppMessage.objects.filter(is_deleted=False).annotate(
+            platform=Value('whatsapp', output_field=CharField()),
+            message_pk=F('id'),
+            # ChatAssignment keys WhatsApp chats by the number without '+'.
+            conversation_id=Func(
+                Case(When(is_from_business=True, then='to_number'), default='from_number'),
+                Value('+'), function='LTRIM', output_field=CharField(),
+            ),
+            account_id=F('business_account__waba_id'),
+            result_sender_name=F('contact_name'),
+            result_text=F('message_text'),
+            result_timestamp=F('timestamp'),
+            is_from_customer=Case(When(is_from_business=False, then=Value(True)), default=Value(False),
+                                  output_field=BooleanField()),
+            rank=_rank(query, *fields),
+        )
+    elif platform == 'widget':
+        fields = ('message_text', 'session__visitor_name')
+        qs = WidgetMessage.objects.filter(is_deleted=False).annotate(
+            platform=Value('widget', output_field=CharField()),
+            message_pk=F('id'),
+            conversation_id=F('session__session_id'),
+            account_id=Cast('session__connection_id', output_field=CharField()),
+            result_sender_name=F('session__visitor_name'),
+            result_text=F('message_text'),
+            result_timestamp=F('timestamp'),
+            is_from_customer=F('is_from_visitor'),
+            rank=_rank(query, *fields),
+        )
+    else:
+        raise ValueError(f'Unknown platform: {platform}')
+    return qs.filter(_match(query, *fields))
+
+
+def _hide_others_assigned(qs, platform: str, user):
+    """Drop conversations actively assigned to somebody other than ``user``."""
+    assigned_elsewhere = ChatAssignment.objects.filter(
+        platform=platform,
+        status__in=['active', 'in_session'],
+        conversation_id=OuterRef('conversation_id'),
+        account_id=OuterRef('account_id'),
+    ).exclude(assigned_user=user)
+    return qs.filter(~Exists(assigned_elsewhere))
+
+
+def search_messages(query: str, platforms: Optional[Iterable[str]] = None, *,
+                    page: int = 1, page_size: int = DEFAULT_PAGE_SIZE,
+                    user=None, hide_assigned: bool = False) -> dict:
+    """Return one page of matching messages from all requested channels.
+
+    Results are ordered by best trigram match, newest first among equals.
+    ``has_more`` is computed by over-fetching one row, so no ``COUNT(*)``
+    over the full match set is needed.
+    """
+    query = (query or '').strip()
+    page = max(int(page), 1)
+    page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+    empty = {'results': [], 'page': page, 'page_size': page_size, 'has_more': False}
+    if len(query) < MIN_QUERY_LENGTH:
+        return empty
+
+    requested = [p for p in (platforms or SEARCH_PLATFORMS) if p in SEARCH_PLATFORMS]
+    branches: List = []
+    for platform in requested:
+        qs = _platform_queryset(platform, query)
+        if hide_assigned and user is not None:
+            qs = _hide_others_assigned(qs, platform, user)
+        branches.append(qs.order_by().values(*UNION_COLUMNS))
+    if not branches:
+        return empty
+
+    union = branches[0].union(*branches[1:], all=True) if len(branches) > 1 else branches[0]
+    offset = (page - 1) * page_size
+    rows = list(union.order_by('-rank', '-result_timestamp')[offset:offset + page_size + 1])
+
+    results = [
+        {
+            'platform': row['platform'],
+            'message_id': row['message_pk'],
+            'conversation_id': row['conversation_id'],
+            'account_id': row['account_id'],
+            'sender_name': row['result_sender_name'] or '',
+            'message_text': row['result_text'] or '',
+            'timestamp': row['result_timestamp'],
+            'is_from_customer': row['is_from_customer'],
+            'rank': round(row['rank'] or 0.0, 4),
+        }
+        for row in rows[:page_size]
+    ]
+    return {
+        'results': results,
+        'page': page,
+        'page_size': page_size,
+        'has_more': len(rows) > page_size,
+    }
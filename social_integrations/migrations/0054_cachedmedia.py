@@ -0,0 +1,31 @@
+# Generated by Django 4.2.24 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_integrations', '0053_widgetsession_ended_at_widgetsession_ended_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('platform', models.CharField(choices=[('whatsapp', 'WhatsApp'), ('instagram', 'Instagram')], max_length=20)),
+                ('media_id', models.CharField(help_text="WhatsApp media ID, or '<instagram message_id>:<attachment index>'", max_length=300)),
+                ('account_id', models.CharField(blank=True, help_text='waba_id / instagram_account_id', max_length=255)),
+                ('storage_path', models.CharField(max_length=500)),
+                ('content_type', models.CharField(default='application/octet-stream', max_length=120)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Cached Media',
+                'verbose_name_plural': 'Cached Media',
+                'unique_together': {('platform', 'media_id')},
+            },
+        ),
+    ]
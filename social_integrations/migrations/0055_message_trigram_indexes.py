@@ -0,0 +1,65 @@
+# Generated by Django 4.2.24 on 2026-10-18 10:05
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; message tables
+    # are large enough that a blocking build would stall webhook ingestion.
+    atomic = False
+
+    dependencies = [
+        ('social_integrations', '0054_cachedmedia'),
+    ]
+
+    operations = [
+        # Installed into ``public`` so the gin_trgm_ops operator class is on
+        # every tenant schema's search_path, not just the first one migrated.
+        migrations.RunSQL(
+            sql='CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='facebookmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message_text'), name='gin_trgm_ops'), name='fbmsg_text_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='facebookmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('sender_name'), name='gin_trgm_ops'), name='fbmsg_sender_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='instagrammessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message_text'), name='gin_trgm_ops'), name='igmsg_text_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='instagrammessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('sender_name'), name='gin_trgm_ops'), name='igmsg_sender_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='instagrammessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('sender_username'), name='gin_trgm_ops'), name='igmsg_username_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='whatsappmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message_text'), name='gin_trgm_ops'), name='wamsg_text_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='whatsappmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('contact_name'), name='gin_trgm_ops'), name='wamsg_contact_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='whatsappmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('from_number'), name='gin_trgm_ops'), name='wamsg_from_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='widgetsession',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('visitor_name'), name='gin_trgm_ops'), name='wgsess_name_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='widgetmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message_text'), name='gin_trgm_ops'), name='wgmsg_text_trgm'),
+        ),
+    ]
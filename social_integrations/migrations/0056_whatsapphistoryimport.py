@@ -0,0 +1,36 @@
+# Generated by Django 4.2.24 on 2026-10-18 10:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social_integrations', '0055_message_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhatsAppHistoryImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.PositiveSmallIntegerField(help_text='Meta history phase (0, 1 or 2)')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('importing', 'Importing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0, help_text='Percent reported by Meta for this phase')),
+                ('last_chunk_order', models.PositiveIntegerField(default=0)),
+                ('chunks_processed', models.PositiveIntegerField(default=0)),
+                ('messages_received', models.PositiveIntegerField(default=0)),
+                ('messages_imported', models.PositiveIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_imports', to='social_integrations.whatsappbusinessaccount')),
+            ],
+            options={
+                'ordering': ['account', 'phase'],
+                'unique_together': {('account', 'phase')},
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.24 on 2026-10-18 14:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    """One grouped pass per source over existing ratings (mirrors rating_rollups.rebuild)."""
+    ChatRating = apps.get_model('social_integrations', 'ChatRating')
+    CallRating = apps.get_model('crm', 'CallRating')
+    RatingDailyRollup = apps.get_model('social_integrations', 'RatingDailyRollup')
+
+    aggregates = {
+        'total': Count('id'),
+        'rating_sum': Sum('rating'),
+        **{f'rating_{n}': Count('id', filter=Q(rating=n)) for n in range(1, 6)},
+    }
+    sources = {
+        'social': ChatRating.objects.filter(rating__gt=0),
+        'calls_callback': CallRating.objects.filter(rating__gt=0, review_method='callback'),
+        'calls_sms': CallRating.objects.filter(rating__gt=0, review_method='sms'),
+    }
+    rows = []
+    for source, qs in sources.items():
+        grouped = (
+            qs.annotate(day=TruncDate('created_at'))
+            .order_by()
+            .values('day', 'rated_user_id')
+            .annotate(**aggregates)
+        )
+        for row in grouped:
+            rows.append(RatingDailyRollup(
+                day=row['day'], source=source, rated_user_id=row['rated_user_id'],
+                **{field: row[field] or 0 for field in aggregates},
+            ))
+    RatingDailyRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crm', '0017_pbxserver'),
+        ('social_integrations', '0056_whatsapphistoryimport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('source', models.CharField(choices=[('social', 'Social chat'), ('calls_callback', 'Call (callback)'), ('calls_sms', 'Call (SMS)')], max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('rated_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rating_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day', 'source'], name='rating_rollup_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ratingdailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('rated_user__isnull', False)), fields=('day', 'source', 'rated_user'), name='rating_rollup_user_day_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='ratingdailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('rated_user__isnull', True)), fields=('day', 'source'), name='rating_rollup_nouser_day_uniq'),
+        ),
+        migrations.RunPython(backfill_rollups, reverse_code=migrations.RunPython.noop),
+    ]
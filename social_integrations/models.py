@@ -1,5 +1,7 @@
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -145,6 +147,10 @@ class FacebookMessage(models.Model):
             # Supports the DISTINCT ON (sender_id) ORDER BY sender_id, timestamp DESC
             # used by unified_conversations to find the latest message per thread.
             models.Index(fields=['page_connection', 'sender_id', '-timestamp']),
+            # Trigram indexes on UPPER(col) serve icontains (UPPER(col) LIKE UPPER(%s))
+            # and the unified message search without a full table scan.
+            GinIndex(OpClass(Upper('message_text'), name='gin_trgm_ops'), name='fbmsg_text_trgm'),
+            GinIndex(OpClass(Upper('sender_name'), name='gin_trgm_ops'), name='fbmsg_sender_trgm'),
         ]
 
     def __str__(self):
@@ -308,6 +314,9 @@ class InstagramMessage(models.Model):
             # Supports the DISTINCT ON (sender_id) ORDER BY sender_id, timestamp DESC
             # used by unified_conversations to find the latest message per thread.
             models.Index(fields=['account_connection', 'sender_id', '-timestamp']),
+            GinIndex(OpClass(Upper('message_text'), name='gin_trgm_ops'), name='igmsg_text_trgm'),
+            GinIndex(OpClass(Upper('sender_name'), name='gin_trgm_ops'), name='igmsg_sender_trgm'),
+            GinIndex(OpClass(Upper('sender_username'), name='gin_trgm_ops'), name='igmsg_username_trgm'),
         ]
 
     def __str__(self):
@@ -605,6 +614,9 @@ class WhatsAppMessage(models.Model):
             # Supports DISTINCT ON (to_number) ORDER BY to_number, -timestamp used
             # for the latest business-sent message per customer (is_from_business=True).
             models.Index(fields=['business_account', 'to_number', '-timestamp']),
+            GinIndex(OpClass(Upper('message_text'), name='gin_trgm_ops'), name='wamsg_text_trgm'),
+            GinIndex(OpClass(Upper('contact_name'), name='gin_trgm_ops'), name='wamsg_contact_trgm'),
+            GinIndex(OpClass(Upper('from_number'), name='gin_trgm_ops'), name='wamsg_from_trgm'),
         ]
 
     def __str__(self):
@@ -671,6 +683,47 @@ class WhatsAppContact(models.Model):
         return f"{self.profile_name or self.wa_id} - {self.account.business_name}"
 
 
+class WhatsAppHistoryImport(models.Model):
+    """
+    Checkpoint for one coexistence history sync phase of a WhatsApp account.
+
+    Meta delivers the Business App history as a series of webhook chunks per
+    phase (0 = last day, 1 = 1-90 days, 2 = 90-180 days). The background
+    importer records every chunk it has applied here so retries and restarts
+    resume instead of re-walking the phase, and so the UI can show progress.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('importing', 'Importing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    account = models.ForeignKey(
+        WhatsAppBusinessAccount,
+        on_delete=models.CASCADE,
+        related_name='history_imports'
+    )
+    phase = models.PositiveSmallIntegerField(help_text="Meta history phase (0, 1 or 2)")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent reported by Meta for this phase")
+    last_chunk_order = models.PositiveIntegerField(default=0)
+    chunks_processed = models.PositiveIntegerField(default=0)
+    messages_received = models.PositiveIntegerField(default=0)
+    messages_imported = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['account', 'phase']
+        ordering = ['account', 'phase']
+
+    def __str__(self):
+        return f"History import {self.account.waba_id} phase {self.phase} ({self.status}, {self.progress}%)"
+
+
 class SocialIntegrationSettings(models.Model):
     """Stores tenant-specific settings for social integrations"""
     # Singleton pattern - only one settings object per tenant
@@ -1063,6 +1116,61 @@ class ChatRating(models.Model):
         return f"Rating {self.rating}/5 for {self.rated_user}"
 
 
+class RatingDailyRollup(models.Model):
+    """
+    Per-day, per-user, per-source totals of answered ratings.
+
+    Maintained from ChatRating/CallRating saves and reconciled nightly (see
+    ``rating_rollups``). ``rating_statistics`` sums these rows instead of
+    scanning the raw rating tables. ``rated_user`` is null for ratings that
+    have no handling user; those only count toward the overall figures.
+    Deleting a user folds their call ratings into those null rows.
+    """
+    SOURCE_CHOICES = [
+        ('social', 'Social chat'),
+        ('calls_callback', 'Call (callback)'),
+        ('calls_sms', 'Call (SMS)'),
+    ]
+
+    day = models.DateField()
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    rated_user = models.ForeignKey(
+        'users.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='rating_rollups'
+    )
+    total = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'source', 'rated_user'],
+                condition=models.Q(rated_user__isnull=False),
+                name='rating_rollup_user_day_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'source'],
+                condition=models.Q(rated_user__isnull=True),
+                name='rating_rollup_nouser_day_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'source'], name='rating_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.source} user={self.rated_user_id}: {self.total}"
+
+
 class EmailConnection(models.Model):
     """Stores Email (IMAP/SMTP) connection details for a tenant - supports multiple connections per tenant"""
 
@@ -1638,6 +1746,9 @@ class Client(models.Model):
     name = models.CharField(max_length=255, help_text="Client's display name")
     email = models.EmailField(blank=True, null=True, help_text="Optional email address")
     phone = models.CharField(max_length=50, blank=True, help_text="Optional phone number")
+    # Derived from ``phone`` on save; see crm/phone_index.py
+    phone_e164 = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
+    phone_reversed = models.CharField(max_length=50, blank=True, db_index=True, editable=False)
     notes = models.TextField(blank=True, help_text="Internal notes about this client")
     profile_picture = models.URLField(
         max_length=500,
@@ -1689,6 +1800,12 @@ class Client(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        from crm import phone_index
+
+        kwargs['update_fields'] = phone_index.fill(self, kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
     @property
     def full_name(self):
         """Return full name for booking, or display name if not set"""
@@ -2081,6 +2198,7 @@ class WidgetSession(models.Model):
         indexes = [
             models.Index(fields=['connection_id', '-started_at']),
             models.Index(fields=['connection_id', 'visitor_id']),
+            GinIndex(OpClass(Upper('visitor_name'), name='gin_trgm_ops'), name='wgsess_name_trgm'),
         ]
 
     def __str__(self):
@@ -2116,8 +2234,40 @@ class WidgetMessage(models.Model):
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['session', '-timestamp']),
+            GinIndex(OpClass(Upper('message_text'), name='gin_trgm_ops'), name='wgmsg_text_trgm'),
         ]
 
     def __str__(self):
         direction = 'visitor' if self.is_from_visitor else 'agent'
-        return f"WidgetMessage({self.message_id}) from={direction}"
\ No newline at end of file
+        return f"WidgetMessage({self.message_id}) from={direction}"
+
+class CachedMedia(models.Model):
+    """Index of WhatsApp / Instagram attachments persisted to object storage.
+
+    Meta media URLs are short-lived and every fetch costs two Graph round
+    trips, so the media proxy downloads each attachment once and serves
+    repeat views from storage. Keyed by the platform's media identifier.
+    """
+    PLATFORM_CHOICES = [
+        ('whatsapp', 'WhatsApp'),
+        ('instagram', 'Instagram'),
+    ]
+
+    platform = models.CharField(max_length=20, choices=PLATFORM_CHOICES)
+    media_id = models.CharField(
+        max_length=300,
+        help_text="WhatsApp media ID, or '<instagram message_id>:<attachment index>'"
+    )
+    account_id = models.CharField(max_length=255, blank=True, help_text="waba_id / instagram_account_id")
+    storage_path = models.CharField(max_length=500)
+    content_type = models.CharField(max_length=120, default='application/octet-stream')
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['platform', 'media_id']]
+        verbose_name = "Cached Media"
+        verbose_name_plural = "Cached Media"
+
+    def __str__(self):
+        return f"CachedMedia({self.platform}:{self.media_id}) {self.size}B"
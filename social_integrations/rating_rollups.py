@@ -0,0 +1,199 @@
+"""Daily rating rollups behind ``rating_statistics``.
+
+``RatingDailyRollup`` holds one row per ``(day, source, rated_user)`` with
+the count, sum and 1-5 histogram of answered ratings. Sources are
+``social`` (ChatRating), and ``calls_callback`` / ``calls_sms``
+(CallRating by review method).
+
+Rows are kept current in two ways:
+
+* every ChatRating/CallRating save or delete recomputes the affected bucket
+  (and the bucket it moved out of, if user or day changed) from the raw rows.
+  The bucket query is scoped to one user-day, so this stays cheap and is
+  idempotent, unlike applying +1/-1 deltas;
+* :func:`rebuild` recomputes a whole date range with one grouped query per
+  source. The nightly reconcile task runs it over the last few days, which
+  also repairs changes that bypass signals (``QuerySet.update``).
+
+Deleting a user moves their call ratings to the unassigned buckets (see
+:func:`detach_user`).
+"""
+from __future__ import annotations
+
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, QuerySet, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ChatRating, RatingDailyRollup
+
+logger = logging.getLogger(__name__)
+
+COUNT_FIELDS = ('total', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+SOURCES = ('social', 'calls_callback', 'calls_sms')
+
+Bucket = Tuple[str, date, Optional[int]]
+
+
+def _aggregates() -> dict:
+    return {
+        'total': Count('id'),
+        'rating_sum': Sum('rating'),
+        **{f'rating_{n}': Count('id', filter=Q(rating=n)) for n in range(1, 6)},
+    }
+
+
+def source_querysets() -> Dict[str, QuerySet]:
+    """Answered ratings per rollup source."""
+    from crm.models import CallRating
+
+    answered_calls = CallRating.objects.filter(rating__gt=0)
+    return {
+        'social': ChatRating.objects.filter(rating__gt=0),
+        'calls_callback': answered_calls.filter(review_method='callback'),
+        'calls_sms': answered_calls.filter(review_method='sms'),
+    }
+
+
+def _day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def bucket_of(instance) -> Optional[Bucket]:
+    """``(source, day, rated_user_id)`` the rating counts toward, if any."""
+    if instance.created_at is None:
+        return None
+    if isinstance(instance, ChatRating):
+        source = 'social'
+    else:
+        source = f'calls_{instance.review_method}'
+        if source not in SOURCES:
+            return None
+    return source, timezone.localdate(instance.created_at), instance.rated_user_id
+
+
+def stored_bucket(model, pk) -> Optional[Bucket]:
+    """Bucket of the row as currently stored (call before saving changes)."""
+    if pk is None:
+        return None
+    previous = model.objects.filter(pk=pk).first()
+    return bucket_of(previous) if previous is not None else None
+
+
+def refresh_bucket(source: str, day: date, user_id: Optional[int]) -> None:
+    start, end = _day_bounds(day)
+    agg = (
+        source_querysets()[source]
+        .filter(created_at__gte=start, created_at__lt=end, rated_user_id=user_id)
+        .aggregate(**_aggregates())
+    )
+    lookup = {'day': day, 'source': source, 'rated_user_id': user_id}
+    if not agg['total']:
+        RatingDailyRollup.objects.filter(**lookup).delete()
+        return
+    values = {field: agg[field] or 0 for field in COUNT_FIELDS}
+    try:
+        with transaction.atomic():
+            RatingDailyRollup.objects.update_or_create(**lookup, defaults=values)
+    except IntegrityError:
+        # A concurrent refresh inserted the bucket first.
+        RatingDailyRollup.objects.filter(**lookup).update(**values)
+
+
+def refresh_buckets(buckets) -> None:
+    """Recompute ``buckets``. Never raises: failures are left to the nightly reconcile."""
+    try:
+        with transaction.atomic():
+            for bucket in buckets:
+                refresh_bucket(*bucket)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Rating rollup refresh failed for {list(buckets)}: {e}")
+
+
+def refresh_for(instance, previous: Optional[Bucket] = None) -> None:
+    """Recompute every bucket a rating save/delete may have changed."""
+    refresh_buckets({bucket_of(instance), previous} - {None})
+
+
+def detach_user(user_id) -> set:
+    """Delete a user's rollups ahead of deleting the user.
+
+    The user's rows can't simply be nulled: they would collide with the
+    unassigned buckets. ChatRating rows go with the user (``CASCADE``), but
+    CallRating rows are nulled, so the call buckets they move into are
+    returned for :func:`refresh_buckets` once the user is gone.
+    """
+    rows = RatingDailyRollup.objects.filter(rated_user_id=user_id)
+    buckets = {
+        (source, day, None)
+        for source, day in rows.exclude(source='social').values_list('source', 'day')
+    }
+    rows.delete()
+    return buckets
+
+
+def rebuild(start_day: date, end_day: date) -> int:
+    """Replace the rollups for ``start_day``..``end_day`` from raw ratings."""
+    start, _ = _day_bounds(start_day)
+    _, end = _day_bounds(end_day)
+    rows = []
+    for source, qs in source_querysets().items():
+        grouped = (
+            qs.filter(created_at__gte=start, created_at__lt=end)
+            .annotate(day=TruncDate('created_at'))
+            .order_by()
+            .values('day', 'rated_user_id')
+            .annotate(**_aggregates())
+        )
+        rows.extend(
+            RatingDailyRollup(
+                day=row['day'], source=source, rated_user_id=row['rated_user_id'],
+                **{field: row[field] or 0 for field in COUNT_FIELDS},
+            )
+            for row in grouped
+        )
+    with transaction.atomic():
+        RatingDailyRollup.objects.filter(day__gte=start_day, day__lte=end_day).delete()
+        RatingDailyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def reconcile(days: int = 7) -> int:
+    """Nightly repair window: rebuild the last ``days`` days (today included)."""
+    today = timezone.localdate()
+    return rebuild(today - timedelta(days=days - 1), today)
+
+
+def summarize(start_day: date, end_day: date, sources) -> Tuple[dict, list]:
+    """Sum rollups for the range.
+
+    Returns ``(totals_by_source, per_user_rows)``. ``totals_by_source`` maps
+    source to ``{'total_ratings', 'ratings_sum'}``. ``per_user_rows`` has one
+    dict per rated user with the same two sums, ``count_1``..``count_5`` and
+    ``social_ratings``/``call_ratings``.
+    """
+    rollups = RatingDailyRollup.objects.filter(day__gte=start_day, day__lte=end_day, source__in=sources)
+    totals = {
+        row['source']: row
+        for row in rollups.order_by().values('source').annotate(
+            total_ratings=Sum('total'), ratings_sum=Sum('rating_sum'),
+        )
+    }
+    per_user = list(
+        rollups.filter(rated_user__isnull=False)
+        .order_by()
+        .values('rated_user_id', 'rated_user__email', 'rated_user__first_name', 'rated_user__last_name')
+        .annotate(
+            total_ratings=Sum('total'),
+            ratings_sum=Sum('rating_sum'),
+            **{f'count_{n}': Sum(f'rating_{n}') for n in range(1, 6)},
+            social_ratings=Sum('total', filter=Q(source='social')),
+            call_ratings=Sum('total', filter=~Q(source='social')),
+        )
+    )
+    return totals, per_user
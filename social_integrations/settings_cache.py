@@ -0,0 +1,90 @@
+"""Per-tenant ``SocialIntegrationSettings`` bundle, cached across requests.
+
+The settings row holds assignment mode, rating, auto-reply, away hours and
+widget options. REST views, webhook auto-reply evaluation, the widget API and
+Celery tasks all read it, often several times per unit of work. Before, only
+the REST views memoised it, and only for one request. Lookups now go through
+two layers:
+
+* a per-process dict that re-checks the tenant's version at most every
+  few seconds. In between, a lookup costs no network hop;
+* the shared Django cache (Redis), keyed by ``(schema, version)``.
+
+Any save or delete of the row moves the tenant to a new version once the
+transaction commits; until then the saving connection reads the row from
+the database (see :mod:`amanati_crm.versioned_cache`). Tenants with no
+settings row are cached too (as ``None``).
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+
+from django.db import connection
+
+from amanati_crm.versioned_cache import VersionedCache
+
+logger = logging.getLogger(__name__)
+
+
+class SocialSettingsBundle(SimpleNamespace):
+    """Read-only view of the tenant's SocialIntegrationSettings row.
+
+    Has the model's field names (plus ``pk``), so code that only reads
+    attributes works unchanged. There is no ``save()``: write through the
+    model (the settings endpoint does).
+    """
+
+    @property
+    def pk(self):
+        return self.id
+
+    def auto_reply_for(self, platform: str) -> dict:
+        return (self.auto_reply_settings or {}).get(platform, {}) or {}
+
+    def is_away_at(self, now: datetime) -> bool:
+        """Whether ``now`` falls in the weekly away-hours grid (business timezone)."""
+        if not self.away_hours_enabled or not self.away_hours_schedule:
+            return False
+        from zoneinfo import ZoneInfo
+
+        local_dt = now.astimezone(ZoneInfo(self.timezone))
+        return local_dt.hour in self.away_hours_schedule.get(local_dt.strftime('%A').lower(), [])
+
+
+def bundle_of(row) -> SocialSettingsBundle:
+    return SocialSettingsBundle(**{
+        field.attname: getattr(row, field.attname)
+        for field in row._meta.concrete_fields
+    })
+
+
+def _load(schema: str) -> Optional[SocialSettingsBundle]:
+    from tenant_schemas.utils import schema_context
+    from .models import SocialIntegrationSettings
+
+    with schema_context(schema):
+        row = SocialIntegrationSettings.objects.first()
+        return bundle_of(row) if row is not None else None
+
+
+_cache = VersionedCache(
+    'social_settings', _load,
+    to_shared=vars, from_shared=lambda cached: SocialSettingsBundle(**cached),
+)
+
+
+def get_settings(schema: Optional[str] = None) -> Optional[SocialSettingsBundle]:
+    """Settings bundle for ``schema`` (default: the active one), or ``None``."""
+    return _cache.get(schema or connection.schema_name)
+
+
+def invalidate_now(schema: str) -> None:
+    _cache.invalidate_now(schema)
+
+
+def invalidate(schema: Optional[str] = None) -> None:
+    """Read from the DB for the rest of this transaction; new version once it commits."""
+    _cache.invalidate(schema or connection.schema_name)
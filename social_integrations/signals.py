@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from crm.models import CallRating
+
+from . import assignment_map, rating_rollups, settings_cache, widget_poll
+from .models import ChatAssignment, ChatRating, SocialIntegrationSettings, WidgetMessage, WidgetSession
+
+
+@receiver(post_save, sender=WidgetMessage)
+def bump_widget_session_version(sender, instance, **kwargs):
+    """Invalidate the visitor's polling ETag whenever one of its messages changes.
+
+    ``session_id`` on the message is the session's pk, while the version is
+    keyed by the public ``WidgetSession.session_id``. Every save path passes
+    the session object, so it is read from the relation cache; the query
+    below is only a fallback. There is no ``post_delete`` hook: messages are
+    only hard-deleted along with their session (whose polls then 404), and a
+    receiver would stop Django from fast-deleting them.
+    """
+    session = sender._meta.get_field('session').get_cached_value(instance, None)
+    if session is not None:
+        widget_poll.bump(session.session_id)
+        return
+    widget_poll.bump(
+        WidgetSession.objects.filter(pk=instance.session_id).values_list('session_id', flat=True).first()
+    )
+
+
+@receiver(pre_save, sender=ChatRating)
+@receiver(pre_save, sender=CallRating)
+def remember_rating_bucket(sender, instance, **kwargs):
+    """Note the rollup bucket an existing rating is about to leave."""
+    instance._rollup_previous = rating_rollups.stored_bucket(sender, instance.pk)
+
+
+@receiver(post_save, sender=ChatRating)
+@receiver(post_save, sender=CallRating)
+@receiver(post_delete, sender=ChatRating)
+@receiver(post_delete, sender=CallRating)
+def refresh_rating_rollups(sender, instance, **kwargs):
+    """Keep RatingDailyRollup in step with rating inserts, answers and deletes."""
+    rating_rollups.refresh_for(instance, previous=getattr(instance, '_rollup_previous', None))
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def detach_user_rating_rollups(sender, instance, **kwargs):
+    """The user's call ratings become unassigned; so do their rollups (see ``detach_user``)."""
+    instance._rating_rollup_buckets = rating_rollups.detach_user(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def refresh_unassigned_rating_rollups(sender, instance, **kwargs):
+    rating_rollups.refresh_buckets(getattr(instance, '_rating_rollup_buckets', ()))
+
+
+@receiver(post_save, sender=ChatAssignment)
+def record_chat_assignment(sender, instance, **kwargs):
+    """Assign, transfer, start/end session: mirror the owner into the assignment map."""
+    assignment_map.record(instance)
+
+
+@receiver(post_delete, sender=ChatAssignment)
+def forget_chat_assignment(sender, instance, **kwargs):
+    assignment_map.forget(instance.platform, instance.conversation_id, instance.account_id)
+
+
+@receiver(post_save, sender=SocialIntegrationSettings)
+@receiver(post_delete, sender=SocialIntegrationSettings)
+def invalidate_social_settings(sender, instance, **kwargs):
+    settings_cache.invalidate()
@@ -82,3 +82,143 @@ def sync_tenant_emails(schema_name):
     return total
 
 
+@shared_task(soft_time_limit=1800, time_limit=1900)
+def run_bulk_inbox_job(schema_name, job_id, operation, platforms, user_id=None):
+    """Async archive-all / mark-all-read for large inboxes (see bulk_inbox)."""
+    from tenant_schemas.utils import schema_context
+    from social_integrations.bulk_inbox import run_job
+
+    with schema_context(schema_name):
+        job = run_job(schema_name, job_id, operation, platforms, user_id)
+
+    logger.info(
+        f"Bulk inbox job {schema_name}/{job_id} ({operation}) done: "
+        f"{job['archived_count']} archived, {job['messages_marked_read']} marked read"
+    )
+    return job
+
+
+@shared_task(acks_late=True, soft_time_limit=600, time_limit=660)
+def import_whatsapp_history(schema_name, account_id, history_entries):
+    """Apply coexistence history webhook chunks off the request path."""
+    from tenant_schemas.utils import schema_context
+    from social_integrations.models import WhatsAppBusinessAccount
+    from social_integrations.whatsapp_history import import_history_entries
+
+    with schema_context(schema_name):
+        account = WhatsAppBusinessAccount.objects.filter(pk=account_id).first()
+        if account is None:
+            logger.warning(f"History import skipped, account {schema_name}/{account_id} no longer exists")
+            return 0
+        checkpoints = import_history_entries(account, history_entries)
+
+    return sum(c.messages_imported for c in checkpoints)
+
+
+@shared_task(ignore_result=True)
+def flush_whatsapp_statuses(schema_name):
+    """Apply buffered WhatsApp delivery/read receipts (see whatsapp_status_ingest)."""
+    from tenant_schemas.utils import schema_context
+    from social_integrations.whatsapp_status_ingest import flush
+
+    with schema_context(schema_name):
+        updated = flush(schema_name)
+    if updated:
+        logger.info(f"Flushed WhatsApp statuses for {schema_name}: {updated} messages updated")
+    return updated
+
+
+@shared_task(ignore_result=True)
+def flush_pending_whatsapp_statuses():
+    """Safety net: flush every tenant that still has buffered WhatsApp statuses."""
+    from social_integrations.whatsapp_status_ingest import pending_schemas
+
+    schemas = pending_schemas()
+    for schema_name in schemas:
+        flush_whatsapp_statuses.delay(schema_name)
+    return len(schemas)
+
+
+@shared_task(ignore_result=True)
+def flush_widget_writes(schema_name):
+    """Persist buffered widget visitor messages/heartbeats (see widget_write_behind)."""
+    from tenant_schemas.utils import schema_context
+    from social_integrations.widget_write_behind import flush
+
+    with schema_context(schema_name):
+        inserted = flush(schema_name)
+    if inserted:
+        logger.info(f"Flushed widget write-behind buffer for {schema_name}: {inserted} messages")
+    return inserted
+
+
+@shared_task(ignore_result=True)
+def flush_pending_widget_writes():
+    """Safety net: flush every tenant that still has buffered widget writes."""
+    from social_integrations.widget_write_behind import pending_schemas
+
+    schemas = pending_schemas()
+    for schema_name in schemas:
+        flush_widget_writes.delay(schema_name)
+    return len(schemas)
+
+
+@shared_task
+def reconcile_rating_rollups(days=7):
+    """Nightly: rebuild each tenant's recent RatingDailyRollup rows from raw ratings."""
+    from tenant_schemas.utils import schema_context
+    from tenants.models import Tenant
+    from social_integrations.rating_rollups import reconcile
+
+    total = 0
+    for tenant in Tenant.objects.exclude(schema_name='public'):
+        try:
+            with schema_context(tenant.schema_name):
+                total += reconcile(days)
+        except Exception as e:
+            logger.error(f"Rating rollup reconcile failed for {tenant.schema_name}: {e}")
+    logger.info(f"Rating rollups reconciled: {total} rows rebuilt over the last {days} days")
+    return total
+
+
+@shared_task(soft_time_limit=120, time_limit=180)
+def sync_whatsapp_templates_for_account(schema_name, account_id):
+    """Refresh one WABA's local template table from Meta (see whatsapp_templates)."""
+    from tenant_schemas.utils import schema_context
+    from social_integrations.models import WhatsAppBusinessAccount
+    from social_integrations.whatsapp_templates import TemplateSyncError, sync_templates
+
+    with schema_context(schema_name):
+        account = WhatsAppBusinessAccount.objects.filter(pk=account_id, is_active=True).first()
+        if account is None:
+            return None
+        try:
+            return sync_templates(account)
+        except TemplateSyncError as e:
+            logger.warning(f"Template sync failed {schema_name}/{account.waba_id}: {e} {e.details}")
+            return None
+
+
+@shared_task
+def sync_all_whatsapp_templates():
+    """Fan out one template-sync job per active WABA across all tenants."""
+    from tenant_schemas.utils import schema_context
+    from tenants.models import Tenant
+    from social_integrations.models import WhatsAppBusinessAccount
+
+    queued = 0
+    for tenant in Tenant.objects.exclude(schema_name='public'):
+        try:
+            with schema_context(tenant.schema_name):
+                account_ids = list(
+                    WhatsAppBusinessAccount.objects.filter(is_active=True).values_list('id', flat=True)
+                )
+        except Exception as e:
+            logger.error(f"Template sync fan-out failed for tenant {tenant.schema_name}: {e}")
+            continue
+        for account_id in account_ids:
+            sync_whatsapp_templates_for_account.delay(tenant.schema_name, account_id)
+            queued += 1
+
+    logger.info(f'sync_all_whatsapp_templates queued {queued} accounts')
+    return queued
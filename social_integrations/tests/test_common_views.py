@@ -164,6 +164,51 @@ class TestArchiveAllConversations(SocialIntegrationTestCase):
         resp = self.api_post(self.url, {}, user=self.agent)
         self.assertNotEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_archive_all_is_set_based_and_idempotent(self):
+        from social_integrations.models import ConversationArchive
+
+        conn = self.create_fb_connection()
+        for sender in ('s1', 's1', 's2', 's3'):
+            self.create_fb_message(page_connection=conn, sender_id=sender, is_from_page=False)
+        self.create_chat_assignment(
+            user=self.agent, platform='facebook', conversation_id='s3',
+            account_id=conn.page_id, status='in_session',
+        )
+        wa = self.create_wa_account()
+        self.create_wa_message(business_account=wa, from_number='+995555000111')
+
+        resp = self.api_post(self.url, {'platform': 'facebook,whatsapp'}, user=self.agent)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['archived_count'], 3)
+        keys = set(ConversationArchive.objects.values_list('platform', 'conversation_id', 'account_id'))
+        self.assertEqual(keys, {
+            ('facebook', 's1', conn.page_id),
+            ('facebook', 's2', conn.page_id),
+            ('whatsapp', '995555000111', wa.waba_id),
+        })
+
+        resp = self.api_post(self.url, {'platform': 'facebook,whatsapp'}, user=self.agent)
+        self.assertEqual(resp.data['archived_count'], 0)
+
+    def test_async_mode_reports_progress(self):
+        conn = self.create_fb_connection()
+        self.create_fb_message(page_connection=conn, sender_id='s1', is_from_page=False)
+
+        with patch('social_integrations.tasks.run_bulk_inbox_job.delay') as delay:
+            resp = self.api_post(self.url, {'platform': 'facebook', 'async': True}, user=self.agent)
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job_id = resp.data['job_id']
+        self.assertEqual(resp.data['status'], 'pending')
+
+        from social_integrations.tasks import run_bulk_inbox_job
+        run_bulk_inbox_job(*delay.call_args.args)
+
+        resp = self.api_get(f'/api/social/bulk-jobs/{job_id}/', user=self.agent)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['status'], 'completed')
+        self.assertEqual(resp.data['completed_steps'], 1)
+        self.assertEqual(resp.data['archived_count'], 1)
+
     def test_no_feature_denied(self):
         with patch('users.models.User.has_feature', return_value=False):
             resp = self.api_post(self.url, {}, user=self.agent)
@@ -191,6 +236,126 @@ class TestSocialSettings(SocialIntegrationTestCase):
         self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class TestSocialSettingsBundle(SocialIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from social_integrations import settings_cache
+        self.settings_cache = settings_cache
+
+    def test_bundle_is_shared_and_follows_saves(self):
+        from django.db import connection
+        # The test transaction is rolled back, not committed: don't leave
+        # its rows cached under the current version.
+        self.addCleanup(self.settings_cache.invalidate_now, connection.schema_name)
+
+        self.assertIsNone(self.settings_cache.get_settings())
+        with self.captureOnCommitCallbacks(execute=True):
+            row = self.create_settings(chat_assignment_enabled=True, auto_reply_settings={
+                'facebook': {'welcome_enabled': True, 'welcome_message': 'Hi'},
+            })
+
+        bundle = self.settings_cache.get_settings()
+        self.assertTrue(bundle.chat_assignment_enabled)
+        self.assertEqual(bundle.auto_reply_for('facebook')['welcome_message'], 'Hi')
+        self.assertEqual(bundle.auto_reply_for('whatsapp'), {})
+        with self.assertNumQueries(0):
+            self.settings_cache.get_settings()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            row.chat_assignment_enabled = False
+            row.save()
+            # Before commit the saver reads its own row, and caches nothing.
+            self.assertFalse(self.settings_cache.get_settings().chat_assignment_enabled)
+        self.assertFalse(self.settings_cache.get_settings().chat_assignment_enabled)
+
+    def test_rolled_back_save_is_not_cached(self):
+        from django.db import connection, transaction
+        self.addCleanup(self.settings_cache.invalidate_now, connection.schema_name)
+        with self.captureOnCommitCallbacks(execute=True):
+            row = self.create_settings(chat_assignment_enabled=True)
+        self.assertTrue(self.settings_cache.get_settings().chat_assignment_enabled)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    row.chat_assignment_enabled = False
+                    row.save()
+                    self.assertFalse(self.settings_cache.get_settings().chat_assignment_enabled)
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertTrue(self.settings_cache.get_settings().chat_assignment_enabled)
+
+    def test_away_hours_use_business_timezone(self):
+        from datetime import datetime, timezone as dt_timezone
+
+        self.create_settings(
+            timezone='Asia/Tbilisi', away_hours_enabled=True,
+            away_hours_schedule={'monday': [22, 23]},
+        )
+        bundle = self.settings_cache.get_settings()
+        # 18:30 UTC on a Monday is 22:30 in Tbilisi (UTC+4).
+        self.assertTrue(bundle.is_away_at(datetime(2026, 3, 2, 18, 30, tzinfo=dt_timezone.utc)))
+        self.assertFalse(bundle.is_away_at(datetime(2026, 3, 2, 10, 0, tzinfo=dt_timezone.utc)))
+
+
+class TestSearchMessages(SocialIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.agent = self.create_user(email='search@test.com')
+        self.url = '/api/social/search/'
+
+    def test_search_spans_channels_and_ranks(self):
+        fb = self.create_fb_connection()
+        self.create_fb_message(page_connection=fb, sender_id='s1', message_text='Where is my parcel?')
+        self.create_fb_message(page_connection=fb, sender_id='s2', message_text='Unrelated question')
+        wa = self.create_wa_account()
+        self.create_wa_message(business_account=wa, message_text='parcel tracking number please')
+
+        resp = self.api_get(self.url, user=self.agent, data={'q': 'parcel'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        platforms = {r['platform'] for r in resp.data['results']}
+        self.assertEqual(platforms, {'facebook', 'whatsapp'})
+        ranks = [r['rank'] for r in resp.data['results']]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+        self.assertFalse(resp.data['has_more'])
+
+    def test_pagination(self):
+        fb = self.create_fb_connection()
+        for i in range(3):
+            self.create_fb_message(page_connection=fb, sender_id=f's{i}', message_text=f'invoice {i}')
+
+        resp = self.api_get(self.url, user=self.agent, data={'q': 'invoice', 'page_size': 2})
+        self.assertEqual(len(resp.data['results']), 2)
+        self.assertTrue(resp.data['has_more'])
+        resp = self.api_get(self.url, user=self.agent, data={'q': 'invoice', 'page_size': 2, 'page': 2})
+        self.assertEqual(len(resp.data['results']), 1)
+        self.assertFalse(resp.data['has_more'])
+
+    def test_short_query_returns_nothing(self):
+        resp = self.api_get(self.url, user=self.agent, data={'q': 'a'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['results'], [])
+
+    def test_hide_assigned_matches_whatsapp_numbers_without_plus(self):
+        from social_integrations.message_search import search_messages
+
+        wa = self.create_wa_account()
+        self.create_wa_message(business_account=wa, from_number='+15550001111', message_text='refund request')
+        colleague = self.create_user(email='search-colleague@test.com')
+        self.create_chat_assignment(
+            user=colleague, platform='whatsapp', conversation_id='15550001111', account_id=wa.waba_id,
+        )
+
+        hidden = search_messages('refund', ['whatsapp'], user=self.agent, hide_assigned=True)
+        self.assertEqual(hidden['results'], [])
+        visible = search_messages('refund', ['whatsapp'], user=colleague, hide_assigned=True)
+        self.assertEqual([r['conversation_id'] for r in visible['results']], ['15550001111'])
+
+
 class TestUnifiedConversations(SocialIntegrationTestCase):
 
     def setUp(self):
@@ -238,6 +403,59 @@ class TestChatAssignmentViews(SocialIntegrationTestCase):
         self.assertNotEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class TestChatAssignmentMap(SocialIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from django.db import connection
+        from social_integrations import assignment_map
+        self.map = assignment_map
+        self.schema = connection.schema_name
+        self._clear()
+        self.agent = self.create_user(email='map-agent@test.com')
+
+    def tearDown(self):
+        self._clear()
+        super().tearDown()
+
+    def _clear(self):
+        redis = self.map.get_redis()
+        redis.delete(self.map.MAP_KEY.format(schema=self.schema), self.map.GEN_KEY.format(schema=self.schema))
+
+    def test_lookup_loads_once_then_follows_saves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment = self.create_chat_assignment(
+                user=self.agent, conversation_id='map_conv', account_id='map_page')
+        self.assertEqual(self.map.lookup('facebook', 'map_conv', 'map_page'), self.agent.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.map.lookup('facebook', 'map_conv', 'map_page'), self.agent.id)
+            self.assertIsNone(self.map.lookup('facebook', 'other_conv', 'map_page'))
+
+        # end_session: completed with no user releases the chat.
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.status = 'completed'
+            assignment.assigned_user = None
+            assignment.save()
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.map.lookup('facebook', 'map_conv', 'map_page'))
+            self.assertEqual(self.map.assigned_users(['facebook']), {})
+
+    def test_change_during_load_is_not_overwritten(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_chat_assignment(user=self.agent, conversation_id='race_conv', account_id='race_page')
+        live_assignments = self.map._live_assignments
+
+        def concurrent_transfer():
+            # Another request commits a change while the load reads its rows.
+            self.map._apply_now(self.schema, self.map._field('facebook', 'race_page', 'race_conv'), None)
+            return live_assignments()
+
+        with patch.object(self.map, '_live_assignments', side_effect=concurrent_transfer):
+            self.map.assigned_users()
+        redis = self.map.get_redis()
+        self.assertIsNone(redis.hget(self.map.MAP_KEY.format(schema=self.schema), self.map.READY_FIELD))
+
+
 class TestWebhookDebugViews(SocialIntegrationTestCase):
 
     def setUp(self):
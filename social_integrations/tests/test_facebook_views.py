@@ -78,7 +78,7 @@ class TestFacebookSendMessage(SocialIntegrationTestCase):
         resp = self.api_post(self.url, {}, user=self.agent)
         self.assertIn(resp.status_code, [status.HTTP_400_BAD_REQUEST, status.HTTP_404_NOT_FOUND])
 
-    @patch('social_integrations.views.requests.post')
+    @patch('social_integrations.graph_client.GraphClient.post')
     def test_send_message_with_valid_data(self, mock_post):
         mock_post.return_value = MagicMock(
             status_code=200,
@@ -0,0 +1,180 @@
+"""
+Tests for the shared Graph API client, run against a local stub server.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.test import SimpleTestCase, override_settings
+
+from social_integrations.graph_client import (
+    GraphClient, GraphRateLimitError, TokenBucket, parse_usage_headers,
+)
+
+
+class _StubGraphHandler(BaseHTTPRequestHandler):
+    """Answers like graph.facebook.com and records every request it sees."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(('GET', self.path))
+        server.peers.add(self.client_address)
+        node_id = urlparse(self.path).path.rsplit('/', 1)[-1]
+        self._reply(200, {'id': node_id, 'url': f'https://cdn.test/{node_id}'}, server.extra_headers)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = parse_qs(self.rfile.read(length).decode())
+        server.requests.append(('POST', self.path))
+        server.peers.add(self.client_address)
+        if 'batch' in body:
+            calls = json.loads(body['batch'][0])
+            server.batch_sizes.append(len(calls))
+            items = []
+            for call in calls:
+                node_id = call['relative_url'].split('?')[0]
+                if node_id.startswith('missing'):
+                    items.append({'code': 404, 'body': json.dumps({'error': {'code': 100}})})
+                else:
+                    items.append({'code': 200, 'body': json.dumps({'id': node_id, 'url': f'https://cdn.test/{node_id}'})})
+            self._reply(200, items, server.extra_headers)
+            return
+        self._reply(200, {'message_id': 'mid_1'}, server.extra_headers)
+
+
+class GraphStubServerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubGraphHandler)
+        self.server.requests = []
+        self.server.peers = set()
+        self.server.batch_sizes = []
+        self.server.extra_headers = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._settings = override_settings(SOCIAL_INTEGRATIONS={
+            'GRAPH_API_BASE_URL': base,
+            'FACEBOOK_API_VERSION': 'v23.0',
+        })
+        self._settings.enable()
+        self.client_ = GraphClient(rate_per_second=1000, burst=1000, max_wait=0.5)
+
+    def tearDown(self):
+        self._settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+
+class TestGraphClientRouting(GraphStubServerTestCase):
+
+    def test_absolute_graph_urls_are_rewritten_to_configured_base(self):
+        resp = self.client_.get('https://graph.facebook.com/v23.0/12345', params={'access_token': 't'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['id'], '12345')
+        self.assertTrue(self.server.requests[0][1].startswith('/v23.0/12345'))
+
+    def test_relative_paths_get_api_version(self):
+        self.client_.post('me/messages', params={'access_token': 't'}, json={})
+        self.assertTrue(self.server.requests[0][1].startswith('/v23.0/me/messages'))
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.client_.get('123', params={'access_token': 't'})
+        # All five calls rode the same pooled keep-alive connection.
+        self.assertEqual(len(self.server.peers), 1)
+
+
+class TestGraphClientBatching(GraphStubServerTestCase):
+
+    def test_get_objects_uses_batch_endpoint(self):
+        found = self.client_.get_objects(['a', 'b', 'c'], access_token='t', fields='name')
+        self.assertEqual(set(found), {'a', 'b', 'c'})
+        self.assertEqual(self.server.batch_sizes, [3])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_batches_are_chunked_at_fifty(self):
+        ids = [f'id{i}' for i in range(120)]
+        found = self.client_.get_objects(ids, access_token='t')
+        self.assertEqual(len(found), 120)
+        self.assertEqual(self.server.batch_sizes, [50, 50, 20])
+
+    def test_failed_items_are_dropped(self):
+        found = self.client_.get_media_urls(['ok1', 'missing1'], access_token='t')
+        self.assertEqual(found, {'ok1': 'https://cdn.test/ok1'})
+
+    def test_single_id_skips_batch(self):
+        found = self.client_.get_media_urls(['only'], access_token='t')
+        self.assertEqual(found, {'only': 'https://cdn.test/only'})
+        self.assertEqual(self.server.batch_sizes, [])
+
+
+class TestGraphClientUsageHeaders(GraphStubServerTestCase):
+
+    def test_regain_access_pauses_token(self):
+        self.server.extra_headers = {
+            'X-Business-Use-Case-Usage': json.dumps({
+                'biz_1': [{'type': 'messenger', 'call_count': 100, 'estimated_time_to_regain_access': 2}],
+            }),
+        }
+        self.client_.get('1', params={'access_token': 'hot'})
+        with self.assertRaises(GraphRateLimitError):
+            self.client_.get('2', params={'access_token': 'hot'})
+        # Other tokens are unaffected.
+        self.server.extra_headers = {}
+        self.assertEqual(self.client_.get('3', params={'access_token': 'cold'}).status_code, 200)
+
+    def test_parse_usage_headers(self):
+        usage, regain = parse_usage_headers({
+            'X-App-Usage': json.dumps({'call_count': 42, 'total_time': 12}),
+            'X-Business-Use-Case-Usage': 'not json',
+        })
+        self.assertEqual(usage, 42)
+        self.assertEqual(regain, 0)
+
+
+class TestTokenBucket(SimpleTestCase):
+
+    def _bucket(self, rate, capacity):
+        self.now = 0.0
+        self.slept = []
+
+        def sleep(seconds):
+            self.slept.append(seconds)
+            self.now += seconds
+
+        return TokenBucket(rate, capacity, clock=lambda: self.now, sleep=sleep)
+
+    def test_burst_then_waits_for_refill(self):
+        bucket = self._bucket(rate=2, capacity=2)
+        bucket.acquire(max_wait=5)
+        bucket.acquire(max_wait=5)
+        self.assertEqual(self.slept, [])
+        bucket.acquire(max_wait=5)
+        self.assertEqual(self.slept, [0.5])
+
+    def test_raises_when_wait_exceeds_max(self):
+        bucket = self._bucket(rate=1, capacity=1)
+        bucket.pause(30)
+        with self.assertRaises(GraphRateLimitError) as ctx:
+            bucket.acquire(max_wait=1)
+        self.assertGreaterEqual(ctx.exception.retry_after, 29)
@@ -10,6 +10,7 @@ The legacy /messages page ignores these unknown event types, so adding them
 is purely additive and these tests guard us from regressing that promise.
 """
 from unittest.mock import AsyncMock, patch
+from django.test import SimpleTestCase
 from rest_framework import status
 
 from social_integrations.tests.conftest import SocialIntegrationTestCase
@@ -227,3 +228,73 @@ class TestBroadcastsAreBestEffort(SocialIntegrationTestCase):
                 user=self.agent,
             )
         self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.content)
+
+
+class TestScopedMessageFanout(SimpleTestCase):
+    """New-message events go to the smallest matching set of groups."""
+
+    def _publish(self, **kwargs):
+        from asgiref.sync import async_to_sync
+        from social_integrations.consumers import send_scoped_message_notification
+
+        channel_layer = _make_async_channel_layer()
+        with patch("channels.layers.get_channel_layer", return_value=channel_layer):
+            async_to_sync(send_scoped_message_notification)(
+                "acme", "+995555123456", {"timestamp": "2026-01-01T00:00:00Z"}, **kwargs
+            )
+        return channel_layer
+
+    def test_unassigned_goes_to_tenant_group_only(self):
+        channel_layer = self._publish()
+        self.assertEqual(_groups_sent(channel_layer), ["messages_acme"])
+
+    def test_assigned_skips_tenant_group(self):
+        channel_layer = self._publish(assigned_user_id=7)
+        groups = _groups_sent(channel_layer)
+        self.assertNotIn("messages_acme", groups)
+        self.assertIn("messages_acme_user_7", groups)
+        self.assertIn("messages_acme_all", groups)
+        # Phone-number conversation ids are sanitised into valid group names.
+        self.assertIn("conversation_acme_-995555123456", groups)
+
+    def _delivered(self, consumer, audience):
+        from asgiref.sync import async_to_sync
+
+        consumer.send = AsyncMock()
+        async_to_sync(consumer.new_message)({
+            "type": "new_message", "message": {}, "conversation_id": "c1",
+            "timestamp": None, "assigned_user_id": 7, "audience": audience,
+        })
+        return consumer.send.called
+
+    def _consumer(self, scope, user_id):
+        from types import SimpleNamespace
+        from social_integrations.consumers import MessagesConsumer
+
+        consumer = MessagesConsumer()
+        consumer.delivery_scope = scope
+        consumer.user = SimpleNamespace(id=user_id, is_anonymous=False)
+        return consumer
+
+    def test_all_scope_socket_gets_one_copy(self):
+        # The assignee in the "all" scope sits in the user, _all and
+        # conversation groups; only the _all copy is forwarded.
+        consumer = self._consumer("all", 7)
+        self.assertEqual(
+            [self._delivered(consumer, audience) for audience in ("user", "all", "conversation")],
+            [False, True, False],
+        )
+
+    def test_assigned_scope_socket_gets_one_copy(self):
+        assignee = self._consumer("assigned", 7)
+        self.assertTrue(self._delivered(assignee, "user"))
+        self.assertFalse(self._delivered(assignee, "conversation"))
+        viewer = self._consumer("assigned", 8)
+        self.assertTrue(self._delivered(viewer, "conversation"))
+
+    def test_long_conversation_ids_are_hashed(self):
+        from social_integrations.consumers import conversation_group
+
+        name = conversation_group("acme", "<" + "x" * 200 + "@mail.example.com>")
+        self.assertLess(len(name), 100)
+        self.assertEqual(name, conversation_group("acme", "<" + "x" * 200 + "@mail.example.com>"))
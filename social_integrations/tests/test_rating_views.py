@@ -84,3 +84,64 @@ class TestPublicRatingEndpoints(SocialIntegrationTestCase):
             status.HTTP_404_NOT_FOUND,
             status.HTTP_400_BAD_REQUEST,
         ])
+
+
+class TestRatingRollups(SocialIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.staff = self.create_user(email='rollup-staff@test.com', is_staff=True)
+        self.url = '/api/social/rating-statistics/'
+
+    def test_rollups_follow_inserts_and_answers(self):
+        from social_integrations.models import RatingDailyRollup
+
+        user = self.create_user(email='rollup-agent@test.com')
+        self.create_chat_rating(rated_user=user, rating=5)
+        pending = self.create_chat_rating(rated_user=user, rating=0)
+
+        rollup = RatingDailyRollup.objects.get(rated_user=user, source='social')
+        self.assertEqual((rollup.total, rollup.rating_sum, rollup.rating_5), (1, 5, 1))
+
+        pending.rating = 2
+        pending.save()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.total, rollup.rating_sum, rollup.rating_2), (2, 7, 1))
+
+        resp = self.api_get(f'{self.url}?source=social', user=self.staff)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        row = next(u for u in resp.data['users'] if u['user_id'] == user.id)
+        self.assertEqual(row['total_ratings'], 2)
+        self.assertEqual(row['average_rating'], 3.5)
+        self.assertEqual(row['rating_breakdown'], {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+        self.assertEqual(resp.data['overall']['by_source']['social'], {'total': 2, 'average': 3.5})
+
+    def test_reconcile_repairs_signal_bypassing_updates(self):
+        from social_integrations.models import ChatRating, RatingDailyRollup
+        from social_integrations.rating_rollups import reconcile
+
+        user = self.create_user(email='rollup-bypass@test.com')
+        rating = self.create_chat_rating(rated_user=user, rating=4)
+        ChatRating.objects.filter(pk=rating.pk).update(rating=1)
+
+        reconcile(days=1)
+        rollup = RatingDailyRollup.objects.get(rated_user=user, source='social')
+        self.assertEqual((rollup.total, rollup.rating_sum, rollup.rating_1, rollup.rating_4), (1, 1, 1, 0))
+
+    def test_deleting_user_moves_call_ratings_to_unassigned(self):
+        from crm.models import CallRating, SipConfiguration
+        from social_integrations.models import RatingDailyRollup
+
+        sip = SipConfiguration.objects.create(
+            name='Rollup SIP', created_by=self.staff, sip_server='pbx.test.com', username='u', password='p',
+        )
+        leaver = self.create_user(email='rollup-leaver@test.com')
+        CallRating.objects.create(caller_number='995555000111', rated_user=leaver, rating=4, sip_configuration=sip)
+        CallRating.objects.create(caller_number='995555000222', rated_user=None, rating=2, sip_configuration=sip)
+        self.create_chat_rating(rated_user=leaver, rating=5)
+
+        leaver.delete()
+
+        self.assertFalse(RatingDailyRollup.objects.filter(source='social').exists())
+        unassigned = RatingDailyRollup.objects.get(source='calls_sms', rated_user__isnull=True)
+        self.assertEqual((unassigned.total, unassigned.rating_sum), (2, 6))
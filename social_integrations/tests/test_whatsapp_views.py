@@ -1,7 +1,8 @@
 """
 Tests for WhatsApp-related views.
 """
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
+from django.test import SimpleTestCase
 from rest_framework import status
 from social_integrations.tests.conftest import SocialIntegrationTestCase
 
@@ -169,3 +170,274 @@ class TestWhatsAppTemplateViews(SocialIntegrationTestCase):
         url = f'/api/social/whatsapp/{acct.waba_id}/templates/'
         resp = self.api_get(url, user=self.agent)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+class TestWhatsAppMediaProxy(SocialIntegrationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.agent = self.create_user(email='wa-media-agent@test.com')
+        self.account = self.create_wa_account()
+
+    def _cache(self, media_id, content=b'0123456789'):
+        from social_integrations.models import CachedMedia
+        return CachedMedia.objects.create(
+            platform='whatsapp',
+            media_id=media_id,
+            account_id=self.account.waba_id,
+            storage_path=f'social_media/test/whatsapp/{media_id}',
+            content_type='image/jpeg',
+            size=len(content),
+        )
+
+    def test_cached_media_redirects_without_graph_call(self):
+        self._cache('media_cached')
+        url = f'/api/social/whatsapp-media/media_cached/?waba_id={self.account.waba_id}'
+        with patch('social_integrations.graph_client.GraphClient.get') as mock_get, \
+                patch('social_integrations.media_cache.media_storage') as media_storage:
+            media_storage.return_value.url.return_value = 'https://cdn.test/media_cached?X-Amz-Signature=sig'
+            resp = self.api_get(url, user=self.agent)
+        self.assertEqual(resp.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(resp['Location'], 'https://cdn.test/media_cached?X-Amz-Signature=sig')
+        self.assertTrue(resp['Cache-Control'].startswith('private'))
+        mock_get.assert_not_called()
+
+    def test_cache_is_not_served_for_unknown_account(self):
+        self._cache('media_other')
+        url = '/api/social/whatsapp-media/media_other/?waba_id=not-this-tenant'
+        with patch('social_integrations.media_cache.media_storage') as media_storage:
+            resp = self.api_get(url, user=self.agent)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        media_storage.assert_not_called()
+
+    def test_range_request_streams_partial_content(self):
+        import io
+        from django.test import override_settings
+
+        self._cache('media_range')
+        url = f'/api/social/whatsapp-media/media_range/?waba_id={self.account.waba_id}'
+        with override_settings(SOCIAL_MEDIA_CACHE_REDIRECT=False), \
+                patch('social_integrations.media_cache.media_storage') as media_storage:
+            media_storage.return_value.open.return_value = io.BytesIO(b'0123456789')
+            resp = self.api_get(url, user=self.agent, HTTP_RANGE='bytes=2-5')
+            body = b''.join(resp.streaming_content)
+        self.assertEqual(resp.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(resp['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(body, b'2345')
+
+    def test_unsatisfiable_range(self):
+        from django.test import override_settings
+
+        self._cache('media_416')
+        url = f'/api/social/whatsapp-media/media_416/?waba_id={self.account.waba_id}'
+        with override_settings(SOCIAL_MEDIA_CACHE_REDIRECT=False):
+            resp = self.api_get(url, user=self.agent, HTTP_RANGE='bytes=50-')
+        self.assertEqual(resp.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+
+class TestWhatsAppHistoryImport(SocialIntegrationTestCase):
+
+    def _entry(self, phase, chunk_order, progress, messages):
+        return {
+            'metadata': {'phase': phase, 'chunk_order': chunk_order, 'progress': progress},
+            'threads': [{'id': '995555000111', 'messages': messages}],
+        }
+
+    def _msg(self, n, outbound=False, ts=1760000000):
+        return {
+            'id': f'wamid.hist{n}',
+            'from': '15550001234' if outbound else '995555000111',
+            'timestamp': str(ts + n),
+            'type': 'text',
+            'text': {'body': f'hello {n}'},
+        }
+
+    def test_chunks_are_checkpointed_and_deduplicated(self):
+        from social_integrations.models import WhatsAppContact, WhatsAppMessage
+        from social_integrations.whatsapp_history import import_history_chunk
+
+        account = self.create_wa_account(phone_number='+15550001234')
+        first = import_history_chunk(account, self._entry(1, 1, 50, [self._msg(1), self._msg(2, outbound=True)]))
+        self.assertEqual(first.status, 'importing')
+        self.assertEqual(first.messages_imported, 2)
+        self.assertFalse(WhatsAppContact.objects.filter(account=account).exists())
+
+        # Redelivered chunk plus the final one: the repeat is skipped and the
+        # contact summary is rebuilt once the phase reaches 100%.
+        import_history_chunk(account, self._entry(1, 1, 50, [self._msg(1), self._msg(2, outbound=True)]))
+        done = import_history_chunk(account, self._entry(1, 2, 100, [self._msg(3)]))
+
+        self.assertEqual(done.status, 'completed')
+        self.assertEqual(done.chunks_processed, 2)
+        self.assertEqual(done.messages_received, 3)
+        self.assertEqual(done.messages_imported, 3)
+        self.assertEqual(WhatsAppMessage.objects.filter(business_account=account).count(), 3)
+        outbound = WhatsAppMessage.objects.get(message_id='wamid.hist2')
+        self.assertTrue(outbound.is_from_business)
+        self.assertEqual(outbound.to_number, '995555000111')
+        contact = WhatsAppContact.objects.get(account=account, wa_id='995555000111')
+        self.assertEqual(int(contact.last_message_at.timestamp()), 1760000003)
+        account.refresh_from_db()
+        self.assertIsNotNone(account.history_synced_at)
+
+    def test_late_chunk_keeps_a_finished_phase_until_a_new_sync(self):
+        from social_integrations.whatsapp_history import import_history_chunk, start_phase
+
+        account = self.create_wa_account(phone_number='+15550001234')
+        import_history_chunk(account, self._entry(2, 1, 50, [self._msg(1)]))
+        import_history_chunk(account, self._entry(2, 2, 100, [self._msg(2)]))
+
+        late = import_history_chunk(account, self._entry(2, 1, 50, [self._msg(1)]))
+        self.assertEqual(late.status, 'completed')
+        self.assertEqual((late.progress, late.chunks_processed, late.messages_imported), (100, 2, 2))
+
+        restarted = start_phase(account, 2)
+        self.assertEqual((restarted.status, restarted.last_chunk_order), ('pending', 0))
+        again = import_history_chunk(account, self._entry(2, 1, 50, [self._msg(1), self._msg(4)]))
+        self.assertEqual((again.status, again.chunks_processed, again.messages_imported), ('importing', 1, 1))
+
+
+class TestWhatsAppStatusCollapse(SimpleTestCase):
+
+    def test_highest_status_wins_and_keeps_earliest_timestamps(self):
+        from social_integrations.whatsapp_status_ingest import collapse, normalize
+
+        records = collapse(normalize(s) for s in [
+            {'id': 'wamid.1', 'status': 'sent', 'timestamp': '100'},
+            {'id': 'wamid.1', 'status': 'read', 'timestamp': '130'},
+            {'id': 'wamid.1', 'status': 'delivered', 'timestamp': '110'},
+            {'id': 'wamid.2', 'status': 'failed', 'timestamp': '105', 'errors': [{'message': 'Undeliverable'}]},
+            {'id': 'wamid.3', 'status': 'bogus'},
+        ])
+        self.assertEqual(set(records), {'wamid.1', 'wamid.2'})
+        self.assertEqual(records['wamid.1']['status'], 'read')
+        self.assertEqual(records['wamid.1']['delivered_ts'], 110)
+        self.assertEqual(records['wamid.1']['read_ts'], 130)
+        self.assertEqual(records['wamid.2']['error'], 'Undeliverable')
+
+
+class TestWhatsAppStatusApply(SocialIntegrationTestCase):
+
+    def test_single_update_without_downgrade_and_one_frame_per_conversation(self):
+        from social_integrations.models import WhatsAppMessage
+        from social_integrations.whatsapp_status_ingest import apply_updates, normalize
+
+        account = self.create_wa_account()
+        first = self.create_wa_message(business_account=account, is_from_business=True, to_number='995555000111')
+        second = self.create_wa_message(business_account=account, is_from_business=True, to_number='995555000111')
+        WhatsAppMessage.objects.filter(pk=second.pk).update(status='read', is_read=True)
+
+        with patch('social_integrations.consumers.send_message_status_batch', new_callable=AsyncMock) as send, \
+                self.captureOnCommitCallbacks(execute=True):
+            updated = apply_updates('test', [normalize(s) for s in [
+                {'id': first.message_id, 'status': 'delivered', 'timestamp': '1760000000'},
+                {'id': second.message_id, 'status': 'delivered', 'timestamp': '1760000001'},
+                {'id': 'wamid.unknown', 'status': 'read', 'timestamp': '1760000002'},
+            ]])
+
+        self.assertEqual(updated, 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, 'delivered')
+        self.assertTrue(first.is_delivered)
+        self.assertEqual(second.status, 'read')
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(len(send.call_args.kwargs['statuses']), 2)
+
+    def test_failed_flush_keeps_the_buffer(self):
+        from django.db import connection
+        from social_integrations import whatsapp_status_ingest as ingest
+
+        schema = connection.schema_name
+        redis = ingest.get_redis()
+        key = ingest.BUFFER_KEY.format(schema=schema)
+        redis.delete(key, ingest.LOCK_KEY.format(schema=schema))
+        self.addCleanup(redis.delete, key)
+        account = self.create_wa_account()
+        message = self.create_wa_message(business_account=account, is_from_business=True, to_number='995555000222')
+        with patch('social_integrations.tasks.flush_whatsapp_statuses.apply_async'):
+            ingest.enqueue(schema, [{'id': message.message_id, 'status': 'read', 'timestamp': '1760000000'}])
+
+        with patch.object(ingest, 'apply_batch', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                ingest.flush(schema)
+        self.assertEqual(redis.llen(key), 1)
+
+        with patch('social_integrations.consumers.send_message_status_batch', new_callable=AsyncMock):
+            self.assertEqual(ingest.flush(schema), 1)
+        self.assertEqual(redis.llen(key), 0)
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'read')
+
+    def test_beat_task_flushes_buffers_whose_flush_was_lost(self):
+        from django.db import connection
+        from social_integrations import whatsapp_status_ingest as ingest
+        from social_integrations.tasks import flush_pending_whatsapp_statuses
+
+        schema = connection.schema_name
+        redis = ingest.get_redis()
+        key = ingest.BUFFER_KEY.format(schema=schema)
+        self.addCleanup(redis.delete, key, ingest.FLUSH_FLAG_KEY.format(schema=schema))
+        with patch('social_integrations.tasks.flush_whatsapp_statuses.apply_async'):
+            ingest.enqueue(schema, [{'id': 'wamid.lost', 'status': 'read', 'timestamp': '1760000000'}])
+
+        self.assertIn(schema, ingest.pending_schemas())
+        with patch('social_integrations.tasks.flush_whatsapp_statuses.delay') as delay:
+            flush_pending_whatsapp_statuses()
+        delay.assert_any_call(schema)
+
+
+class TestWhatsAppTemplateSync(SocialIntegrationTestCase):
+
+    def _remote(self, name, language='en', template_id='1', status_value='APPROVED'):
+        return {
+            'id': template_id, 'name': name, 'language': language,
+            'status': status_value, 'category': 'UTILITY', 'components': [],
+        }
+
+    def test_diff_upserts_and_deletes_stale(self):
+        from social_integrations.models import WhatsAppMessageTemplate
+        from social_integrations.whatsapp_templates import sync_templates
+
+        acct = self.create_wa_account()
+        self.create_wa_template(business_account=acct, name='order_update', language='en',
+                                template_id='10', status='PENDING', category='UTILITY', components=[])
+        self.create_wa_template(business_account=acct, name='same', language='en',
+                                template_id='11', status='APPROVED', category='UTILITY', components=[])
+        self.create_wa_template(business_account=acct, name='gone', language='en', template_id='12')
+
+        remote = [
+            self._remote('order_update', template_id='10'),   # status changed
+            self._remote('same', template_id='11'),           # unchanged
+            self._remote('welcome', language='ka', template_id='13'),  # new
+        ]
+        with patch('social_integrations.whatsapp_templates.fetch_all_templates', return_value=remote):
+            result = sync_templates(acct)
+
+        self.assertEqual(result, {'fetched': 3, 'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1})
+        rows = {
+            (t.name, t.language): t.status
+            for t in WhatsAppMessageTemplate.objects.filter(business_account=acct)
+        }
+        self.assertEqual(rows, {
+            ('order_update', 'en'): 'APPROVED',
+            ('same', 'en'): 'APPROVED',
+            ('welcome', 'ka'): 'APPROVED',
+        })
+
+    def test_fetch_follows_paging_cursors(self):
+        from unittest.mock import MagicMock
+        from social_integrations.whatsapp_templates import fetch_all_templates
+
+        acct = self.create_wa_account()
+        pages = [
+            {'data': [self._remote('a')], 'paging': {'next': 'https://graph.facebook.com/v23.0/x?after=c1'}},
+            {'data': [self._remote('b')], 'paging': {}},
+        ]
+        responses = [MagicMock(status_code=200, json=MagicMock(return_value=page)) for page in pages]
+        with patch('social_integrations.graph_client.GraphClient.get', side_effect=responses) as get:
+            templates = fetch_all_templates(acct)
+
+        self.assertEqual([t['name'] for t in templates], ['a', 'b'])
+        self.assertEqual(get.call_count, 2)
+        self.assertIn('after=c1', get.call_args.args[0])
@@ -5,10 +5,15 @@ for the `/api/widget/public/*` endpoints. WidgetConnection lives in the public
 schema (SHARED_APPS/widget_registry); WidgetSession and WidgetMessage live in
 each tenant's schema (TENANT_APPS/social_integrations).
 """
+import asyncio
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 from tenant_schemas.utils import schema_context
 
+from social_integrations import widget_poll
 from social_integrations.models import WidgetMessage, WidgetSession
 from social_integrations.tests.conftest import SocialIntegrationTestCase
 from widget_registry.models import WidgetConnection
@@ -103,6 +108,43 @@ class TestWidgetConfig(WidgetPublicTestCase):
         self.assertEqual(payload['widget_token'], conn.widget_token)
 
 
+class TestWidgetTokenCache(WidgetPublicTestCase):
+
+    def test_second_lookup_skips_the_database(self):
+        from social_integrations.widget_utils import resolve_widget_connection
+
+        conn = self._make_connection()
+        first, err = resolve_widget_connection(conn.widget_token)
+        self.assertIsNone(err)
+        with self.assertNumQueries(0):
+            again, err = resolve_widget_connection(conn.widget_token)
+        self.assertIsNone(err)
+        self.assertEqual(again.pk, conn.pk)
+        self.assertEqual(again.tenant_schema, self.tenant.schema_name)
+
+    def test_unknown_tokens_are_negatively_cached(self):
+        from social_integrations.widget_utils import resolve_widget_connection
+
+        token = WidgetConnection.generate_token()
+        self.assertEqual(resolve_widget_connection(token), (None, 'not_found'))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_widget_connection(token), (None, 'not_found'))
+
+    def test_save_invalidates_cached_snapshot(self):
+        from social_integrations.widget_utils import resolve_widget_connection
+
+        conn = self._make_connection()
+        resolve_widget_connection(conn.widget_token)
+        with schema_context('public'), self.captureOnCommitCallbacks() as callbacks:
+            conn.is_active = False
+            conn.save()
+            # Until the save commits, other readers keep the committed row.
+            self.assertIsNone(resolve_widget_connection(conn.widget_token)[1])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(resolve_widget_connection(conn.widget_token), (None, 'disabled'))
+
+
 class TestCreateSession(WidgetPublicTestCase):
     url = '/api/widget/public/sessions/'
 
@@ -210,6 +252,30 @@ class TestPostMessage(WidgetPublicTestCase):
             self.assertEqual(msg.session.session_id, session_id)
             self.assertEqual(msg.message_text, 'hello from the widget')
 
+    def test_post_message_to_assigned_session_skips_tenant_group(self):
+        from unittest.mock import AsyncMock, patch
+
+        conn = self._make_connection(allowed_origins=['https://foo.ge'])
+        session_id = self._bootstrap_session(conn)
+
+        channel_layer = AsyncMock()
+        with patch('channels.layers.get_channel_layer', return_value=channel_layer), \
+                patch('social_integrations.assignment_map.lookup', return_value=7) as lookup:
+            resp = self.widget_post(
+                self.messages_url,
+                {'token': conn.widget_token, 'session_id': session_id, 'message_text': 'hi'},
+                HTTP_ORIGIN='https://foo.ge',
+            )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        lookup.assert_called_once_with('widget', session_id, str(conn.id))
+        groups = [call.args[0] for call in channel_layer.group_send.call_args_list]
+        schema = self.tenant.schema_name
+        self.assertNotIn(f'messages_{schema}', groups)
+        self.assertCountEqual(groups, [
+            f'messages_{schema}_user_7', f'messages_{schema}_all',
+            f'conversation_{schema}_widget_{conn.id}_{session_id}',
+        ])
+
     def test_post_message_empty_body_returns_400(self):
         conn = self._make_connection(allowed_origins=['https://foo.ge'])
         session_id = self._bootstrap_session(conn)
@@ -226,3 +292,193 @@ class TestPostMessage(WidgetPublicTestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(resp.json().get('error'), 'empty_message')
+
+
+class TestMessagesListConditional(WidgetPublicTestCase):
+    sessions_url = TestPostMessage.sessions_url
+    messages_url = TestPostMessage.messages_url
+    list_url = '/api/widget/public/messages/list/'
+    _bootstrap_session = TestPostMessage._bootstrap_session
+
+    def _poll(self, conn, session_id, **extra):
+        return self.widget_get(
+            f'{self.list_url}?token={conn.widget_token}&session_id={session_id}', **extra,
+        )
+
+    def test_unchanged_session_answers_304(self):
+        conn = self._make_connection(allowed_origins=['https://foo.ge'])
+        session_id = self._bootstrap_session(conn)
+
+        first = self._poll(conn, session_id)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first['ETag']
+        self.assertTrue(etag)
+
+        # The only query is EchoDeskTenantMiddleware's tenant lookup; the
+        # view answers from Redis without touching the tenant schema.
+        with self.assertNumQueries(1):
+            second = self._poll(conn, session_id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second['ETag'], etag)
+
+    def test_new_message_invalidates_etag(self):
+        conn = self._make_connection(allowed_origins=['https://foo.ge'])
+        session_id = self._bootstrap_session(conn)
+        etag = self._poll(conn, session_id)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.widget_post(
+                self.messages_url,
+                {'token': conn.widget_token, 'session_id': session_id, 'message_text': 'ping'},
+                HTTP_ORIGIN='https://foo.ge',
+            )
+
+        resp = self._poll(conn, session_id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual([m['message_text'] for m in resp.json()], ['ping'])
+
+
+class _FakePubSub:
+    def __init__(self):
+        self.subscribed = []
+        self.unsubscribed = []
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.subscribed.append(channel)
+
+    async def unsubscribe(self, channel):
+        self.unsubscribed.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        pass
+
+
+class _FakeAsyncRedis:
+    def __init__(self):
+        self.pubsub_instance = _FakePubSub()
+        self.values = {}
+
+    def pubsub(self):
+        return self.pubsub_instance
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def aclose(self):
+        pass
+
+
+class TestLongPollSubscriber(SimpleTestCase):
+
+    def setUp(self):
+        self.client_stub = _FakeAsyncRedis()
+        patcher = patch('redis.asyncio.from_url', return_value=self.client_stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waiters_share_one_subscription(self):
+        pubsub = self.client_stub.pubsub_instance
+        channel = widget_poll.CHANNEL_KEY.format(schema='t', session_id='s1')
+
+        async def scenario():
+            waits = [
+                asyncio.ensure_future(widget_poll.wait_for_change('t', 's1', '1', timeout=5))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            await pubsub.queue.put({'type': 'message', 'channel': channel.encode(), 'data': b'2'})
+            return await asyncio.gather(*waits)
+
+        self.assertEqual(asyncio.run(scenario()), [True, True, True])
+        self.assertEqual(pubsub.subscribed, [channel])
+        self.assertEqual(pubsub.unsubscribed, [channel])
+
+    def test_timeout_reports_no_change_and_unsubscribes(self):
+        pubsub = self.client_stub.pubsub_instance
+        channel = widget_poll.CHANNEL_KEY.format(schema='t', session_id='s2')
+
+        changed = asyncio.run(widget_poll.wait_for_change('t', 's2', '1', timeout=0.05))
+
+        self.assertFalse(changed)
+        self.assertEqual(pubsub.unsubscribed, [channel])
+
+    def test_bump_before_subscribe_is_not_missed(self):
+        self.client_stub.values[widget_poll.VERSION_KEY.format(schema='t', session_id='s3')] = b'2'
+
+        self.assertTrue(asyncio.run(widget_poll.wait_for_change('t', 's3', '1', timeout=5)))
+
+
+class TestWidgetWriteBehind(WidgetPublicTestCase):
+
+    def _session(self):
+        conn = self._make_connection()
+        with schema_context(self.tenant.schema_name):
+            return WidgetSession.objects.create(
+                connection_id=conn.id, session_id=WidgetConnection.generate_token()[-32:],
+                visitor_id='wb-visitor',
+            )
+
+    def test_replayed_batch_is_idempotent_and_ordered(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from social_integrations.widget_write_behind import message_record, write_messages
+
+        session = self._session()
+        now = timezone.now()
+        records = [
+            message_record(session.session_id, 'first', [], now),
+            message_record(session.session_id, 'second', [], now + timedelta(milliseconds=5)),
+            message_record('no-such-session', 'orphan', [], now),
+        ]
+        with schema_context(self.tenant.schema_name):
+            inserted, touched = write_messages(records)
+            replayed, _ = write_messages(records)
+            texts = list(
+                WidgetMessage.objects.filter(session=session).values_list('message_text', flat=True)
+            )
+        self.assertEqual(inserted, 2)
+        self.assertEqual(replayed, 0)
+        self.assertEqual(touched, {session.session_id})
+        self.assertEqual(texts, ['first', 'second'])
+
+    def test_touch_sessions_only_moves_forward(self):
+        from datetime import timedelta
+        from social_integrations.widget_write_behind import touch_sessions
+
+        session = self._session()
+        with schema_context(self.tenant.schema_name):
+            touch_sessions({session.session_id: session.last_seen_at - timedelta(hours=1)})
+            session.refresh_from_db()
+            before = session.last_seen_at
+            touch_sessions({session.session_id: before + timedelta(minutes=5)})
+            session.refresh_from_db()
+        self.assertEqual(session.last_seen_at, before + timedelta(minutes=5))
+
+    def test_failed_heartbeat_flush_keeps_the_buffer(self):
+        from social_integrations import widget_write_behind as wb
+
+        schema = self.tenant.schema_name
+        session = self._session()
+        redis = wb.get_redis()
+        key = wb.HEARTBEAT_KEY.format(schema=schema)
+        redis.delete(key, wb.BUFFER_KEY.format(schema=schema), wb.LOCK_KEY.format(schema=schema))
+        self.addCleanup(redis.delete, key)
+        with patch('social_integrations.tasks.flush_widget_writes.apply_async'):
+            wb.record_heartbeat(schema, session.session_id)
+
+        with schema_context(schema):
+            with patch.object(wb, 'touch_sessions', side_effect=RuntimeError('db down')):
+                with self.assertRaises(RuntimeError):
+                    wb.flush(schema)
+            self.assertEqual([wb.decode(field) for field in redis.hkeys(key)], [session.session_id])
+
+            wb.flush(schema)
+        self.assertFalse(redis.exists(key))
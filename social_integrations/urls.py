@@ -58,6 +58,7 @@ urlpatterns = [
 
     # WhatsApp Media Proxy (avoids browser ORB/CORS blocking on Meta URLs)
     path('whatsapp-media/<str:media_id>/', views.whatsapp_media_proxy, name='whatsapp_media_proxy'),
+    path('instagram-media/<str:message_id>/', views.instagram_media_proxy, name='instagram_media_proxy'),
 
     # WhatsApp Template Management
     path('whatsapp/<str:waba_id>/templates/', views.whatsapp_list_templates, name='whatsapp_list_templates'),
@@ -123,6 +124,7 @@ urlpatterns = [
 
     # Unified conversations endpoint
     path('conversations/', views.unified_conversations, name='unified_conversations'),
+    path('search/', views.search_messages, name='search_messages'),
 
     # Unread messages count endpoint
     path('unread-count/', views.unread_messages_count, name='unread_messages_count'),
@@ -136,6 +138,7 @@ urlpatterns = [
     path('conversations/archive/', views.archive_conversation, name='archive_conversation'),
     path('conversations/unarchive/', views.unarchive_conversation, name='unarchive_conversation'),
     path('conversations/archive-all/', views.archive_all_conversations, name='archive_all_conversations'),
+    path('bulk-jobs/<str:job_id>/', views.bulk_inbox_job_status, name='bulk_inbox_job_status'),
 
     # Delete conversation endpoint (superadmin only)
     path('delete-conversation/', views.delete_conversation, name='delete_conversation'),
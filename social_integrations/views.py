@@ -55,6 +55,11 @@ from .serializers import (
     UnifiedConversationSerializer, PaginatedUnifiedConversationSerializer,
     AutoPostSettingsSerializer, AutoPostContentSerializer,
 )
+from . import (
+    assignment_map, bulk_inbox, media_cache, message_search, rating_rollups, settings_cache,
+    whatsapp_templates, widget_poll,
+)
+from .graph_client import get_graph_client
 from .pagination import SocialMessagePagination
 from .permissions import (
     CanManageSocialConnections, CanViewSocialMessages,
@@ -72,18 +77,18 @@ _SOCIAL_SETTINGS_MISS = object()
 
 
 def get_social_settings(request):
-    """Return the singleton ``SocialIntegrationSettings`` row for this tenant,
+    """Return the ``SocialIntegrationSettings`` bundle for this tenant,
     cached for the lifetime of the request.
 
     The hot social endpoints all peek at this same row (12+ callsites — see
-    plan ``Speed up Social Messages``). Without caching, every request
-    issues an identical ``SELECT … LIMIT 1`` per touchpoint. Memoising
-    against the request object collapses those into one query while keeping
-    invalidation trivial: a new request gets a fresh fetch automatically.
+    plan ``Speed up Social Messages``). Memoising against the request object
+    keeps every touchpoint in one request on the same snapshot; across
+    requests the bundle comes from ``settings_cache`` (process memory, then
+    Redis), so most requests don't query the row at all.
     """
     cached = getattr(request, '_social_settings_cache', _SOCIAL_SETTINGS_MISS)
     if cached is _SOCIAL_SETTINGS_MISS:
-        cached = SocialIntegrationSettings.objects.first()
+        cached = settings_cache.get_settings()
         request._social_settings_cache = cached
     return cached
 
@@ -141,17 +146,12 @@ def get_assignment_for_conversation(platform, conversation_id, account_id):
     """
     Look up if a conversation is assigned to a user.
     Returns the assigned_user_id or None if not assigned.
+
+    Served from the tenant's Redis assignment map (see assignment_map), with
+    a DB fallback when the map is cold or Redis is down.
     """
     try:
-        assignment = ChatAssignment.objects.filter(
-            platform=platform,
-            conversation_id=conversation_id,
-            account_id=account_id,
-            status__in=['active', 'in_session']  # Only active assignments
-        ).first()
-        if assignment and assignment.assigned_user:
-            return assignment.assigned_user.id
-        return None
+        return assignment_map.lookup(platform, conversation_id, account_id)
     except Exception as e:
         logger.error(f"Failed to get assignment for conversation: {e}")
         return None
@@ -172,18 +172,11 @@ def send_websocket_notification(tenant_schema, message_data, conversation_id, as
             logger.warning("WebSocket channel layer not configured")
             return
 
-        # Send to general messages group for this tenant
-        group_name = f'messages_{tenant_schema}'
-
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': 'new_message',
-                'message': message_data,
-                'conversation_id': conversation_id,
-                'timestamp': message_data.get('timestamp'),
-                'assigned_user_id': assigned_user_id,  # None if unassigned, user_id if assigned
-            }
+        # Unassigned chats go to the whole tenant; assigned ones only to the
+        # assignee, "all"-scope agents and the conversation's open viewers.
+        from .consumers import send_scoped_message_notification
+        async_to_sync(send_scoped_message_notification)(
+            tenant_schema, conversation_id, message_data, assigned_user_id
         )
 
     except (ConnectionError, OSError) as e:
@@ -258,18 +251,13 @@ def process_auto_reply(platform, account_id, conversation_id, sender_name, conne
         connection: FacebookPageConnection, InstagramAccountConnection, or WhatsAppBusinessAccount
     """
     try:
-        from zoneinfo import ZoneInfo
-    except ImportError:
-        from pytz import timezone as _pytz_tz
-        ZoneInfo = _pytz_tz
-
-    try:
-        settings = SocialIntegrationSettings.objects.first()
+        # Shared cached bundle; webhook bursts don't re-read the settings row.
+        settings = settings_cache.get_settings()
         if not settings or not settings.auto_reply_settings:
             return False
 
         # Get platform-specific settings
-        platform_settings = settings.auto_reply_settings.get(platform, {})
+        platform_settings = settings.auto_reply_for(platform)
         if not platform_settings:
             return False
 
@@ -286,14 +274,8 @@ def process_auto_reply(platform, account_id, conversation_id, sender_name, conne
         is_away = False
         if settings.away_hours_enabled and settings.away_hours_schedule:
             try:
-                business_tz = ZoneInfo(settings.timezone)
-                local_dt = now.astimezone(business_tz)
-                current_hour = local_dt.hour
-                current_day = local_dt.strftime('%A').lower()  # monday, tuesday, etc.
-
-                day_schedule = settings.away_hours_schedule.get(current_day, [])
-                is_away = current_hour in day_schedule
-                logger.info(f"🕐 Auto-reply check: {current_day} {current_hour}:00 in {settings.timezone}, is_away={is_away}")
+                is_away = settings.is_away_at(now)
+                logger.info(f"🕐 Auto-reply check: {now.isoformat()} in {settings.timezone}, is_away={is_away}")
             except Exception as e:
                 logger.error(f"Error checking away hours: {e}")
 
@@ -375,7 +357,7 @@ def send_facebook_auto_reply(recipient_id, message_text, page_connection):
             'message': {'text': message_text},
             'messaging_type': 'RESPONSE'
         }
-        response = requests.post(
+        response = get_graph_client().post(
             send_url,
             json=message_data,
             params={'access_token': page_connection.page_access_token},
@@ -429,7 +411,7 @@ def send_instagram_auto_reply(recipient_id, message_text, account_connection):
         # Use the Facebook Page's access token with platform=instagram
         access_token = account_connection.facebook_page.page_access_token
 
-        response = requests.post(
+        response = get_graph_client().post(
             send_url,
             json=message_data,
             params={
@@ -482,7 +464,7 @@ def send_whatsapp_auto_reply(recipient_number, message_text, account):
             'text': {'body': message_text}
         }
 
-        response = requests.post(
+        response = get_graph_client().post(
             send_url,
             json=message_data,
             headers={'Authorization': f'Bearer {account.access_token}'},
@@ -1438,7 +1420,7 @@ def facebook_send_message(request):
                 }
                 if reply_to_message_id:
                     text_payload['reply_to'] = {'mid': reply_to_message_id}
-                text_response = requests.post(
+                text_response = get_graph_client().post(
                     send_url,
                     json=text_payload,
                     headers={'Content-Type': 'application/json'},
@@ -1459,7 +1441,7 @@ def facebook_send_message(request):
                 'filedata': (media_filename, media_file, media_mime_type),
             }
 
-            response = requests.post(
+            response = get_graph_client().post(
                 send_url,
                 files={'filedata': (media_filename, media_file, media_mime_type)},
                 data={
@@ -1486,7 +1468,7 @@ def facebook_send_message(request):
                 message_data['reply_to'] = {'mid': reply_to_message_id}
                 logger.info(f"Replying to message: {reply_to_message_id}")
 
-            response = requests.post(
+            response = get_graph_client().post(
                 send_url,
                 json=message_data,
                 headers={'Content-Type': 'application/json'},
@@ -1981,7 +1963,7 @@ def facebook_webhook(request):
                                                                 'fields': 'name,first_name,last_name,profile_pic',
                                                                 'access_token': page_connection.page_access_token
                                                             }
-                                                            profile_response = requests.get(profile_url, params=profile_params, timeout=10)
+                                                            profile_response = get_graph_client().get(profile_url, params=profile_params, timeout=10)
                                                             if profile_response.status_code == 200:
                                                                 profile_data = profile_response.json()
                                                                 recipient_name = profile_data.get('name', '')
@@ -2091,7 +2073,7 @@ def facebook_webhook(request):
                                                     'fields': 'from',
                                                     'access_token': page_connection.page_access_token
                                                 }
-                                                message_response = requests.get(message_url, params=message_params, timeout=10)
+                                                message_response = get_graph_client().get(message_url, params=message_params, timeout=10)
 
                                                 if message_response.status_code == 200:
                                                     message_api_data = message_response.json()
@@ -2114,7 +2096,7 @@ def facebook_webhook(request):
                                                 'redirect': 'false',
                                                 'access_token': page_connection.page_access_token
                                             }
-                                            profile_pic_response = requests.get(profile_pic_url_api, params=profile_pic_params, timeout=10)
+                                            profile_pic_response = get_graph_client().get(profile_pic_url_api, params=profile_pic_params, timeout=10)
                                             if profile_pic_response.status_code == 200:
                                                 pic_data = profile_pic_response.json().get('data', {})
                                                 if not pic_data.get('is_silhouette', True):
@@ -3092,11 +3074,11 @@ def instagram_send_message(request):
                     'message': {'text': message_text},
                     'messaging_type': 'RESPONSE'
                 }
-                requests.post(send_url, json=text_payload,
-                              headers={'Content-Type': 'application/json'}, params=params)
+                get_graph_client().post(send_url, json=text_payload,
+                                        headers={'Content-Type': 'application/json'}, params=params)
 
             # Send media attachment using form data upload
-            response = requests.post(
+            response = get_graph_client().post(
                 send_url,
                 files={'filedata': (media_filename, media_file, media_mime_type)},
                 data={
@@ -3120,7 +3102,7 @@ def instagram_send_message(request):
                 'messaging_type': 'RESPONSE'
             }
 
-            response = requests.post(
+            response = get_graph_client().post(
                 send_url,
                 json=message_data,
                 headers={'Content-Type': 'application/json'},
@@ -3446,7 +3428,7 @@ def instagram_webhook(request):
                                                             'fields': 'name,username,profile_pic',
                                                             'access_token': account_connection.access_token
                                                         }
-                                                        profile_response = requests.get(profile_url, params=profile_params, timeout=10)
+                                                        profile_response = get_graph_client().get(profile_url, params=profile_params, timeout=10)
                                                         if profile_response.status_code == 200:
                                                             profile_data = profile_response.json()
                                                             recipient_name = profile_data.get('name', '')
@@ -3543,7 +3525,7 @@ def instagram_webhook(request):
                                             'access_token': account_connection.access_token
                                         }
                                         logger.info(f"👤 Fetching Instagram profile for sender {sender_id}")
-                                        profile_response = requests.get(profile_url, params=profile_params, timeout=10)
+                                        profile_response = get_graph_client().get(profile_url, params=profile_params, timeout=10)
 
                                         logger.info(f"👤 Instagram profile fetch response: status={profile_response.status_code}")
                                         if profile_response.status_code == 200:
@@ -3575,7 +3557,7 @@ def instagram_webhook(request):
                                                 'redirect': 'false',
                                                 'access_token': account_connection.access_token
                                             }
-                                            pic_response = requests.get(pic_url, params=pic_params, timeout=10)
+                                            pic_response = get_graph_client().get(pic_url, params=pic_params, timeout=10)
                                             if pic_response.status_code == 200:
                                                 pic_data = pic_response.json().get('data', {})
                                                 if not pic_data.get('is_silhouette', True):
@@ -4121,6 +4103,13 @@ def _broadcast_read_state(request, *, platform, conversation_id, account_id, unr
         logger.warning('read_state_update broadcast failed: %s', exc)
 
 
+def _truthy(value):
+    """Request flag parsing that accepts JSON booleans and form strings."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
 def _broadcast_archive_change(request, *, platform, conversation_id, account_id, archived, archived_at=None):
     """Emit an `archive_update` WS frame after archive/unarchive."""
     from django.db import connection
@@ -4632,7 +4621,7 @@ def send_rating_request_facebook(conversation_id, page_id, message):
             "message": {"text": message}
         }
         headers = {"Authorization": f"Bearer {page.page_access_token}"}
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_graph_client().post(url, json=payload, headers=headers)
         if response.ok:
             message_id = response.json().get('message_id')
             timestamp = datetime.now()
@@ -4692,7 +4681,7 @@ def send_rating_request_instagram(conversation_id, account_id, message):
             "access_token": account.facebook_page.page_access_token,
             "platform": "instagram"
         }
-        response = requests.post(url, json=payload, headers=headers, params=params)
+        response = get_graph_client().post(url, json=payload, headers=headers, params=params)
         if response.ok:
             message_id = response.json().get('message_id')
             timestamp = datetime.now()
@@ -4750,7 +4739,7 @@ def send_rating_request_whatsapp(conversation_id, waba_id, message):
             "Authorization": f"Bearer {account.access_token}",
             "Content-Type": "application/json"
         }
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_graph_client().post(url, json=payload, headers=headers)
         if response.ok:
             data = response.json()
             message_id = data.get('messages', [{}])[0].get('id')
@@ -4860,9 +4849,8 @@ def rating_statistics(request):
     Supports date filtering via start_date and end_date query params.
     Default: current month (1st to today).
     Supports source filtering via source query param: all (default), social, calls.
+    Reads the pre-aggregated daily rollups, so long ranges cost the same as short ones.
     """
-    from crm.models import CallRating
-
     # Parse date filters (default: this month)
     from datetime import date
     today = date.today()
@@ -4894,53 +4882,25 @@ def rating_statistics(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    from django.db.models import Avg, Count, Sum, Q
-    from django.db.models.functions import Coalesce
-
-    # --- Query ChatRating (social) ---
+    # --- Sum the daily rollups (see rating_rollups) ---
     include_social = source in ('all', 'social')
     include_calls = source in ('all', 'calls')
-
-    social_ratings = None
-    if include_social:
-        social_ratings = ChatRating.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            rating__gt=0,
-        ).select_related('rated_user')
-
-    # --- Query CallRating (calls) ---
-    call_ratings = None
-    if include_calls:
-        call_ratings = CallRating.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
-            rating__gt=0,
-        ).select_related('rated_user')
-
-    # --- Overall stats with by_source breakdown ---
-    social_overall = {'total': 0, 'average': 0}
-    calls_callback_overall = {'total': 0, 'average': 0}
-    calls_sms_overall = {'total': 0, 'average': 0}
-
-    if social_ratings is not None:
-        agg = social_ratings.aggregate(total=Count('id'), average=Avg('rating'))
-        social_overall = {
-            'total': agg['total'] or 0,
-            'average': round(agg['average'], 2) if agg['average'] else 0,
+    sources = (['social'] if include_social else []) + (['calls_callback', 'calls_sms'] if include_calls else [])
+    totals, user_rows = rating_rollups.summarize(start_date, end_date, sources)
+
+    def _overall(key):
+        row = totals.get(key)
+        if not row or not row['total_ratings']:
+            return {'total': 0, 'average': 0}
+        return {
+            'total': row['total_ratings'],
+            'average': round(row['ratings_sum'] / row['total_ratings'], 2),
         }
 
-    if call_ratings is not None:
-        cb_agg = call_ratings.filter(review_method='callback').aggregate(total=Count('id'), average=Avg('rating'))
-        calls_callback_overall = {
-            'total': cb_agg['total'] or 0,
-            'average': round(cb_agg['average'], 2) if cb_agg['average'] else 0,
-        }
-        sms_agg = call_ratings.filter(review_method='sms').aggregate(total=Count('id'), average=Avg('rating'))
-        calls_sms_overall = {
-            'total': sms_agg['total'] or 0,
-            'average': round(sms_agg['average'], 2) if sms_agg['average'] else 0,
-        }
+    # --- Overall stats with by_source breakdown ---
+    social_overall = _overall('social')
+    calls_callback_overall = _overall('calls_callback')
+    calls_sms_overall = _overall('calls_sms')
 
     combined_total = social_overall['total'] + calls_callback_overall['total'] + calls_sms_overall['total']
     if combined_total > 0:
@@ -4954,107 +4914,19 @@ def rating_statistics(request):
         combined_average = 0
 
     # --- Per-user stats ---
-    # Build a dict keyed by user_id with merged data
-    user_map = {}  # user_id -> { ...stats }
-
-    if social_ratings is not None:
-        social_user_stats = social_ratings.values(
-            'rated_user__id',
-            'rated_user__email',
-            'rated_user__first_name',
-            'rated_user__last_name',
-        ).annotate(
-            total_ratings=Count('id'),
-            average_rating=Avg('rating'),
-            rating_1=Count('id', filter=Q(rating=1)),
-            rating_2=Count('id', filter=Q(rating=2)),
-            rating_3=Count('id', filter=Q(rating=3)),
-            rating_4=Count('id', filter=Q(rating=4)),
-            rating_5=Count('id', filter=Q(rating=5)),
-        )
-        for stat in social_user_stats:
-            uid = stat['rated_user__id']
-            if not uid:
-                continue
-            user_map[uid] = {
-                'user_id': uid,
-                'email': stat['rated_user__email'],
-                'name': f"{stat['rated_user__first_name'] or ''} {stat['rated_user__last_name'] or ''}".strip() or stat['rated_user__email'],
-                'total_ratings': stat['total_ratings'],
-                'rating_sum': (stat['average_rating'] or 0) * stat['total_ratings'],
-                'rating_breakdown': {
-                    '1': stat['rating_1'],
-                    '2': stat['rating_2'],
-                    '3': stat['rating_3'],
-                    '4': stat['rating_4'],
-                    '5': stat['rating_5'],
-                },
-                'social_ratings': stat['total_ratings'],
-                'call_ratings': 0,
-            }
-
-    if call_ratings is not None:
-        call_user_stats = call_ratings.values(
-            'rated_user__id',
-            'rated_user__email',
-            'rated_user__first_name',
-            'rated_user__last_name',
-        ).annotate(
-            total_ratings=Count('id'),
-            average_rating=Avg('rating'),
-            rating_1=Count('id', filter=Q(rating=1)),
-            rating_2=Count('id', filter=Q(rating=2)),
-            rating_3=Count('id', filter=Q(rating=3)),
-            rating_4=Count('id', filter=Q(rating=4)),
-            rating_5=Count('id', filter=Q(rating=5)),
-        )
-        for stat in call_user_stats:
-            uid = stat['rated_user__id']
-            if not uid:
-                continue
-            if uid in user_map:
-                existing = user_map[uid]
-                existing['total_ratings'] += stat['total_ratings']
-                existing['rating_sum'] += (stat['average_rating'] or 0) * stat['total_ratings']
-                existing['rating_breakdown']['1'] += stat['rating_1']
-                existing['rating_breakdown']['2'] += stat['rating_2']
-                existing['rating_breakdown']['3'] += stat['rating_3']
-                existing['rating_breakdown']['4'] += stat['rating_4']
-                existing['rating_breakdown']['5'] += stat['rating_5']
-                existing['call_ratings'] += stat['total_ratings']
-            else:
-                # Need user info — fetch email/name from annotated values
-                user_map[uid] = {
-                    'user_id': uid,
-                    'email': stat['rated_user__email'],
-                    'name': f"{stat['rated_user__first_name'] or ''} {stat['rated_user__last_name'] or ''}".strip() or stat['rated_user__email'],
-                    'total_ratings': stat['total_ratings'],
-                    'rating_sum': (stat['average_rating'] or 0) * stat['total_ratings'],
-                    'rating_breakdown': {
-                        '1': stat['rating_1'],
-                        '2': stat['rating_2'],
-                        '3': stat['rating_3'],
-                        '4': stat['rating_4'],
-                        '5': stat['rating_5'],
-                    },
-                    'social_ratings': 0,
-                    'call_ratings': stat['total_ratings'],
-                }
-
-    # Finalize: compute average from sum/total and sort
     stats_list = []
-    for entry in user_map.values():
-        total = entry['total_ratings']
-        avg = round(entry['rating_sum'] / total, 2) if total > 0 else 0
+    for row in user_rows:
+        total = row['total_ratings'] or 0
+        email = row['rated_user__email']
         stats_list.append({
-            'user_id': entry['user_id'],
-            'email': entry['email'],
-            'name': entry['name'],
+            'user_id': row['rated_user_id'],
+            'email': email,
+            'name': f"{row['rated_user__first_name'] or ''} {row['rated_user__last_name'] or ''}".strip() or email,
             'total_ratings': total,
-            'average_rating': avg,
-            'rating_breakdown': entry['rating_breakdown'],
-            'social_ratings': entry['social_ratings'],
-            'call_ratings': entry['call_ratings'],
+            'average_rating': round(row['ratings_sum'] / total, 2) if total > 0 else 0,
+            'rating_breakdown': {str(n): row[f'count_{n}'] or 0 for n in range(1, 6)},
+            'social_ratings': row['social_ratings'] or 0,
+            'call_ratings': row['call_ratings'] or 0,
         })
 
     stats_list.sort(key=lambda x: (-x['average_rating'], -x['total_ratings']))
@@ -5556,31 +5428,22 @@ def unified_conversations(request):
         return (platform, conversation_id, account_id) in archived_conversations
 
     # Get all assignments for current user if filtering by assigned
+    # Both this and the hide_assigned map below come from one read of the
+    # tenant's Redis assignment map (DB fallback when cold).
     user_assignments = set()
+    _active_assignment_map = {}
+    if assigned_only or (hide_assigned and not is_admin):
+        _active_assignment_map = assignment_map.assigned_users(enabled_platforms)
     if assigned_only:
-        assignments = ChatAssignment.objects.filter(
-            assigned_user=request.user,
-            status__in=['active', 'in_session']
-        )
-        for a in assignments:
-            # Create a tuple key: (platform, account_id, conversation_id)
-            user_assignments.add((a.platform, a.account_id, a.conversation_id))
+        # Tuple keys: (platform, account_id, conversation_id)
+        user_assignments = {
+            key for key, user_id in _active_assignment_map.items() if user_id == request.user.id
+        }
 
     # Helper to check if conversation is assigned to current user
     def is_assigned_to_user(platform, account_id, conversation_id):
         return (platform, account_id, conversation_id) in user_assignments
 
-    # Pre-load all active assignments for hide_assigned visibility check
-    # Maps (platform, account_id, conversation_id) -> assigned_user_id.
-    # Narrowed to visible platforms so the scan is bounded.
-    _active_assignment_map = {}
-    if hide_assigned and not is_admin:
-        for a in ChatAssignment.objects.filter(
-            status__in=['active', 'in_session'],
-            platform__in=enabled_platforms,
-        ).values_list('platform', 'account_id', 'conversation_id', 'assigned_user_id'):
-            _active_assignment_map[(a[0], a[1], a[2])] = a[3]
-
     # Helper to check if conversation should be visible based on assignment and archive status
     def is_conversation_visible(platform, account_id, conversation_id):
         # Check archive status first
@@ -6186,6 +6049,44 @@ def unified_conversations(request):
     })
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, CanViewSocialMessages])
+def search_messages(request):
+    """
+    Ranked message search across Facebook, Instagram, WhatsApp and widget chats.
+
+    Query parameters:
+    - q: Search text (min 2 characters)
+    - platforms: Comma-separated list of platforms (default: all)
+    - page: Page number (default: 1)
+    - page_size: Results per page (default: 50, max: 200)
+
+    Returns {results, page, page_size, has_more}; each result carries the
+    platform, conversation_id and account_id needed to open the thread.
+    """
+    platforms_param = request.query_params.get('platforms', '')
+    platforms = [p.strip().lower() for p in platforms_param.split(',') if p.strip()] or None
+    try:
+        page = int(request.query_params.get('page', 1))
+        page_size = int(request.query_params.get('page_size', message_search.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    settings_obj = get_social_settings(request)
+    hide_assigned = bool(settings_obj and settings_obj.hide_assigned_chats) and not (
+        request.user.is_superuser or request.user.is_staff
+    )
+
+    return Response(message_search.search_messages(
+        request.query_params.get('q', ''),
+        platforms,
+        page=page,
+        page_size=page_size,
+        user=request.user,
+        hide_assigned=hide_assigned,
+    ))
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, CanViewSocialMessages])
 def unread_messages_count(request):
@@ -6496,6 +6397,8 @@ def mark_conversation_read(request):
                 is_read_by_staff=True,
                 read_by_staff_at=now,
             )
+            if updated_count:
+                widget_poll.bump(conversation_id)
         else:
             return Response({
                 'error': f'Invalid platform: {platform}'
@@ -6794,6 +6697,8 @@ def delete_conversation(request):
                 session__session_id=conversation_id,
                 is_deleted=False,
             ).update(is_deleted=True)
+            if deleted_count:
+                widget_poll.bump(conversation_id)
 
         else:
             return Response({
@@ -6857,7 +6762,7 @@ class WhatsAppBusinessAccountViewSet(viewsets.ModelViewSet):
 
             # Call Meta API to request contacts sync
             url = f"https://graph.facebook.com/v23.0/{account.phone_number_id}/smb_app_data"
-            response = requests.post(
+            response = get_graph_client().post(
                 url,
                 headers={
                     'Authorization': f'Bearer {account.access_token}',
@@ -6940,7 +6845,7 @@ class WhatsAppBusinessAccountViewSet(viewsets.ModelViewSet):
             elif phase == '90-180':
                 payload['history'] = {'start_days_ago': 90, 'end_days_ago': 180}
 
-            response = requests.post(
+            response = get_graph_client().post(
                 url,
                 headers={
                     'Authorization': f'Bearer {account.access_token}',
@@ -6955,6 +6860,10 @@ class WhatsAppBusinessAccountViewSet(viewsets.ModelViewSet):
                 account.history_synced_at = timezone.now()
                 account.save(update_fields=['sync_status', 'history_synced_at'])
 
+                # A fresh run: chunks from an earlier sync of this phase no longer apply.
+                from .whatsapp_history import start_phase
+                start_phase(account, valid_phases.index(phase))
+
                 return Response({
                     'status': 'success',
                     'message': f'History sync initiated for phase {phase}. Messages will be delivered via webhook.',
@@ -6996,6 +6905,18 @@ class WhatsAppBusinessAccountViewSet(viewsets.ModelViewSet):
             'history_synced_at': account.history_synced_at.isoformat() if account.history_synced_at else None,
             'throughput_limit': account.throughput_limit,
         }
+        local_status['history_import'] = [
+            {
+                'phase': checkpoint.phase,
+                'status': checkpoint.status,
+                'progress': checkpoint.progress,
+                'chunks_processed': checkpoint.chunks_processed,
+                'messages_received': checkpoint.messages_received,
+                'messages_imported': checkpoint.messages_imported,
+                'completed_at': checkpoint.completed_at.isoformat() if checkpoint.completed_at else None,
+            }
+            for checkpoint in account.history_imports.all()
+        ]
 
         # Check if within 24-hour sync window
         sync_window_open = False
@@ -7016,7 +6937,7 @@ class WhatsAppBusinessAccountViewSet(viewsets.ModelViewSet):
         if fetch_from_api and account.access_token:
             try:
                 url = f"https://graph.facebook.com/v23.0/{account.phone_number_id}"
-                response = requests.get(
+                response = get_graph_client().get(
                     url,
                     params={'fields': 'id,is_on_biz_app,platform_type,verified_name,quality_rating'},
                     headers={'Authorization': f'Bearer {account.access_token}'},
@@ -7690,10 +7611,10 @@ def whatsapp_media_proxy(request, media_id):
     """Proxy WhatsApp media through the backend to avoid browser ORB/CORS blocking.
 
     WhatsApp Cloud API media URLs (lookaside.fbsbx.com) are temporary and blocked
-    by browsers. This endpoint fetches fresh URLs using the media_id and streams
-    the content back to the frontend.
+    by browsers. The first view resolves a fresh URL using the media_id and
+    persists the binary to object storage (see ``media_cache``); every later
+    view is served from storage without touching Meta.
     """
-    logger = logging.getLogger(__name__)
     waba_id = request.query_params.get('waba_id')
     if not waba_id:
         return Response({'error': 'waba_id required'}, status=status.HTTP_400_BAD_REQUEST)
@@ -7703,84 +7624,129 @@ def whatsapp_media_proxy(request, media_id):
     except WhatsAppBusinessAccount.DoesNotExist:
         return Response({'error': 'Account not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    cached = media_cache.get_cached('whatsapp', media_id, account.waba_id)
+    if cached:
+        return media_cache.serve_cached(request, cached)
+
     if not account.access_token:
         return Response({'error': 'No access token configured'}, status=status.HTTP_400_BAD_REQUEST)
 
+    auth_headers = {'Authorization': f'Bearer {account.access_token}'}
     try:
         # Step 1: Get fresh download URL from Meta Graph API
-        media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-        media_response = requests.get(
-            media_info_url,
-            headers={'Authorization': f'Bearer {account.access_token}'},
-            timeout=10
-        )
+        download_url, mime_type = media_cache.resolve_whatsapp_media(account, media_id)
 
-        if media_response.status_code != 200:
-            # Distinguish "Meta says it's gone" from transient upstream failures
-            # so the frontend can show a friendly "expired" message instead of
-            # DigitalOcean's generic 502 HTML page (DO replaces any backend 5xx
-            # with its branded error page). Meta returns 4xx + error code 100
-            # when the media_id has expired — Cloud API attachments only live
-            # for a limited window (days for documents, up to 30 days for
-            # other types). Anything 5xx from Meta is worth retrying → 502.
-            try:
-                err_body = media_response.json()
-                meta_code = (err_body.get('error') or {}).get('code')
-            except ValueError:
-                err_body = {}
-                meta_code = None
-            logger.warning(
-                "WhatsApp media info fetch failed: media_id=%s http=%s meta_code=%s body=%s",
-                media_id, media_response.status_code, meta_code, str(err_body)[:500],
-            )
-            if 400 <= media_response.status_code < 500:
-                return Response(
-                    {
-                        'error': 'Media no longer available',
-                        'detail': (
-                            'WhatsApp has expired this attachment. Ask the sender '
-                            'to resend it, or contact support to retrieve from backup.'
-                        ),
-                        'media_id': media_id,
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-            return Response(
-                {'error': 'Upstream error from WhatsApp Cloud API'},
-                status=status.HTTP_502_BAD_GATEWAY,
+        # Step 2: Download once into storage, then serve from there
+        try:
+            cached = media_cache.store_from_url(
+                'whatsapp', media_id, download_url,
+                account_id=account.waba_id,
+                headers=auth_headers,
+                content_type=mime_type,
             )
+        except (media_cache.MediaUnavailable, requests.RequestException):
+            raise
+        except Exception as e:
+            # Storage is down — still answer the viewer straight from Meta.
+            logger.error(f"Could not cache WhatsApp media {media_id}, streaming from Meta: {e}")
+            return media_cache.stream_upstream(request, download_url, headers=auth_headers, content_type=mime_type)
 
-        media_data = media_response.json()
-        download_url = media_data.get('url')
-        mime_type = media_data.get('mime_type', 'application/octet-stream')
-
-        if not download_url:
-            return Response({'error': 'No download URL returned by Meta'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Step 2: Download the actual media binary
-        download_response = requests.get(
-            download_url,
-            headers={'Authorization': f'Bearer {account.access_token}'},
-            timeout=30
-        )
-
-        if download_response.status_code != 200:
-            logger.error(f"Failed to download WhatsApp media {media_id}: {download_response.status_code}")
-            return Response({'error': 'Failed to download media'}, status=status.HTTP_502_BAD_GATEWAY)
-
-        # Step 3: Stream back to the client with caching headers
-        response = HttpResponse(download_response.content, content_type=mime_type)
-        response['Cache-Control'] = 'public, max-age=86400'  # Cache for 24 hours
+        response = media_cache.serve_cached(request, cached)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+    except media_cache.MediaUnavailable:
+        # Distinguish "Meta says it's gone" from transient upstream failures
+        # so the frontend can show a friendly "expired" message instead of
+        # DigitalOcean's generic 502 HTML page (DO replaces any backend 5xx
+        # with its branded error page). Meta returns 4xx + error code 100
+        # when the media_id has expired — Cloud API attachments only live
+        # for a limited window (days for documents, up to 30 days for
+        # other types). Anything 5xx from Meta is worth retrying → 502.
+        return Response(
+            {
+                'error': 'Media no longer available',
+                'detail': (
+                    'WhatsApp has expired this attachment. Ask the sender '
+                    'to resend it, or contact support to retrieve from backup.'
+                ),
+                'media_id': media_id,
+            },
+            status=status.HTTP_404_NOT_FOUND,
+        )
     except requests.Timeout:
         return Response({'error': 'Media download timed out'}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except requests.RequestException as e:
+        logger.error(f"Failed to download WhatsApp media {media_id}: {e}")
+        return Response(
+            {'error': 'Upstream error from WhatsApp Cloud API'},
+            status=status.HTTP_502_BAD_GATEWAY,
+        )
     except Exception as e:
         logger.error(f"WhatsApp media proxy error for {media_id}: {e}")
         return Response({'error': 'Internal error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@extend_schema(
+    parameters=[
+        OpenApiParameter('index', OpenApiTypes.INT, description='Attachment index within the message (default 0)'),
+    ],
+    description="Proxy an Instagram DM attachment through cached object storage",
+    summary="Instagram Media Proxy"
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, CanViewSocialMessages])
+def instagram_media_proxy(request, message_id):
+    """Serve an Instagram DM attachment from storage, downloading it once.
+
+    Instagram CDN URLs stored on the message expire after a while; the first
+    view copies the file into object storage so it stays viewable.
+    """
+    try:
+        index = int(request.query_params.get('index', 0))
+    except (TypeError, ValueError):
+        return Response({'error': 'index must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    message = InstagramMessage.objects.filter(message_id=message_id).select_related('account_connection').first()
+    if not message:
+        return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    cache_key = f'{message_id}:{index}'
+    account_id = message.account_connection.instagram_account_id
+    cached = media_cache.get_cached('instagram', cache_key, account_id)
+    if cached:
+        return media_cache.serve_cached(request, cached)
+
+    attachments = message.attachments or []
+    if index < len(attachments):
+        source_url = attachments[index].get('url')
+    else:
+        source_url = message.attachment_url if index == 0 else None
+    if not source_url:
+        return Response({'error': 'Attachment not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        cached = media_cache.store_from_url(
+            'instagram', cache_key, source_url,
+            account_id=account_id,
+        )
+    except media_cache.MediaUnavailable:
+        return Response(
+            {'error': 'Media no longer available', 'message_id': message_id},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    except requests.Timeout:
+        return Response({'error': 'Media download timed out'}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except requests.RequestException as e:
+        logger.error(f"Failed to download Instagram media {cache_key}: {e}")
+        return Response({'error': 'Upstream error from Instagram'}, status=status.HTTP_502_BAD_GATEWAY)
+    except Exception as e:
+        logger.error(f"Could not cache Instagram media {cache_key}, streaming from CDN: {e}")
+        return media_cache.stream_upstream(request, source_url)
+
+    return media_cache.serve_cached(request, cached)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, CanSendSocialMessages])
 def whatsapp_send_message(request):
@@ -7827,7 +7793,7 @@ def whatsapp_send_message(request):
             media_filename = media_file.name or 'file'
 
             upload_url = f"https://graph.facebook.com/{fb_api_version}/{account.phone_number_id}/media"
-            upload_response = requests.post(
+            upload_response = get_graph_client().post(
                 upload_url,
                 headers=auth_headers,
                 files={'file': (media_filename, media_file, media_mime_type)},
@@ -7896,7 +7862,7 @@ def whatsapp_send_message(request):
         headers = {**auth_headers, 'Content-Type': 'application/json'}
 
         logger.info(f"Sending WhatsApp {message_type} message to {to_number} from {account.display_phone_number}")
-        response = requests.post(send_url, json=message_payload, headers=headers)
+        response = get_graph_client().post(send_url, json=message_payload, headers=headers)
         response_data = response.json()
 
         if response.status_code != 200 or 'error' in response_data:
@@ -8073,6 +8039,21 @@ def whatsapp_webhook(request):
 
                 # Handle messages
                 messages = value.get('messages', [])
+
+                # Resolve every attachment's download URL in one Graph batch
+                # call instead of one round trip per message.
+                media_urls = {}
+                if account.access_token:
+                    media_ids = [
+                        message.get(message.get('type'), {}).get('id')
+                        for message in messages
+                        if message.get('type') in ('image', 'video', 'document', 'audio', 'sticker')
+                    ]
+                    try:
+                        media_urls = get_graph_client().get_media_urls(media_ids, account.access_token)
+                    except Exception as e:
+                        logger.error(f"Failed to fetch WhatsApp media URLs: {e}")
+
                 for message in messages:
                     message_id = message.get('id')
                     from_number = message.get('from')
@@ -8177,20 +8158,7 @@ def whatsapp_webhook(request):
                         message_text = image_data.get('caption', '')
                         media_id = image_data.get('id', '')
                         media_mime_type = image_data.get('mime_type', '')
-                        # Fetch media URL using WhatsApp API
-                        if media_id and account.access_token:
-                            try:
-                                media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-                                media_response = requests.get(
-                                    media_info_url,
-                                    headers={'Authorization': f'Bearer {account.access_token}'},
-                                    timeout=10
-                                )
-                                if media_response.status_code == 200:
-                                    media_url = media_response.json().get('url', '')
-                                    logger.info(f"📎 Fetched WhatsApp image URL: {media_url[:50]}...")
-                            except Exception as e:
-                                logger.error(f"Failed to fetch WhatsApp media URL: {e}")
+                        media_url = media_urls.get(media_id, '')
                         attachments.append({
                             'type': 'image',
                             'media_id': media_id,
@@ -8202,19 +8170,7 @@ def whatsapp_webhook(request):
                         message_text = video_data.get('caption', '')
                         media_id = video_data.get('id', '')
                         media_mime_type = video_data.get('mime_type', '')
-                        if media_id and account.access_token:
-                            try:
-                                media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-                                media_response = requests.get(
-                                    media_info_url,
-                                    headers={'Authorization': f'Bearer {account.access_token}'},
-                                    timeout=10
-                                )
-                                if media_response.status_code == 200:
-                                    media_url = media_response.json().get('url', '')
-                                    logger.info(f"📎 Fetched WhatsApp video URL")
-                            except Exception as e:
-                                logger.error(f"Failed to fetch WhatsApp media URL: {e}")
+                        media_url = media_urls.get(media_id, '')
                         attachments.append({
                             'type': 'video',
                             'media_id': media_id,
@@ -8226,18 +8182,7 @@ def whatsapp_webhook(request):
                         message_text = doc_data.get('filename', '')
                         media_id = doc_data.get('id', '')
                         media_mime_type = doc_data.get('mime_type', '')
-                        if media_id and account.access_token:
-                            try:
-                                media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-                                media_response = requests.get(
-                                    media_info_url,
-                                    headers={'Authorization': f'Bearer {account.access_token}'},
-                                    timeout=10
-                                )
-                                if media_response.status_code == 200:
-                                    media_url = media_response.json().get('url', '')
-                            except Exception as e:
-                                logger.error(f"Failed to fetch WhatsApp media URL: {e}")
+                        media_url = media_urls.get(media_id, '')
                         attachments.append({
                             'type': 'document',
                             'media_id': media_id,
@@ -8249,19 +8194,7 @@ def whatsapp_webhook(request):
                         audio_data = message.get('audio', {})
                         media_id = audio_data.get('id', '')
                         media_mime_type = audio_data.get('mime_type', '')
-                        if media_id and account.access_token:
-                            try:
-                                media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-                                media_response = requests.get(
-                                    media_info_url,
-                                    headers={'Authorization': f'Bearer {account.access_token}'},
-                                    timeout=10
-                                )
-                                if media_response.status_code == 200:
-                                    media_url = media_response.json().get('url', '')
-                                    logger.info(f"📎 Fetched WhatsApp audio URL")
-                            except Exception as e:
-                                logger.error(f"Failed to fetch WhatsApp media URL: {e}")
+                        media_url = media_urls.get(media_id, '')
                         attachments.append({
                             'type': 'audio',
                             'media_id': media_id,
@@ -8272,19 +8205,7 @@ def whatsapp_webhook(request):
                         sticker_data = message.get('sticker', {})
                         media_id = sticker_data.get('id', '')
                         media_mime_type = sticker_data.get('mime_type', 'image/webp')
-                        if media_id and account.access_token:
-                            try:
-                                media_info_url = f"https://graph.facebook.com/v23.0/{media_id}"
-                                media_response = requests.get(
-                                    media_info_url,
-                                    headers={'Authorization': f'Bearer {account.access_token}'},
-                                    timeout=10
-                                )
-                                if media_response.status_code == 200:
-                                    media_url = media_response.json().get('url', '')
-                                    logger.info(f"📎 Fetched WhatsApp sticker URL")
-                            except Exception as e:
-                                logger.error(f"Failed to fetch WhatsApp media URL: {e}")
+                        media_url = media_urls.get(media_id, '')
                         attachments.append({
                             'type': 'sticker',
                             'media_id': media_id,
@@ -8391,86 +8312,31 @@ def whatsapp_webhook(request):
                     except Exception as notif_err:
                         logger.error(f"Failed to create WhatsApp message notification: {notif_err}")
 
-                # Handle message status updates
+                # Handle message status updates: buffered and applied in
+                # batches so campaign receipt storms don't cost a query each.
                 statuses = value.get('statuses', [])
-                for status_update in statuses:
-                    message_id = status_update.get('id')
-                    status_value = status_update.get('status')  # sent, delivered, read, failed
-                    timestamp_value = status_update.get('timestamp', '')
-
-                    # Update message status
-                    try:
-                        message_obj = WhatsAppMessage.objects.get(message_id=message_id)
-                        message_obj.status = status_value
-
-                        if status_value == 'delivered':
-                            message_obj.is_delivered = True
-                            message_obj.delivered_at = datetime.fromtimestamp(int(timestamp_value), tz=timezone.utc) if timestamp_value else timezone.now()
-                        elif status_value == 'read':
-                            message_obj.is_read = True
-                            message_obj.read_at = datetime.fromtimestamp(int(timestamp_value), tz=timezone.utc) if timestamp_value else timezone.now()
-                        elif status_value == 'failed':
-                            error_info = status_update.get('errors', [{}])[0]
-                            message_obj.error_message = error_info.get('message', 'Failed to deliver')
-
-                        message_obj.save()
-                        logger.info(f"✅ Updated WhatsApp message status: {message_id} -> {status_value}")
-                    except WhatsAppMessage.DoesNotExist:
-                        logger.warning(f"Message not found for status update: {message_id}")
+                if statuses:
+                    from .whatsapp_status_ingest import enqueue as enqueue_statuses
+                    enqueue_statuses(tenant_schema, statuses)
 
                 # ==================== COEXISTENCE WEBHOOK HANDLERS ====================
 
                 # Handle history webhook (synced messages from WhatsApp Business App)
                 if webhook_field == 'history':
+                    # Hand the chunk to the background importer: a 90-180 day
+                    # phase is far too large to apply inside Meta's webhook
+                    # timeout. Fall back to importing inline only if the
+                    # broker is unreachable so the chunk is not lost.
                     history_entries = value.get('history', [])
-                    for entry in history_entries:
-                        history_messages = entry.get('messages', [])
-                        for hist_msg in history_messages:
-                            hist_msg_id = hist_msg.get('id')
-
-                            # Skip if message already exists
-                            if WhatsAppMessage.objects.filter(message_id=hist_msg_id).exists():
-                                logger.debug(f"Skipping duplicate history message: {hist_msg_id}")
-                                continue
-
-                            hist_from = hist_msg.get('from', '')
-                            hist_to = hist_msg.get('to', '')
-                            hist_timestamp = hist_msg.get('timestamp', '')
-                            hist_type = hist_msg.get('type', 'text')
-                            hist_text = ''
-
-                            if hist_type == 'text':
-                                hist_text = hist_msg.get('text', {}).get('body', '')
-                            elif hist_type == 'image':
-                                hist_text = hist_msg.get('image', {}).get('caption', '')
-                            elif hist_type == 'video':
-                                hist_text = hist_msg.get('video', {}).get('caption', '')
-                            elif hist_type == 'document':
-                                hist_text = hist_msg.get('document', {}).get('filename', '')
-
-                            # Determine direction: if 'from' is our phone number, it's outbound
-                            is_outbound = hist_from == account.phone_number or hist_from == account.phone_number_id
-
-                            message_timestamp = datetime.fromtimestamp(int(hist_timestamp), tz=timezone.utc) if hist_timestamp else timezone.now()
-
-                            WhatsAppMessage.objects.create(
-                                business_account=account,
-                                message_id=hist_msg_id,
-                                from_number=hist_from if not is_outbound else account.phone_number,
-                                to_number=hist_to if is_outbound else account.phone_number,
-                                message_text=hist_text,
-                                message_type=hist_type,
-                                timestamp=message_timestamp,
-                                is_from_business=is_outbound,
-                                source='synced',
-                                status='delivered',
-                                is_delivered=True,
-                            )
-                            logger.info(f"📥 Synced history message: {hist_msg_id} (source: synced)")
-
-                    # Update sync timestamp
-                    account.history_synced_at = timezone.now()
-                    account.save(update_fields=['history_synced_at'])
+                    if history_entries:
+                        from .tasks import import_whatsapp_history
+                        try:
+                            import_whatsapp_history.delay(tenant_schema, account.id, history_entries)
+                            logger.info(f"📥 Queued {len(history_entries)} history chunk(s) for {account.waba_id}")
+                        except Exception as queue_err:
+                            logger.error(f"Failed to queue history import, importing inline: {queue_err}")
+                            from .whatsapp_history import import_history_entries
+                            import_history_entries(account, history_entries)
 
                 # Handle smb_message_echoes webhook (messages sent from WhatsApp Business App)
                 if webhook_field == 'smb_message_echoes':
@@ -8620,41 +8486,15 @@ def whatsapp_sync_templates(request, waba_id):
             # Get WABA
             waba = WhatsAppBusinessAccount.objects.get(waba_id=waba_id)
 
-            # Fetch templates from Meta
-            fb_api_version = settings.FACEBOOK_APP_VERSION
-            templates_url = f"https://graph.facebook.com/{fb_api_version}/{waba_id}/message_templates"
-            params = {
-                'access_token': waba.access_token,
-                'fields': 'id,name,language,status,category,components',
-                'limit': 100
-            }
-
-            response = requests.get(templates_url, params=params)
-
-            if response.status_code != 200:
+            # Follows every page, diffs and applies one bulk upsert/delete
+            try:
+                result = whatsapp_templates.sync_templates(waba, created_by=request.user)
+            except whatsapp_templates.TemplateSyncError as sync_err:
                 return Response({
-                    'error': 'Failed to fetch templates from Meta',
-                    'details': response.json()
-                }, status=response.status_code)
-
-            meta_templates = response.json().get('data', [])
-
-            # Sync to database
-            synced_count = 0
-            for meta_template in meta_templates:
-                template_obj, created = WhatsAppMessageTemplate.objects.update_or_create(
-                    business_account=waba,
-                    name=meta_template['name'],
-                    language=meta_template['language'],
-                    defaults={
-                        'template_id': meta_template['id'],
-                        'status': meta_template['status'],
-                        'category': meta_template.get('category', 'UTILITY'),
-                        'components': meta_template.get('components', []),
-                        'created_by': request.user
-                    }
-                )
-                synced_count += 1
+                    'error': str(sync_err),
+                    'details': sync_err.details
+                }, status=sync_err.status_code)
+            synced_count = result['fetched']
 
             # Get all templates after sync
             templates = WhatsAppMessageTemplate.objects.filter(business_account=waba)
@@ -8662,6 +8502,9 @@ def whatsapp_sync_templates(request, waba_id):
 
             return Response({
                 'synced': synced_count,
+                'created': result['created'],
+                'updated': result['updated'],
+                'deleted': result['deleted'],
                 'templates': serializer.data
             }, status=status.HTTP_200_OK)
 
@@ -8713,7 +8556,7 @@ def whatsapp_create_template(request):
                 'Content-Type': 'application/json'
             }
 
-            response = requests.post(create_url, json=payload, headers=headers)
+            response = get_graph_client().post(create_url, json=payload, headers=headers)
 
             if response.status_code not in [200, 201]:
                 return Response({
@@ -8774,7 +8617,7 @@ def whatsapp_delete_template(request, template_id):
                     'name': template.name
                 }
 
-                response = requests.delete(delete_url, params=params)
+                response = get_graph_client().delete(delete_url, params=params)
 
                 if response.status_code not in [200, 204]:
                     logger.warning(f"Failed to delete template from Meta: {response.json()}")
@@ -8880,7 +8723,7 @@ def whatsapp_send_template_message(request):
                 'Content-Type': 'application/json'
             }
 
-            response = requests.post(send_url, json=message_payload, headers=headers)
+            response = get_graph_client().post(send_url, json=message_payload, headers=headers)
 
             if response.status_code != 200:
                 return Response({
@@ -11102,91 +10945,33 @@ def mark_all_conversations_read(request):
 
     Request body (optional):
     {
-        "platform": "facebook" | "instagram" | "whatsapp" | "email" | "all" | "facebook,instagram,whatsapp"  (default: "all")
+        "platform": "facebook" | "instagram" | "whatsapp" | "email" | "all" | "facebook,instagram,whatsapp"  (default: "all"),
+        "async": false  (true = run as a background job, poll /bulk-jobs/<job_id>/)
     }
 
     Supports comma-separated platform values (e.g., "facebook,instagram,whatsapp" to exclude email).
+    Each platform is a single UPDATE statement.
 
-    Returns count of messages marked as read.
+    Returns count of messages marked as read (or 202 + job for async).
     """
     logger = logging.getLogger(__name__)
 
     try:
         platform_param = request.data.get('platform', 'all').lower()
-        now = timezone.now()
-        total_updated = 0
-
-        # Support comma-separated platforms
-        platforms = [p.strip() for p in platform_param.split(',')]
-        include_all = 'all' in platforms
-
-        # Mark Facebook messages as read
-        if include_all or 'facebook' in platforms:
-            count = FacebookMessage.objects.filter(
-                is_from_page=False,
-                is_read_by_staff=False
-            ).update(
-                is_read_by_staff=True,
-                read_by_staff_at=now
-            )
-            total_updated += count
-            logger.info(f"Marked {count} Facebook messages as read")
-
-        # Mark Instagram messages as read
-        if include_all or 'instagram' in platforms:
-            count = InstagramMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(
-                is_read_by_staff=True,
-                read_by_staff_at=now
-            )
-            total_updated += count
-            logger.info(f"Marked {count} Instagram messages as read")
-
-        # Mark WhatsApp messages as read
-        if include_all or 'whatsapp' in platforms:
-            count = WhatsAppMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(
-                is_read_by_staff=True,
-                read_by_staff_at=now
-            )
-            total_updated += count
-            logger.info(f"Marked {count} WhatsApp messages as read")
+        platforms = bulk_inbox.parse_platforms(platform_param)
 
-        # Mark Email messages as read
-        if include_all or 'email' in platforms:
-            count = EmailMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(
-                is_read_by_staff=True,
-                read_by_staff_at=now
-            )
-            total_updated += count
-            logger.info(f"Marked {count} Email messages as read")
+        if _truthy(request.data.get('async')):
+            job = bulk_inbox.start_job('mark_all_read', platforms, request.user.id)
+            return Response(job, status=status.HTTP_202_ACCEPTED)
 
-        # Mark Widget messages as read
-        if include_all or 'widget' in platforms:
-            count = WidgetMessage.objects.filter(
-                is_from_visitor=True,
-                is_read_by_staff=False,
-            ).update(
-                is_read_by_staff=True,
-                read_by_staff_at=now,
-            )
-            total_updated += count
-            logger.info(f"Marked {count} Widget messages as read")
+        now = timezone.now()
+        total_updated = bulk_inbox.mark_all_read(platforms, now)
 
         # Bulk read-state broadcast: beta clients treat conversation_id=None
         # as "clear all unread for the listed platform(s)" so the sidebar
         # badges drop instantly without a list refetch. Emitted once per
         # touched platform so handlers can keep platform-scoped logic clean.
-        for plat in [p for p in platforms if p != 'all'] or (
-            ['facebook', 'instagram', 'whatsapp', 'email', 'widget'] if include_all else []
-        ):
+        for plat in bulk_inbox.broadcast_platforms(platforms):
             _broadcast_read_state(
                 request,
                 platform=plat,
@@ -11291,11 +11076,12 @@ def archive_conversation(request):
                     is_read_by_staff=False
                 ).update(is_read_by_staff=True, read_by_staff_at=now)
             elif platform == 'widget':
-                WidgetMessage.objects.filter(
+                if WidgetMessage.objects.filter(
                     session__session_id=conversation_id,
                     is_from_visitor=True,
                     is_read_by_staff=False,
-                ).update(is_read_by_staff=True, read_by_staff_at=now)
+                ).update(is_read_by_staff=True, read_by_staff_at=now):
+                    widget_poll.bump(conversation_id)
                 # Archiving a widget chat is also the agent saying "I'm done
                 # with this conversation". Close the underlying session and
                 # tell the visitor's iframe so it surfaces the post-chat
@@ -11462,170 +11248,37 @@ def archive_all_conversations(request):
 
     Request body (optional):
     {
-        "platform": "facebook" | "instagram" | "whatsapp" | "email" | "all" | "facebook,instagram,whatsapp"  (default: "all")
+        "platform": "facebook" | "instagram" | "whatsapp" | "email" | "all" | "facebook,instagram,whatsapp"  (default: "all"),
+        "async": false  (true = run as a background job, poll /bulk-jobs/<job_id>/)
     }
 
     Supports comma-separated platform values (e.g., "facebook,instagram,whatsapp" to exclude email).
+    Each platform is one INSERT ... SELECT ... ON CONFLICT DO NOTHING plus one
+    UPDATE for read state, regardless of inbox size.
 
-    Returns count of conversations archived.
+    Returns count of conversations archived (or 202 + job for async).
     """
     logger = logging.getLogger(__name__)
 
     try:
         platform_param = request.data.get('platform', 'all').lower()
-        archived_count = 0
-
-        # Support comma-separated platforms
-        platforms = [p.strip() for p in platform_param.split(',')]
-        include_all = 'all' in platforms
-
-        # Get all existing archived conversation keys for quick lookup
-        existing_archives = set(
-            ConversationArchive.objects.values_list('platform', 'conversation_id', 'account_id')
-        )
-
-        # Get all active assignments to skip (don't archive assigned chats)
-        active_assignments = set(
-            ChatAssignment.objects.filter(status='in_session')
-            .values_list('platform', 'conversation_id', 'account_id')
-        )
+        platforms = bulk_inbox.parse_platforms(platform_param)
 
-        conversations_to_archive = []
+        if _truthy(request.data.get('async')):
+            job = bulk_inbox.start_job('archive_all', platforms, request.user.id)
+            return Response(job, status=status.HTTP_202_ACCEPTED)
 
-        # Gather Facebook conversations
-        if include_all or 'facebook' in platforms:
-            fb_pages = FacebookPageConnection.objects.filter(is_active=True)
-            for page in fb_pages:
-                # Get unique sender_ids for this page
-                sender_ids = FacebookMessage.objects.filter(
-                    page_connection=page,
-                    is_deleted=False
-                ).values_list('sender_id', flat=True).distinct()
-
-                for sender_id in sender_ids:
-                    key = ('facebook', sender_id, page.page_id)
-                    if key not in existing_archives and key not in active_assignments:
-                        conversations_to_archive.append({
-                            'platform': 'facebook',
-                            'conversation_id': sender_id,
-                            'account_id': page.page_id
-                        })
-
-        # Gather Instagram conversations
-        if include_all or 'instagram' in platforms:
-            ig_accounts = InstagramAccountConnection.objects.filter(is_active=True)
-            for account in ig_accounts:
-                sender_ids = InstagramMessage.objects.filter(
-                    account_connection=account,
-                    is_deleted=False
-                ).values_list('sender_id', flat=True).distinct()
-
-                for sender_id in sender_ids:
-                    key = ('instagram', sender_id, account.instagram_account_id)
-                    if key not in existing_archives and key not in active_assignments:
-                        conversations_to_archive.append({
-                            'platform': 'instagram',
-                            'conversation_id': sender_id,
-                            'account_id': account.instagram_account_id
-                        })
-
-        # Gather WhatsApp conversations
-        if include_all or 'whatsapp' in platforms:
-            wa_accounts = WhatsAppBusinessAccount.objects.filter(is_active=True)
-            for account in wa_accounts:
-                from_numbers = WhatsAppMessage.objects.filter(
-                    business_account=account,
-                    is_deleted=False
-                ).values_list('from_number', flat=True).distinct()
-
-                for from_number in from_numbers:
-                    # Normalize phone number
-                    normalized = from_number.lstrip('+') if from_number else from_number
-                    key = ('whatsapp', normalized, account.waba_id)
-                    if key not in existing_archives and key not in active_assignments:
-                        conversations_to_archive.append({
-                            'platform': 'whatsapp',
-                            'conversation_id': normalized,
-                            'account_id': account.waba_id
-                        })
-
-        # Gather Email conversations (only INBOX threads)
-        if include_all or 'email' in platforms:
-            email_connections = EmailConnection.objects.filter(is_active=True)
-            for connection in email_connections:
-                thread_ids = EmailMessage.objects.filter(
-                    connection=connection,
-                    is_deleted=False,
-                    folder='INBOX'
-                ).values_list('thread_id', flat=True).distinct()
-
-                for thread_id in thread_ids:
-                    key = ('email', thread_id, str(connection.id))
-                    if key not in existing_archives and key not in active_assignments:
-                        conversations_to_archive.append({
-                            'platform': 'email',
-                            'conversation_id': thread_id,
-                            'account_id': str(connection.id)
-                        })
-
-        # Bulk create archive records
-        archive_objects = [
-            ConversationArchive(
-                platform=conv['platform'],
-                conversation_id=conv['conversation_id'],
-                account_id=conv['account_id'],
-                archived_by=request.user
-            )
-            for conv in conversations_to_archive
-        ]
-
-        if archive_objects:
-            ConversationArchive.objects.bulk_create(archive_objects, ignore_conflicts=True)
-            archived_count = len(archive_objects)
-
-        # Mark all messages as read for archived conversations
         now = timezone.now()
-        messages_marked_read = 0
-
-        if include_all or 'facebook' in platforms:
-            count = FacebookMessage.objects.filter(
-                is_from_page=False,
-                is_read_by_staff=False
-            ).update(is_read_by_staff=True, read_by_staff_at=now)
-            messages_marked_read += count
-
-        if include_all or 'instagram' in platforms:
-            count = InstagramMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(is_read_by_staff=True, read_by_staff_at=now)
-            messages_marked_read += count
-
-        if include_all or 'whatsapp' in platforms:
-            count = WhatsAppMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(is_read_by_staff=True, read_by_staff_at=now)
-            messages_marked_read += count
-
-        if include_all or 'email' in platforms:
-            count = EmailMessage.objects.filter(
-                is_from_business=False,
-                is_read_by_staff=False
-            ).update(is_read_by_staff=True, read_by_staff_at=now)
-            messages_marked_read += count
+        result = bulk_inbox.archive_all(platforms, request.user.id, now)
+        archived_count = result['archived_count']
 
-        logger.info(f"Archived {archived_count} conversations, marked {messages_marked_read} messages as read (platform: {platform_param})")
+        logger.info(f"Archived {archived_count} conversations, marked {result['messages_marked_read']} messages as read (platform: {platform_param})")
 
         # Bulk archive_update broadcast: emit one frame per touched platform
         # with conversation_id=None so beta clients can re-evaluate the entire
         # platform's archived map at once instead of receiving N frames. Same
         # convention as the bulk mark-all-read path above.
-        bulk_platforms = (
-            [p for p in platforms if p != 'all']
-            or (['facebook', 'instagram', 'whatsapp', 'email', 'widget'] if include_all else [])
-        )
-        for plat in bulk_platforms:
+        for plat in bulk_inbox.broadcast_platforms(platforms):
             _broadcast_archive_change(
                 request,
                 platform=plat,
@@ -11649,6 +11302,18 @@ def archive_all_conversations(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, CanViewSocialMessages])
+def bulk_inbox_job_status(request, job_id):
+    """Progress of an async archive-all / mark-all-read job."""
+    from django.db import connection
+
+    job = bulk_inbox.get_job(connection.schema_name, job_id)
+    if job is None:
+        return Response({'error': 'Job not found or expired'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job)
+
+
 # ===========================
 # Auto-Posting Endpoints
 # ===========================
@@ -0,0 +1,245 @@
+"""Background importer for WhatsApp coexistence ``history`` webhooks.
+
+During coexistence onboarding Meta replays up to 180 days of WhatsApp
+Business App history as a stream of webhook chunks. Importing them inline
+(one ``exists()`` plus one ``create()`` per message) made the webhook time
+out against Meta on busy numbers, so the webhook now only enqueues the chunk
+and :func:`import_history_chunk` applies it:
+
+* messages are parsed in memory and written with ``bulk_create`` in batches,
+  relying on the unique ``message_id`` to make redelivered chunks harmless;
+* progress is checkpointed per account and phase in
+  :class:`~social_integrations.models.WhatsAppHistoryImport`. Chunks already
+  applied in the current run are skipped; a new run starts only when the
+  sync is requested again (:func:`start_phase`);
+* contact summaries (``WhatsAppContact.last_message_at``) are rebuilt once
+  when a phase reports 100 % instead of being touched per message.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from datetime import datetime
+from typing import Iterable, Iterator, List, Tuple
+
+from django.db import transaction
+from django.db.models import (
+    Case, CharField, F, Max, PositiveIntegerField, PositiveSmallIntegerField, Value, When,
+)
+from django.utils import timezone
+
+from .models import (
+    WhatsAppBusinessAccount, WhatsAppContact, WhatsAppHistoryImport, WhatsAppMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+
+_NON_DIGITS = re.compile(r'\D+')
+
+
+def _digits(number: str) -> str:
+    return _NON_DIGITS.sub('', number or '')
+
+
+def _message_text(message: dict, message_type: str) -> str:
+    if message_type == 'text':
+        return (message.get('text') or {}).get('body', '')
+    if message_type in ('image', 'video'):
+        return (message.get(message_type) or {}).get('caption', '')
+    if message_type == 'document':
+        return (message.get('document') or {}).get('filename', '')
+    return ''
+
+
+def _iter_entry_messages(entry: dict) -> Iterator[Tuple[str, dict]]:
+    """Yield ``(thread_wa_id, message)`` for both payload shapes Meta has used:
+    ``{"threads": [{"id": ..., "messages": [...]}]}`` and a flat ``{"messages": [...]}``."""
+    for thread in entry.get('threads') or []:
+        for message in thread.get('messages') or []:
+            yield thread.get('id', ''), message
+    for message in entry.get('messages') or []:
+        yield '', message
+
+
+def build_messages(account: WhatsAppBusinessAccount, entry: dict) -> List[WhatsAppMessage]:
+    """Turn one history entry into unsaved ``WhatsAppMessage`` rows."""
+    own_numbers = {_digits(account.phone_number), _digits(account.display_phone_number), account.phone_number_id}
+    own_numbers.discard('')
+    messages = []
+    for thread_id, message in _iter_entry_messages(entry):
+        message_id = message.get('id')
+        if not message_id:
+            continue
+        sender = message.get('from', '')
+        is_outbound = sender in own_numbers or _digits(sender) in own_numbers
+        counterpart = (message.get('to') or thread_id) if is_outbound else sender
+        message_type = message.get('type', 'text')
+        raw_timestamp = message.get('timestamp')
+        messages.append(WhatsAppMessage(
+            business_account=account,
+            message_id=message_id,
+            from_number=account.phone_number if is_outbound else sender,
+            to_number=counterpart if is_outbound else account.phone_number,
+            message_text=_message_text(message, message_type),
+            message_type=message_type,
+            timestamp=(
+                datetime.fromtimestamp(int(raw_timestamp), tz=timezone.utc)
+                if raw_timestamp else timezone.now()
+            ),
+            is_from_business=is_outbound,
+            source='synced',
+            status='delivered',
+            is_delivered=True,
+        ))
+    return messages
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_messages(messages: List[WhatsAppMessage]) -> int:
+    """Insert ``messages`` skipping ids already stored. Returns rows inserted.
+
+    One ``IN`` lookup per batch tells us which ids are new (so the checkpoint
+    counts are honest); ``ignore_conflicts`` still covers a concurrent
+    webhook or a redelivered chunk racing this one.
+    """
+    inserted = 0
+    for batch in _chunks(messages, BULK_BATCH_SIZE):
+        existing = set(
+            WhatsAppMessage.objects
+            .filter(message_id__in=[m.message_id for m in batch])
+            .values_list('message_id', flat=True)
+        )
+        new = [m for m in batch if m.message_id not in existing]
+        if new:
+            WhatsAppMessage.objects.bulk_create(new, ignore_conflicts=True)
+            inserted += len(new)
+    return inserted
+
+
+def rebuild_contact_summaries(account: WhatsAppBusinessAccount) -> int:
+    """Upsert one ``WhatsAppContact`` per customer with its latest message time.
+
+    A single ``GROUP BY`` over the account's messages plus one
+    ``INSERT ... ON CONFLICT DO UPDATE``; returns the number of contacts touched.
+    """
+    latest = (
+        WhatsAppMessage.objects
+        .filter(business_account=account, is_deleted=False)
+        .annotate(customer_number=Case(
+            When(is_from_business=True, then=F('to_number')),
+            default=F('from_number'),
+            output_field=CharField(),
+        ))
+        .order_by()
+        .values('customer_number')
+        .annotate(last_message_at=Max('timestamp'))
+    )
+    by_wa_id = {}
+    for row in latest:
+        wa_id = _digits(row['customer_number'])
+        if wa_id and (wa_id not in by_wa_id or row['last_message_at'] > by_wa_id[wa_id]):
+            by_wa_id[wa_id] = row['last_message_at']
+
+    contacts = [
+        WhatsAppContact(account=account, wa_id=wa_id, last_message_at=last_message_at)
+        for wa_id, last_message_at in by_wa_id.items()
+    ]
+    for batch in _chunks(contacts, BULK_BATCH_SIZE):
+        WhatsAppContact.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['account', 'wa_id'],
+            update_fields=['last_message_at'],
+        )
+    return len(contacts)
+
+
+def start_phase(account: WhatsAppBusinessAccount, phase: int) -> WhatsAppHistoryImport:
+    """Reset the phase's checkpoint for a newly requested sync."""
+    checkpoint, _ = WhatsAppHistoryImport.objects.get_or_create(account=account, phase=phase)
+    WhatsAppHistoryImport.objects.filter(pk=checkpoint.pk).update(
+        status='pending', progress=0, last_chunk_order=0, chunks_processed=0,
+        messages_received=0, messages_imported=0, error_message='', completed_at=None,
+    )
+    checkpoint.refresh_from_db()
+    return checkpoint
+
+
+def import_history_chunk(account: WhatsAppBusinessAccount, entry: dict) -> WhatsAppHistoryImport:
+    """Apply one ``history`` entry and advance the account/phase checkpoint.
+
+    Meta numbers the chunks of a phase in delivery order, so a chunk at or
+    below ``last_chunk_order`` was already applied in this run (a redelivery
+    or a late retry) and is skipped. Only :func:`start_phase` starts a new run.
+    """
+    meta = entry.get('metadata') or {}
+    phase = int(meta.get('phase', 0) or 0)
+    chunk_order = int(meta.get('chunk_order', 0) or 0)
+    # Legacy payloads carry no progress metadata; treat each as a whole phase.
+    progress = int(meta.get('progress', 100) if meta else 100)
+
+    checkpoint, _ = WhatsAppHistoryImport.objects.get_or_create(account=account, phase=phase)
+    messages = build_messages(account, entry)
+    with transaction.atomic():
+        checkpoint = WhatsAppHistoryImport.objects.select_for_update().get(pk=checkpoint.pk)
+        if chunk_order and chunk_order <= checkpoint.last_chunk_order:
+            logger.info('History chunk already applied: waba=%s phase=%s chunk=%s (last %s)',
+                        account.waba_id, phase, chunk_order, checkpoint.last_chunk_order)
+            return checkpoint
+
+        errors = entry.get('errors') or []
+        if errors:
+            WhatsAppHistoryImport.objects.filter(pk=checkpoint.pk).update(
+                status='failed',
+                error_message=str(errors[0].get('message') or errors[0])[:1000],
+            )
+            checkpoint.refresh_from_db()
+            logger.warning('History sync declined/failed: waba=%s phase=%s errors=%s', account.waba_id, phase, errors)
+            return checkpoint
+
+        inserted = insert_messages(messages)
+        WhatsAppHistoryImport.objects.filter(pk=checkpoint.pk).update(
+            status='importing',
+            chunks_processed=F('chunks_processed') + 1,
+            messages_received=F('messages_received') + len(messages),
+            messages_imported=F('messages_imported') + inserted,
+            last_chunk_order=Case(
+                When(last_chunk_order__lt=chunk_order, then=Value(chunk_order)),
+                default=F('last_chunk_order'),
+                output_field=PositiveIntegerField(),
+            ),
+            progress=Case(
+                When(progress__lt=progress, then=Value(progress)),
+                default=F('progress'),
+                output_field=PositiveSmallIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    checkpoint.refresh_from_db()
+    logger.info('History chunk imported: waba=%s phase=%s chunk=%s progress=%s%% %s/%s new',
+                account.waba_id, phase, chunk_order, progress, inserted, len(messages))
+
+    if checkpoint.progress >= 100 and checkpoint.status != 'completed':
+        finish_phase(account, checkpoint)
+    return checkpoint
+
+
+def finish_phase(account: WhatsAppBusinessAccount, checkpoint: WhatsAppHistoryImport) -> None:
+    contacts = rebuild_contact_summaries(account)
+    now = timezone.now()
+    WhatsAppHistoryImport.objects.filter(pk=checkpoint.pk).update(status='completed', completed_at=now)
+    account.history_synced_at = now
+    account.save(update_fields=['history_synced_at'])
+    checkpoint.refresh_from_db()
+    logger.info('History phase %s complete for waba=%s: %s messages imported, %s contacts summarised',
+                checkpoint.phase, account.waba_id, checkpoint.messages_imported, contacts)
+
+
+def import_history_entries(account: WhatsAppBusinessAccount, entries: List[dict]) -> List[WhatsAppHistoryImport]:
+    return [import_history_chunk(account, entry) for entry in entries]
@@ -0,0 +1,256 @@
+"""Buffered ingestion of WhatsApp ``statuses`` webhooks.
+
+Template and campaign sends produce thousands of sent/delivered/read
+callbacks within seconds. Instead of a ``get()`` + full-row ``save()`` per
+callback, the webhook pushes raw statuses onto a per-tenant Redis list and
+schedules a single delayed flush. The flush:
+
+1. reads the list in chunks and collapses each to one record per message
+   (highest status wins, earliest delivered/read timestamps kept);
+2. applies each chunk in a transaction with one ``UPDATE ... FROM (VALUES
+   ...)`` per batch that never downgrades a message (a late ``delivered``
+   cannot undo ``read``), and trims the chunk from the list after commit;
+3. emits one ``message_status_batch`` WebSocket frame per conversation.
+
+If Redis is unavailable the webhook's statuses are applied inline through
+the same collapse/update path, so nothing is lost. A beat task flushes any
+tenant whose buffer outlived its scheduled flush (see ``pending_schemas``).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, transaction
+
+from amanati_crm.redis_utils import decode, get_redis
+
+from .models import WhatsAppBusinessAccount, WhatsAppMessage
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'wa_status_buffer:{schema}'
+FLUSH_FLAG_KEY = 'wa_status_flush:{schema}'
+LOCK_KEY = 'wa_status_lock:{schema}'
+FLUSH_BATCH_SIZE = 1000
+LOCK_TTL = 60
+
+STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+def _flush_window() -> float:
+    return float(getattr(settings, 'SOCIAL_INTEGRATIONS', {}).get('WHATSAPP_STATUS_FLUSH_SECONDS', 2))
+
+
+# ---------------------------------------------------------------------------
+# Parsing / collapsing
+# ---------------------------------------------------------------------------
+
+def normalize(status_update: dict) -> Optional[dict]:
+    """Reduce one Meta status callback to the fields the update needs."""
+    message_id = status_update.get('id')
+    status = status_update.get('status')
+    if not message_id or status not in STATUS_RANK:
+        return None
+    try:
+        ts = int(status_update.get('timestamp') or 0)
+    except (TypeError, ValueError):
+        ts = 0
+    error = ''
+    if status == 'failed':
+        error = ((status_update.get('errors') or [{}])[0] or {}).get('message', 'Failed to deliver')
+    return {'message_id': message_id, 'status': status, 'ts': ts, 'error': error}
+
+
+def collapse(updates: Iterable[dict]) -> Dict[str, dict]:
+    """Fold many callbacks into one record per message id."""
+    collapsed: Dict[str, dict] = {}
+    for update in updates:
+        if not update:
+            continue
+        record = collapsed.setdefault(update['message_id'], {
+            'message_id': update['message_id'],
+            'status': update['status'],
+            'delivered_ts': None,
+            'read_ts': None,
+            'error': '',
+        })
+        if STATUS_RANK[update['status']] > STATUS_RANK[record['status']]:
+            record['status'] = update['status']
+        ts = update['ts'] or None
+        if update['status'] in ('delivered', 'read') and ts:
+            record['delivered_ts'] = min(filter(None, [record['delivered_ts'], ts]))
+        if update['status'] == 'read' and ts:
+            record['read_ts'] = min(filter(None, [record['read_ts'], ts]))
+        if update['error']:
+            record['error'] = update['error']
+    return collapsed
+
+
+def _as_datetime(ts: Optional[int]) -> Optional[datetime]:
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc) if ts else None
+
+
+# ---------------------------------------------------------------------------
+# Apply
+# ---------------------------------------------------------------------------
+
+def apply_batch(records: List[dict]) -> List[tuple]:
+    """One ``UPDATE ... FROM (VALUES ...)`` for ``records``.
+
+    Returns ``(message_id, status, business_account_id, customer_number)``
+    for every row actually updated.
+    """
+    if not records:
+        return []
+    table = connection.ops.quote_name(WhatsAppMessage._meta.db_table)
+    values_sql = ', '.join(['(%s, %s, %s::timestamptz, %s::timestamptz, %s)'] * len(records))
+    params = []
+    for record in records:
+        delivered_at = _as_datetime(record['delivered_ts'])
+        read_at = _as_datetime(record['read_ts'])
+        if record['status'] in ('delivered', 'read') and delivered_at is None:
+            delivered_at = read_at or datetime.now(dt_timezone.utc)
+        if record['status'] == 'read' and read_at is None:
+            read_at = datetime.now(dt_timezone.utc)
+        params.extend([record['message_id'], record['status'], delivered_at, read_at, record['error']])
+
+    sql = f'''
+        UPDATE {table} AS m SET
+            status = CASE
+                WHEN m.status = 'failed' THEN m.status
+                WHEN m.status = 'read' AND v.status IN ('sent', 'delivered') THEN m.status
+                WHEN m.status = 'delivered' AND v.status = 'sent' THEN m.status
+                ELSE v.status
+            END,
+            is_delivered = m.is_delivered OR v.delivered_at IS NOT NULL,
+            delivered_at = COALESCE(m.delivered_at, v.delivered_at),
+            is_read = m.is_read OR v.read_at IS NOT NULL,
+            read_at = COALESCE(m.read_at, v.read_at),
+            error_message = CASE WHEN v.error <> '' THEN v.error ELSE m.error_message END
+        FROM (VALUES {values_sql}) AS v(message_id, status, delivered_at, read_at, error)
+        WHERE m.message_id = v.message_id
+        RETURNING m.message_id, m.status, m.business_account_id,
+                  CASE WHEN m.is_from_business THEN m.to_number ELSE m.from_number END
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _broadcast(tenant_schema: str, rows: List[tuple]) -> None:
+    from .consumers import send_message_status_batch
+
+    if not rows:
+        return
+    waba_ids = dict(
+        WhatsAppBusinessAccount.objects
+        .filter(pk__in={row[2] for row in rows})
+        .values_list('pk', 'waba_id')
+    )
+    now = datetime.now(dt_timezone.utc).isoformat()
+    by_conversation: Dict[tuple, List[dict]] = {}
+    for message_id, status, account_pk, customer_number in rows:
+        key = (waba_ids.get(account_pk), customer_number)
+        by_conversation.setdefault(key, []).append(
+            {'message_id': message_id, 'status': status, 'timestamp': now}
+        )
+    for (waba_id, customer_number), statuses in by_conversation.items():
+        try:
+            async_to_sync(send_message_status_batch)(
+                tenant_schema,
+                platform='whatsapp',
+                conversation_id=customer_number,
+                account_id=waba_id,
+                statuses=statuses,
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('message_status_batch broadcast failed: %s', exc)
+
+
+def apply_updates(tenant_schema: str, updates: Iterable[dict]) -> int:
+    """Collapse, apply in batches and broadcast. Returns messages updated."""
+    records = list(collapse(updates).values())
+    updated = 0
+    for start in range(0, len(records), FLUSH_BATCH_SIZE):
+        rows = apply_batch(records[start:start + FLUSH_BATCH_SIZE])
+        updated += len(rows)
+        # Inside a flush's transaction, only announce what actually committed.
+        transaction.on_commit(lambda rows=rows: _broadcast(tenant_schema, rows))
+    missing = len(records) - updated
+    if missing:
+        logger.info('%s WhatsApp status update(s) for unknown messages ignored', missing)
+    return updated
+
+
+# ---------------------------------------------------------------------------
+# Buffering
+# ---------------------------------------------------------------------------
+
+def enqueue(tenant_schema: str, statuses: List[dict]) -> None:
+    """Buffer webhook ``statuses`` and make sure a flush is scheduled.
+
+    Never raises; falls back to applying inline when Redis or the broker is down.
+    """
+    updates = [u for u in (normalize(s) for s in statuses) if u]
+    if not updates:
+        return
+    window = _flush_window()
+    try:
+        redis = get_redis()
+        redis.rpush(BUFFER_KEY.format(schema=tenant_schema), *[json.dumps(u) for u in updates])
+        # The flag's TTL is only a safety net in case a scheduled flush is lost.
+        if redis.set(FLUSH_FLAG_KEY.format(schema=tenant_schema), '1', nx=True, ex=max(int(window * 10), 30)):
+            from .tasks import flush_whatsapp_statuses
+            flush_whatsapp_statuses.apply_async((tenant_schema,), countdown=window)
+        return
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('WhatsApp status buffer unavailable, applying %s update(s) inline: %s', len(updates), exc)
+    apply_updates(tenant_schema, updates)
+
+
+def flush(tenant_schema: str) -> int:
+    """Drain the tenant's buffer and apply it. Runs inside ``schema_context``.
+
+    Only one flusher per tenant runs at a time. Each chunk is read, applied in
+    a transaction and only then trimmed, so a worker that dies mid-flush
+    leaves its chunk in the buffer for the next flush. ``RPUSH`` only appends
+    past the range being processed, so trimming the processed prefix is safe.
+    """
+    redis = get_redis()
+    lock_key = LOCK_KEY.format(schema=tenant_schema)
+    if not redis.set(lock_key, '1', nx=True, ex=LOCK_TTL):
+        # Another worker is flushing; look again once it is likely done.
+        from .tasks import flush_whatsapp_statuses
+        flush_whatsapp_statuses.apply_async((tenant_schema,), countdown=_flush_window())
+        return 0
+    try:
+        # Clear the flag first: anything pushed from here on schedules its own flush.
+        redis.delete(FLUSH_FLAG_KEY.format(schema=tenant_schema))
+        key = BUFFER_KEY.format(schema=tenant_schema)
+        total = 0
+        while True:
+            raw = redis.lrange(key, 0, FLUSH_BATCH_SIZE * 5 - 1)
+            if not raw:
+                break
+            with transaction.atomic():
+                total += apply_updates(tenant_schema, [json.loads(item) for item in raw])
+            redis.ltrim(key, len(raw), -1)
+            redis.expire(lock_key, LOCK_TTL)
+        return total
+    finally:
+        redis.delete(lock_key)
+
+
+def pending_schemas() -> List[str]:
+    """Tenants with buffered statuses (safety net for lost flush tasks)."""
+    redis = get_redis()
+    prefix = BUFFER_KEY.format(schema='')
+    return sorted(
+        decode(key)[len(prefix):]
+        for key in redis.scan_iter(match=prefix + '*', count=500)
+    )
@@ -0,0 +1,140 @@
+"""WhatsApp message-template sync engine.
+
+Pulls every page of ``/<waba_id>/message_templates`` from Graph, diffs it
+against the stored :class:`~social_integrations.models.WhatsAppMessageTemplate`
+rows by ``(name, language, template_id)`` and applies the result as one bulk
+upsert plus one bulk delete. Runs both from the manual "sync" button and from
+the periodic per-WABA Celery job, so the template picker always reads a warm
+local table instead of calling Meta.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+from .graph_client import get_graph_client
+from .models import WhatsAppBusinessAccount, WhatsAppMessageTemplate
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_FIELDS = 'id,name,language,status,category,components'
+PAGE_LIMIT = 100
+# Safety stop for a runaway ``paging.next`` chain (25k templates).
+MAX_PAGES = 250
+
+SYNCED_FIELDS = ('template_id', 'status', 'category', 'components')
+
+
+class TemplateSyncError(Exception):
+    """Graph refused the template listing; nothing was changed locally."""
+
+    def __init__(self, message, status_code=502, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+def fetch_all_templates(waba: WhatsAppBusinessAccount) -> List[dict]:
+    """Every template Meta has for ``waba``, following the paging cursors."""
+    client = get_graph_client()
+    url = f'{waba.waba_id}/message_templates'
+    params: Optional[dict] = {
+        'access_token': waba.access_token,
+        'fields': TEMPLATE_FIELDS,
+        'limit': PAGE_LIMIT,
+    }
+    templates: List[dict] = []
+    for _ in range(MAX_PAGES):
+        response = client.get(url, params=params)
+        if response.status_code != 200:
+            try:
+                details = response.json()
+            except ValueError:
+                details = response.text[:500]
+            raise TemplateSyncError('Failed to fetch templates from Meta', response.status_code, details)
+        payload = response.json()
+        templates.extend(payload.get('data', []))
+        next_url = (payload.get('paging') or {}).get('next')
+        if not next_url:
+            return templates
+        # ``next`` already carries the cursor, token and fields.
+        url, params = next_url, None
+    logger.warning('Template paging for WABA %s stopped after %s pages', waba.waba_id, MAX_PAGES)
+    return templates
+
+
+def _remote_values(remote: dict) -> dict:
+    return {
+        'template_id': str(remote.get('id', '')),
+        'status': remote.get('status', 'PENDING'),
+        'category': remote.get('category', 'UTILITY'),
+        'components': remote.get('components', []),
+    }
+
+
+def diff_templates(existing: List[WhatsAppMessageTemplate], remote: List[dict]
+                   ) -> Tuple[List[dict], List[dict], List[int], int]:
+    """Split ``remote`` into ``(created, changed, stale_ids, unchanged_count)``.
+
+    ``created``/``changed`` are ``{'name', 'language', ...SYNCED_FIELDS}``
+    dicts; ``stale_ids`` are primary keys of local rows Meta no longer has.
+    """
+    by_key: Dict[Tuple[str, str], WhatsAppMessageTemplate] = {
+        (t.name, t.language): t for t in existing
+    }
+    created, changed = [], []
+    unchanged = 0
+    seen = set()
+    for item in remote:
+        key = (item.get('name'), item.get('language'))
+        if not all(key) or key in seen:
+            continue
+        seen.add(key)
+        values = _remote_values(item)
+        row = by_key.get(key)
+        if row is None:
+            created.append({'name': key[0], 'language': key[1], **values})
+        elif any(getattr(row, field) != values[field] for field in SYNCED_FIELDS):
+            changed.append({'name': key[0], 'language': key[1], **values})
+        else:
+            unchanged += 1
+    stale_ids = [t.pk for key, t in by_key.items() if key not in seen]
+    return created, changed, stale_ids, unchanged
+
+
+def sync_templates(waba: WhatsAppBusinessAccount, created_by=None) -> dict:
+    """Bring the local template table for ``waba`` in line with Meta.
+
+    Raises :class:`TemplateSyncError` (before touching the table) when Graph
+    fails, so a partial listing never deletes live templates.
+    """
+    remote = fetch_all_templates(waba)
+    existing = list(WhatsAppMessageTemplate.objects.filter(business_account=waba))
+    created, changed, stale_ids, unchanged = diff_templates(existing, remote)
+
+    rows = [
+        WhatsAppMessageTemplate(business_account=waba, created_by=created_by, **values)
+        for values in created + changed
+    ]
+    with transaction.atomic():
+        if rows:
+            WhatsAppMessageTemplate.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['business_account', 'name', 'language'],
+                update_fields=[*SYNCED_FIELDS, 'updated_at'],
+            )
+        if stale_ids:
+            WhatsAppMessageTemplate.objects.filter(pk__in=stale_ids).delete()
+
+    result = {
+        'fetched': len(remote),
+        'created': len(created),
+        'updated': len(changed),
+        'unchanged': unchanged,
+        'deleted': len(stale_ids),
+    }
+    logger.info('Synced WhatsApp templates for WABA %s: %s', waba.waba_id, result)
+    return result
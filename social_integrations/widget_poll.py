@@ -0,0 +1,226 @@
+"""Change versions for widget sessions (polling fallback).
+
+Visitors whose WebSocket cannot connect poll
+``/api/widget/public/messages/list/`` every few seconds. Almost all of those
+polls see no change, so each session gets a small change counter in Redis:
+
+* every write that alters what the visitor's list would show (a new message,
+  staff read receipts, soft deletes) bumps the counter after commit and
+  publishes it on a per-session channel;
+* the poll endpoint derives its ``ETag`` from the counter. A matching
+  ``If-None-Match`` is answered with 304 without touching the tenant schema;
+* the long-poll endpoint parks on the session channel until a bump arrives
+  or its timeout fires. All parked requests in a process share one pub/sub
+  connection (:class:`_Subscriber`), so a waiter costs a future and a
+  channel subscription, not a Redis connection.
+
+Keys are seeded from the wall clock instead of starting at 1. An expired key
+that gets recreated therefore never hands out a version a client has already
+seen. When Redis is unavailable every helper degrades to "unknown version",
+and the endpoints fall back to a full response.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+import weakref
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from amanati_crm.redis_utils import decode, get_redis
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'widget_session_ver:{schema}:{session_id}'
+CHANNEL_KEY = 'widget_session_ch:{schema}:{session_id}'
+# Long enough to outlive a visitor tab left open over a working day.
+VERSION_TTL = 60 * 60 * 24
+LONG_POLL_MAX_SECONDS = 25
+
+
+def _seed() -> int:
+    return int(time.time() * 1000)
+
+
+def get_version(schema: str, session_id: str) -> Optional[str]:
+    """Current version for the session, or ``None`` if unknown/unavailable."""
+    try:
+        raw = get_redis().get(VERSION_KEY.format(schema=schema, session_id=session_id))
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget poll version read failed: %s', exc)
+        return None
+    return decode(raw)
+
+
+def ensure_version(schema: str, session_id: str) -> Optional[str]:
+    """Like :func:`get_version` but creates the key on first use."""
+    key = VERSION_KEY.format(schema=schema, session_id=session_id)
+    try:
+        redis = get_redis()
+        redis.set(key, _seed(), nx=True, ex=VERSION_TTL)
+        raw = redis.get(key)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget poll version init failed: %s', exc)
+        return None
+    return decode(raw)
+
+
+def bump_now(schema: str, session_id: str) -> None:
+    key = VERSION_KEY.format(schema=schema, session_id=session_id)
+    try:
+        redis = get_redis()
+        pipe = redis.pipeline()
+        pipe.set(key, _seed(), nx=True, ex=VERSION_TTL)
+        pipe.incr(key)
+        pipe.expire(key, VERSION_TTL)
+        _, version, _ = pipe.execute()
+        redis.publish(CHANNEL_KEY.format(schema=schema, session_id=session_id), version)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget poll version bump failed: %s', exc)
+
+
+def bump(session_id: str, schema: Optional[str] = None) -> None:
+    """Mark the session changed once the current transaction commits.
+
+    Bumping before commit would let a poll cache the new version against the
+    old rows, and the visitor would then miss the change until the next one.
+    """
+    if not session_id:
+        return
+    schema = schema or connection.schema_name
+    transaction.on_commit(lambda: bump_now(schema, session_id))
+
+
+def etag_for(version: str, after: Optional[str]) -> str:
+    # The body depends on ``after`` too, so it is part of the validator.
+    after_hash = hashlib.sha1((after or '').encode()).hexdigest()[:8]
+    return f'W/"{version}-{after_hash}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    header = request.headers.get('If-None-Match') or ''
+    return any(candidate.strip() == etag for candidate in header.split(','))
+
+
+class _Subscriber:
+    """One Redis pub/sub connection per event loop, shared by every parked long-poll.
+
+    Waiters register a future per session channel. A single reader task
+    resolves them as bumps arrive. A channel is subscribed while it has a
+    waiter and unsubscribed when the last one leaves. If the connection
+    fails, every pending waiter is released as "no change" and the next
+    waiter opens a fresh connection.
+    """
+
+    def __init__(self):
+        import redis.asyncio as aioredis
+
+        self.client = aioredis.from_url(settings.CACHES['default']['LOCATION'])
+        self.pubsub = self.client.pubsub()
+        self.waiters: Dict[str, Set[asyncio.Future]] = {}
+        self.lock = asyncio.Lock()
+        self.reader: Optional[asyncio.Task] = None
+        self.closed = False
+
+    async def add(self, channel: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        async with self.lock:
+            waiters = self.waiters.setdefault(channel, set())
+            waiters.add(future)
+            if len(waiters) == 1:
+                try:
+                    await self.pubsub.subscribe(channel)
+                except Exception:
+                    del self.waiters[channel]
+                    raise
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self._read())
+        return future
+
+    async def remove(self, channel: str, future: asyncio.Future) -> None:
+        async with self.lock:
+            waiters = self.waiters.get(channel)
+            if waiters is None:
+                return
+            waiters.discard(future)
+            if not waiters:
+                del self.waiters[channel]
+                if not self.closed:
+                    await self.pubsub.unsubscribe(channel)
+
+    async def _read(self) -> None:
+        try:
+            while self.waiters:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message or message.get('type') != 'message':
+                    continue
+                for future in self.waiters.get(decode(message['channel']), ()):
+                    if not future.done():
+                        future.set_result(True)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('Widget long-poll subscriber failed: %s', exc)
+            await self.close()
+
+    async def close(self) -> None:
+        self.closed = True
+        if _subscribers.get(asyncio.get_running_loop()) is self:
+            del _subscribers[asyncio.get_running_loop()]
+        for waiters in self.waiters.values():
+            for future in waiters:
+                if not future.done():
+                    future.set_result(False)
+        for resource in (self.pubsub, self.client):
+            try:
+                # ``aclose`` only exists from redis-py 5.0.1.
+                await (getattr(resource, 'aclose', None) or resource.close)()
+            except Exception:  # noqa: BLE001
+                pass
+
+
+# Keyed by event loop: redis.asyncio connections can't cross loops.
+_subscribers: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Subscriber]' = weakref.WeakKeyDictionary()
+
+
+def _subscriber() -> _Subscriber:
+    loop = asyncio.get_running_loop()
+    subscriber = _subscribers.get(loop)
+    if subscriber is None:
+        subscriber = _subscribers[loop] = _Subscriber()
+    return subscriber
+
+
+async def wait_for_change(schema: str, session_id: str, known_version: str, timeout: float) -> bool:
+    """Block until the session's version moves past ``known_version``.
+
+    Returns ``True`` on change, ``False`` when ``timeout`` expires (or Redis is
+    unavailable, in which case the caller just answers as if nothing changed).
+    """
+    channel = CHANNEL_KEY.format(schema=schema, session_id=session_id)
+    try:
+        subscriber = _subscriber()
+        future = await subscriber.add(channel)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget long-poll wait failed: %s', exc)
+        return False
+    try:
+        # A bump may have landed between the caller's version read and the
+        # subscribe; re-check once the channel is live so it isn't missed.
+        current = await subscriber.client.get(VERSION_KEY.format(schema=schema, session_id=session_id))
+        if current is not None and decode(current) != known_version:
+            return True
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        return False
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget long-poll wait failed: %s', exc)
+        return False
+    finally:
+        try:
+            await subscriber.remove(channel, future)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning('Widget long-poll unsubscribe failed: %s', exc)
+            await subscriber.close()
@@ -19,5 +19,6 @@ urlpatterns = [
     path('public/sessions/rate/', widget_views.widget_public_rate_session, name='widget_public_rate_session'),
     path('public/messages/', widget_views.widget_public_messages, name='widget_public_messages'),
     path('public/messages/list/', widget_views.widget_public_messages_list, name='widget_public_messages_list'),
+    path('public/messages/wait/', widget_views.widget_public_messages_wait, name='widget_public_messages_wait'),
     path('public/upload/', widget_views.widget_public_upload, name='widget_public_upload'),
 ]
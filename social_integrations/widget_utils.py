@@ -11,7 +11,6 @@ from __future__ import annotations
 import logging
 
 from django.conf import settings as django_settings
-from tenant_schemas.utils import schema_context, get_public_schema_name
 
 logger = logging.getLogger(__name__)
 
@@ -23,20 +22,20 @@ def resolve_widget_connection(token: str):
 
     Returns (connection, None) on success or (None, error_code) where
     error_code is one of: 'missing_token', 'not_found', 'disabled'.
+
+    The connection is a read-only snapshot served from the widget token
+    cache (process memory + Redis), so the visitor hot path usually skips
+    the public-schema query entirely.
     """
     if not token:
         return None, 'missing_token'
-    from widget_registry.models import WidgetConnection
-    with schema_context(get_public_schema_name()):
-        try:
-            conn = WidgetConnection.objects.get(widget_token=token)
-        except WidgetConnection.DoesNotExist:
-            return None, 'not_found'
-        if not conn.is_active:
-            return None, 'disabled'
-        # Evaluate fields while the ORM is bound to public so .refresh_from_db() etc.
-        # behave predictably — materialise a lightweight dict for the caller.
-        return conn, None
+    from widget_registry.cache import get_connection
+    conn = get_connection(token)
+    if conn is None:
+        return None, 'not_found'
+    if not conn.is_active:
+        return None, 'disabled'
+    return conn, None
 
 
 def request_origin(request) -> str:
@@ -100,17 +99,16 @@ def is_tenant_online(schema_name: str) -> bool:
     If anything goes wrong (no settings row, malformed schedule), returns True
     so we don't block visitors due to a misconfigured tenant.
     """
-    from .models import SocialIntegrationSettings
+    from .settings_cache import get_settings
     try:
-        with schema_context(schema_name):
-            sett = SocialIntegrationSettings.objects.first()
-            if not sett or not getattr(sett, 'away_hours_schedule', None):
-                return True
-            # Don't re-implement business-hours logic here — the existing
-            # helper (if any) is the source of truth. For MVP return True;
-            # PR 3 can refine this once the WS layer needs accurate online
-            # status for presence pings.
+        sett = get_settings(schema_name)
+        if not sett or not getattr(sett, 'away_hours_schedule', None):
             return True
+        # Don't re-implement business-hours logic here — the existing
+        # helper (if any) is the source of truth. For MVP return True;
+        # PR 3 can refine this once the WS layer needs accurate online
+        # status for presence pings.
+        return True
     except Exception as exc:  # pragma: no cover
         logger.warning("is_tenant_online(%s) failed: %s", schema_name, exc)
         return True
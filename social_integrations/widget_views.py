@@ -12,8 +12,12 @@ import logging
 import uuid
 from datetime import timedelta
 
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.utils import timezone
+from django_ratelimit.core import is_ratelimited
 from django_ratelimit.decorators import ratelimit
+from django_ratelimit.exceptions import Ratelimited
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from rest_framework import status, viewsets
 from rest_framework.decorators import api_view, permission_classes
@@ -22,6 +26,7 @@ from rest_framework.response import Response
 from tenant_schemas.utils import schema_context
 
 from widget_registry.models import WidgetConnection
+from . import assignment_map, widget_poll
 from .models import ChatRating, ConversationArchive, WidgetMessage, WidgetSession
 from .widget_serializers import (
     WidgetConnectionSerializer,
@@ -48,6 +53,30 @@ def _error(code: str, status_code: int, detail: str | None = None):
     return Response(payload, status=status_code)
 
 
+def _publish_widget_event(tenant_schema: str, connection_id, session_id: str, event: dict) -> None:
+    """Fan a widget conversation event out like every other platform's messages.
+
+    Unassigned sessions go to ``messages_<tenant>``; once an agent has the
+    chat, to the assignee, ``_all``-scope agents and the conversation group
+    (which the visitor's socket also joins).
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from .consumers import send_scoped_event
+
+    if get_channel_layer() is None:
+        logger.warning(
+            "No channel layer available — widget %s broadcast skipped for session %s (tenant %s)",
+            event.get('type'), session_id, tenant_schema,
+        )
+        return
+    with schema_context(tenant_schema):
+        assigned_user_id = assignment_map.lookup('widget', session_id, str(connection_id))
+    async_to_sync(send_scoped_event)(
+        tenant_schema, f'widget_{connection_id}_{session_id}', event, assigned_user_id,
+    )
+
+
 @api_view(['GET', 'OPTIONS'])
 @permission_classes([AllowAny])
 @ratelimit(key='ip', rate='60/m', block=True)
@@ -228,31 +257,23 @@ def widget_public_messages(request):
         session.save(update_fields=['last_seen_at'])
         response_data = WidgetMessageSerializer(msg).data
 
-    # Single broadcast to the tenant group — agents AND visitor iframes
-    # both listen there. Frontend dedupes by message_id if the same frame
-    # arrives twice (which happens when an agent is in both the tenant and
-    # a conversation-specific group).
-    from asgiref.sync import async_to_sync
-    from channels.layers import get_channel_layer
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        conversation_id = f"widget_{conn.id}_{session.session_id}"
-        msg_payload = {
-            'message_id': msg.message_id,
-            'message_text': msg.message_text,
-            'attachments': msg.attachments,
-            'is_from_visitor': True,
-            'timestamp': msg.timestamp.isoformat(),
-            'session_id': session.session_id,
-            'connection_id': conn.id,
-            'platform': 'widget',
-        }
-        async_to_sync(channel_layer.group_send)(f'messages_{conn.tenant_schema}', {
-            'type': 'new_message',
-            'message': msg_payload,
-            'conversation_id': conversation_id,
-            'timestamp': msg_payload['timestamp'],
-        })
+    # Agents AND visitor iframes listen on the groups this publishes to;
+    # sockets in several of them forward the frame once.
+    msg_payload = {
+        'message_id': msg.message_id,
+        'message_text': msg.message_text,
+        'attachments': msg.attachments,
+        'is_from_visitor': True,
+        'timestamp': msg.timestamp.isoformat(),
+        'session_id': session.session_id,
+        'connection_id': conn.id,
+        'platform': 'widget',
+    }
+    _publish_widget_event(conn.tenant_schema, conn.id, session.session_id, {
+        'type': 'new_message',
+        'message': msg_payload,
+        'timestamp': msg_payload['timestamp'],
+    })
 
     # Auto-unarchive: a new visitor message should always pop the conversation
     # back into the agent's active inbox if it had been moved to history.
@@ -268,28 +289,21 @@ def widget_public_messages(request):
     return Response(response_data, status=status.HTTP_201_CREATED)
 
 
-@api_view(['GET'])
-@permission_classes([AllowAny])
-@ratelimit(key='ip', rate='120/m', block=True)
-def widget_public_messages_list(request):
-    """Polling fallback — return session messages after `after` timestamp."""
-    token = request.query_params.get('token')
-    session_id = (request.query_params.get('session_id') or '').strip()
-    after_raw = request.query_params.get('after')
-
-    if not session_id:
-        return _error('missing_session_id', status.HTTP_400_BAD_REQUEST)
-
-    conn, err = resolve_widget_connection(token)
-    if err:
-        code_map = {'missing_token': 400, 'not_found': 404, 'disabled': 403}
-        return _error(err, code_map[err])
+def _poll_messages(conn, session_id: str, after_raw: str | None):
+    """Shared body of the polling endpoints.
 
+    Returns ``(error_code, status_code, data, version)``; ``error_code`` is
+    ``None`` on success. The session version is read *before* the message
+    query so a write racing this request can only make the ETag older than
+    the body, never newer.
+    """
     with schema_context(conn.tenant_schema):
         try:
             session = WidgetSession.objects.get(session_id=session_id, connection_id=conn.id)
         except WidgetSession.DoesNotExist:
-            return _error('session_not_found', status.HTTP_404_NOT_FOUND)
+            return 'session_not_found', status.HTTP_404_NOT_FOUND, None, None
+
+        version = widget_poll.ensure_version(conn.tenant_schema, session.session_id)
 
         qs = WidgetMessage.objects.filter(session=session, is_deleted=False).order_by('timestamp')
         if after_raw:
@@ -300,13 +314,101 @@ def widget_public_messages_list(request):
                 pass  # Ignore malformed timestamps — return everything.
 
         # Mark agent-sent messages as read now that visitor polled them.
-        now = timezone.now()
         (
             qs.filter(is_from_visitor=False, is_read_by_visitor=False)
               .update(is_read_by_visitor=True)
         )
 
-        return Response(WidgetMessageSerializer(qs, many=True).data)
+        return None, status.HTTP_200_OK, WidgetMessageSerializer(qs, many=True).data, version
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@ratelimit(key='ip', rate='120/m', block=True)
+def widget_public_messages_list(request):
+    """Polling fallback — return session messages after `after` timestamp.
+
+    Responses carry an ``ETag`` derived from the session's change version;
+    sending it back as ``If-None-Match`` yields a 304 when nothing changed,
+    answered from Redis alone.
+    """
+    token = request.query_params.get('token')
+    session_id = (request.query_params.get('session_id') or '').strip()
+    after_raw = request.query_params.get('after')
+
+    if not session_id:
+        return _error('missing_session_id', status.HTTP_400_BAD_REQUEST)
+
+    conn, err = resolve_widget_connection(token)
+    if err:
+        code_map = {'missing_token': 400, 'not_found': 404, 'disabled': 403}
+        return _error(err, code_map[err])
+
+    version = widget_poll.get_version(conn.tenant_schema, session_id)
+    if version is not None:
+        etag = widget_poll.etag_for(version, after_raw)
+        if widget_poll.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    err, status_code, data, version = _poll_messages(conn, session_id, after_raw)
+    if err:
+        return _error(err, status_code)
+    headers = {'ETag': widget_poll.etag_for(version, after_raw)} if version is not None else None
+    return Response(data, headers=headers)
+
+
+async def widget_public_messages_wait(request):
+    """Long-poll variant of :func:`widget_public_messages_list`.
+
+    Same parameters plus ``timeout`` (seconds, max 25). When the client's
+    ``If-None-Match`` is still current, the request waits on the async stack
+    until the session changes or the timeout fires (then 304). Plain Django
+    async view: DRF's ``api_view`` can't suspend without holding a worker
+    thread.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if await sync_to_async(is_ratelimited)(
+        request, group='widget_public_messages_wait', key='ip', rate='120/m', increment=True,
+    ):
+        raise Ratelimited()
+
+    token = request.GET.get('token')
+    session_id = (request.GET.get('session_id') or '').strip()
+    after_raw = request.GET.get('after')
+    try:
+        timeout = float(request.GET.get('timeout') or widget_poll.LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        timeout = widget_poll.LONG_POLL_MAX_SECONDS
+    timeout = max(0.0, min(timeout, widget_poll.LONG_POLL_MAX_SECONDS))
+
+    if not session_id:
+        return JsonResponse({'error': 'missing_session_id'}, status=status.HTTP_400_BAD_REQUEST)
+
+    conn, err = await sync_to_async(resolve_widget_connection)(token)
+    if err:
+        code_map = {'missing_token': 400, 'not_found': 404, 'disabled': 403}
+        return JsonResponse({'error': err}, status=code_map[err])
+
+    version = await sync_to_async(widget_poll.get_version)(conn.tenant_schema, session_id)
+    if version is not None:
+        etag = widget_poll.etag_for(version, after_raw)
+        if widget_poll.etag_matches(request, etag):
+            changed = timeout > 0 and await widget_poll.wait_for_change(
+                conn.tenant_schema, session_id, version, timeout,
+            )
+            if not changed:
+                response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = etag
+                return response
+
+    err, status_code, data, version = await sync_to_async(_poll_messages)(conn, session_id, after_raw)
+    if err:
+        return JsonResponse({'error': err}, status=status_code)
+    response = JsonResponse(data, safe=False)
+    if version is not None:
+        response['ETag'] = widget_poll.etag_for(version, after_raw)
+    return response
 
 
 WIDGET_UPLOAD_MAX_BYTES = 10 * 1024 * 1024  # 10 MB
@@ -448,28 +550,22 @@ def widget_admin_send_message(request):
         payload_data = WidgetMessageSerializer(msg).data
 
     # Broadcast
-    from asgiref.sync import async_to_sync
-    from channels.layers import get_channel_layer
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        conversation_id = f"widget_{connection_id}_{session_id}"
-        msg_payload = {
-            'message_id': msg.message_id,
-            'message_text': msg.message_text,
-            'attachments': msg.attachments,
-            'is_from_visitor': False,
-            'sent_by': request.user.id,
-            'timestamp': msg.timestamp.isoformat(),
-            'session_id': session_id,
-            'connection_id': connection_id,
-            'platform': 'widget',
-        }
-        async_to_sync(channel_layer.group_send)(f'messages_{schema}', {
-            'type': 'new_message',
-            'message': msg_payload,
-            'conversation_id': conversation_id,
-            'timestamp': msg_payload['timestamp'],
-        })
+    msg_payload = {
+        'message_id': msg.message_id,
+        'message_text': msg.message_text,
+        'attachments': msg.attachments,
+        'is_from_visitor': False,
+        'sent_by': request.user.id,
+        'timestamp': msg.timestamp.isoformat(),
+        'session_id': session_id,
+        'connection_id': connection_id,
+        'platform': 'widget',
+    }
+    _publish_widget_event(schema, connection_id, session_id, {
+        'type': 'new_message',
+        'message': msg_payload,
+        'timestamp': msg_payload['timestamp'],
+    })
 
     return Response(payload_data, status=status.HTTP_201_CREATED)
 
@@ -563,6 +659,8 @@ def widget_public_close_session(request):
                 assigned_user=None,
                 session_ended_at=session.ended_at,
             )
+            # .update() skips post_save; drop the owner from the map by hand.
+            assignment_map.forget('widget', session_id, str(conn.id))
         except Exception as exc:  # noqa: BLE001
             logger.warning(
                 "Failed to complete ChatAssignment on visitor close: %s",
@@ -589,24 +687,18 @@ def widget_public_close_session(request):
 
     # Broadcast so the agent dashboard sees the visitor-initiated close in
     # real time. Mirrors the agent-close path which broadcasts the same
-    # event the other direction. Both MessagesConsumer (agent) and
-    # WidgetVisitorConsumer (visitor) live in `messages_<tenant>` — but
-    # WidgetVisitorConsumer filters by session_id so only the active
-    # visitor iframe receives it (and on the visitor side we expect a
-    # no-op anyway: they're the one who clicked "End conversation").
-    from asgiref.sync import async_to_sync
-    from channels.layers import get_channel_layer
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        async_to_sync(channel_layer.group_send)(f'messages_{conn.tenant_schema}', {
-            'type': 'session_ended',
-            'session_id': session_id,
-            'connection_id': conn.id,
-            'conversation_id': f'widget_{conn.id}_{session_id}',
-            'ended_by': 'visitor',
-            'ended_at': ended_at_iso,
-            'message': 'The visitor ended this conversation.',
-        })
+    # event the other direction. WidgetVisitorConsumer filters by
+    # session_id so only the active visitor iframe receives it (and on the
+    # visitor side we expect a no-op anyway: they're the one who clicked
+    # "End conversation").
+    _publish_widget_event(conn.tenant_schema, conn.id, session_id, {
+        'type': 'session_ended',
+        'session_id': session_id,
+        'connection_id': conn.id,
+        'ended_by': 'visitor',
+        'ended_at': ended_at_iso,
+        'message': 'The visitor ended this conversation.',
+    })
 
     return Response({
         'status': 'ok',
@@ -840,6 +932,8 @@ def widget_admin_close_session(request):
                     assigned_user=None,
                     session_ended_at=session.ended_at,
                 )
+                # .update() skips post_save; drop the owner from the map by hand.
+                assignment_map.forget('widget', session_id, str(connection_id))
             except Exception as exc:  # noqa: BLE001
                 logger.warning(
                     "Failed to complete ChatAssignment on agent close: %s",
@@ -868,25 +962,14 @@ def widget_admin_close_session(request):
         "session_id=%s ended_by=%s already_ended=%s",
         conn.tenant_schema, connection_id, session_id, ended_by_value, already_ended,
     )
-    from asgiref.sync import async_to_sync
-    from channels.layers import get_channel_layer
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        async_to_sync(channel_layer.group_send)(f'messages_{conn.tenant_schema}', {
-            'type': 'session_ended',
-            'session_id': session_id,
-            'connection_id': connection_id,
-            'conversation_id': f'widget_{connection_id}_{session_id}',
-            'ended_by': ended_by_value,
-            'ended_at': ended_at_iso,
-            'message': 'The agent has ended this conversation.',
-        })
-    else:
-        logger.warning(
-            "No channel layer available — agent end broadcast skipped for "
-            "session %s (tenant %s)",
-            session_id, conn.tenant_schema,
-        )
+    _publish_widget_event(conn.tenant_schema, connection_id, session_id, {
+        'type': 'session_ended',
+        'session_id': session_id,
+        'connection_id': connection_id,
+        'ended_by': ended_by_value,
+        'ended_at': ended_at_iso,
+        'message': 'The agent has ended this conversation.',
+    })
 
     return Response({
         'status': 'already_ended' if already_ended else 'ok',
@@ -0,0 +1,229 @@
+"""Write-behind buffer for widget visitor messages and session heartbeats.
+
+A storefront with hundreds of open widgets turns every visitor keystroke
+burst into its own small transaction: one ``WidgetSession`` read, one
+``WidgetMessage`` insert and one ``last_seen_at`` update per frame. The
+visitor WebSocket now hands those writes to a per-tenant Redis buffer:
+
+* messages are echoed to agents through the channel layer straight away and
+  appended to ``widget_wb:<schema>`` (a list, so arrival order is kept);
+* heartbeats (pings and message activity) go into the ``widget_hb:<schema>``
+  hash, which keeps only the latest timestamp per session. A flush clears
+  a field only after its update commits, and only if no newer ping replaced it;
+* a delayed :func:`flush` (Celery) drains the list in batches. Each batch is
+  inserted in one transaction and trimmed from Redis only after the commit.
+  A crash between the commit and the trim replays the batch, and the unique
+  ``message_id`` makes that replay a no-op (at-least-once, idempotent).
+
+If Redis is unavailable the consumer falls back to its old synchronous write.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from amanati_crm.redis_utils import decode, delete_unchanged, get_redis, read_hash
+
+from . import widget_poll
+from .models import WidgetMessage, WidgetSession
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'widget_wb:{schema}'
+HEARTBEAT_KEY = 'widget_hb:{schema}'
+FLUSH_FLAG_KEY = 'widget_wb_flush:{schema}'
+LOCK_KEY = 'widget_wb_lock:{schema}'
+FLUSH_BATCH_SIZE = 500
+LOCK_TTL = 60
+
+
+def _flush_window() -> float:
+    return float(getattr(settings, 'SOCIAL_INTEGRATIONS', {}).get('WIDGET_WRITE_BEHIND_SECONDS', 1))
+
+
+def _schedule_flush(redis, tenant_schema: str) -> None:
+    window = _flush_window()
+    if redis.set(FLUSH_FLAG_KEY.format(schema=tenant_schema), '1', nx=True, ex=max(int(window * 10), 30)):
+        from .tasks import flush_widget_writes
+        flush_widget_writes.apply_async((tenant_schema,), countdown=window)
+
+
+# ---------------------------------------------------------------------------
+# Enqueue (called from the visitor consumer)
+# ---------------------------------------------------------------------------
+
+def message_record(session_id: str, text: str, attachments: list, now: datetime) -> dict:
+    """Buffer entry for one visitor message; ``message_id`` is fixed here."""
+    return {
+        'message_id': uuid.uuid4().hex,
+        'session_id': session_id,
+        'text': text,
+        'attachments': attachments,
+        'ts': now.timestamp(),
+    }
+
+
+def enqueue_message(tenant_schema: str, record: dict) -> bool:
+    """Buffer ``record`` and schedule a flush. ``False`` means write it yourself."""
+    try:
+        redis = get_redis()
+        pipe = redis.pipeline()
+        pipe.rpush(BUFFER_KEY.format(schema=tenant_schema), json.dumps(record))
+        pipe.hset(HEARTBEAT_KEY.format(schema=tenant_schema), record['session_id'], record['ts'])
+        pipe.execute()
+        _schedule_flush(redis, tenant_schema)
+        return True
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget write-behind unavailable, writing message inline: %s', exc)
+        return False
+
+
+def record_heartbeat(tenant_schema: str, session_id: str) -> None:
+    """Note visitor activity; ``last_seen_at`` catches up on the next flush."""
+    try:
+        redis = get_redis()
+        redis.hset(HEARTBEAT_KEY.format(schema=tenant_schema), session_id, time.time())
+        _schedule_flush(redis, tenant_schema)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget heartbeat not recorded: %s', exc)
+
+
+# ---------------------------------------------------------------------------
+# Flush
+# ---------------------------------------------------------------------------
+
+def _as_datetime(ts) -> datetime:
+    return datetime.fromtimestamp(float(ts), tz=dt_timezone.utc)
+
+
+def write_messages(records: List[dict]) -> Tuple[int, set]:
+    """Insert buffered messages. Returns ``(rows inserted, session ids touched)``.
+
+    Records for sessions that no longer exist are dropped with a warning.
+    """
+    session_pks = dict(
+        WidgetSession.objects
+        .filter(session_id__in={r['session_id'] for r in records})
+        .values_list('session_id', 'pk')
+    )
+    rows = []
+    for record in records:
+        session_pk = session_pks.get(record['session_id'])
+        if session_pk is None:
+            logger.warning('Dropping buffered widget message %s: session %s is gone',
+                           record['message_id'], record['session_id'])
+            continue
+        ts = _as_datetime(record['ts'])
+        rows.append(WidgetMessage(
+            session_id=session_pk,
+            message_id=record['message_id'],
+            message_text=record['text'],
+            attachments=record['attachments'],
+            is_from_visitor=True,
+            is_delivered=True,
+            delivered_at=ts,
+            timestamp=ts,
+        ))
+    if not rows:
+        return 0, set()
+    existing = set(
+        WidgetMessage.objects
+        .filter(message_id__in=[row.message_id for row in rows])
+        .values_list('message_id', flat=True)
+    )
+    new = [row for row in rows if row.message_id not in existing]
+    WidgetMessage.objects.bulk_create(new, ignore_conflicts=True)
+    touched = {record['session_id'] for record in records if record['session_id'] in session_pks}
+    return len(new), touched
+
+
+def touch_sessions(last_seen: Dict[str, datetime]) -> int:
+    """One ``UPDATE ... FROM (VALUES ...)`` moving ``last_seen_at`` forward only."""
+    if not last_seen:
+        return 0
+    table = connection.ops.quote_name(WidgetSession._meta.db_table)
+    values_sql = ', '.join(['(%s, %s::timestamptz)'] * len(last_seen))
+    params = []
+    for session_id, seen_at in last_seen.items():
+        params.extend([session_id, seen_at])
+    sql = f'''
+        UPDATE {table} AS s SET last_seen_at = GREATEST(s.last_seen_at, v.seen_at)
+        FROM (VALUES {values_sql}) AS v(session_id, seen_at)
+        WHERE s.session_id = v.session_id
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _flush_heartbeats(redis, tenant_schema: str) -> None:
+    """Apply buffered heartbeats, then clear the ones no newer ping has replaced.
+
+    The hash is only trimmed after the update commits, so a failed write
+    leaves every heartbeat for the next flush.
+    """
+    key = HEARTBEAT_KEY.format(schema=tenant_schema)
+    buffered = read_hash(redis, key)
+    if not buffered:
+        return
+    with transaction.atomic():
+        touch_sessions({session_id: _as_datetime(ts) for session_id, ts in buffered.items()})
+    delete_unchanged(redis, key, buffered)
+
+
+def flush(tenant_schema: str) -> int:
+    """Drain the tenant's buffer into Postgres. Runs inside ``schema_context``.
+
+    Returns the number of messages inserted. Only one flusher per tenant runs
+    at a time; the only writer that could race it is ``RPUSH``, which appends
+    past the range being processed, so trimming the processed prefix is safe.
+    """
+    redis = get_redis()
+    lock_key = LOCK_KEY.format(schema=tenant_schema)
+    if not redis.set(lock_key, '1', nx=True, ex=LOCK_TTL):
+        # Another worker is flushing; look again once it is likely done.
+        from .tasks import flush_widget_writes
+        flush_widget_writes.apply_async((tenant_schema,), countdown=_flush_window())
+        return 0
+    try:
+        # Clear the flag first: anything pushed from here on schedules its own flush.
+        redis.delete(FLUSH_FLAG_KEY.format(schema=tenant_schema))
+        key = BUFFER_KEY.format(schema=tenant_schema)
+        inserted = 0
+        while True:
+            raw = redis.lrange(key, 0, FLUSH_BATCH_SIZE - 1)
+            if not raw:
+                break
+            records = [json.loads(item) for item in raw]
+            with transaction.atomic():
+                count, touched = write_messages(records)
+            redis.ltrim(key, len(raw), -1)
+            redis.expire(lock_key, LOCK_TTL)
+            inserted += count
+            # bulk_create skips post_save, so move the polling ETags by hand.
+            for session_id in touched:
+                widget_poll.bump(session_id, tenant_schema)
+
+        _flush_heartbeats(redis, tenant_schema)
+        return inserted
+    finally:
+        redis.delete(lock_key)
+
+
+def pending_schemas() -> List[str]:
+    """Tenants with anything buffered (safety net for lost flush tasks)."""
+    redis = get_redis()
+    schemas = set()
+    for pattern in (BUFFER_KEY, HEARTBEAT_KEY):
+        prefix = pattern.format(schema='')
+        for key in redis.scan_iter(match=prefix + '*', count=500):
+            key = decode(key)
+            schemas.add(key[len(prefix):])
+    return sorted(schemas)
@@ -8,8 +8,10 @@ import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from asgiref.sync import sync_to_async
 from tenant_schemas.utils import schema_context
-from .models import Notification, UserOnlineStatus, TeamChatConversation, TeamChatMessage
+from . import presence
+from .models import Notification, TeamChatConversation, TeamChatMessage
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -286,6 +288,15 @@ async def send_unread_count_update(tenant_schema, user_id, count):
     )
 
 
+async def presence_heartbeat_loop(tenant_schema, scopes, user_id, channel_name):
+    """Keep a connection's presence entries alive until the task is cancelled."""
+    while True:
+        await asyncio.sleep(presence.HEARTBEAT_SECONDS)
+        await sync_to_async(presence.heartbeat, thread_sensitive=False)(
+            tenant_schema, scopes, user_id, channel_name,
+        )
+
+
 class TicketBoardConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer for real-time ticket board collaboration.
@@ -323,6 +334,9 @@ class TicketBoardConsumer(AsyncWebsocketConsumer):
 
         # Add user to presence tracking
         await self.add_user_presence()
+        self.presence_task = asyncio.ensure_future(presence_heartbeat_loop(
+            self.tenant_schema, [presence.board_scope(self.board_id)], self.user.id, self.channel_name,
+        ))
 
         # Get current board state
         board_data = await self.get_board_data()
@@ -355,6 +369,8 @@ class TicketBoardConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         # Remove user from presence tracking
+        if hasattr(self, 'presence_task'):
+            self.presence_task.cancel()
         if hasattr(self, 'board_group_name'):
             try:
                 await self.remove_user_presence()
@@ -589,59 +605,24 @@ class TicketBoardConsumer(AsyncWebsocketConsumer):
             print(f"[TicketBoardWS] Error getting board data: {str(e)}")
             return None
 
-    @database_sync_to_async
+    @sync_to_async(thread_sensitive=False)
     def add_user_presence(self):
-        """Track user presence on the board using Django cache"""
-        from django.core.cache import cache
-        cache_key = f'board_presence_{self.tenant_schema}_{self.board_id}'
-
-        # Get current users
-        users = cache.get(cache_key, {})
-
-        # Add this user
-        users[str(self.user.id)] = {
-            'user_id': self.user.id,
-            'user_name': self.user.get_full_name() or self.user.email,
-            'user_email': self.user.email,
-            'channel_name': self.channel_name
-        }
-
-        # Store with 5 minute expiry (refreshed on each ping)
-        cache.set(cache_key, users, 300)
-
+        """Track user presence on the board (Redis sorted set, see users.presence)"""
+        presence.join(self.tenant_schema, presence.board_scope(self.board_id), self.user, self.channel_name)
         print(f"[TicketBoardWS] User {self.user.email} added to board presence")
 
-    @database_sync_to_async
+    @sync_to_async(thread_sensitive=False)
     def remove_user_presence(self):
-        """Remove user from presence tracking"""
-        from django.core.cache import cache
-        cache_key = f'board_presence_{self.tenant_schema}_{self.board_id}'
-
-        users = cache.get(cache_key, {})
-        users.pop(str(self.user.id), None)
-
-        cache.set(cache_key, users, 300)
-
+        """Remove this connection from presence tracking"""
+        presence.leave(self.tenant_schema, presence.board_scope(self.board_id), self.user.id, self.channel_name)
         print(f"[TicketBoardWS] User {self.user.id} removed from board presence")
 
-    @database_sync_to_async
+    @sync_to_async(thread_sensitive=False)
     def get_active_users(self):
-        """Get list of currently active users on this board"""
-        from django.core.cache import cache
-        cache_key = f'board_presence_{self.tenant_schema}_{self.board_id}'
-
-        users = cache.get(cache_key, {})
-
-        # Return list of users (excluding self)
-        return [
-            {
-                'user_id': user_data['user_id'],
-                'user_name': user_data['user_name'],
-                'user_email': user_data['user_email']
-            }
-            for user_id, user_data in users.items()
-            if user_id != str(self.user.id)
-        ]
+        """Get list of currently active users on this board (excluding self)"""
+        return presence.active_users(
+            self.tenant_schema, presence.board_scope(self.board_id), exclude_user_id=self.user.id,
+        )
 
 
 # Utility functions for sending WebSocket messages from Django views/signals
@@ -823,23 +804,28 @@ class TeamChatConsumer(AsyncWebsocketConsumer):
             await self.accept()
 
             # Update online status (wrapped in try/catch to not fail connection)
+            first_connection = True
             try:
-                await self.set_online_status(True)
+                first_connection = await self.set_online_status(True)
             except Exception as e:
                 print(f"[TeamChatWS] Error setting online status: {e}")
+            self.presence_task = asyncio.ensure_future(presence_heartbeat_loop(
+                self.tenant_schema, [presence.TEAM_CHAT], self.user.id, self.channel_name,
+            ))
 
-            # Notify other users that this user is online
+            # Notify other users that this user is online (first tab only)
             try:
-                await self.channel_layer.group_send(
-                    self.tenant_group_name,
-                    {
-                        'type': 'user_status_changed',
-                        'user_id': self.user.id,
-                        'is_online': True,
-                        'user_name': self.user.get_full_name() or self.user.email,
-                        'exclude_channel': self.channel_name
-                    }
-                )
+                if first_connection:
+                    await self.channel_layer.group_send(
+                        self.tenant_group_name,
+                        {
+                            'type': 'user_status_changed',
+                            'user_id': self.user.id,
+                            'is_online': True,
+                            'user_name': self.user.get_full_name() or self.user.email,
+                            'exclude_channel': self.channel_name
+                        }
+                    )
             except Exception as e:
                 print(f"[TeamChatWS] Error broadcasting online status: {e}")
 
@@ -867,13 +853,15 @@ class TeamChatConsumer(AsyncWebsocketConsumer):
             await self.close(code=4000)
 
     async def disconnect(self, close_code):
+        if hasattr(self, 'presence_task'):
+            self.presence_task.cancel()
         if hasattr(self, 'personal_group_name'):
             try:
                 # Update online status
-                await self.set_online_status(False)
+                went_offline = await self.set_online_status(False)
 
-                # Notify other users that this user is offline
-                if hasattr(self, 'tenant_group_name'):
+                # Notify other users that this user is offline (last tab only)
+                if went_offline and hasattr(self, 'tenant_group_name'):
                     await self.channel_layer.group_send(
                         self.tenant_group_name,
                         {
@@ -1069,44 +1057,33 @@ class TeamChatConsumer(AsyncWebsocketConsumer):
             'user_name': event['user_name']
         }))
 
-    # Database operations
-    @database_sync_to_async
+    # Presence (Redis; UserOnlineStatus is written lazily by users.tasks.persist_presence)
+    @sync_to_async(thread_sensitive=False)
     def set_online_status(self, is_online):
-        """Update user's online status"""
-        try:
-            with schema_context(self.tenant_schema):
-                status, created = UserOnlineStatus.objects.get_or_create(
-                    user=self.user,
-                    defaults={'is_online': is_online}
-                )
-                if not created:
-                    status.is_online = is_online
-                    status.save(update_fields=['is_online', 'last_seen'])
-                return True
-        except Exception as e:
-            print(f"[TeamChatWS] Error setting online status: {e}")
-            return False
+        """Join/leave team-chat presence.
 
-    @database_sync_to_async
+        Returns True when this changes what other users see: the user's first
+        tab coming online, or their last tab going away.
+        """
+        if is_online:
+            return presence.join(self.tenant_schema, presence.TEAM_CHAT, self.user, self.channel_name)
+        return presence.leave(self.tenant_schema, presence.TEAM_CHAT, self.user.id, self.channel_name)
+
+    @sync_to_async(thread_sensitive=False)
     def get_online_users(self):
         """Get list of online users"""
-        try:
-            with schema_context(self.tenant_schema):
-                online_statuses = UserOnlineStatus.objects.filter(
-                    is_online=True
-                ).exclude(user=self.user).select_related('user')
+        return [
+            {
+                'user_id': user['user_id'],
+                'user_name': user['user_name'] or user['user_email'],
+                'email': user['user_email'],
+            }
+            for user in presence.active_users(
+                self.tenant_schema, presence.TEAM_CHAT, exclude_user_id=self.user.id,
+            )
+        ]
 
-                return [
-                    {
-                        'user_id': status.user.id,
-                        'user_name': status.user.get_full_name() or status.user.email,
-                        'email': status.user.email
-                    }
-                    for status in online_statuses
-                ]
-        except Exception as e:
-            print(f"[TeamChatWS] Error getting online users: {e}")
-            return []
+    # Database operations
 
     @database_sync_to_async
     def create_message(self, recipient_id=None, conversation_id=None, text='', message_type='text'):
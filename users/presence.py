@@ -0,0 +1,225 @@
+"""
+Redis presence for the ticket-board and team-chat WebSockets.
+
+Each presence scope (one board, or the tenant's team chat) is a sorted set
+whose members are ``"<user_id>|<channel_name>"`` and whose scores are expiry
+timestamps. A connection joins by adding its member. While it stays open,
+the consumer refreshes the score every ``HEARTBEAT_SECONDS``. Leaving
+removes the member. A connection that dies without a clean disconnect just
+falls out after ``PRESENCE_TTL``. Join and leave are Lua scripts, so the
+"first tab opened" / "last tab closed" answers are atomic and one user with
+several tabs is counted once.
+
+Nothing here writes to Postgres. Heartbeats and leaves note the time in a
+per-tenant ``presence_seen`` hash. :func:`persist_presence` (Celery beat)
+copies it into ``UserOnlineStatus`` in a few set-based statements, so the
+REST team-chat user list stays roughly current.
+
+Every helper is best-effort: with Redis down, joins report "first
+connection", queries return nobody, and nothing raises into the consumer.
+"""
+import json
+import logging
+import time
+
+from django.db import connection
+
+from amanati_crm.redis_utils import decode, delete_unchanged, get_redis, read_hash
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL = 120
+HEARTBEAT_SECONDS = 30
+
+TEAM_CHAT = 'team_chat'
+
+SCOPE_KEY = 'presence:{schema}:{scope}'
+PROFILE_KEY = 'presence_profile:{schema}'
+SEEN_KEY = 'presence_seen:{schema}'
+
+# KEYS[1] scope zset; ARGV: member, expires_at, now, user prefix, key ttl.
+# Returns 1 when no other live connection of the user was present.
+_JOIN = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+local first = 1
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if member ~= ARGV[1] and string.sub(member, 1, #ARGV[4]) == ARGV[4] then
+        first = 0
+        break
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return first
+"""
+
+# KEYS[1] scope zset; ARGV: member, now, user prefix.
+# Returns 1 when the user has no live connection left.
+_LEAVE = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if string.sub(member, 1, #ARGV[3]) == ARGV[3] then
+        return 0
+    end
+end
+return 1
+"""
+
+
+def board_scope(board_id):
+    return f'board:{board_id}'
+
+
+def _member(user_id, channel_name):
+    return f'{user_id}|{channel_name}'
+
+
+def join(schema, scope, user, channel_name):
+    """Register a connection. Returns True if it is the user's first live one."""
+    now = time.time()
+    try:
+        redis = get_redis()
+        redis.hset(PROFILE_KEY.format(schema=schema), str(user.id), json.dumps({
+            'user_name': user.get_full_name() or user.email,
+            'user_email': user.email,
+        }))
+        first = redis.eval(
+            _JOIN, 1, SCOPE_KEY.format(schema=schema, scope=scope),
+            _member(user.id, channel_name), now + PRESENCE_TTL, now, f'{user.id}|', PRESENCE_TTL * 2,
+        )
+        return bool(first)
+    except Exception as e:
+        logger.warning(f"Presence join failed for {schema}/{scope}: {e}")
+        return True
+
+
+def leave(schema, scope, user_id, channel_name):
+    """Drop a connection. Returns True if the user has no live connection left."""
+    now = time.time()
+    try:
+        redis = get_redis()
+        redis.hset(SEEN_KEY.format(schema=schema), str(user_id), now)
+        gone = redis.eval(
+            _LEAVE, 1, SCOPE_KEY.format(schema=schema, scope=scope),
+            _member(user_id, channel_name), now, f'{user_id}|',
+        )
+        return bool(gone)
+    except Exception as e:
+        logger.warning(f"Presence leave failed for {schema}/{scope}: {e}")
+        return True
+
+
+def heartbeat(schema, scopes, user_id, channel_name):
+    """Push this connection's expiry forward in every scope it belongs to."""
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for scope in scopes:
+            key = SCOPE_KEY.format(schema=schema, scope=scope)
+            # XX: never resurrect a member that leave() already removed.
+            pipe.zadd(key, {_member(user_id, channel_name): now + PRESENCE_TTL}, xx=True)
+            pipe.expire(key, PRESENCE_TTL * 2)
+        pipe.hset(SEEN_KEY.format(schema=schema), str(user_id), now)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Presence heartbeat failed for {schema}: {e}")
+
+
+def online_user_ids(schema, scope):
+    """IDs of users with at least one live connection in ``scope``."""
+    try:
+        members = get_redis().zrangebyscore(SCOPE_KEY.format(schema=schema, scope=scope), time.time(), '+inf')
+    except Exception as e:
+        logger.warning(f"Presence query failed for {schema}/{scope}: {e}")
+        return set()
+    return {int(decode(member).split('|', 1)[0]) for member in members}
+
+
+def presence_for(schema, scope, user_ids):
+    """Batched lookup: ``{user_id: is_online}`` for every id in ``user_ids``."""
+    online = online_user_ids(schema, scope)
+    return {user_id: user_id in online for user_id in user_ids}
+
+
+def active_users(schema, scope, exclude_user_id=None):
+    """Live users in ``scope`` with their cached display name and email."""
+    user_ids = sorted(online_user_ids(schema, scope) - {exclude_user_id})
+    if not user_ids:
+        return []
+    try:
+        profiles = get_redis().hmget(PROFILE_KEY.format(schema=schema), [str(user_id) for user_id in user_ids])
+    except Exception as e:
+        logger.warning(f"Presence profile lookup failed for {schema}: {e}")
+        profiles = [None] * len(user_ids)
+    users = []
+    for user_id, raw in zip(user_ids, profiles):
+        profile = json.loads(raw) if raw else {}
+        users.append({
+            'user_id': user_id,
+            'user_name': profile.get('user_name', ''),
+            'user_email': profile.get('user_email', ''),
+        })
+    return users
+
+
+def persist_presence(schema):
+    """Write buffered last-seen times and team-chat online flags to Postgres.
+
+    Runs inside ``schema_context(schema)``. Returns the number of users
+    whose row was written. Buffered times are only removed from Redis once
+    the rows are written, and only if no newer heartbeat replaced them.
+    """
+    from datetime import datetime, timezone as dt_timezone
+    from .models import UserOnlineStatus
+
+    redis = get_redis()
+    seen_key = SEEN_KEY.format(schema=schema)
+    buffered = read_hash(redis, seen_key)
+    seen = {int(user_id): datetime.fromtimestamp(float(ts), tz=dt_timezone.utc) for user_id, ts in buffered.items()}
+    # Read the scope directly rather than via online_user_ids(): that helper
+    # answers "nobody" when Redis fails, which here would clear every flag.
+    scope_key = SCOPE_KEY.format(schema=schema, scope=TEAM_CHAT)
+    now = time.time()
+    redis.zremrangebyscore(scope_key, '-inf', now)
+    online = {int(decode(member).split('|', 1)[0]) for member in redis.zrangebyscore(scope_key, now, '+inf')}
+
+    written = 0
+    if seen:
+        existing = set(UserOnlineStatus.objects.filter(user_id__in=seen).values_list('user_id', flat=True))
+        UserOnlineStatus.objects.bulk_create(
+            [UserOnlineStatus(user_id=user_id, is_online=user_id in online) for user_id in seen.keys() - existing],
+            ignore_conflicts=True,
+        )
+        table = connection.ops.quote_name(UserOnlineStatus._meta.db_table)
+        values_sql = ', '.join(['(%s, %s::timestamptz, %s)'] * len(seen))
+        params = []
+        for user_id, seen_at in seen.items():
+            params.extend([user_id, seen_at, user_id in online])
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {table} AS s SET last_seen = GREATEST(s.last_seen, v.seen_at), is_online = v.is_online
+                FROM (VALUES {values_sql}) AS v(user_id, seen_at, is_online)
+                WHERE s.user_id = v.user_id
+            ''', params)
+            written = cursor.rowcount
+
+    # Connections that died without a disconnect never wrote a leave; clear
+    # any flag that Redis no longer backs. With nobody online the exclude()
+    # matches every row, which is the intended "everyone offline".
+    UserOnlineStatus.objects.filter(is_online=True).exclude(user_id__in=online).update(is_online=False)
+    delete_unchanged(redis, seen_key, buffered)
+    return written
+
+
+def pending_schemas():
+    """Tenants with buffered last-seen times or a live team-chat scope."""
+    redis = get_redis()
+    schemas = set()
+    seen_prefix = SEEN_KEY.format(schema='')
+    for key in redis.scan_iter(match=seen_prefix + '*', count=500):
+        schemas.add(decode(key)[len(seen_prefix):])
+    scope_prefix, scope_suffix = 'presence:', f':{TEAM_CHAT}'
+    for key in redis.scan_iter(match=scope_prefix + '*' + scope_suffix, count=500):
+        schemas.add(decode(key)[len(scope_prefix):-len(scope_suffix)])
+    return sorted(schemas)
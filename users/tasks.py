@@ -0,0 +1,21 @@
+import logging
+
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def persist_presence():
+    """Flush Redis presence (last seen, team-chat online flags) into UserOnlineStatus."""
+    from tenant_schemas.utils import schema_context
+    from users.presence import pending_schemas, persist_presence as persist
+
+    written = 0
+    for schema_name in pending_schemas():
+        try:
+            with schema_context(schema_name):
+                written += persist(schema_name)
+        except Exception as e:
+            logger.error(f"Presence persist failed for {schema_name}: {e}")
+    return written
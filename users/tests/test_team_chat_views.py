@@ -456,3 +456,70 @@ class TestConversationListTodayFilter(TeamChatTestMixin, EchoDeskTenantTestCase)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         returned_ids = [c['id'] for c in resp.data.get('results', resp.data)]
         self.assertIn(conv.pk, returned_ids)
+
+
+# ============================================================
+# Redis presence (users.presence)
+# ============================================================
+class TestPresence(EchoDeskTenantTestCase):
+
+    def setUp(self):
+        super().setUp()
+        import uuid
+        from users import presence
+        self.presence = presence
+        # Private key space so parallel runs and real tenants never collide.
+        self.schema = f'presence_test_{uuid.uuid4().hex[:8]}'
+        self.user1 = self.create_user(email='presence1@test.com')
+        self.user2 = self.create_user(email='presence2@test.com')
+
+    def tearDown(self):
+        redis = self.presence.get_redis()
+        for key in redis.scan_iter(match=f'*{self.schema}*'):
+            redis.delete(key)
+        super().tearDown()
+
+    def test_multiple_tabs_count_once(self):
+        p, chat = self.presence, self.presence.TEAM_CHAT
+        self.assertTrue(p.join(self.schema, chat, self.user1, 'tab-a'))
+        self.assertFalse(p.join(self.schema, chat, self.user1, 'tab-b'))
+        self.assertTrue(p.join(self.schema, chat, self.user2, 'tab-c'))
+        self.assertEqual(
+            p.presence_for(self.schema, chat, [self.user1.id, self.user2.id, 0]),
+            {self.user1.id: True, self.user2.id: True, 0: False},
+        )
+
+        self.assertFalse(p.leave(self.schema, chat, self.user1.id, 'tab-a'))
+        self.assertTrue(p.leave(self.schema, chat, self.user1.id, 'tab-b'))
+        users = p.active_users(self.schema, chat, exclude_user_id=self.user2.id)
+        self.assertEqual(users, [])
+        self.assertEqual(
+            [u['user_email'] for u in p.active_users(self.schema, chat)],
+            ['presence2@test.com'],
+        )
+
+    def test_persist_writes_last_seen_and_clears_stale_flags(self):
+        p, chat = self.presence, self.presence.TEAM_CHAT
+        UserOnlineStatus.objects.create(user=self.user2, is_online=True)
+        p.join(self.schema, chat, self.user1, 'tab-a')
+        p.heartbeat(self.schema, [chat], self.user1.id, 'tab-a')
+
+        with self.assertNumQueries(4):
+            p.persist_presence(self.schema)
+
+        self.assertTrue(UserOnlineStatus.objects.get(user=self.user1).is_online)
+        # user2 has no live connection in Redis.
+        self.assertFalse(UserOnlineStatus.objects.get(user=self.user2).is_online)
+        self.assertFalse(p.get_redis().exists(p.SEEN_KEY.format(schema=self.schema)))
+
+    def test_failed_persist_keeps_buffered_last_seen(self):
+        p, chat = self.presence, self.presence.TEAM_CHAT
+        p.join(self.schema, chat, self.user1, 'tab-a')
+        p.heartbeat(self.schema, [chat], self.user1.id, 'tab-a')
+
+        with patch.object(UserOnlineStatus.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                p.persist_presence(self.schema)
+
+        buffered = p.get_redis().hkeys(p.SEEN_KEY.format(schema=self.schema))
+        self.assertEqual([p.decode(field) for field in buffered], [str(self.user1.id)])
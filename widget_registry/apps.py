@@ -5,3 +5,7 @@ class WidgetRegistryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "widget_registry"
     verbose_name = "Widget Registry"
+
+    def ready(self):
+        # Keep the public widget token cache coherent with admin edits.
+        from . import signals  # noqa: F401
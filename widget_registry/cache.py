@@ -0,0 +1,133 @@
+"""Token -> WidgetConnection snapshot cache for the public widget API.
+
+Every visitor request (config, polling, message post, upload, WebSocket
+connect) resolves its widget token. Going to the public schema for each one
+is wasteful, so lookups go through two layers:
+
+* a per-process dict with a very short TTL (absorbs polling bursts with no
+  network hop at all);
+* the shared Django cache (Redis) with a longer TTL.
+
+Unknown tokens are cached too (negative entries) so scanners and stale
+embeds cannot hammer the database. ``post_save``/``post_delete`` on
+:class:`~widget_registry.models.WidgetConnection` drop both layers for the
+token in this process once the change commits; other processes converge
+within ``LOCAL_TTL``.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TTL = 10
+SHARED_TTL = 300
+NEGATIVE_TTL = 60
+LOCAL_MAX_ENTRIES = 4096
+
+_NOT_FOUND = '__not_found__'
+
+_local: dict = {}
+_local_lock = threading.Lock()
+
+
+class WidgetConnectionSnapshot(SimpleNamespace):
+    """Read-only view of a WidgetConnection row.
+
+    Exposes the same attribute names as the model (plus ``pk``) so callers
+    that only read fields don't notice the difference. It is detached from
+    the ORM: there is no ``save()``.
+    """
+
+    @property
+    def pk(self):
+        return self.id
+
+
+def snapshot_of(conn) -> WidgetConnectionSnapshot:
+    return WidgetConnectionSnapshot(**{
+        field.attname: getattr(conn, field.attname)
+        for field in conn._meta.concrete_fields
+    })
+
+
+def _cache_key(token: str) -> str:
+    # Tokens are bearer credentials; keep them out of Redis key names.
+    return 'widget_conn:' + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _local_get(token: str):
+    entry = _local.get(token)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        _local.pop(token, None)
+        return None
+    return value
+
+
+def _local_set(token: str, value) -> None:
+    with _local_lock:
+        if len(_local) >= LOCAL_MAX_ENTRIES:
+            _local.clear()
+        _local[token] = (time.monotonic() + LOCAL_TTL, value)
+
+
+def _load(token: str):
+    from tenant_schemas.utils import get_public_schema_name, schema_context
+    from .models import WidgetConnection
+
+    with schema_context(get_public_schema_name()):
+        conn = WidgetConnection.objects.filter(widget_token=token).first()
+        return snapshot_of(conn) if conn is not None else None
+
+
+def get_connection(token: str) -> Optional[WidgetConnectionSnapshot]:
+    """Snapshot for ``token`` (active or not), or ``None`` if it doesn't exist."""
+    value = _local_get(token)
+    if value is None:
+        key = _cache_key(token)
+        try:
+            cached = cache.get(key)
+        except Exception as exc:  # noqa: BLE001 — Redis down: fall through to the DB.
+            logger.warning('Widget token cache read failed: %s', exc)
+            cached = None
+        if cached is not None:
+            value = WidgetConnectionSnapshot(**cached) if isinstance(cached, dict) else cached
+        else:
+            snapshot = _load(token)
+            value = snapshot if snapshot is not None else _NOT_FOUND
+            try:
+                if snapshot is None:
+                    cache.set(key, _NOT_FOUND, NEGATIVE_TTL)
+                else:
+                    cache.set(key, vars(snapshot), SHARED_TTL)
+            except Exception as exc:  # noqa: BLE001
+                logger.warning('Widget token cache write failed: %s', exc)
+        _local_set(token, value)
+    return None if value == _NOT_FOUND else value
+
+
+def invalidate(token: str) -> None:
+    if not token:
+        return
+    with _local_lock:
+        _local.pop(token, None)
+    try:
+        cache.delete(_cache_key(token))
+    except Exception as exc:  # noqa: BLE001
+        logger.warning('Widget token cache invalidation failed: %s', exc)
+
+
+def clear_local() -> None:
+    """Drop this process's layer (tests, or after bulk admin edits)."""
+    with _local_lock:
+        _local.clear()
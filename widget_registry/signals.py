@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate
+from .models import WidgetConnection
+
+
+@receiver(post_save, sender=WidgetConnection)
+@receiver(post_delete, sender=WidgetConnection)
+def invalidate_widget_token_cache(sender, instance, **kwargs):
+    """Drop the cached token snapshot once a connection change or delete commits.
+
+    Dropping it inside the transaction would let a concurrent lookup re-cache
+    the old row for ``SHARED_TTL``.
+    """
+    token = instance.widget_token
+    transaction.on_commit(lambda: invalidate(token))